@@ -0,0 +1,190 @@
+"""分块性能基准：多层级分块（单遍区间打包 vs 逐层 Recursive 切分）与父子块关联（区间扫描 vs 逐对比较）。
+
+用法（项目根目录）::
+
+    python scripts/bench_chunking.py --corpus eval_corpus_v2 --min-chars 300000
+
+说明：
+- 读取语料目录下的 .md / .txt，逐篇重复拼接到至少 --min-chars 字，模拟长文档非流式入库。
+- 分块使用默认 CHUNK_CONFIGS（不读系统管理端设置）。
+- 逐层切分、逐对比较均为改造前的实现，仅作对照，保留在本脚本中；父子关联会校验两者结果一致。
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
+
+from langchain_core.documents import Document  # noqa: E402
+
+from utils.smart_chunker import (  # noqa: E402
+    CHINESE_SEPARATORS,
+    CHUNK_CONFIGS,
+    SmartChunker,
+    _link_children_to_parents,
+)
+
+
+def legacy_multi_level(text: str, name: str) -> Dict[str, List[Document]]:
+    """改造前的 create_multi_level_chunks（对照用）：每层新建 RecursiveCharacterTextSplitter，
+    find 定位 + fix_chunk_boundary 修边界；摘要与父子关联与现实现相同，便于端到端对比。"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from utils.improved_chunker import detect_document_type, fix_chunk_boundary, is_sentence_complete
+
+    chunker = SmartChunker()
+    doc_type = detect_document_type(text, "txt")
+    out: Dict[str, List[Document]] = {}
+    base = Document(page_content=text, metadata={"source_file": name})
+    for level, cfg in CHUNK_CONFIGS.items():
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=cfg["chunk_size"],
+            chunk_overlap=cfg["chunk_overlap"],
+            separators=CHINESE_SEPARATORS,
+            length_function=len,
+        )
+        chunks = splitter.split_documents([base])
+        pos = 0
+        for i, c in enumerate(chunks):
+            start = text.find(c.page_content[:50], pos)
+            if start == -1:
+                start = pos
+            c.page_content = fix_chunk_boundary(c.page_content, text, start)
+            c.metadata.update(
+                {
+                    "chunk_level": level,
+                    "chunk_index": i,
+                    "chunk_id": chunker._generate_chunk_id(c.page_content),
+                    "doc_type": doc_type,
+                    "chunk_start": start,
+                    "chunk_end": start + len(c.page_content),
+                    "is_sentence_complete": is_sentence_complete(c.page_content),
+                }
+            )
+            pos = start + len(c.page_content)
+        out[level] = chunks
+    summary = chunker._create_summary_chunk(text, name, "txt")
+    out["summary"] = [summary] if summary else []
+    chunker._build_parent_child_relations(out, text)
+    return out
+
+
+def naive_link(child_chunks: List[Document], parent_chunks: List[Document]) -> List[int]:
+    """改造前的逐对比较实现（对照用）。"""
+    out: List[int] = []
+    for child in child_chunks:
+        cs, ce = child.metadata.get("chunk_start"), child.metadata.get("chunk_end")
+        best_idx, best_containment = 0, 0
+        if cs is not None and ce is not None:
+            for j, parent in enumerate(parent_chunks):
+                ps, pe = parent.metadata.get("chunk_start"), parent.metadata.get("chunk_end")
+                if ps is not None and pe is not None and ps <= cs and ce <= pe:
+                    containment = (ce - cs) / max(1, pe - ps)
+                    if containment > best_containment:
+                        best_containment, best_idx = containment, j
+        if best_containment == 0:
+            head = child.page_content[:50]
+            best_overlap = 0
+            for j, parent in enumerate(parent_chunks):
+                if head in parent.page_content:
+                    overlap = len(set(child.page_content) & set(parent.page_content))
+                    if overlap > best_overlap:
+                        best_overlap, best_idx = overlap, j
+        out.append(best_idx)
+    return out
+
+
+def _load_texts(corpus: str, min_chars: int) -> List[Tuple[str, str]]:
+    root = os.path.join(_PROJECT_ROOT, corpus)
+    paths = sorted(glob.glob(os.path.join(root, "*.md")) + glob.glob(os.path.join(root, "*.txt")))
+    out: List[Tuple[str, str]] = []
+    for p in paths:
+        with open(p, encoding="utf-8", errors="ignore") as f:
+            t = f.read().strip()
+        if not t:
+            continue
+        reps = max(1, -(-min_chars // len(t)))
+        out.append((os.path.basename(p), "\n\n".join([t] * reps)))
+    return out
+
+
+def _bench_one(name: str, text: str) -> Dict[str, float]:
+    t0 = time.perf_counter()
+    legacy_multi_level(text, name)
+    t_legacy = time.perf_counter() - t0
+    chunker = SmartChunker()
+    t0 = time.perf_counter()
+    chunks = chunker.create_multi_level_chunks(text, name, "txt")
+    t_chunk = time.perf_counter() - t0
+    t_naive = t_sweep = 0.0
+    mismatch = 0
+    for child_level, parent_level in (("small", "medium"), ("medium", "large")):
+        children, parents = chunks[child_level], chunks[parent_level]
+        t0 = time.perf_counter()
+        ref = naive_link(children, parents)
+        t_naive += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        got = _link_children_to_parents(children, parents, text)
+        t_sweep += time.perf_counter() - t0
+        mismatch += sum(1 for a, b in zip(ref, got) if a != b)
+    return {
+        "chars": len(text),
+        "small": len(chunks["small"]),
+        "medium": len(chunks["medium"]),
+        "large": len(chunks["large"]),
+        "legacy_chunk_s": t_legacy,
+        "chunk_s": t_chunk,
+        "naive_s": t_naive,
+        "sweep_s": t_sweep,
+        "mismatch": mismatch,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="分块父子关联性能基准")
+    ap.add_argument("--corpus", default="eval_corpus_v2", help="语料目录（项目根相对路径）")
+    ap.add_argument("--min-chars", type=int, default=300_000, help="每篇重复拼接到的最少字数")
+    ap.add_argument("--limit", type=int, default=6, help="最多测试几篇（0 为全部）")
+    args = ap.parse_args()
+
+    texts = _load_texts(args.corpus, args.min_chars)
+    if args.limit > 0:
+        texts = texts[: args.limit]
+    if not texts:
+        print(f"语料目录无 .md/.txt：{args.corpus}")
+        return 1
+
+    print(
+        f"{'文件':<28} {'字数':>8} {'小/中/大块':>16} {'逐层分块s':>9} {'单遍分块s':>9} "
+        f"{'逐对s':>8} {'扫描s':>7} 不一致"
+    )
+    total_legacy = total_chunk = total_naive = total_sweep = 0.0
+    bad = 0
+    for name, text in texts:
+        r = _bench_one(name, text)
+        total_legacy += r["legacy_chunk_s"]
+        total_chunk += r["chunk_s"]
+        total_naive += r["naive_s"]
+        total_sweep += r["sweep_s"]
+        bad += int(r["mismatch"])
+        counts = f"{r['small']}/{r['medium']}/{r['large']}"
+        print(
+            f"{name[:28]:<28} {r['chars']:>8} {counts:>16} {r['legacy_chunk_s']:>9.2f} {r['chunk_s']:>9.3f} "
+            f"{r['naive_s']:>8.3f} {r['sweep_s']:>7.3f} {int(r['mismatch'])}"
+        )
+    print(
+        f"合计：分块 逐层 {total_legacy:.2f}s / 单遍 {total_chunk:.2f}s；"
+        f"父子关联 逐对 {total_naive:.2f}s / 扫描 {total_sweep:.3f}s，父块不一致 {bad} 个"
+    )
+    return 0 if bad == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
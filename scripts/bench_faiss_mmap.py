@@ -0,0 +1,115 @@
+"""FAISS 载入微基准：常规载入 vs 只读 mmap 载入的耗时、私有堆（RssAnon）与检索延迟（合成索引，临时目录）。
+
+用法（项目根目录）::
+
+    python scripts/bench_faiss_mmap.py --n 200000 --dim 384
+
+说明：
+- 两种载入各在独立子进程中测量，RssAnon 为进程私有匿名内存；mmap 载入的基段计入 RssFile（可跨进程共享）。
+- 另报告按文件取块 id（删除路径）的耗时。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
+
+import numpy as np  # noqa: E402
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+from utils.faiss_tombstones import TombstoneFAISS, load_faiss_index  # noqa: E402
+
+
+class _ConstEmbeddings(Embeddings):
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        return [0.5] * self.dim
+
+
+def _rss_kb() -> dict:
+    out = {}
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith(("RssAnon", "RssFile")):
+                k, v = line.split(":")
+                out[k] = int(v.split()[0])
+    return out
+
+
+def _build(index_dir: str, n: int, dim: int, files: int) -> None:
+    rng = np.random.default_rng(0)
+    vecs = rng.random((n, dim), dtype=np.float32)
+    pairs = [(f"文档{i % files} 第{i}段 " + "正文" * 150, vecs[i]) for i in range(n)]
+    metas = [{"source_file": f"f{i % files}.txt"} for i in range(n)]
+    TombstoneFAISS.from_embeddings(pairs, _ConstEmbeddings(dim), metadatas=metas).save_local(index_dir)
+
+
+def _measure(index_dir: str, dim: int, read_only: bool) -> dict:
+    before = _rss_kb()
+    t0 = time.perf_counter()
+    db = load_faiss_index(index_dir, _ConstEmbeddings(dim), read_only=read_only)
+    load_s = time.perf_counter() - t0
+    lat = []
+    for _ in range(20):
+        t = time.perf_counter()
+        db.similarity_search("q", k=5)
+        lat.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    n_ids = len(db.ids_for_source_file("f7.txt"))
+    ids_ms = (time.perf_counter() - t) * 1000
+    after = _rss_kb()
+    return {
+        "read_only": db.read_only,
+        "load_s": round(load_s, 3),
+        "search_p50_ms": round(sorted(lat)[len(lat) // 2] * 1000, 2),
+        "ids_for_file_ms": round(ids_ms, 1),
+        "ids_for_file_n": n_ids,
+        "rss_anon_mb": round((after["RssAnon"] - before["RssAnon"]) / 1024, 1),
+        "rss_file_mb": round((after["RssFile"] - before["RssFile"]) / 1024, 1),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="FAISS 常规载入 vs mmap 只读载入")
+    ap.add_argument("--n", type=int, default=200_000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--files", type=int, default=500)
+    ap.add_argument("--_child", choices=["owned", "mmap"], help=argparse.SUPPRESS)
+    ap.add_argument("--_dir", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args._child:
+        print(json.dumps(_measure(args._dir, args.dim, args._child == "mmap")))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = os.path.join(tmp, "faiss_index")
+        t0 = time.perf_counter()
+        _build(index_dir, args.n, args.dim, args.files)
+        print(f"建索引 {args.n} × {args.dim}：{time.perf_counter() - t0:.1f}s")
+        for mode in ("owned", "mmap"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--dim", str(args.dim), "--_child", mode, "--_dir", index_dir],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            print(mode, out.stdout.strip().splitlines()[-1])
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
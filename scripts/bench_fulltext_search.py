@@ -0,0 +1,101 @@
+"""全文子串检索微基准：位置索引 vs 逐篇线性扫描（生成合成语料，在临时知识库目录中运行）。
+
+用法（项目根目录）::
+
+    python scripts/bench_fulltext_search.py --mb 50 --docs 200
+
+说明：
+- 语料为随机拼接的中英文词句，写入 sidecar 时同步建索引，入库耗时单独列出。
+- 每个查询分别取「首页 800 条」（接口默认）与全部命中，索引与线性扫描结果逐条比对。
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
+
+from utils import document_preview as dpv  # noqa: E402
+from utils.path_context import kb_dir_context  # noqa: E402
+from utils.text_sidecar import write_sidecar  # noqa: E402
+
+_WORDS = (
+    "借阅 期限 图书馆 读者 续借 逾期 滞纳金 馆藏 检索 目录 期刊 数据库 电子资源 开放时间 自习室 "
+    "Python FAISS embedding retrieval GPU server 2024 版本 条款 规定 申请 审批 流程 说明 附件"
+).split()
+_QUERIES = ["续借", "滞纳金", "电子资源", "馆", "faiss", "mbed", "2024版本", "审批流程说明", "不存在的词组"]
+
+
+def _doc(rnd: random.Random, chars: int) -> str:
+    out, n = [], 0
+    while n < chars:
+        w = rnd.choice(_WORDS)
+        out.append(w)
+        n += len(w) + 1
+        out.append(rnd.choice("，。 \n"))
+    return "".join(out)
+
+
+def _take(it, limit):
+    out = []
+    for x in it:
+        out.append(x)
+        if len(out) >= limit:
+            break
+    return out
+
+
+def _linear(names, q, limit):
+    out = []
+    for fn in names:
+        text = dpv.get_plain_text_for_kb_substring_search(fn, None)
+        for h in dpv.substring_hits_with_context(text, q, max_hits=200):
+            out.append((fn, h))
+            if len(out) >= limit:
+                return out
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="全文子串检索微基准")
+    ap.add_argument("--mb", type=float, default=20, help="语料总字符数（百万）")
+    ap.add_argument("--docs", type=int, default=100, help="文档篇数")
+    ap.add_argument("--limit", type=int, default=800, help="首页条数")
+    args = ap.parse_args()
+
+    rnd = random.Random(7)
+    per_doc = int(args.mb * 1_000_000 / max(1, args.docs))
+    with tempfile.TemporaryDirectory() as kb, kb_dir_context(kb):
+        names = [f"doc{i:05d}.txt" for i in range(args.docs)]
+        t0 = time.perf_counter()
+        for fn in names:
+            write_sidecar(fn, _doc(rnd, per_doc))
+        t_ingest = time.perf_counter() - t0
+        size = sum(os.path.getsize(os.path.join(kb, f)) for f in os.listdir(kb) if f.startswith("fulltext_index"))
+        print(f"语料 {args.mb:g}M 字 / {args.docs} 篇，写 sidecar+索引 {t_ingest:.1f}s，索引 {size / 1e6:.1f}MB")
+        print(f"{'查询':<10} {'命中':>6} {'索引首页ms':>10} {'线性首页ms':>10} {'索引全部ms':>10} {'线性全部ms':>10}")
+        bad = 0
+        for q in _QUERIES:
+            row = []
+            for limit in (args.limit, 10**9):
+                t0 = time.perf_counter()
+                got = _take(dpv.iter_indexed_substring_hits(names, q, None, max_per_file=200), limit)
+                t_idx = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                want = _linear(names, q, limit)
+                t_lin = time.perf_counter() - t0
+                bad += got != want
+                row += [t_idx * 1e3, t_lin * 1e3]
+            print(f"{q:<10} {len(want):>6} {row[0]:>10.1f} {row[1]:>10.1f} {row[2]:>10.1f} {row[3]:>10.1f}")
+        print(f"结果不一致 {bad} 处")
+    return 0 if not bad else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""LLM 首 token 延迟（TTFT）微基准：每次新建 ChatOpenAI vs 注册表复用客户端与连接池。
+
+用法（项目根目录）::
+
+    python scripts/bench_llm_ttft.py --rounds 30 --connect-delay-ms 80 --gap-sec 6
+
+说明：
+- 默认在本机起一个 OpenAI 兼容的流式桩服务；--connect-delay-ms 在每条新连接建立时人为等待，
+  模拟到模型服务商的 TCP+TLS 握手往返。
+- --gap-sec 为两次请求的间隔：openai 默认 keep-alive 只保留 5s，间隔更长时旧方式必然重新建连。
+- 统计每轮「发起请求 → 收到首个内容块」的耗时，以及桩服务累计接受的连接数。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
+
+from langchain_openai import ChatOpenAI  # noqa: E402
+
+import services.llm_factory as lf  # noqa: E402
+
+
+def _make_handler(connect_delay: float, token_delay: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        connections = 0
+
+        def setup(self):
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            type(self).connections += 1
+            time.sleep(connect_delay)
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, delta in enumerate(({"role": "assistant", "content": "你好"}, {"content": "。"}, {})):
+                chunk = {
+                    "id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if not delta else None}],
+                }
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if i == 0:
+                    time.sleep(token_delay)
+            self._chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+async def _ttft(llm: ChatOpenAI) -> float:
+    t0 = time.perf_counter()
+    first = None
+    async for chunk in llm.astream("你好"):
+        if first is None and chunk.content:
+            first = time.perf_counter() - t0
+    return first if first is not None else float("nan")
+
+
+def _fresh(base_url: str) -> ChatOpenAI:
+    # 与改造前 build_chat_llm 相同的构造方式
+    return ChatOpenAI(
+        model="stub", api_key="bench", base_url=base_url, temperature=0.3,
+        use_responses_api=False, streaming=True, timeout=lf._default_llm_timeout_sec(),
+    )
+
+
+def _pooled(base_url: str) -> ChatOpenAI:
+    base = lf._registry_get("bench", "stub", "bench", base_url, lf._default_llm_timeout_sec())
+    return base.model_copy(update={"temperature": 0.3})
+
+
+async def _run(mode: str, base_url: str, rounds: int, gap: float) -> list:
+    out = []
+    for i in range(rounds):
+        if i and gap:
+            await asyncio.sleep(gap)
+        llm = _fresh(base_url) if mode == "fresh" else _pooled(base_url)
+        out.append(await _ttft(llm))
+    return out
+
+
+def _pct(xs: list, p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p * (len(xs) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--connect-delay-ms", type=float, default=80.0)
+    ap.add_argument("--token-delay-ms", type=float, default=5.0)
+    ap.add_argument("--gap-sec", type=float, default=0.0)
+    args = ap.parse_args()
+
+    print(f"{'mode':<8} {'p50_ms':>8} {'p95_ms':>8} {'mean_ms':>8} {'conns':>6}")
+    for mode in ("fresh", "pooled"):
+        handler = _make_handler(args.connect_delay_ms / 1000.0, args.token_delay_ms / 1000.0)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        try:
+            xs = [x * 1000 for x in asyncio.run(_run(mode, base_url, args.rounds, args.gap_sec))]
+        finally:
+            lf.invalidate_llm_clients()
+            server.shutdown()
+            server.server_close()
+        print(
+            f"{mode:<8} {statistics.median(xs):>8.1f} {_pct(xs, 0.95):>8.1f} "
+            f"{statistics.fmean(xs):>8.1f} {handler.connections:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""查询分类微基准：预编译单遍匹配（含缓存）vs 改造前逐条 re.search / 子串循环，并校验输出一致。
+
+用法（项目根目录）::
+
+    python scripts/bench_query_classifier.py --repeat 200
+
+说明：
+- 查询取自 scripts/eval_set_handcrafted.py 全部评测/负样本，另加口语化、闲聊与系统问题变体。
+- 「冷」为绕过缓存的单遍匹配耗时，「热」为带缓存的公开函数（检索管线对同一问题多次分类的情形）。
+- 逐条匹配均为改造前的实现，仅作对照，保留在本脚本中。
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, List, Optional
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
+
+from scripts.eval_set_handcrafted import (  # noqa: E402
+    LEGACY_EVAL_SET,
+    NEG_PURE_CANDIDATES,
+    NEG_TRAP,
+    NEW_SELFBUILT_QUERIES,
+)
+from utils import improved_query_classifier as iqc  # noqa: E402
+from utils import intent_classifier as ic  # noqa: E402
+
+_EXTRA_QUERIES = [
+    "你好", "Hello", "谢谢你", "拜拜了", "你是谁", "你能做什么", "怎么使用这个系统", "灭火器怎么使用",
+    "知识库怎么用", "咋用这个", "啥是RAG", "这玩意咋样", "全书有哪些章节", "A和B的区别", "如果下雨那么怎么办",
+    "为什么是这样", "因为下雨所以取消", "哪个方案更好", "张三的职位是什么", "总结一下再对比区别",
+]
+
+
+def legacy_query_type(query: str) -> str:
+    """改造前的 classify_query_type_rule_based（对照用）。"""
+    query = query.strip()
+    oral_mapping = {
+        "咋": ["如何", "怎么", "怎样"],
+        "啥": ["什么", "什么是"],
+        "咋样": ["怎么样"],
+        "咋办": ["怎么办"],
+        "咋弄": ["怎么弄"],
+        "咋做": ["怎么做"],
+    }
+    for oral, formal_list in oral_mapping.items():
+        if oral in query:
+            query = query.replace(oral, formal_list[0])
+    groups = [
+        ("summary", [
+            r"总结|概括|概述|简介|介绍|主题|主旨|中心思想",
+            r"讲了什么|说了什么|写了什么|描述了什么",
+            r"主要内容|核心内容|大意|要点|要义",
+            r"全文|全书|整体|整篇|通篇",
+            r"有哪些.*章|有几.*章|章节.*有哪些",
+            r"文档.*内容|资料.*内容",
+        ]),
+        ("comparison", [
+            r"区别|差异|不同|对比|比较|关系|联系",
+            r"哪个.*更好|哪个.*更|.*和.*的区别|.*与.*的区别",
+            r"相比|相较|对比.*和",
+        ]),
+        ("conditional", [
+            r"满足.*条件|符合.*要求|达到.*标准",
+            r"哪些.*满足|哪些.*符合|哪些.*达到",
+            r"如果.*那么|假如.*则|当.*时",
+            r"条件.*是|要求.*是|标准.*是",
+        ]),
+        ("reasoning", [
+            r"为什么|原因|原理|机制|道理|依据",
+            r"如何.*判断|怎么.*判断|怎样.*判断",
+            r"推导|推理|推断|推测",
+            r"因为.*所以|由于.*因此",
+        ]),
+        ("concept", [
+            r"什么是|是什么|定义|概念|含义|意思",
+            r"如何|怎么|怎样|方法|步骤|流程|过程",
+            r"特点|特征|特性|性格|品质|品格",
+            r"作用|功能|意义|价值|影响",
+        ]),
+        ("precise", [
+            r"谁是|是谁|叫什么|名字",
+            r"哪里|在哪|何处|地点|位置",
+            r"什么时候|何时|时间|日期",
+            r"多少|几个|几次|数量|数字",
+            r"^.{0,10}的.{0,10}[是叫有在]",
+        ]),
+    ]
+    for name, patterns in groups:
+        for pattern in patterns:
+            if re.search(pattern, query):
+                return name
+    return "concept"
+
+
+def legacy_keyword_count(query: str) -> int:
+    """改造前 classify_query_type_hybrid 的多类型关键词计数（对照用）。"""
+    return sum([
+        len(re.findall(r"总结|概括|概述", query)),
+        len(re.findall(r"区别|对比|比较", query)),
+        len(re.findall(r"什么是|如何|为什么", query)),
+        len(re.findall(r"满足|条件|如果", query)),
+    ])
+
+
+def legacy_intent(query: str) -> Optional[str]:
+    """改造前的 classify_intent_lightweight（对照用）。"""
+    query_lower = query.lower().strip()
+    query_zh = query.strip()
+    if len(query_zh) <= 5:
+        for greeting in ["你好", "hi", "hello", "嗨", "谢谢", "再见", "拜拜", "bye"]:
+            if query_lower == greeting or query_zh == greeting:
+                return "CHAT"
+    if len(query_zh) <= 10:
+        for word in ["谢谢你", "谢了", "多谢", "感谢", "再见了", "拜拜了"]:
+            if query_zh == word or query_lower == word:
+                return "CHAT"
+    if len(query_zh) < 30:
+        for sq in ic._SYSTEM_QUESTIONS:
+            if sq in query_zh:
+                return "CHAT"
+        for up in ic._USAGE_PHRASES:
+            if up in query_zh and any(r in query_zh for r in ic._SYSTEM_REFS):
+                return "CHAT"
+    return None
+
+
+def load_queries() -> List[str]:
+    out = [q for q, _ in LEGACY_EVAL_SET]
+    out += [row[0] for row in NEW_SELFBUILT_QUERIES]
+    out += list(NEG_PURE_CANDIDATES) + list(NEG_TRAP) + _EXTRA_QUERIES
+    return out
+
+
+def _time(fn: Callable[[str], object], queries: List[str], repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            fn(q)
+    return time.perf_counter() - t0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="查询分类微基准")
+    ap.add_argument("--repeat", type=int, default=200, help="全部查询重复分类的轮数")
+    args = ap.parse_args()
+
+    queries = load_queries()
+    bad = [q for q in queries if iqc.classify_query_type_rule_based(q) != legacy_query_type(q)]
+    bad += [q for q in queries if len(iqc._TYPE_KEYWORD_RE.findall(q)) != legacy_keyword_count(q)]
+    bad += [q for q in queries if ic.classify_intent_lightweight(q) != legacy_intent(q)]
+
+    n = len(queries) * args.repeat
+    rows = [
+        ("查询类型", legacy_query_type, lambda q: iqc._rule_based_type.__wrapped__(q.strip()),
+         iqc.classify_query_type_rule_based),
+        ("闲聊意图", legacy_intent, ic._lightweight_intent.__wrapped__, ic.classify_intent_lightweight),
+    ]
+    print(f"查询 {len(queries)} 条 × {args.repeat} 轮")
+    print(f"{'分类器':<8} {'逐条us/次':>10} {'单遍us/次':>10} {'缓存us/次':>10}")
+    for name, legacy, cold, warm in rows:
+        t_legacy = _time(legacy, queries, args.repeat)
+        t_cold = _time(cold, queries, args.repeat)
+        t_warm = _time(warm, queries, args.repeat)
+        print(f"{name:<8} {t_legacy / n * 1e6:>10.2f} {t_cold / n * 1e6:>10.2f} {t_warm / n * 1e6:>10.2f}")
+    print(f"输出不一致 {len(bad)} 条" + (f"：{bad[:10]}" if bad else ""))
+    return 0 if not bad else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,10 @@
     python scripts/build_eval_kb_20260815.py --user 99 --corpus eval_corpus_v2 --reset
 
 支持格式：document_parsers 白名单（txt/md/html/csv/docx/xlsx/pptx/pdf/图片等）。
---reset 先清空该用户知识库（FAISS + BM25 + 元数据）再整体重建。
+--reset 先清空该用户知识库（FAISS + BM25 + 元数据 + 父文本库）再整体重建。
+--embed-levels 指定嵌入层级（同 RAG_EMBED_LEVELS，如 small,summary），其余层级只存父文本库；
+对比召回时分别建库后用 scripts/eval_retrieval.py 评测。RAG_EMBED_LEVELS 仍为实验性配置：
+与全部层级嵌入的召回对比尚未跑出结果，跑完前生产环境保持默认。
 """
 from __future__ import annotations
 
@@ -49,6 +52,9 @@ def reset_kb(user_id: int) -> None:
     for f in os.listdir(kb):
         if f.startswith("bm25_index") or f.startswith("bm25_docs"):
             os.remove(os.path.join(kb, f))
+    from utils.parent_chunk_store import clear_parent_store
+
+    clear_parent_store(kb)
     print(f"[reset] 已清空用户 {user_id} 知识库: {kb}")
 
 
@@ -63,7 +69,14 @@ def main() -> None:
     parser.add_argument(
         "--reset", action="store_true", help="入库前清空该用户知识库（bge-m3 与旧索引不可混用，务必重建）"
     )
+    parser.add_argument(
+        "--embed-levels",
+        default="",
+        help="嵌入层级（逗号分隔，同 RAG_EMBED_LEVELS，实验性）；默认全部层级嵌入",
+    )
     args = parser.parse_args()
+    if args.embed_levels:
+        os.environ["RAG_EMBED_LEVELS"] = args.embed_levels
 
     corpus_dir = os.path.join(_PROJECT_ROOT, args.corpus)
 
@@ -9,6 +9,8 @@
 - 评测集为「查询 → 相关文档文件名（可多个，按相关度降序）」的标注。
 - 相关文档为空列表 = 负样本（期望检索不到该语义，用于测误召回）。
 - 输出 Recall@k、nDCG@k、MRR，支持向量 / 混合两种模式对比。
+- embed-once（RAG_EMBED_LEVELS，实验性）对比：用 build_eval_kb_20260815.py 分别以默认与
+  ``--embed-levels small,summary`` 建到两个用户，再对两个 --user 各跑一次本脚本比较 Recall@k。
 """
 from __future__ import annotations
 
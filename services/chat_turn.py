@@ -6,6 +6,7 @@ import logging
 import os
 import re
 from collections import Counter
+from contextlib import nullcontext
 from dataclasses import dataclass, field
 from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
 
@@ -16,6 +17,7 @@ from services.rag_prompts import get_qa_hybrid_prompt, get_qa_prompt, get_rephra
 from services.retrieval import retrieve_for_rag, retrieve_for_rag_multi
 from services.ui_sink import RetrievalUISink
 from utils.intent_classifier import classify_intent_lightweight
+from utils.latency_trace import LatencyTrace, span
 from utils.prompt_runtime import (
     format_rag_chat_short,
     format_rag_empty_kb_prompt,
@@ -38,7 +40,8 @@ def _retrieve_rag_decomposed(
     sink: RetrievalUISink,
 ) -> Any:
     """单句或多子问：多子问时分别召回再合并，整句重排。"""
-    subqs = decompose_for_retrieval(standalone_q, llm)
+    with span("decompose"):
+        subqs = decompose_for_retrieval(standalone_q, llm)
     if len(subqs) > 1:
         return retrieve_for_rag_multi(
             vector_db=vector_db,
@@ -503,6 +506,26 @@ async def iter_astream_llm_chunks(
             pass
 
 
+def _run_traced(trace: LatencyTrace, fn: Any, *args: Any, **kwargs: Any) -> Any:
+    """在工作线程内激活本轮计时后执行（检索深处的 span 记到本轮）。"""
+    with trace.activate():
+        return fn(*args, **kwargs)
+
+
+async def _traced_llm_chunks(
+    trace: LatencyTrace,
+    llm: Any,
+    input_data: Union[str, List[BaseMessage]],
+    user_id: Optional[int],
+    call_type: str,
+) -> AsyncIterator[str]:
+    """iter_astream_llm_chunks 加计时：首个片段记 ttft（自本轮开始），整段流记 generate。"""
+    with trace.span("generate"):
+        async for piece in iter_astream_llm_chunks(llm, input_data, user_id, call_type):
+            trace.mark("ttft")
+            yield piece
+
+
 async def run_chat_turn_astream(
     *,
     user_input: str,
@@ -520,15 +543,23 @@ async def run_chat_turn_astream(
     user_id: Optional[int] = None,
     enable_web_search: bool = False,
 ) -> AsyncIterator[Dict[str, Any]]:
-    """供 FastAPI StreamingResponse 使用：meta → chunk* → done。"""
+    """供 FastAPI StreamingResponse 使用：meta → chunk* → meta → done。
+
+    末尾的 meta 带 stage_ms（各阶段耗时，毫秒，见 utils.latency_trace）；检索失败时唯一的 meta 即带 stage_ms。
+    """
+    trace = LatencyTrace()
     chat_history = _api_history_to_messages(chat_history_messages)
 
-    if classify_intent_lightweight(user_input) == "CHAT":
+    with trace.span("intent"):
+        intent = classify_intent_lightweight(user_input)
+    if intent == "CHAT":
         system_keywords = ["你是谁", "你是什么", "你叫什么", "介绍", "你能做什么", "功能", "怎么使用"]
         is_system_question = any(kw in user_input for kw in system_keywords)
         if is_system_question:
             yield _yield_meta("chat", "", [], None)
+            trace.mark("ttft")
             yield {"type": "chunk", "text": get_rag_static_assistant_intro()}
+            yield _yield_meta("chat", "", [], None, stage_ms=trace.finish())
             yield {"type": "done"}
             return
         extra = ""
@@ -539,10 +570,11 @@ async def run_chat_turn_astream(
         )
         yield _yield_meta("chat", "", [], None)
         try:
-            async for piece in iter_astream_llm_chunks(llm, prompt, user_id, "chat"):
+            async for piece in _traced_llm_chunks(trace, llm, prompt, user_id, "chat"):
                 yield {"type": "chunk", "text": piece}
         except Exception as e:
             yield {"type": "chunk", "text": _friendly_llm_error(e)}
+        yield _yield_meta("chat", "", [], None, stage_ms=trace.finish())
         yield {"type": "done"}
         return
 
@@ -552,13 +584,17 @@ async def run_chat_turn_astream(
     pronouns = ["他", "她", "它", "这个", "那个", "这些", "那些", "其他", "其它", "其中", "其实", "其余", "该文", "该书", "该方法"]
     has_pronoun = any(p in user_input for p in pronouns)
     if has_history and has_pronoun:
-        standalone_q = await asyncio.to_thread(
-            _rephrase_standalone_sync, llm, user_input, chat_history, user_id
-        )
+        with trace.span("rephrase"):
+            standalone_q = await asyncio.to_thread(
+                _rephrase_standalone_sync, llm, user_input, chat_history, user_id
+            )
 
     try:
-        ret = await asyncio.to_thread(
-            lambda: _retrieve_rag_decomposed(
+        with trace.span("retrieval"):
+            ret = await asyncio.to_thread(
+                _run_traced,
+                trace,
+                _retrieve_rag_decomposed,
                 vector_db=vector_db,
                 standalone_q=standalone_q,
                 llm=llm,
@@ -569,19 +605,20 @@ async def run_chat_turn_astream(
                 reranker=reranker,
                 sink=RetrievalUISink.noop(),
             )
-        )
     except Exception as e:
-        yield _yield_meta("error", standalone_q, [], str(e))
+        yield _yield_meta("error", standalone_q, [], str(e), stage_ms=trace.finish())
         yield {"type": "chunk", "text": f"检索失败：{e}"}
         yield {"type": "done"}
         return
 
-    context_text, evidence_raw, has_web = await asyncio.to_thread(
-        augment_rag_with_web_search,
-        ret,
-        standalone_q,
-        enable_web_search,
-    )
+    # 未开启联网时不计样本，免得 0ms 拉低该阶段分位数
+    with trace.span("web_search") if enable_web_search else nullcontext():
+        context_text, evidence_raw, has_web = await asyncio.to_thread(
+            augment_rag_with_web_search,
+            ret,
+            standalone_q,
+            enable_web_search,
+        )
     sources = _serialize_evidence(evidence_raw)
 
     if not (context_text or "").strip():
@@ -594,7 +631,7 @@ async def run_chat_turn_astream(
             empty_prompt = prepend_to_text_prompt(
                 format_rag_empty_kb_prompt(user_input=user_input, pextra=pextra)
             )
-            async for piece in iter_astream_llm_chunks(llm, empty_prompt, user_id, "rag_empty"):
+            async for piece in _traced_llm_chunks(trace, llm, empty_prompt, user_id, "rag_empty"):
                 answer_buf.append(piece)
                 yield {"type": "chunk", "text": piece}
         except Exception as e:
@@ -604,6 +641,7 @@ async def run_chat_turn_astream(
             standalone_q,
             filter_sources_for_traceability("".join(answer_buf), sources),
             None,
+            stage_ms=trace.finish(),
         )
         yield {"type": "done"}
         return
@@ -638,7 +676,7 @@ async def run_chat_turn_astream(
                     web_low=web_low,
                 )
             )
-            async for piece in iter_astream_llm_chunks(llm, low_prompt, user_id, "rag_low_score"):
+            async for piece in _traced_llm_chunks(trace, llm, low_prompt, user_id, "rag_low_score"):
                 answer_buf_ls.append(piece)
                 yield {"type": "chunk", "text": piece}
         except Exception as e:
@@ -648,6 +686,7 @@ async def run_chat_turn_astream(
             standalone_q,
             filter_sources_for_traceability("".join(answer_buf_ls), sources),
             None,
+            stage_ms=trace.finish(),
         )
         yield {"type": "done"}
         return
@@ -663,7 +702,7 @@ async def run_chat_turn_astream(
         messages = _append_persona_and_style_to_system_messages(
             messages, response_style, persona_prompt, system_prompt_extra=system_prompt_extra
         )
-        async for piece in iter_astream_llm_chunks(llm, messages, user_id, "qa"):
+        async for piece in _traced_llm_chunks(trace, llm, messages, user_id, "qa"):
             answer_buf_main.append(piece)
             yield {"type": "chunk", "text": piece}
     except Exception as e:
@@ -673,6 +712,7 @@ async def run_chat_turn_astream(
         standalone_q,
         filter_sources_for_traceability("".join(answer_buf_main), sources),
         None,
+        stage_ms=trace.finish(),
     )
     yield {"type": "done"}
 
@@ -682,14 +722,18 @@ def _yield_meta(
     retrieval_query: str,
     sources: List[Dict[str, Any]],
     error: Optional[str],
+    stage_ms: Optional[Dict[str, float]] = None,
 ) -> Dict[str, Any]:
-    return {
+    ev: Dict[str, Any] = {
         "type": "meta",
         "mode": mode,
         "retrieval_query": retrieval_query or "",
         "sources": sources,
         "error": error,
     }
+    if stage_ms is not None:
+        ev["stage_ms"] = stage_ms
+    return ev
 
 
 def run_chat_turn(
@@ -1,4 +1,4 @@
-"""即时文档对话：基于上传文档全文（超长则截断），不访问向量库；开启联网时可返回网页摘要溯源列表。"""
+"""即时文档对话：基于上传文档全文（超长则截断）或相关摘录，不访问向量库；开启联网时可返回网页摘要溯源列表。"""
 from __future__ import annotations
 
 from typing import Any, AsyncIterator, Dict, List, Optional
@@ -20,8 +20,12 @@ from utils.prompt_runtime import (
 )
 from utils.rag_prompt_hardening import prepend_to_first_system, prepend_to_text_prompt
 from services.instant_web_context import fetch_instant_web_with_evidence
+from utils.instant_doc_excerpt import InstantDocIndex, select_excerpts
 from utils.intent_classifier import classify_intent_lightweight
 
+# excerpts 模式下发给模型的摘录总长上限（全文短于此值时仍整篇发送）
+INSTANT_EXCERPT_MAX_CHARS = 16_000
+
 
 def _yield_meta(
     mode: str,
@@ -38,6 +42,27 @@ def _yield_meta(
     }
 
 
+def _instant_doc_body(
+    doc: str,
+    user_input: str,
+    *,
+    cap: int,
+    context_mode: str,
+    doc_index: Optional[InstantDocIndex],
+) -> str:
+    """full：全文截断到 cap；excerpts：按预建索引（无则现场切块）只取与问题相关的摘录。"""
+    if context_mode == "excerpts":
+        body, _parts = select_excerpts(
+            doc,
+            user_input,
+            max_chars=min(cap, INSTANT_EXCERPT_MAX_CHARS),
+            index=doc_index,
+        )
+        if body:
+            return body
+    return doc if len(doc) <= cap else doc[:cap]
+
+
 async def run_instant_chat_turn_astream(
     *,
     user_input: str,
@@ -51,6 +76,8 @@ async def run_instant_chat_turn_astream(
     user_id: Optional[int] = None,
     context_max_chars: int = 100_000,
     enable_web_search: bool = False,
+    context_mode: str = "excerpts",
+    doc_index: Optional[InstantDocIndex] = None,
 ) -> AsyncIterator[Dict[str, Any]]:
     doc = (document_text or "").strip()
     fname = (document_file_name or "文档").strip() or "文档"
@@ -117,7 +144,9 @@ async def run_instant_chat_turn_astream(
         return
 
     cap = max(4_000, min(int(context_max_chars), 100_000))
-    body = doc if len(doc) <= cap else doc[:cap]
+    body = _instant_doc_body(
+        doc, user_input, cap=cap, context_mode=context_mode, doc_index=doc_index
+    )
 
     web_append = ""
     web_err_meta: Optional[str] = None
@@ -172,6 +201,8 @@ def run_instant_chat_turn(
     user_id: Optional[int] = None,
     context_max_chars: int = 100_000,
     enable_web_search: bool = False,
+    context_mode: str = "excerpts",
+    doc_index: Optional[InstantDocIndex] = None,
 ) -> tuple[str, str, str, List[Dict[str, Any]], Optional[str]]:
     """同步非流式：返回 (answer, mode, retrieval_query, sources, error)；联网时 sources 为网页摘要条目。"""
     from services.chat_turn import _track_llm  # noqa: PLC0415
@@ -240,7 +271,9 @@ def run_instant_chat_turn(
             return "", "error", user_input, [], _friendly_llm_error(e)
 
     cap = max(4_000, min(int(context_max_chars), 100_000))
-    body = doc if len(doc) <= cap else doc[:cap]
+    body = _instant_doc_body(
+        doc, user_input, cap=cap, context_mode=context_mode, doc_index=doc_index
+    )
 
     web_append = ""
     web_err_meta: Optional[str] = None
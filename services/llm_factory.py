@@ -1,9 +1,26 @@
+"""
+LLM 客户端构造。
+
+build_chat_llm 走进程内客户端注册表：按 (预设名, model, base_url, api_key 指纹, 超时) 复用同一个
+ChatOpenAI 及其 httpx 连接池（keep-alive），每次调用只按 temperature 浅拷贝，避免每个对话/标题/
+分类/摘要请求都重新建客户端、重新 TLS 握手。预设内容变更后键随之变化，旧条目被替换；
+也可显式 invalidate_llm_clients()（保存 llm_api_presets 时调用）。
+"""
+import asyncio
+import hashlib
 import logging
 import os
-from typing import Optional
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
 
+import httpx
+import openai
 from langchain_openai import ChatOpenAI
 
+from utils.env_numbers import env_float, env_int
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,6 +34,274 @@ def _default_llm_timeout_sec() -> Optional[int]:
         return 180
 
 
+def _pool_limits() -> httpx.Limits:
+    """连接池参数。openai 默认 keepalive_expiry 仅 5s，对话间隔稍长就要重新握手，这里默认放宽到 60s。"""
+    return httpx.Limits(
+        max_connections=env_int("RAG_LLM_POOL_MAX_CONNECTIONS", 100, 1, 1000),
+        max_keepalive_connections=env_int("RAG_LLM_POOL_MAX_KEEPALIVE", 20, 0, 1000),
+        keepalive_expiry=env_float("RAG_LLM_POOL_KEEPALIVE_SEC", 60.0, 1.0, 3600.0),
+    )
+
+
+_SSE_DONE = b"data: [DONE]"
+
+
+class _DrainOnDoneStream(httpx.SyncByteStream):
+    """openai SDK 读到 [DONE] 即关闭响应，httpcore 尚未读到消息结束标记，会直接丢弃连接。
+    已见到 [DONE] 时在 close 前把剩余的结束标记读完，让连接回到 keep-alive 池；
+    中途放弃的流不做排空，避免阻塞等待仍在生成的内容。"""
+
+    def __init__(self, inner: httpx.SyncByteStream) -> None:
+        self._inner = inner
+        self._tail = b""
+
+    def __iter__(self):
+        for chunk in self._inner:
+            self._tail = (self._tail + chunk)[-64:]
+            yield chunk
+
+    def close(self) -> None:
+        try:
+            if _SSE_DONE in self._tail:
+                for _ in self._inner:
+                    pass
+        except Exception:  # noqa: BLE001
+            pass
+        finally:
+            self._inner.close()
+
+
+class _AsyncDrainOnDoneStream(httpx.AsyncByteStream):
+    def __init__(self, inner: httpx.AsyncByteStream) -> None:
+        self._inner = inner
+        self._tail = b""
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            self._tail = (self._tail + chunk)[-64:]
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            if _SSE_DONE in self._tail:
+                async for _ in self._inner:
+                    pass
+        except Exception:  # noqa: BLE001
+            pass
+        finally:
+            await self._inner.aclose()
+
+
+class _GcClosedHttpxClient(openai.DefaultHttpxClient):
+    """注册表条目被替换/清空后不再显式关闭，最后一个持有它的客户端拷贝被回收时关闭同步连接池。"""
+
+    def __del__(self) -> None:
+        if self.is_closed:
+            return
+        try:
+            self.close()
+        except Exception:  # noqa: BLE001
+            pass
+
+
+class _GcClosedAsyncHttpxClient(openai.DefaultAsyncHttpxClient):
+    """异步版：httpx 回收 AsyncClient 时不会关闭连接池。连接绑定在发请求的事件循环上，
+    因此记下该循环，最后一个引用释放时在其上调度 aclose()。"""
+
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def send(self, request: httpx.Request, **kwargs: Any) -> httpx.Response:
+        self._loop = asyncio.get_running_loop()
+        return await super().send(request, **kwargs)
+
+    def __del__(self) -> None:
+        loop = self._loop
+        if self.is_closed or loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(loop.create_task, self.aclose())
+        except Exception:  # noqa: BLE001
+            pass
+
+
+class _KeepAliveTransport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = super().handle_request(request)
+        response.stream = _DrainOnDoneStream(response.stream)
+        return response
+
+
+class _AsyncKeepAliveTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await super().handle_async_request(request)
+        response.stream = _AsyncDrainOnDoneStream(response.stream)
+        return response
+
+
+def _proxy_mounts(transport_cls: Any, limits: httpx.Limits) -> Dict[str, Any]:
+    """显式传 transport 时 httpx 不再读取 HTTP(S)_PROXY/NO_PROXY，这里按环境变量补齐同类 transport。"""
+    try:
+        from httpx._utils import get_environment_proxies
+
+        env = get_environment_proxies()
+    except Exception:  # noqa: BLE001
+        return {}
+    return {
+        pattern: (transport_cls(limits=limits, proxy=url) if url else None) for pattern, url in env.items()
+    }
+
+
+def _max_registry_entries() -> int:
+    return env_int("RAG_LLM_CLIENT_CACHE_SIZE", 16, 1, 256)
+
+
+def _key_fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+_RegistryKey = Tuple[str, str, str, str, Optional[int]]
+
+
+@dataclass
+class _ClientEntry:
+    llm: ChatOpenAI
+    http_client: httpx.Client
+    http_async_client: httpx.AsyncClient
+    hits: int = 0
+
+
+@dataclass
+class _RegistryStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    by_preset: Dict[str, _RegistryKey] = field(default_factory=dict)
+
+
+_registry: "OrderedDict[_RegistryKey, _ClientEntry]" = OrderedDict()
+_registry_lock = threading.Lock()
+_stats = _RegistryStats()
+
+
+def _drop_locked(key: _RegistryKey) -> None:
+    # 不主动关闭被弃用条目的连接池：此前发出的浅拷贝可能仍在其它线程里请求（标题生成、分类器等），
+    # 最后一个引用释放时由 __del__ 关闭（见 _GcClosedHttpxClient / _GcClosedAsyncHttpxClient）
+    _registry.pop(key, None)
+    for preset, k in list(_stats.by_preset.items()):
+        if k == key:
+            _stats.by_preset.pop(preset, None)
+
+
+def _new_entry(model: str, api_key: str, base_url: str, timeout: Optional[int]) -> _ClientEntry:
+    limits = _pool_limits()
+    http_client = _GcClosedHttpxClient(
+        timeout=timeout,
+        transport=_KeepAliveTransport(limits=limits),
+        mounts=_proxy_mounts(_KeepAliveTransport, limits),
+    )
+    http_async_client = _GcClosedAsyncHttpxClient(
+        timeout=timeout,
+        transport=_AsyncKeepAliveTransport(limits=limits),
+        mounts=_proxy_mounts(_AsyncKeepAliveTransport, limits),
+    )
+    llm = ChatOpenAI(
+        model=model,
+        api_key=api_key,
+        base_url=base_url,
+        temperature=0.0,
+        use_responses_api=False,
+        streaming=True,
+        timeout=timeout,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+    return _ClientEntry(llm=llm, http_client=http_client, http_async_client=http_async_client)
+
+
+def _registry_get(preset: str, model: str, api_key: str, base_url: str, timeout: Optional[int]) -> ChatOpenAI:
+    key: _RegistryKey = (preset, model, base_url, _key_fingerprint(api_key), timeout)
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is not None:
+            _registry.move_to_end(key)
+            entry.hits += 1
+            _stats.hits += 1
+            return entry.llm
+        _stats.misses += 1
+        old = _stats.by_preset.get(preset)
+        if old is not None and old != key:
+            # 同一预设的 model/base_url/key 变了：旧客户端不会再被命中
+            _drop_locked(old)
+            _stats.invalidations += 1
+        entry = _new_entry(model, api_key, base_url, timeout)
+        _registry[key] = entry
+        _stats.by_preset[preset] = key
+        while len(_registry) > _max_registry_entries():
+            oldest = next(iter(_registry))
+            _drop_locked(oldest)
+            _stats.evictions += 1
+        return entry.llm
+
+
+def invalidate_llm_clients() -> int:
+    """清空客户端注册表（预设保存后调用），返回清掉的条目数。"""
+    with _registry_lock:
+        n = len(_registry)
+        for key in list(_registry):
+            _drop_locked(key)
+        _stats.by_preset.clear()
+        if n:
+            _stats.invalidations += 1
+    if n:
+        logger.info("[LLM] LLM API 预设已变更，清空 %d 个缓存客户端", n)
+    return n
+
+
+def _pool_connections(client: Any) -> Tuple[int, int]:
+    """(连接数, 空闲连接数)；httpx/httpcore 内部结构变化时返回 (0, 0)。"""
+    try:
+        conns = list(client._transport._pool.connections)
+    except Exception:  # noqa: BLE001
+        return 0, 0
+    idle = 0
+    for c in conns:
+        try:
+            idle += 1 if c.is_idle() else 0
+        except Exception:  # noqa: BLE001
+            pass
+    return len(conns), idle
+
+
+def llm_client_stats() -> Dict[str, Any]:
+    """注册表命中情况与各客户端连接池状态（健康检查/管理端展示）。"""
+    with _registry_lock:
+        clients: List[Dict[str, Any]] = []
+        for (preset, model, base_url, _fp, _timeout), entry in _registry.items():
+            sync_n, sync_idle = _pool_connections(entry.http_client)
+            async_n, async_idle = _pool_connections(entry.http_async_client)
+            clients.append(
+                {
+                    "preset": preset,
+                    "model": model,
+                    "base_url": base_url,
+                    "hits": entry.hits,
+                    "sync_connections": sync_n,
+                    "sync_idle": sync_idle,
+                    "async_connections": async_n,
+                    "async_idle": async_idle,
+                }
+            )
+        return {
+            "llm_client_entries": len(_registry),
+            "llm_client_hits": _stats.hits,
+            "llm_client_misses": _stats.misses,
+            "llm_client_evictions": _stats.evictions,
+            "llm_client_invalidations": _stats.invalidations,
+            "llm_clients": clients,
+        }
+
+
 def build_chat_openai_explicit(
     *,
     model: str,
@@ -39,7 +324,9 @@ def build_chat_openai_explicit(
 
 
 def build_chat_llm(temperature: float, *, config_name: str | None = None) -> ChatOpenAI:
-    """根据当前 API 配置构造 ChatOpenAI（不依赖 Streamlit）。config_name 指定预设名。
+    """根据当前 API 配置取 ChatOpenAI（不依赖 Streamlit）。config_name 指定预设名。
+
+    同一预设/模型/地址/密钥复用注册表中的客户端与连接池，返回按 temperature 绑定的浅拷贝。
 
     配置读取失败或配置不完整时立即抛错并记日志，不再静默回退空 key 的客户端——
     那会把配置错误推迟到对话调用时才爆 401，难以排查。调用方（Web 端点、
@@ -63,12 +350,16 @@ def build_chat_llm(temperature: float, *, config_name: str | None = None) -> Cha
             f"base_url={base_url or '未设置'}），请在管理端「检索设置 → 模型 API」完成配置"
         )
 
-    return ChatOpenAI(
-        model=model,
-        api_key=api_key,
-        base_url=base_url,
-        temperature=temperature,
-        use_responses_api=False,
-        streaming=True,
-        timeout=_default_llm_timeout_sec(),
-    )
+    preset = config_name if config_name else _preset_name_for_registry()
+    base = _registry_get(preset, model, api_key, base_url, _default_llm_timeout_sec())
+    # 浅拷贝共享底层 openai/httpx 客户端，只改本次调用的 temperature
+    return base.model_copy(update={"temperature": temperature})
+
+
+def _preset_name_for_registry() -> str:
+    try:
+        from utils.api_config import get_active_preset_name
+
+        return get_active_preset_name()
+    except Exception:  # noqa: BLE001
+        return ""
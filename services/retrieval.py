@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-import hashlib
 import time
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple
 
+from utils.chunk_ids import chunk_uid
+from utils.latency_trace import span
 from utils.metadata_manager import get_all_documents, get_documents_by_category
 from utils.reranker import rerank_documents
 from services.ui_sink import RetrievalUISink
@@ -25,12 +26,9 @@ class RetrievalResult:
     last_search_results: List[Tuple[Any, float]] = field(default_factory=list)
 
 
-def _merge_doc_key(doc: Any) -> str:
-    meta = getattr(doc, "metadata", None) or {}
-    src = str(meta.get("source_file") or "")
-    body = (getattr(doc, "page_content", None) or "")[:320]
-    digest = hashlib.md5(body.encode("utf-8", errors="ignore")).hexdigest()[:16]
-    return f"{src}\x1f{digest}"
+def _merge_doc_key(doc: Any) -> int:
+    """合并去重键：分块稳定 id（utils.chunk_ids），旧索引缺该字段时按来源文件 + 全文现算。"""
+    return chunk_uid(doc)
 
 
 def filter_by_absolute_floor(
@@ -71,34 +69,39 @@ def finalize_retrieval_from_scored(
 
     out.last_search_results = high_quality_docs
 
-    from utils.parent_document_retrieval import expand_retrieved_chunks, should_expand_chunk
-
-    expanded_docs: List[Tuple[Any, float]] = []
-    for doc, score in high_quality_docs:
-        if should_expand_chunk(doc):
-            expanded_chunks = expand_retrieved_chunks(
-                [(doc, score)],
-                vector_db,
-                expansion_strategy="parent",
-                expand_to_level="medium",
-            )
-            expanded_docs.extend(expanded_chunks)
-        else:
-            expanded_docs.append((doc, score))
-
-    if expanded_docs:
-        # 去重：多个 small 子块常扩展到同一 medium 父块，重复占位会挤掉其它来源
-        seen: set = set()
-        deduped: List[Tuple[Any, float]] = []
-        for doc, score in expanded_docs:
-            key = _merge_doc_key(doc)
-            if key in seen:
-                continue
-            seen.add(key)
-            deduped.append((doc, score))
-        # 用调用方传入的 k（多子查询路径的 k_sub 由此生效），不再全局钉死 CONTEXT_TOP_K
-        high_quality_docs = deduped[: max(k, CONTEXT_TOP_K)]
-        sink.caption("📖 已扩展上下文（Parent-Document Retrieval）")
+    with span("parent_expand"):
+        from utils.parent_chunk_store import ParentChunkReader
+        from utils.parent_document_retrieval import expand_retrieved_chunks, should_expand_chunk
+
+        expanded_docs: List[Tuple[Any, float]] = []
+        # 本次检索内的父块查找共用一个父文本库连接
+        with ParentChunkReader() as parent_store:
+            for doc, score in high_quality_docs:
+                if should_expand_chunk(doc):
+                    expanded_chunks = expand_retrieved_chunks(
+                        [(doc, score)],
+                        vector_db,
+                        expansion_strategy="parent",
+                        expand_to_level="medium",
+                        parent_store=parent_store,
+                    )
+                    expanded_docs.extend(expanded_chunks)
+                else:
+                    expanded_docs.append((doc, score))
+
+        if expanded_docs:
+            # 去重：多个 small 子块常扩展到同一 medium 父块，重复占位会挤掉其它来源
+            seen: set = set()
+            deduped: List[Tuple[Any, float]] = []
+            for doc, score in expanded_docs:
+                key = _merge_doc_key(doc)
+                if key in seen:
+                    continue
+                seen.add(key)
+                deduped.append((doc, score))
+            # 用调用方传入的 k（多子查询路径的 k_sub 由此生效），不再全局钉死 CONTEXT_TOP_K
+            high_quality_docs = deduped[: max(k, CONTEXT_TOP_K)]
+            sink.caption("📖 已扩展上下文（Parent-Document Retrieval）")
 
     context_docs = high_quality_docs[: max(k, CONTEXT_TOP_K)]
     context_parts: List[str] = []
@@ -180,44 +183,48 @@ def retrieve_for_rag(
         get_retrieval_params_for_query,
     )
 
-    query_type, confidence = classify_query_type_hybrid(query, use_llm=False)
-    preferred_levels = get_chunk_level_for_query_improved(query_type)
-
-    type_names = {
-        "precise": "精确",
-        "concept": "概念",
-        "summary": "总结",
-        "comparison": "比较",
-        "conditional": "条件",
-        "reasoning": "推理",
-    }
-    sink.caption(f"查询类型：{type_names.get(query_type, query_type)}（置信度：{confidence:.1%}）")
-
-    kb_doc_count = 0
-    if selected_kb != "全部知识库":
-        try:
-            kb_documents = get_documents_by_category(selected_kb)
-            kb_doc_count = len(kb_documents)
-        except Exception:
-            pass
-
-    retrieval_params = get_retrieval_params_for_query(
-        query_type=query_type,
-        query_length=len(query),
-        kb_doc_count=kb_doc_count,
-    )
-    fetch_k = retrieval_params["fetch_k"]
+    with span("query_classify"):
+        query_type, confidence = classify_query_type_hybrid(query, use_llm=False)
+        preferred_levels = get_chunk_level_for_query_improved(query_type)
+
+        type_names = {
+            "precise": "精确",
+            "concept": "概念",
+            "summary": "总结",
+            "comparison": "比较",
+            "conditional": "条件",
+            "reasoning": "推理",
+        }
+        sink.caption(f"查询类型：{type_names.get(query_type, query_type)}（置信度：{confidence:.1%}）")
+
+        kb_doc_count = 0
+        if selected_kb != "全部知识库":
+            try:
+                kb_documents = get_documents_by_category(selected_kb)
+                kb_doc_count = len(kb_documents)
+            except Exception:
+                pass
+
+        retrieval_params = get_retrieval_params_for_query(
+            query_type=query_type,
+            query_length=len(query),
+            kb_doc_count=kb_doc_count,
+        )
+        fetch_k = retrieval_params["fetch_k"]
 
     docs_with_scores: List[Tuple[Any, float]] = []
 
     try:
+        from utils.hybrid_search import vector_search_with_score
+
         if search_mode == "hybrid":
             from utils.hybrid_search import load_bm25_index, hybrid_search, rebuild_bm25_index
 
-            bm25_index, bm25_docs = load_bm25_index()
-            if bm25_index is None or bm25_docs is None:
-                with sink.spinner("🔨 正在构建BM25索引（首次使用需要一些时间）..."):
-                    bm25_index, bm25_docs = rebuild_bm25_index(vector_db)
+            with span("bm25_load"):
+                bm25_index, bm25_docs = load_bm25_index()
+                if bm25_index is None or bm25_docs is None:
+                    with sink.spinner("🔨 正在构建BM25索引（首次使用需要一些时间）..."):
+                        bm25_index, bm25_docs = rebuild_bm25_index(vector_db)
 
             if bm25_index and bm25_docs:
                 docs_with_scores = hybrid_search(
@@ -231,10 +238,10 @@ def retrieve_for_rag(
                 sink.caption("🔀 使用混合检索（BM25 + 向量 + RRF）")
             else:
                 sink.warning("⚠️ BM25索引构建失败，回退到向量检索")
-                docs_with_scores = vector_db.similarity_search_with_score(query, k=fetch_k)
+                docs_with_scores = vector_search_with_score(vector_db, query, fetch_k)
                 docs_with_scores = [(doc, 1 / (1 + score)) for doc, score in docs_with_scores]
         else:
-            docs_with_scores = vector_db.similarity_search_with_score(query, k=fetch_k)
+            docs_with_scores = vector_search_with_score(vector_db, query, fetch_k)
             docs_with_scores = [(doc, 1 / (1 + score)) for doc, score in docs_with_scores]
             sink.caption("🔍 使用向量检索")
 
@@ -249,66 +256,68 @@ def retrieve_for_rag(
         from utils.score_normalization import normalize_scores_by_kb
 
         if selected_kb == "全部知识库" and len(docs_with_scores) > 5:
-            docs_with_scores = normalize_scores_by_kb(
-                docs_with_scores,
-                selected_kb=selected_kb,
-                normalization_method="min_max",
-            )
+            with span("fusion"):
+                docs_with_scores = normalize_scores_by_kb(
+                    docs_with_scores,
+                    selected_kb=selected_kb,
+                    normalization_method="min_max",
+                )
             sink.caption("📊 已应用分数归一化（Min-Max Scaling）")
     except Exception as e:
         sink.error(f"检索出错: {str(e)}")
         return out
 
-    kb_file_names: Optional[set] = None
-    if selected_kb != "全部知识库":
-        kb_documents = get_documents_by_category(selected_kb)
-        kb_file_names = set(doc.get("file_name") for doc in kb_documents)
-        if not kb_file_names:
-            elapsed = time.perf_counter() - start_time
-            sink.caption(f"检索耗时: {elapsed:.2f} 秒（知识库为空）")
-            return out
-    else:
-        all_active = get_all_documents(include_deleted=False)
-        names = {str(d.get("file_name")) for d in all_active if d.get("file_name")}
-        if names:
-            kb_file_names = names
-
-    preferred_docs: List[Tuple[Any, float, str]] = []
-    fallback_docs: List[Tuple[Any, float, str]] = []
+    with span("kb_filter"):
+        kb_file_names: Optional[set] = None
+        if selected_kb != "全部知识库":
+            kb_documents = get_documents_by_category(selected_kb)
+            kb_file_names = set(doc.get("file_name") for doc in kb_documents)
+            if not kb_file_names:
+                elapsed = time.perf_counter() - start_time
+                sink.caption(f"检索耗时: {elapsed:.2f} 秒（知识库为空）")
+                return out
+        else:
+            all_active = get_all_documents(include_deleted=False)
+            names = {str(d.get("file_name")) for d in all_active if d.get("file_name")}
+            if names:
+                kb_file_names = names
 
-    for doc, score in docs_with_scores:
-        source_file = doc.metadata.get("source_file")
+        preferred_docs: List[Tuple[Any, float, str]] = []
+        fallback_docs: List[Tuple[Any, float, str]] = []
 
-        if source_file in ["system", None] or doc.metadata.get("note") == "empty_init":
-            continue
+        for doc, score in docs_with_scores:
+            source_file = doc.metadata.get("source_file")
 
-        if kb_file_names and source_file not in kb_file_names:
-            continue
+            if source_file in ["system", None] or doc.metadata.get("note") == "empty_init":
+                continue
 
-        if search_mode == "hybrid":
-            similarity = score
-        else:
-            similarity = score
+            if kb_file_names and source_file not in kb_file_names:
+                continue
 
-        chunk_level = doc.metadata.get("chunk_level", "medium")
+            if search_mode == "hybrid":
+                similarity = score
+            else:
+                similarity = score
 
-        if chunk_level in preferred_levels:
-            preferred_docs.append((doc, similarity, chunk_level))
-        else:
-            fallback_docs.append((doc, similarity, chunk_level))
+            chunk_level = doc.metadata.get("chunk_level", "medium")
 
-        if len(preferred_docs) >= k * 2:
-            break
+            if chunk_level in preferred_levels:
+                preferred_docs.append((doc, similarity, chunk_level))
+            else:
+                fallback_docs.append((doc, similarity, chunk_level))
 
-    filtered_docs: List[Tuple[Any, float]] = []
-    for doc, sim, _level in preferred_docs:
-        filtered_docs.append((doc, sim))
+            if len(preferred_docs) >= k * 2:
+                break
 
-    if len(filtered_docs) < k:
-        for doc, sim, _level in fallback_docs:
+        filtered_docs: List[Tuple[Any, float]] = []
+        for doc, sim, _level in preferred_docs:
             filtered_docs.append((doc, sim))
-            if len(filtered_docs) >= k:
-                break
+
+        if len(filtered_docs) < k:
+            for doc, sim, _level in fallback_docs:
+                filtered_docs.append((doc, sim))
+                if len(filtered_docs) >= k:
+                    break
 
     initial_docs = [doc for doc, _ in filtered_docs[:k]]
     initial_scores = [score for _, score in filtered_docs[:k]]
@@ -319,14 +328,15 @@ def retrieve_for_rag(
         return out
 
     if enable_reranker and reranker is not None:
-        scored_docs = rerank_documents(
-            query=query,
-            documents=initial_docs,
-            reranker=reranker,
-            top_k=k,
-            reranker_type="local",
-            fallback_scores=initial_scores,
-        )
+        with span("rerank"):
+            scored_docs = rerank_documents(
+                query=query,
+                documents=initial_docs,
+                reranker=reranker,
+                top_k=k,
+                reranker_type="local",
+                fallback_scores=initial_scores,
+            )
     else:
         scored_docs = list(zip(initial_docs, initial_scores))
 
@@ -375,7 +385,7 @@ def retrieve_for_rag_multi(
     k_sub = max(5, min(k + 4, (k * 4) // n + n + 3))
     sink.caption(f"🔀 多子查询检索（{n} 条）→ 合并去重 → 整句重排")
 
-    merged: Dict[str, Tuple[Any, float]] = {}
+    merged: Dict[int, Tuple[Any, float]] = {}
     for subq in queries:
         sub = retrieve_for_rag(
             vector_db=vector_db,
@@ -398,14 +408,15 @@ def retrieve_for_rag_multi(
     docs_only = [d for d, _ in pool]
 
     if enable_reranker and reranker is not None and docs_only:
-        scored_docs = rerank_documents(
-            query=final_rerank_query,
-            documents=docs_only,
-            reranker=reranker,
-            top_k=k,
-            reranker_type="local",
-            fallback_scores=[sc for _d, sc in pool],
-        )
+        with span("rerank"):
+            scored_docs = rerank_documents(
+                query=final_rerank_query,
+                documents=docs_only,
+                reranker=reranker,
+                top_k=k,
+                reranker_type="local",
+                fallback_scores=[sc for _d, sc in pool],
+            )
     else:
         scored_docs = pool[:k]
 
@@ -9,8 +9,8 @@ def load_embeddings_only() -> Any:
     return get_embeddings()
 
 
-def load_embeddings_and_vector_db() -> Tuple[Any, Any]:
-    """加载嵌入模型与 FAISS 向量库（供页面 cache_resource 包装）。"""
+def load_embeddings_and_vector_db(read_only: bool = False) -> Tuple[Any, Any]:
+    """加载嵌入模型与 FAISS 向量库（供页面 cache_resource 包装；Web 检索缓存传 read_only=True 走 mmap）。"""
     embeddings = get_embeddings()
-    vector_db = get_vector_db(embeddings)
+    vector_db = get_vector_db(embeddings, read_only=read_only)
     return vector_db, embeddings
@@ -0,0 +1,113 @@
+"""全站统计物化汇总：首次请求同步校正、事件增量更新与全量校正结果一致、未挂钩改动由校正修正。"""
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import utils.admin_docs as admin_docs
+import utils.auth_store as auth_store
+import web_app.backend.analytics_aggregates as agg
+import web_app.backend.stats_helpers as sh
+import web_app.backend.storage_ledger as sl
+from utils.admin_analytics import platform_analytics_overview
+
+_TODAY = datetime.now(timezone.utc).date()
+
+
+def _doc(name: str, days_ago: int, chunks: int, *, deleted: bool = False, category: str = "默认知识库"):
+    t = (_TODAY - timedelta(days=days_ago)).isoformat() + " 10:00:00"
+    return {
+        "file_name": name,
+        "upload_time": t,
+        "chunks_count": chunks,
+        "file_size_mb": 0.5,
+        "category": category,
+        "is_deleted": deleted,
+    }
+
+
+@pytest.fixture
+def platform(tmp_path, monkeypatch):
+    root = tmp_path / "users"
+    for mod in (admin_docs, sl, sh):
+        monkeypatch.setattr(mod, "WEB_USERS_ROOT", str(root))
+    monkeypatch.setenv("RAG_STORAGE_LEDGER_DB", str(tmp_path / "ledger.sqlite3"))
+    monkeypatch.setenv("RAG_ANALYTICS_DB", str(tmp_path / "analytics.sqlite3"))
+    recent = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    accounts = [
+        {"id": 1, "username": "a", "last_login_at": recent},
+        {"id": 2, "username": "b", "last_login_at": None},
+        {"id": 3, "username": "c", "last_login_at": "2000-01-01T00:00:00+00:00"},
+    ]
+    monkeypatch.setattr(auth_store, "list_users_admin", lambda search=None: list(accounts))
+
+    def write_meta(uid: int, docs, cats=("默认知识库",)):
+        p = root / str(uid) / "knowledge_db" / "documents_metadata.json"
+        os.makedirs(p.parent, exist_ok=True)
+        p.write_text(json.dumps({"documents": {d["file_name"]: d for d in docs}, "categories": list(cats)}))
+
+    write_meta(1, [_doc("a.pdf", 0, 10), _doc("b.pdf", 3, 5), _doc("gone.pdf", 1, 7, deleted=True)], ("默认知识库", "制度"))
+    write_meta(2, [_doc("c.txt", 3, 2)])
+    write_meta(9, [_doc("orphan.txt", 0, 4)])  # 有目录无账号：只计入知识库与上传趋势
+    return accounts, write_meta
+
+
+def _snapshot():
+    ov = platform_analytics_overview(trend_days=7, active_days=30)
+    return {k: v for k, v in ov.items() if k not in ("storage_bytes_total", "storage_mb_total")}
+
+
+def test_first_request_reconciles(platform):
+    ov = platform_analytics_overview(trend_days=7, active_days=30)
+    assert (ov["user_total"], ov["users_active"], ov["disk_user_folders"]) == (3, 1, 4)
+    assert ov["knowledge_bases_total"] == 2 + 1 + 1 + 1  # 用户 3 无目录，按默认知识库计
+    assert (ov["documents_total"], ov["chunks_total"]) == (3, 17)
+    trend = {x["date"]: x["uploads"] for x in ov["upload_trend"]}
+    assert trend[_TODAY.isoformat()] == 2 and trend[(_TODAY - timedelta(days=3)).isoformat()] == 2
+    assert ov["uploads_sum_in_trend"] == 4
+
+
+def test_events_match_full_reconcile(platform):
+    accounts, _write = platform
+    _snapshot()
+    # 入库 / 删除 / 改分类都经元数据保存
+    meta = admin_docs._load_user_meta(2)
+    meta["documents"]["d.txt"] = _doc("d.txt", 0, 6, category="新库")
+    meta["categories"] = ["默认知识库", "新库"]
+    admin_docs._save_user_meta(2, meta)
+    meta = admin_docs._load_user_meta(1)
+    meta["documents"]["a.pdf"]["is_deleted"] = True
+    admin_docs._save_user_meta(1, meta)
+    # 注册 + 登录，删除账号
+    accounts.append({"id": 4, "username": "d", "last_login_at": datetime.now(timezone.utc).isoformat()})
+    agg.note_user_registered(4)
+    agg.note_user_login(4)
+    del accounts[2]
+    agg.forget_user(3)
+
+    incremental = _snapshot()
+    assert incremental["user_total"] == 3 and incremental["users_active"] == 2
+    assert agg.reconcile_all_users() == 4
+    assert _snapshot() == incremental
+
+
+def test_reconcile_corrects_unhooked_changes(platform):
+    _accounts, write_meta = platform
+    before = _snapshot()
+    write_meta(2, [_doc("c.txt", 3, 2), _doc("e.txt", 0, 8)])  # 绕过 save 钩子直接写文件
+    assert _snapshot() == before
+    agg.reconcile_all_users()
+    after = _snapshot()
+    assert after["documents_total"] == before["documents_total"] + 1
+    assert after["chunks_total"] == before["chunks_total"] + 8
+    assert after["uploads_sum_in_trend"] == before["uploads_sum_in_trend"] + 1
+
+
+def test_full_reconcile_claim_is_per_store(platform):
+    # 汇总库与存储台账共用校正线程骨架，但各自在自己的库中抢占
+    assert agg._reconciler.claim(600) is True
+    assert agg._reconciler.claim(600) is False
+    assert sl._reconciler.claim(600) is True
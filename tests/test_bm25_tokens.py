@@ -0,0 +1,78 @@
+"""BM25 分词缓存：重建只对新正文分词、重复正文只分一次、分词器升版失效并清理、进程池分词结果一致。"""
+from __future__ import annotations
+
+import sqlite3
+
+import pytest
+from langchain_core.documents import Document
+from rank_bm25 import BM25Okapi
+
+import utils.bm25_tokens as bt
+import utils.hybrid_search as hs
+from utils.path_context import kb_dir_context
+
+_TEXTS = ["图书馆借阅规则第一条", "逾期归还需缴纳滞纳金", "图书馆借阅规则第一条", "潜水证考试流程"]
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    calls = []
+    real = hs.tokenize_chinese
+
+    def counting(text):
+        calls.append(text)
+        return real(text)
+
+    monkeypatch.setattr(hs, "tokenize_chinese", counting)
+    monkeypatch.delenv("RAG_BM25_TOKEN_CACHE", raising=False)
+    monkeypatch.setenv("RAG_BM25_TOKENIZE_PROCESSES", "0")
+    with kb_dir_context(str(tmp_path)):
+        yield tmp_path, calls, real
+
+
+def _docs(texts):
+    return [Document(page_content=t, metadata={"source_file": "a.txt"}) for t in texts]
+
+
+def test_rebuild_only_tokenizes_new_content(kb):
+    _tmp, calls, real = kb
+    first = hs.build_bm25_index(_docs(_TEXTS))
+    assert len(calls) == 3  # 重复正文只分一次
+    calls.clear()
+    bt.remember_document_tokens(_docs(["新上传的分块内容"]))
+    assert calls == ["新上传的分块内容"]
+    calls.clear()
+    again = hs.build_bm25_index(_docs(_TEXTS + ["新上传的分块内容"]))
+    assert calls == []
+    all_texts = _TEXTS + ["新上传的分块内容"]
+    assert again.doc_freqs[:4] == first.doc_freqs
+    q = real("图书馆借阅规则")
+    assert list(again.get_scores(q)) == list(BM25Okapi([real(t) for t in all_texts]).get_scores(q))
+
+
+def test_tokenizer_version_bump_misses_and_prunes(kb, monkeypatch):
+    tmp, calls, _real = kb
+    hs.build_bm25_index(_docs(_TEXTS))
+    monkeypatch.setattr(hs, "_BM25_TOKENIZER_VERSION", hs._BM25_TOKENIZER_VERSION + 1)
+    calls.clear()
+    hs.build_bm25_index(_docs(_TEXTS))
+    assert len(calls) == 3
+    with sqlite3.connect(str(tmp / bt.BM25_TOKENS_FILENAME)) as conn:
+        versions = {v for (v,) in conn.execute("SELECT DISTINCT tokenizer FROM bm25_tokens")}
+    assert versions == {hs._BM25_TOKENIZER_VERSION}
+
+
+def test_disabled_cache_still_tokenizes(kb, monkeypatch):
+    tmp, calls, real = kb
+    monkeypatch.setenv("RAG_BM25_TOKEN_CACHE", "0")
+    assert bt.tokenize_texts(_TEXTS) == [real(t) for t in _TEXTS]
+    assert not (tmp / bt.BM25_TOKENS_FILENAME).exists()
+
+
+def test_process_pool_matches_serial(kb, monkeypatch):
+    _tmp, _calls, real = kb
+    texts = [f"第{i}条 图书馆借阅规则与逾期费用说明" for i in range(40)]
+    monkeypatch.setenv("RAG_BM25_TOKENIZE_PROCESSES", "2")
+    monkeypatch.setenv("RAG_BM25_TOKENIZE_PARALLEL_MIN", "10")
+    monkeypatch.setenv("RAG_BM25_TOKEN_CACHE", "0")
+    assert bt.tokenize_texts(texts) == [real(t) for t in texts]
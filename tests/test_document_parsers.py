@@ -169,9 +169,11 @@ def _tesseract_available() -> bool:
 
 
 @pytest.mark.skipif(not _tesseract_available(), reason="本机无 Tesseract，跳过真图 OCR")
-def test_parse_image_real_ocr(tmp_path):
+def test_parse_image_real_ocr(tmp_path, monkeypatch):
     from PIL import Image, ImageDraw, ImageFont
 
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")  # 不写入默认知识库目录的 OCR 缓存
+
     font = None
     for name in ("arial.ttf", "DejaVuSans.ttf", "C:/Windows/Fonts/arial.ttf"):
         try:
@@ -200,6 +202,7 @@ def test_parse_image_blank_raises(tmp_path, monkeypatch):
 
     # 空白图会触发云端回退（且云端可能对空白图也返回内容），锁定 off 只测本地路径
     monkeypatch.setattr(dp, "_ocr_cloud_cfg", lambda: {"mode": "off", "conf_threshold": 60})
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
     p = tmp_path / "blank.jpg"
     Image.new("RGB", (100, 100), "white").save(str(p))
     with pytest.raises(ValueError, match="未识别到文字"):
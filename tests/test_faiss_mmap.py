@@ -0,0 +1,123 @@
+"""FAISS 只读 mmap 载入：结果与常规载入一致（含追加段与墓碑）、写操作被拦截、旧目录补写列式 docstore、
+压缩重写基段后已映射的旧对象仍可检索。"""
+from __future__ import annotations
+
+from typing import List
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import utils.document_deleter as dd
+import utils.faiss_segments as fs
+from utils.faiss_mmap import MmapDocstore
+from utils.faiss_tombstones import TombstoneFAISS, compact_faiss_index, load_faiss_index
+from utils.path_context import kb_dir_context
+
+
+class _HashEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float((hash(text) >> s) & 0xFF) for s in range(0, 64, 8)]
+
+
+def _docs(src: str, n: int) -> List[Document]:
+    return [Document(page_content=f"{src} 第{i}段", metadata={"source_file": src, "i": i}) for i in range(n)]
+
+
+def _hits(db, q: str, k: int = 30, **kw):
+    return [(d.page_content, d.metadata, round(float(s), 4)) for d, s in db.similarity_search_with_score(q, k=k, **kw)]
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    d = str(tmp_path / "faiss_index")
+    db = TombstoneFAISS.from_documents(_docs("base.txt", 80), _HashEmbeddings())
+    db.save_local(d)
+    db.add_documents(_docs("a.txt", 10))
+    db.save_local(d)
+    return d
+
+
+def test_mmap_matches_owned_load_with_segments_and_tombstones(index_dir):
+    emb = _HashEmbeddings()
+    owned = load_faiss_index(index_dir, emb)
+    ro = load_faiss_index(index_dir, emb, read_only=True)
+    assert ro.read_only and isinstance(ro.docstore, MmapDocstore)
+    assert ro._tail_index.ntotal == 10 and len(ro.index_to_docstore_id) == 90
+    for q in ("a.txt 第3段", "base.txt 第7段"):
+        assert _hits(ro, q) == _hits(owned, q)
+    assert _hits(ro, "x", k=5, filter={"source_file": "a.txt"}, fetch_k=100) == _hits(
+        owned, "x", k=5, filter={"source_file": "a.txt"}, fetch_k=100
+    )
+    assert ro.ids_for_source_file("a.txt") == owned.ids_for_source_file("a.txt")
+
+    # 基段与追加段各删一个文件的一部分：两种载入方式过滤结果一致
+    victims = owned.ids_for_source_file("a.txt")[:4] + owned.ids_for_source_file("base.txt")[:30]
+    owned.mark_deleted(victims)
+    owned.flush_tombstones()
+    assert ro.sync_tombstones() == 34
+    assert _hits(ro, "a.txt 第3段", k=100) == _hits(owned, "a.txt 第3段", k=100)
+    assert ro.dead_count() == 34 and len(ro.ids_for_source_file("a.txt")) == 6
+
+
+def test_read_only_rejects_writes_but_accepts_tombstones(index_dir, tmp_path, monkeypatch):
+    emb = _HashEmbeddings()
+    ro = load_faiss_index(index_dir, emb, read_only=True)
+    with pytest.raises(RuntimeError):
+        ro.add_documents(_docs("b.txt", 1))
+    with pytest.raises(RuntimeError):
+        ro.delete(ro.ids_for_source_file("a.txt"))
+    with pytest.raises(RuntimeError):
+        ro.save_local(str(tmp_path / "other"))
+
+    monkeypatch.setattr(dd, "log_file_delete", lambda **kw: None)
+    before = fs._base_fingerprint(index_dir)
+    with kb_dir_context(str(tmp_path)):
+        assert dd.delete_document_from_vector_db("a.txt", ro, emb) == (True, 10)
+    ro.save_local(index_dir)  # 保存回原目录：无向量可写，只追加墓碑
+    assert fs._base_fingerprint(index_dir) == before
+    assert all(d.metadata["source_file"] == "base.txt" for d in load_faiss_index(index_dir, emb).similarity_search("a.txt", k=100))
+
+
+def test_legacy_dir_gets_docstore_once(tmp_path, monkeypatch):
+    emb = _HashEmbeddings()
+    d = str(tmp_path / "faiss_index")
+    FAISS.from_documents(_docs("legacy.txt", 12), emb).save_local(d)
+    assert fs.read_manifest(d) is None
+    before = fs._base_fingerprint(d)
+    ro = load_faiss_index(d, emb, read_only=True)
+    assert ro.read_only and fs._base_fingerprint(d) == before
+    assert fs.read_manifest(d)["docs"]
+    assert _hits(ro, "legacy.txt 第2段") == _hits(load_faiss_index(d, emb), "legacy.txt 第2段")
+
+    # 写者之后的增量保存保留 docs，只读载入继续映射（追加段在 tail）
+    w = load_faiss_index(d, emb)
+    w.add_documents(_docs("new.txt", 3))
+    w.save_local(d)
+    ro2 = load_faiss_index(d, emb, read_only=True)
+    assert ro2.read_only and ro2._tail_index.ntotal == 3
+
+    monkeypatch.setenv("RAG_FAISS_MMAP", "0")
+    assert not load_faiss_index(d, emb, read_only=True).read_only
+
+
+def test_mapped_object_survives_compaction(tmp_path):
+    # 压缩整库重写基段须原子替换：就地截断 index.faiss 会让仍映射旧文件的对象检索时 SIGBUS
+    emb = _HashEmbeddings()
+    d = str(tmp_path / "faiss_index")
+    TombstoneFAISS.from_documents(_docs("base.txt", 5000), emb).save_local(d)
+    ro = load_faiss_index(d, emb, read_only=True)
+    assert ro.read_only
+    before = _hits(ro, "base.txt 第3段", k=5)
+
+    w = load_faiss_index(d, emb)
+    w.mark_deleted(list(w.index_to_docstore_id.values())[:4500])
+    w.flush_tombstones()
+    assert compact_faiss_index(str(tmp_path), emb) == 4500
+    assert load_faiss_index(d, emb).index.ntotal == 500
+
+    assert _hits(ro, "base.txt 第3段", k=5) == before
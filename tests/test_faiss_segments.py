@@ -0,0 +1,159 @@
+"""FAISS 分段持久化：增量保存不动基段、载入拼接追加段、段合并/基段重写、旧 manifest 与半途崩溃的处理。"""
+from __future__ import annotations
+
+import os
+from typing import List
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import utils.faiss_segments as fs
+from utils.faiss_tombstones import TombstoneFAISS, compact_faiss_index, load_faiss_index
+
+
+class _HashEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float((hash(text) >> s) & 0xFF) for s in range(0, 64, 8)]
+
+
+def _docs(src: str, n: int) -> List[Document]:
+    return [Document(page_content=f"{src} 第{i}段", metadata={"source_file": src}) for i in range(n)]
+
+
+def _base_fp(index_dir: str):
+    return fs._base_fingerprint(index_dir)
+
+
+def _segment_files(index_dir: str) -> List[str]:
+    return sorted(f for f in os.listdir(index_dir) if f.startswith(fs.SEGMENT_PREFIX))
+
+
+def _contents(db) -> List[str]:
+    return sorted(db.docstore.search(i).page_content for i in db.index_to_docstore_id.values())
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    d = str(tmp_path / "faiss_index")
+    db = TombstoneFAISS.from_documents(_docs("base.txt", 100), _HashEmbeddings())
+    db.save_local(d)
+    return d
+
+
+def test_append_leaves_base_untouched_and_loads_back(index_dir):
+    emb = _HashEmbeddings()
+    before = _base_fp(index_dir)
+    db = load_faiss_index(index_dir, emb)
+    db.add_documents(_docs("a.txt", 10))
+    db.save_local(index_dir)
+    db.add_documents(_docs("b.txt", 5))
+    db.save_local(index_dir)
+    assert _base_fp(index_dir) == before
+    assert len(_segment_files(index_dir)) == 4
+    m = fs.read_manifest(index_dir)
+    assert [(s["start"], s["count"]) for s in m["segments"]] == [(100, 10), (110, 5)]
+
+    loaded = load_faiss_index(index_dir, emb)
+    assert loaded.index.ntotal == 115
+    assert _contents(loaded) == _contents(db)
+    q = "a.txt 第3段"
+    assert [d.page_content for d in loaded.similarity_search(q, k=5)] == [d.page_content for d in db.similarity_search(q, k=5)]
+    # 无新增时保存不写任何文件
+    loaded.save_local(index_dir)
+    assert fs.read_manifest(index_dir) == m
+
+
+def test_segments_merge_then_base_rewrite(index_dir, monkeypatch):
+    emb = _HashEmbeddings()
+    monkeypatch.setattr(fs, "max_segments", lambda: 2)
+    before = _base_fp(index_dir)
+    db = load_faiss_index(index_dir, emb)
+    for name in ("a.txt", "b.txt", "c.txt"):
+        db.add_documents(_docs(name, 4))
+        db.save_local(index_dir)
+    # 第三段触发段合并：只剩一段覆盖全部增量，基段不变
+    m = fs.read_manifest(index_dir)
+    assert [(s["start"], s["count"]) for s in m["segments"]] == [(100, 12)]
+    assert len(_segment_files(index_dir)) == 2
+    assert _base_fp(index_dir) == before
+    assert load_faiss_index(index_dir, emb).index.ntotal == 112
+
+    # 增量超过基段的一半：整库重写基段
+    db.add_documents(_docs("big.txt", 60))
+    db.save_local(index_dir)
+    m = fs.read_manifest(index_dir)
+    assert m["segments"] == [] and m["base_ntotal"] == 172
+    assert _segment_files(index_dir) == []
+    assert _base_fp(index_dir) != before
+    assert _contents(load_faiss_index(index_dir, emb)) == _contents(db)
+
+
+def test_legacy_full_save_ignores_stale_manifest(index_dir):
+    emb = _HashEmbeddings()
+    db = load_faiss_index(index_dir, emb)
+    db.add_documents(_docs("a.txt", 10))
+    db.save_local(index_dir)
+    legacy = FAISS.from_documents(_docs("legacy.txt", 3), emb)
+    legacy.save_local(index_dir)
+    loaded = load_faiss_index(index_dir, emb)
+    assert _contents(loaded) == _contents(legacy)
+    # 下次保存整库写并重建 manifest
+    loaded.add_documents(_docs("b.txt", 2))
+    loaded.save_local(index_dir)
+    assert fs.read_manifest(index_dir)["base_ntotal"] == 5
+    assert load_faiss_index(index_dir, emb).index.ntotal == 5
+
+
+def test_crash_before_manifest_keeps_previous_state(index_dir, monkeypatch):
+    emb = _HashEmbeddings()
+    db = load_faiss_index(index_dir, emb)
+    db.add_documents(_docs("a.txt", 10))
+
+    def boom(*_a, **_k):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(fs, "_write_manifest", boom)
+    with pytest.raises(OSError):
+        db.save_local(index_dir)
+    monkeypatch.undo()
+    assert load_faiss_index(index_dir, emb).index.ntotal == 100
+    # 孤儿段文件在下次成功保存时清理
+    db2 = load_faiss_index(index_dir, emb)
+    db2.add_documents(_docs("b.txt", 3))
+    db2.save_local(index_dir)
+    assert len(_segment_files(index_dir)) == 2
+    assert load_faiss_index(index_dir, emb).index.ntotal == 103
+
+
+def test_stale_copy_falls_back_to_full_save(index_dir):
+    emb = _HashEmbeddings()
+    first = load_faiss_index(index_dir, emb)
+    stale = load_faiss_index(index_dir, emb)
+    first.add_documents(_docs("a.txt", 10))
+    first.save_local(index_dir)
+    stale.add_documents(_docs("b.txt", 4))
+    stale.save_local(index_dir)
+    # 与原 save_local 相同：后写者整体覆盖，但磁盘状态自洽
+    loaded = load_faiss_index(index_dir, emb)
+    assert _contents(loaded) == _contents(stale)
+    assert fs.read_manifest(index_dir)["segments"] == []
+
+
+def test_tombstones_and_compaction_with_segments(index_dir, tmp_path):
+    emb = _HashEmbeddings()
+    db = load_faiss_index(index_dir, emb)
+    db.add_documents(_docs("a.txt", 10))
+    db.save_local(index_dir)
+    db.mark_deleted(db.ids_for_source_file("a.txt"))
+    db.flush_tombstones()
+    loaded = load_faiss_index(index_dir, emb)
+    assert all(d.metadata["source_file"] == "base.txt" for d in loaded.similarity_search("a.txt 第1段", k=200))
+    assert compact_faiss_index(str(tmp_path)) == 10
+    compacted = load_faiss_index(index_dir, emb)
+    assert compacted.index.ntotal == 100
+    assert fs.read_manifest(index_dir)["segments"] == []
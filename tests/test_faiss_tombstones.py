@@ -0,0 +1,135 @@
+"""FAISS 墓碑软删除：删除只追加日志、检索过滤、跨副本同步、后台压缩后结果不变且旧副本写回不复活。"""
+from __future__ import annotations
+
+import os
+from typing import List
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import utils.document_deleter as dd
+import utils.faiss_tombstones as ft
+from utils.db import get_vector_db
+from utils.ingest_dedup import ChunkVectorReuse
+from utils.path_context import kb_dir_context
+
+
+class _HashEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float((hash(text) >> s) & 0xFF) for s in range(0, 64, 8)]
+
+
+def _doc(text: str, src: str) -> Document:
+    return Document(page_content=text, metadata={"source_file": src})
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    monkeypatch.setattr(dd, "log_file_delete", lambda **kw: None)
+    with kb_dir_context(str(tmp_path)):
+        emb = _HashEmbeddings()
+        vdb = get_vector_db(emb)
+        for name in ("a.txt", "b.txt", "c.txt"):
+            vdb.add_documents([_doc(f"{name} 第{i}段", name) for i in range(20)])
+        vdb.save_local(str(tmp_path / "faiss_index"))
+        yield tmp_path, emb
+
+
+def _sources(vdb, query: str = "第3段", k: int = 100) -> List[str]:
+    return [d.metadata["source_file"] for d in vdb.similarity_search(query, k=k)]
+
+
+def test_delete_appends_log_without_rewriting_index(kb):
+    root, emb = kb
+    index_dir = root / "faiss_index"
+    vdb = get_vector_db(emb)
+    before = os.stat(index_dir / "index.faiss").st_mtime_ns
+    ok, n = dd.delete_document_from_vector_db("b.txt", vdb, emb)
+    assert ok and n == 20
+    assert os.stat(index_dir / "index.faiss").st_mtime_ns == before
+    assert "b.txt" not in _sources(vdb)
+    assert vdb.index.ntotal == 61 and vdb.dead_count() == 20
+    # 重新载入（其他进程）同样不可见；再删一次无块可删
+    fresh = get_vector_db(emb)
+    assert "b.txt" not in _sources(fresh)
+    assert len([s for s in _sources(fresh) if s != "system"]) == 40
+    assert dd.delete_document_from_vector_db("b.txt", fresh, emb) == (False, 0)
+
+
+def test_filter_and_threshold_match_plain_faiss(kb):
+    root, emb = kb
+    vdb = get_vector_db(emb)
+    dd.delete_document_from_vector_db("a.txt", vdb, emb)
+    got = vdb.similarity_search_with_score("c.txt 第5段", k=5, filter={"source_file": "c.txt"}, fetch_k=100)
+    assert [d.metadata["source_file"] for d, _s in got] == ["c.txt"] * 5
+    assert got[0][0].page_content == "c.txt 第5段"
+    cutoff = got[2][1]
+    limited = vdb.similarity_search_with_score("c.txt 第5段", k=50, score_threshold=cutoff)
+    assert all(s <= cutoff for _d, s in limited)
+    assert all(d.metadata["source_file"] != "a.txt" for d, _s in limited)
+
+
+def test_sync_picks_up_other_writers(kb):
+    root, emb = kb
+    reader = get_vector_db(emb)
+    writer = get_vector_db(emb)
+    dd.delete_document_from_vector_db("c.txt", writer, emb)
+    assert "c.txt" in _sources(reader)
+    assert reader.sync_tombstones() == 20
+    assert "c.txt" not in _sources(reader)
+
+
+def test_compaction_preserves_results_and_blocks_stale_copy(kb):
+    root, emb = kb
+    stale = get_vector_db(emb)
+    vdb = get_vector_db(emb)
+    dd.delete_document_from_vector_db("a.txt", vdb, emb)
+    expected = [(d.page_content, round(float(s), 4)) for d, s in vdb.similarity_search_with_score("b.txt 第7段", k=30)]
+
+    assert ft.needs_compaction(vdb) is False  # 20 条 < 默认最少 64 条
+    assert ft.compact_faiss_index(str(root)) == 20
+    compacted = get_vector_db(emb)
+    assert compacted.index.ntotal == 41 and compacted.dead_count() == 0
+    got = [(d.page_content, round(float(s), 4)) for d, s in compacted.similarity_search_with_score("b.txt 第7段", k=30)]
+    assert got == expected
+
+    # 压缩前载入的旧副本随后落盘：a.txt 的块被写回，但日志仍屏蔽它们
+    stale.add_documents([_doc("d.txt 新段", "d.txt")])
+    stale.save_local(str(root / "faiss_index"))
+    reloaded = get_vector_db(emb)
+    assert "a.txt" not in _sources(reloaded)
+    assert "d.txt" in _sources(reloaded, "d.txt 新段")
+    assert ft.compact_faiss_index(str(root)) == 20
+    assert get_vector_db(emb).index.ntotal == 42
+
+
+def test_compaction_batches(kb, monkeypatch):
+    root, emb = kb
+    monkeypatch.setattr(ft, "compact_batch_size", lambda: 15)
+    vdb = get_vector_db(emb)
+    dd.delete_document_from_vector_db("a.txt", vdb, emb)
+    dd.delete_document_from_vector_db("b.txt", vdb, emb)
+    assert ft.compact_faiss_index(str(root)) == 40
+    assert sorted(set(_sources(get_vector_db(emb)))) == ["c.txt", "system"]
+
+
+def test_reupload_tombstones_old_version_on_save(kb):
+    root, emb = kb
+    index_dir = str(root / "faiss_index")
+    vdb = get_vector_db(emb)
+    reuse = ChunkVectorReuse(vdb, "a.txt")
+    reuse.add_documents([_doc("a.txt 新版", "a.txt")])
+    assert reuse.drop_replaced() == 20
+    assert [d.page_content for d in vdb.similarity_search("a.txt 第1段", k=100, filter={"source_file": "a.txt"}, fetch_k=100)] == [
+        "a.txt 新版"
+    ]
+    # 落盘前崩溃：磁盘上仍是旧版本，不会出现两头皆空
+    assert len(get_vector_db(emb).ids_for_source_file("a.txt")) == 20
+    vdb.save_local(index_dir)
+    assert [d.page_content for d in get_vector_db(emb).similarity_search("x", k=100) if d.metadata["source_file"] == "a.txt"] == [
+        "a.txt 新版"
+    ]
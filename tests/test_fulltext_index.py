@@ -0,0 +1,92 @@
+"""全文位置索引：与线性子串扫描结果一致、随 sidecar 增删同步、旧文档补建、无法走索引时返回 None。"""
+from __future__ import annotations
+
+import os
+import random
+
+import pytest
+
+import utils.document_preview as dpv
+import utils.fulltext_index as fti
+import utils.text_sidecar as ts
+from utils.path_context import kb_dir_context
+
+
+@pytest.fixture
+def kb(tmp_path):
+    with kb_dir_context(str(tmp_path)):
+        yield tmp_path
+
+
+def _corpus(seed: int, n: int) -> str:
+    rnd = random.Random(seed)
+    pieces = ["借阅", "期限", "三十天", "续借", "Python", "python3", "PyTorch", "GPU", "第12条", "：", "，", "。",
+              " ", "\n", "ABC-123", "abc", "図書館", "한국어", "Straße", "ÉCOLE", "école", "の", "的"]
+    return "".join(rnd.choice(pieces) for _ in range(n))
+
+
+_QUERIES = [
+    "借阅", "借", "期限三", "三十天续借", "的", "python", "PYTHON3", "ytho", "on3", "p", "gpu第", "第12",
+    "12条", "2", "abc-1", "C-12", "図書", "국어", "école", "ÉCOLE", "Straße", "ABC", "n第", "，", "借阅 期限",
+]
+
+
+def _linear(names, q):
+    out = []
+    for fn in names:
+        text = dpv.get_plain_text_for_kb_substring_search(fn, None)
+        out += [(fn, h) for h in dpv.substring_hits_with_context(text, q, max_hits=50)]
+    return out
+
+
+def test_indexed_hits_match_linear_scan(kb):
+    names = [f"doc{i}.txt" for i in range(4)]
+    for i, fn in enumerate(names):
+        assert ts.write_sidecar(fn, "  " + _corpus(i, 3000) + "\n")
+    # 流式写入的多段文档
+    w = ts.SidecarWriter("stream.txt")
+    for seg in range(3):
+        w.append(_corpus(10 + seg, 800).strip())
+    w.commit()
+    names.append("stream.txt")
+    assert set(fti.indexed_documents(names)) == set(names)
+
+    for q in _QUERIES:
+        it = dpv.iter_indexed_substring_hits(names, q, None, max_per_file=50)
+        if it is None:
+            assert q in ("，", "Straße"), q
+            continue
+        assert list(it) == _linear(names, q), q
+
+
+def test_index_follows_sidecar_replace_and_delete(kb):
+    ts.write_sidecar("a.txt", "旧版本：借阅期限三十天")
+    assert [h["match"] for _fn, h in dpv.iter_indexed_substring_hits(["a.txt"], "三十天", None)] == ["三十天"]
+    ts.write_sidecar("a.txt", "新版本：借阅期限六十天")
+    assert list(dpv.iter_indexed_substring_hits(["a.txt"], "三十天", None)) == []
+    assert len(list(dpv.iter_indexed_substring_hits(["a.txt"], "六十天", None))) == 1
+    ts.delete_sidecar("a.txt")
+    assert fti.indexed_documents(["a.txt"]) == {}
+    ts.clear_sidecars()
+    assert not os.path.exists(fti.fulltext_index_path())
+
+
+def test_legacy_document_backfilled_on_first_search(kb):
+    ts.write_sidecar("old.txt", "旧文档：馆藏图书可续借一次。")
+    fti.clear_fulltext_index()  # 模拟索引上线前入库的文档
+    hits = list(dpv.iter_indexed_substring_hits(["old.txt", "missing.txt"], "续借", None))
+    assert [(fn, h["global_offset"]) for fn, h in hits] == [("old.txt", 9)]
+    assert set(fti.indexed_documents(["old.txt", "missing.txt"])) == {"old.txt", "missing.txt"}
+
+
+def test_early_stop_and_flush_batches(kb, monkeypatch):
+    monkeypatch.setattr(fti, "_FLUSH_POSITIONS", 50)
+    ts.write_sidecar("big.txt", "甲乙丙。" * 500)
+    it = dpv.iter_indexed_substring_hits(["big.txt"], "乙丙", None, max_per_file=3)
+    assert [h["global_offset"] for _fn, h in it] == [1, 5, 9]
+
+
+def test_plan_rejects_unindexable_queries():
+    assert fti.plan_fulltext_query("，。！") is None
+    assert fti.plan_fulltext_query("Straße") is None
+    assert fti.plan_fulltext_query("数据ab") is not None
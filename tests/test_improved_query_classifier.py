@@ -76,3 +76,36 @@ class TestRetrievalParams:
     def test_stable_keys_present(self):
         p = get_retrieval_params_for_query("reasoning", query_length=30)
         assert set(p.keys()) == {"fetch_k", "top_k", "similarity_threshold"}
+
+
+class TestCombinedMatcherParity:
+    """预编译单遍匹配与改造前逐条匹配（见 scripts/bench_query_classifier.py）输出一致。"""
+
+    def test_handcrafted_queries_match_legacy(self):
+        from scripts.bench_query_classifier import (
+            legacy_intent,
+            legacy_keyword_count,
+            legacy_query_type,
+            load_queries,
+        )
+        from utils import improved_query_classifier as iqc
+        from utils.intent_classifier import classify_intent_lightweight
+
+        for q in load_queries():
+            assert classify_query_type_rule_based(q) == legacy_query_type(q), q
+            assert len(iqc._TYPE_KEYWORD_RE.findall(q)) == legacy_keyword_count(q), q
+            assert classify_intent_lightweight(q) == legacy_intent(q), q
+
+    @pytest.mark.parametrize(
+        "query,expected",
+        [
+            # 低优先级信号在前、高优先级信号在后，且命中区间重叠
+            ("如何判断", "reasoning"),
+            ("为什么是这样", "reasoning"),
+            ("张三和李四的区别", "comparison"),
+            ("第三章有哪些要点", "summary"),
+            ("如果下雨那么怎么办", "conditional"),
+        ],
+    )
+    def test_priority_with_overlapping_signals(self, query, expected):
+        assert classify_query_type_rule_based(query) == expected
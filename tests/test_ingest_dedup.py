@@ -0,0 +1,128 @@
+"""入库去重：块级向量复用与同名重传替换、文件级去重按知识库、哈希映射跨载入复用。"""
+from __future__ import annotations
+
+from typing import List
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import utils.ingest_dedup as idd
+from utils.db import get_vector_db
+from utils.ingest_dedup import ChunkVectorReuse, chunk_content_hash
+from utils.path_context import kb_dir_context
+
+
+class _CountingEmbeddings(Embeddings):
+    def __init__(self) -> None:
+        self.embedded: List[str] = []
+
+    def _vec(self, text: str) -> List[float]:
+        h = chunk_content_hash(text)
+        return [int(h[i : i + 2], 16) / 255.0 for i in range(0, 16, 2)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [self._vec(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vec(text)
+
+
+def _doc(text: str, source: str) -> Document:
+    return Document(page_content=text, metadata={"source_file": source})
+
+
+def _sources(vdb) -> List[str]:
+    return sorted(
+        f"{d.metadata['source_file']}:{d.page_content}"
+        for d in (vdb.docstore.search(i) for i in vdb.index_to_docstore_id.values())
+    )
+
+
+def test_reupload_reuses_unchanged_chunks_and_replaces_old_version():
+    emb = _CountingEmbeddings()
+    vdb = FAISS.from_documents([_doc("系统占位", "system")], emb)
+    first = ChunkVectorReuse(vdb, "a.txt")
+    first.add_documents([_doc("第一段", "a.txt"), _doc("第二段", "a.txt")])
+    assert first.drop_replaced() == 0
+    assert first.stats(0)["chunks_embedded"] == 2
+
+    emb.embedded.clear()
+    second = ChunkVectorReuse(vdb, "a.txt")
+    second.add_documents([_doc("第一段", "a.txt"), _doc("第二段（修订）", "a.txt")])
+    assert second.drop_replaced() == 2
+    assert emb.embedded == ["第二段（修订）"]
+    assert second.stats(2) == {"chunks_embedded": 1, "chunks_reused": 1, "chunks_replaced": 2}
+    assert _sources(vdb) == sorted(["system:系统占位", "a.txt:第一段", "a.txt:第二段（修订）"])
+    # 复用的向量与原向量一致，检索结果不变
+    hit = vdb.similarity_search("第一段", k=1)[0]
+    assert hit.page_content == "第一段" and hit.metadata["content_hash"] == chunk_content_hash("第一段")
+
+
+def test_repeated_chunk_within_one_file_embedded_once():
+    emb = _CountingEmbeddings()
+    vdb = FAISS.from_documents([_doc("系统占位", "system")], emb)
+    emb.embedded.clear()
+    reuse = ChunkVectorReuse(vdb, "b.txt")
+    reuse.add_documents([_doc("页眉", "b.txt"), _doc("正文一", "b.txt")])
+    reuse.add_documents([_doc("页眉", "b.txt"), _doc("正文二", "b.txt")])
+    assert emb.embedded == ["页眉", "正文一", "正文二"]
+    assert reuse.stats(0)["chunks_reused"] == 1
+
+
+def test_identical_file_only_skipped_within_same_kb(monkeypatch):
+    meta = {
+        "documents": {
+            "a.pdf": {"content_sha256": "h1", "category": "制度"},
+            "b.pdf": {"content_sha256": "h2"},  # 旧元数据无 category：按默认知识库
+            "c.pdf": {"content_sha256": "h3", "category": "制度", "is_deleted": True},
+        }
+    }
+    monkeypatch.setattr(idd, "load_metadata", lambda: meta)
+    assert idd.find_identical_document("h1", "制度") == "a.pdf"
+    assert idd.find_identical_document("h1", "默认知识库") is None
+    assert idd.find_identical_document("h2", "默认知识库") == "b.pdf"
+    assert idd.find_identical_document("h3", "制度") is None
+
+
+def test_hash_index_scans_only_new_positions_across_loads(tmp_path):
+    emb = _CountingEmbeddings()
+    index_dir = str(tmp_path / "faiss_index")
+
+    def load_counting():
+        vdb = get_vector_db(emb)
+        calls = []
+        real = vdb.docstore.search
+        vdb.docstore.search = lambda i: calls.append(i) or real(i)
+        return vdb, calls
+
+    with kb_dir_context(str(tmp_path)):
+        vdb = get_vector_db(emb)
+        first = ChunkVectorReuse(vdb, "a.txt")
+        first.add_documents([_doc(f"a 第{i}段", "a.txt") for i in range(30)])
+        vdb.save_local(index_dir)
+
+        # 新载入的私有副本：缓存映射仍有效，不再遍历已有 30 个块
+        vdb, calls = load_counting()
+        emb.embedded.clear()
+        second = ChunkVectorReuse(vdb, "b.txt")
+        assert calls == []
+        second.add_documents([_doc("a 第3段", "b.txt"), _doc("b 新段", "b.txt")])
+        assert emb.embedded == ["b 新段"] and second.reused == 1
+        assert len(calls) == 2  # 只补扫本批新增的两个位置
+        vdb.save_local(index_dir)
+
+        # 物理删除使位置前移：校验失败后整表重建，复用结果仍正确
+        vdb = get_vector_db(emb)
+        vdb.delete(vdb.ids_for_source_file("a.txt")[:5])
+        vdb.save_local(index_dir)
+        vdb, calls = load_counting()
+        emb.embedded.clear()
+        third = ChunkVectorReuse(vdb, "b.txt")
+        assert len(calls) == len(vdb.index_to_docstore_id)
+        assert len(third.replaced_ids) == 2
+        third.add_documents([_doc("a 第20段", "b.txt"), _doc("b 新段", "b.txt")])
+        assert emb.embedded == [] and third.reused == 2
+        hit = vdb.similarity_search("a 第20段", k=1)[0]
+        assert hit.page_content == "a 第20段"
@@ -0,0 +1,174 @@
+"""入库队列：持久化任务库上的按用户公平领取、租约回收与启动恢复。"""
+from __future__ import annotations
+
+import os
+
+import pytest
+
+import web_app.backend.ingest_queue as iq
+from web_app.backend.ingest_job_store import IngestJobStore
+
+
+@pytest.fixture
+def fresh_queue(monkeypatch, tmp_path):
+    monkeypatch.setattr(iq, "_store", IngestJobStore(str(tmp_path / "jobs.sqlite3")))
+    monkeypatch.setattr(iq, "_pending_by_user", {})
+    monkeypatch.setattr(iq, "WEB_USERS_ROOT", str(tmp_path / "users"))
+    return iq
+
+
+def _enqueue(q, job_id: str, uid: int, staging: str = "") -> None:
+    q.enqueue_staged_file(job_id, uid, f"{job_id}.txt", "默认知识库", "", staging or f"/tmp/{job_id}")
+
+
+def _finish(q, job_id: str) -> None:
+    assert q._get_store().finish(job_id, q._OWNER, status="done", chunks=1, error=None, stages={})
+
+
+def test_round_robin_across_users(fresh_queue):
+    q = fresh_queue
+    for jid in ("a1", "a2", "a3"):
+        _enqueue(q, jid, 1)
+    _enqueue(q, "b1", 2)
+
+    first = q._next_task(0)
+    assert first.job_id == "a1"
+    # 用户 1 仍在跑：第二个空闲 worker 只能拿到用户 2 的任务
+    second = q._next_task(0)
+    assert second.job_id == "b1"
+    assert q._next_task(0) is None
+
+    _finish(q, "a1")
+    assert q._next_task(0).job_id == "a2"
+    _finish(q, "b1")
+    _finish(q, "a2")
+    _enqueue(q, "b2", 2)
+    # 用户 2 最近一次被服务早于用户 1，优先
+    assert q._next_task(0).job_id == "b2"
+
+
+def test_queued_job_reports_position_and_depth(fresh_queue):
+    q = fresh_queue
+    _enqueue(q, "a1", 1)
+    _enqueue(q, "a2", 1)
+    d = q.job_to_dict(q.get_job_for_user("a2", 1))
+    assert d["status"] == "queued"
+    assert d["queue_position"] == 2
+    assert d["queue_depth"] == 2
+    assert d["queue_depth_at_enqueue"] == 1
+    assert d["stages"] == {}
+    assert q.get_job_for_user("a2", 2) is None
+
+
+def test_expired_lease_is_requeued_then_failed(fresh_queue, monkeypatch, tmp_path):
+    q = fresh_queue
+    monkeypatch.setattr(q, "_MAX_ATTEMPTS", 2)
+    monkeypatch.setenv("RAG_STORAGE_LEDGER_DB", str(tmp_path / "ledger.sqlite3"))
+    staging = tmp_path / "a1.txt"
+    staging.write_bytes(b"x")
+    _enqueue(q, "a1", 1, str(staging))
+    store = q._get_store()
+    for attempt in (1, 2):
+        task = q._next_task(0)
+        assert task is not None and task.job_id == "a1"
+        store.expire_leases_of([q._OWNER])
+    # 第二次租约过期后超过最大尝试次数：不再排队
+    assert q._next_task(0) is None
+    rec = q.get_job_for_user("a1", 1)
+    assert rec.status == "error" and rec.attempts == 2
+    # 置 error 的任务不会再执行：领取时即删除暂存文件，不等下次启动恢复
+    assert not staging.exists()
+
+
+def test_startup_recovery_cleans_orphans_and_missing_staging(fresh_queue, tmp_path):
+    q = fresh_queue
+    staging = tmp_path / "users" / "7" / "knowledge_db" / "upload_staging"
+    staging.mkdir(parents=True)
+    kept = staging / "keep_a.txt"
+    kept.write_bytes(b"x")
+    orphan = staging / "orphan_b.txt"
+    orphan.write_bytes(b"x")
+    old = os.path.getmtime(orphan) - q._ORPHAN_STAGING_GRACE_SEC - 5
+    os.utime(orphan, (old, old))
+    _enqueue(q, "keep", 7, str(kept))
+    _enqueue(q, "lost", 7, str(staging / "lost_c.txt"))
+
+    q._recover_on_startup()
+
+    assert kept.exists() and not orphan.exists()
+    assert q.get_job_for_user("lost", 7).status == "error"
+    assert q.get_job_for_user("keep", 7).status == "queued"
+
+
+def test_lost_lease_aborts_before_writes(fresh_queue, monkeypatch, tmp_path):
+    import threading
+
+    import utils.db
+
+    q = fresh_queue
+    staging = tmp_path / "a1.txt"
+    staging.write_bytes(b"x")
+    _enqueue(q, "a1", 1, str(staging))
+    task = q._next_task(0)
+    store = q._get_store()
+    lost = threading.Event()
+
+    def heartbeat(*_a, **_k):
+        lost.set()
+        return False  # 租约已被其他进程回收
+
+    calls = []
+
+    def fake_ingest(*_a, abort_check, **_k):
+        assert lost.wait(2.0)
+        abort_check()  # 写 FAISS 前检查
+        calls.append("faiss_write")
+        return 3
+
+    monkeypatch.setattr(q, "_lease_sec", lambda: 0.03)
+    monkeypatch.setattr(store, "heartbeat", heartbeat)
+    monkeypatch.setattr(q, "set_user_kb_context", lambda uid: (None, None))
+    monkeypatch.setattr(q, "reset_kb_context", lambda *a: None)
+    monkeypatch.setattr(q, "note_document_storage_changed", lambda *a: None)
+    monkeypatch.setattr(q.vdb_cache, "get_cached_vdb_pair", lambda uid: (None, None))
+    monkeypatch.setattr(utils.db, "get_vector_db", lambda emb: object())
+    monkeypatch.setattr(q, "ingest_file", fake_ingest)
+    monkeypatch.setattr(q, "apply_compliance_hits", lambda *a: calls.append("compliance"))
+    monkeypatch.setattr(q.vdb_cache, "bump_user_cache", lambda uid: calls.append("cache"))
+
+    q._process_one_task(task)
+
+    assert calls == []
+    rec = q.get_job_for_user("a1", 1)
+    assert rec.status == "error" and "租约" in rec.error
+
+
+def test_startup_recovery_treats_reused_own_pid_as_dead(fresh_queue, tmp_path):
+    q = fresh_queue
+    staging = tmp_path / "a1.txt"
+    staging.write_bytes(b"x")
+    _enqueue(q, "a1", 1, str(staging))
+    # 重启前的进程与本进程 pid 相同（容器内 PID 1），只有随机后缀不同
+    previous = f"{q.socket.gethostname()}:{os.getpid()}:previous"
+    row, _failed = q._get_store().claim_next(previous, 600, q._MAX_ATTEMPTS)
+    assert row["job_id"] == "a1"
+
+    q._recover_on_startup()
+
+    rec = q.get_job_for_user("a1", 1)
+    assert rec.status == "queued" and rec.attempts == 1
+
+
+def test_idle_poll_takes_no_write_lock(fresh_queue):
+    q = fresh_queue
+    store = q._get_store()
+    statements = []
+    store._conn().set_trace_callback(statements.append)
+    assert q._next_task(0) is None
+    assert not any(s.startswith("BEGIN") for s in statements)
+
+    _enqueue(q, "a1", 1)
+    assert q._next_task(0).job_id == "a1"
+    # 租约过期的任务同样可被探测到
+    store.expire_leases_of([q._OWNER])
+    assert store.has_claimable()
@@ -0,0 +1,92 @@
+"""即时文档：预建摘录索引、服务端正文缓存，以及默认请求只把相关摘录发给模型。"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import utils.instant_doc_store as store
+import web_app.backend.routers.rag_routes as rr
+from utils.instant_doc_excerpt import build_instant_doc_index, select_excerpts
+from web_app.backend.schemas import InstantChatRequest
+
+
+def _long_doc() -> str:
+    filler = "\n\n".join(f"第{i}段：这里是与主题无关的填充说明文字，用于拉长全文。" * 12 for i in range(60))
+    target = "报销流程：员工提交发票后由财务部在五个工作日内审核并打款。"
+    return filler + "\n\n" + target + "\n\n" + filler
+
+
+def test_index_picks_relevant_chunk():
+    doc = _long_doc()
+    idx = build_instant_doc_index(doc)
+    out, parts = select_excerpts(doc, "报销流程多久打款", max_chars=2_000, index=idx)
+    assert "财务部在五个工作日内" in out
+    assert len(out) <= 2_000
+    assert parts and all(p in idx.chunks for p in parts)
+
+
+def test_index_and_plain_scoring_agree_on_top_chunk():
+    doc = _long_doc()
+    idx = build_instant_doc_index(doc)
+    _, with_idx = select_excerpts(doc, "财务部审核", max_chars=1_500, max_chunks=1, index=idx)
+    _, plain = select_excerpts(doc, "财务部审核", max_chars=1_500, max_chunks=1)
+    assert with_idx == plain
+
+
+def test_short_doc_returned_whole():
+    idx = build_instant_doc_index("  短文档  ")
+    assert select_excerpts("", "任意", index=idx) == ("短文档", ["短文档"])
+
+
+def test_store_reuses_entry_by_content_and_upload_hash(monkeypatch):
+    monkeypatch.setattr(store, "_entries", store.OrderedDict())
+    monkeypatch.setattr(store, "_upload_alias", {})
+    a = store.put_instant_doc(1, "正文内容", "a.txt", raw_sha256="abc")
+    b = store.put_instant_doc(1, "正文内容 ", "b.txt")
+    assert a is b and a.doc_id == store.instant_doc_id("正文内容")
+    assert store.get_instant_doc_by_upload(1, "abc") is a
+    # 按用户隔离
+    assert store.get_instant_doc(2, a.doc_id) is None
+
+
+def test_store_expires_after_ttl(monkeypatch):
+    monkeypatch.setattr(store, "_entries", store.OrderedDict())
+    monkeypatch.setattr(store, "_upload_alias", {})
+    ent = store.put_instant_doc(1, "会过期的正文", "x.txt", raw_sha256="h")
+    ent.last_access -= store._ttl_sec() + 1
+    assert store.get_instant_doc(1, ent.doc_id) is None
+    assert store.get_instant_doc_by_upload(1, "h") is None
+
+
+def test_default_request_sends_only_excerpts(monkeypatch):
+    sent = []
+
+    class _LLM:
+        def invoke(self, messages):
+            sent.append(messages)
+            return SimpleNamespace(content="五个工作日")
+
+    @asynccontextmanager
+    async def _slot():
+        yield
+
+    monkeypatch.setattr(store, "_entries", store.OrderedDict())
+    monkeypatch.setattr(store, "_upload_alias", {})
+    monkeypatch.setattr(rr, "get_api_config_for", lambda _name: {"api_key": "k"})
+    monkeypatch.setattr(rr, "build_chat_llm", lambda *a, **k: _LLM())
+    monkeypatch.setattr(rr, "get_system_prompt_extra", lambda: "")
+    monkeypatch.setattr(rr, "is_instant_web_search_ui_enabled", lambda: False)
+    monkeypatch.setattr(rr, "rag_chat_slot", _slot)
+    monkeypatch.setattr("services.chat_turn.track_token_usage", lambda *a, **k: None)
+
+    doc = _long_doc()
+    req = InstantChatRequest(message="报销流程多久打款", document_text=doc)  # 与前端一样不依赖显式 full
+    request = SimpleNamespace(state=SimpleNamespace(user=SimpleNamespace(id=7)))
+    resp = asyncio.run(rr.chat_instant(request, req))
+    assert resp.mode == "instant_doc"
+
+    system = str(sent[0][0].content)
+    assert "财务部在五个工作日内" in system
+    assert len(system) < len(doc) // 2
+    assert system.count("这里是与主题无关的填充说明文字") < doc.count("这里是与主题无关的填充说明文字") // 2
@@ -0,0 +1,104 @@
+"""对话分阶段计时：工作线程内的 span 记到本轮、未激活时不记、分位数统计、流式对话末尾 meta 带 stage_ms。"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessageChunk
+
+import services.chat_turn as ct
+import utils.latency_trace as lt
+from services.retrieval import RetrievalResult
+
+
+@pytest.fixture(autouse=True)
+def _fresh_stats():
+    lt.reset_stage_latency_stats()
+    yield
+    lt.reset_stage_latency_stats()
+
+
+def test_spans_in_worker_thread_accumulate():
+    trace = lt.LatencyTrace()
+
+    def work():
+        for _ in range(2):
+            with lt.span("faiss_search"):
+                time.sleep(0.01)
+
+    async def run():
+        await asyncio.to_thread(ct._run_traced, trace, work)
+
+    asyncio.run(run())
+    with lt.span("faiss_search"):  # 未激活：不记到任何一轮
+        time.sleep(0.01)
+    assert 20 <= trace.as_dict()["faiss_search"] < 30
+
+
+def test_percentiles_nearest_rank():
+    for ms in range(1, 101):
+        lt.record_stage_samples({"rerank": float(ms)})
+    st = lt.stage_latency_stats()["stages"]["rerank"]
+    assert (st["p50_ms"], st["p95_ms"], st["p99_ms"], st["max_ms"]) == (50.0, 95.0, 99.0, 100.0)
+    assert st["count"] == st["samples"] == 100
+
+
+def test_percentiles_keep_recent_window(monkeypatch):
+    monkeypatch.setenv("RAG_LATENCY_SAMPLES", "16")
+    for ms in range(1, 41):
+        lt.record_stage_samples({"rerank": float(ms)})
+    st = lt.stage_latency_stats()["stages"]["rerank"]
+    assert st["samples"] == 16 and st["count"] == 40
+    assert st["p50_ms"] == 32.0
+
+
+class _FakeLLM:
+    model_name = "fake"
+
+    async def astream(self, _input):
+        for piece in ("图书馆", "周一闭馆", "[来源1]"):
+            await asyncio.sleep(0.005)
+            yield AIMessageChunk(content=piece)
+
+
+def test_stream_final_meta_carries_stage_ms(monkeypatch):
+    doc = Document(page_content="图书馆每周一闭馆", metadata={"source_file": "a.txt"})
+
+    def fake_retrieve(**_kw):
+        with lt.span("faiss_search"):
+            time.sleep(0.01)
+        with lt.span("rerank"):
+            time.sleep(0.01)
+        return RetrievalResult(
+            scored_docs=[(doc, 0.9)],
+            numbered_context="[来源1] 文件：a.txt\n图书馆每周一闭馆",
+            evidence_sources=[{"index": 1, "file": "a.txt", "content": doc.page_content, "score": 0.9}],
+            last_search_results=[(doc, 0.9)],
+        )
+
+    monkeypatch.setattr(ct, "classify_intent_lightweight", lambda _q: "RAG")
+    monkeypatch.setattr(ct, "_retrieve_rag_decomposed", fake_retrieve)
+
+    async def run():
+        return [
+            ev
+            async for ev in ct.run_chat_turn_astream(
+                user_input="图书馆哪天闭馆",
+                chat_history_messages=[],
+                vector_db=None,
+                llm=_FakeLLM(),
+            )
+        ]
+
+    events = asyncio.run(run())
+    metas = [e for e in events if e["type"] == "meta"]
+    assert "stage_ms" not in metas[0]
+    stage_ms = metas[-1]["stage_ms"]
+    assert {"intent", "retrieval", "faiss_search", "rerank", "ttft", "generate", "total"} <= set(stage_ms)
+    assert "web_search" not in stage_ms and "rephrase" not in stage_ms
+    assert stage_ms["retrieval"] >= stage_ms["faiss_search"] + stage_ms["rerank"]
+    assert stage_ms["ttft"] >= stage_ms["retrieval"]
+    assert stage_ms["total"] >= stage_ms["ttft"]
+    assert lt.stage_latency_stats()["stages"]["generate"]["count"] == 1
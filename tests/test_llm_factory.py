@@ -0,0 +1,141 @@
+"""LLM 客户端注册表：同预设复用客户端与连接池、按调用绑定 temperature、预设变更/保存后失效。"""
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import services.llm_factory as lf
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        chunks = [
+            {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+             "choices": [{"index": 0, "delta": {"role": "assistant", "content": f"t={body.get('temperature')}"},
+                          "finish_reason": None}]},
+            {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+             "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+        ]
+        payload = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+        data = payload.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    _StubHandler.connections = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    presets = {"A": {"model": "m1", "api_key": "k1", "base_url": base_url}}
+    import utils.api_config as ac
+
+    monkeypatch.setattr(ac, "get_api_config_for", lambda name: dict(presets[name or "A"]))
+    lf.invalidate_llm_clients()
+    yield presets
+    lf.invalidate_llm_clients()
+    server.shutdown()
+    server.server_close()
+
+
+def test_reuses_client_and_binds_temperature(stub):
+    a = lf.build_chat_llm(0.0, config_name="A")
+    b = lf.build_chat_llm(0.7, config_name="A")
+    assert a is not b
+    assert a.temperature == 0.0 and b.temperature == 0.7
+    assert a.root_client is b.root_client
+    assert "t=0.7" in "".join(c.content for c in b.stream("hi"))
+    assert "t=0.0" in "".join(c.content for c in a.stream("hi"))
+    # 两次请求走同一条 keep-alive 连接
+    assert _StubHandler.connections == 1
+    stats = lf.llm_client_stats()
+    assert stats["llm_client_entries"] == 1
+    assert stats["llm_client_hits"] >= 1
+    assert stats["llm_clients"][0]["sync_connections"] == 1
+
+
+def test_preset_change_replaces_entry(stub):
+    first = lf.build_chat_llm(0.0, config_name="A")
+    stub["A"] = dict(stub["A"], api_key="k2")
+    second = lf.build_chat_llm(0.0, config_name="A")
+    assert first.root_client is not second.root_client
+    stats = lf.llm_client_stats()
+    assert stats["llm_client_entries"] == 1
+    assert stats["llm_client_invalidations"] >= 1
+
+
+def test_save_api_config_invalidates(stub, monkeypatch):
+    import utils.api_config as ac
+
+    monkeypatch.setattr(ac, "save_system_settings", lambda data: None)
+    lf.build_chat_llm(0.0, config_name="A")
+    ac.save_api_config({"A": stub["A"]})
+    assert lf.llm_client_stats()["llm_client_entries"] == 0
+
+
+def test_async_stream_reuses_connection(stub):
+    import asyncio
+    import gc
+
+    async def run():
+        out = []
+        for t in (0.1, 0.2, 0.3):
+            llm = lf.build_chat_llm(t, config_name="A")
+            out.append("".join([c.content async for c in llm.astream("hi")]))
+        assert _StubHandler.connections == 1
+        # 在发请求的事件循环关闭前释放客户端，连接池由该循环上的 aclose() 关闭
+        del llm
+        lf.invalidate_llm_clients()
+        gc.collect()
+        await asyncio.sleep(0.05)
+        return out
+
+    assert asyncio.run(run()) == ["t=0.1", "t=0.2", "t=0.3"]
+
+
+def test_copy_in_flight_survives_invalidate(stub):
+    # 预设保存/变更前发出的拷贝可能仍在工作线程里请求，失效时不能关掉它的连接池
+    llm = lf.build_chat_llm(0.0, config_name="A")
+    http_client = llm.root_client._client
+    lf.invalidate_llm_clients()
+    stub["A"] = dict(stub["A"], api_key="k2")
+    lf.build_chat_llm(0.0, config_name="A")
+    assert not http_client.is_closed
+    assert "t=0.0" in "".join(c.content for c in llm.stream("hi"))
+
+
+def test_released_async_pool_is_closed(stub):
+    import asyncio
+    import gc
+
+    async def run():
+        llm = lf.build_chat_llm(0.0, config_name="A")
+        transport = llm.root_async_client._client._transport
+        assert "".join([c.content async for c in llm.astream("hi")]) == "t=0.0"
+        assert len(transport._pool.connections) == 1
+        lf.invalidate_llm_clients()
+        del llm
+        gc.collect()
+        await asyncio.sleep(0.05)  # 让调度到本循环上的 aclose() 执行
+        return transport
+
+    transport = asyncio.run(run())
+    assert transport._pool.connections == []
@@ -0,0 +1,80 @@
+"""OCR 结果缓存：按页图像摘要命中、按当前配置复核、键含 dpi / 模式 / 模型。"""
+from __future__ import annotations
+
+import pytest
+from PIL import Image
+
+import utils.document_parsers as dp
+import utils.ocr_cache as oc
+
+
+@pytest.fixture
+def ocr(monkeypatch, tmp_path):
+    cfg = {"mode": "fallback", "conf_threshold": 60, "model": "deepseek-ai/DeepSeek-OCR",
+           "api_key": "sk-test", "base_url": "https://api.siliconflow.cn"}
+    state = {"tess": 0, "cloud": 0, "conf": 95.0, "cloud_error": None}
+
+    def tesseract(img):
+        state["tess"] += 1
+        return "本地识别出的足够长的文本内容", state["conf"]
+
+    class _Cloud:
+        def extract_text(self, image_bytes, mime="image/png"):
+            state["cloud"] += 1
+            if state["cloud_error"]:
+                raise state["cloud_error"]
+            return "云端识别结果"
+
+    monkeypatch.setattr(dp, "_ocr_cloud_cfg", lambda: cfg)
+    monkeypatch.setattr(dp, "_tesseract_text_and_conf", tesseract)
+    monkeypatch.setattr(dp, "_build_cloud_ocr", lambda c: _Cloud())
+    return cfg, state, oc.ocr_cache_path(str(tmp_path))
+
+
+def _img(color=0):
+    return Image.new("L", (32, 16), color)
+
+
+def test_repeat_ocr_hits_cache(ocr):
+    cfg, state, path = ocr
+    assert dp._ocr_image(_img(), cache_path=path) == ("本地识别出的足够长的文本内容", "tesseract")
+    assert dp._ocr_image(_img(), cache_path=path) == ("本地识别出的足够长的文本内容", "tesseract")
+    assert state["tess"] == 1
+    # 像素不同 / dpi 不同 / 模式不同 → 各自独立的键
+    dp._ocr_image(_img(255), cache_path=path)
+    dp._ocr_image(_img(), cache_path=path, dpi=300)
+    cfg["mode"] = "off"
+    dp._ocr_image(_img(), cache_path=path)
+    assert state["tess"] == 4
+
+
+def test_cloud_result_cached_and_failed_cloud_retried(ocr):
+    cfg, state, path = ocr
+    state["conf"] = 20.0
+    state["cloud_error"] = RuntimeError("api down")
+    # 云端失败保留本地低置信度结果；缓存复核时仍需云端 → 下次重新识别
+    assert dp._ocr_image(_img(), cache_path=path)[1] == "tesseract"
+    state["cloud_error"] = None
+    assert dp._ocr_image(_img(), cache_path=path) == ("云端识别结果", "cloud")
+    assert dp._ocr_image(_img(), cache_path=path) == ("云端识别结果", "cloud")
+    assert (state["tess"], state["cloud"]) == (2, 2)
+    # 换云端模型后不复用旧模型的结果
+    cfg["model"] = "other/OCR"
+    dp._ocr_image(_img(), cache_path=path)
+    assert state["cloud"] == 3
+
+
+def test_raised_threshold_invalidates_local_entry(ocr):
+    cfg, state, path = ocr
+    state["conf"] = 70.0
+    dp._ocr_image(_img(), cache_path=path)
+    cfg["conf_threshold"] = 80
+    assert dp._ocr_image(_img(), cache_path=path)[1] == "cloud"
+    assert state["tess"] == 2
+
+
+def test_cache_disabled_by_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("RAG_OCR_CACHE", "0")
+    assert oc.ocr_cache_path(str(tmp_path)) is None
+    oc.store_ocr(None, "d", 0, {"mode": "off"}, "t", "tesseract", 90.0)
+    assert not (tmp_path / oc.OCR_CACHE_FILENAME).exists()
@@ -0,0 +1,101 @@
+"""embed-once：只嵌入检索层级，父层级存父文本库并按 parent_chunk_id 取回。"""
+from __future__ import annotations
+
+import pytest
+from langchain_core.documents import Document
+
+import utils.parent_chunk_store as pcs
+from utils.parent_document_retrieval import expand_chunk_to_parent, expand_retrieved_chunks
+from utils.smart_chunker import SmartChunker
+
+
+@pytest.fixture
+def kb(monkeypatch, tmp_path):
+    monkeypatch.setattr(pcs, "get_kb_dir", lambda: str(tmp_path))
+    return tmp_path
+
+
+class _NoSearch:
+    def similarity_search_with_score(self, *a, **k):
+        raise AssertionError("父文本库命中时不应走向量检索")
+
+
+def test_embed_levels_env(monkeypatch):
+    monkeypatch.delenv("RAG_EMBED_LEVELS", raising=False)
+    assert pcs.embed_levels() == pcs.ALL_CHUNK_LEVELS
+    monkeypatch.setenv("RAG_EMBED_LEVELS", " Small , summary,bogus")
+    assert pcs.embed_levels() == ("small", "summary")
+    # 只剩摘要层不可检索正文：回退全部嵌入
+    monkeypatch.setenv("RAG_EMBED_LEVELS", "summary")
+    assert pcs.embed_levels() == pcs.ALL_CHUNK_LEVELS
+
+
+def test_small_chunk_expands_from_parent_store(monkeypatch, kb):
+    monkeypatch.setenv("RAG_EMBED_LEVELS", "small,summary")
+    text = "\n\n".join(f"第{i}条：借阅期限为三十天，可续借一次。逾期每日收取滞纳金。" * 4 for i in range(30))
+    chunks = SmartChunker().create_multi_level_chunks(text, "rules.txt")
+    all_chunks = [c for docs in chunks.values() for c in docs]
+    to_embed, text_only = pcs.split_chunks_for_embedding(all_chunks)
+    assert {c.metadata["chunk_level"] for c in to_embed} == {"small", "summary"}
+    assert {c.metadata["chunk_level"] for c in text_only} == {"medium", "large"}
+    assert pcs.replace_parent_chunks("rules.txt", text_only) == len(text_only)
+
+    child = chunks["small"][5]
+    parent = expand_chunk_to_parent(child, _NoSearch(), "medium")
+    want = chunks["medium"][child.metadata["parent_chunk_index"]]
+    assert parent.page_content == want.page_content
+    assert parent.metadata["from_parent_store"] is True
+
+    # 同名重传替换旧版本；删除后取不到
+    assert pcs.replace_parent_chunks("rules.txt", text_only[:1]) == 1
+    assert pcs.delete_parent_chunks("rules.txt") == 1
+    assert pcs.get_parent_chunk("rules.txt", "medium", 0, want.metadata["chunk_id"]) is None
+
+
+def test_parent_lookup_checks_chunk_id(kb):
+    docs = [
+        Document(page_content=f"父块{i}", metadata={"chunk_level": "medium", "chunk_index": i, "chunk_id": f"id{i}"})
+        for i in range(3)
+    ]
+    pcs.replace_parent_chunks("a.txt", docs)
+    assert pcs.get_parent_chunk("a.txt", "medium", 1, "id1").page_content == "父块1"
+    # 下标与 id 不符（旧元数据）时按 id 查找
+    assert pcs.get_parent_chunk("a.txt", "medium", 0, "id2").page_content == "父块2"
+    assert pcs.get_parent_chunk("b.txt", "medium", 0, "id0") is None
+
+
+def _store_multi_level(monkeypatch):
+    monkeypatch.setenv("RAG_EMBED_LEVELS", "small,summary")
+    text = "\n\n".join(f"第{i}条：借阅期限为三十天，可续借一次。逾期每日收取滞纳金。" * 4 for i in range(60))
+    chunks = SmartChunker().create_multi_level_chunks(text, "rules.txt")
+    _, text_only = pcs.split_chunks_for_embedding([c for docs in chunks.values() for c in docs])
+    pcs.replace_parent_chunks("rules.txt", text_only)
+    return chunks
+
+
+def test_small_chunk_expands_to_large_through_medium(monkeypatch, kb):
+    chunks = _store_multi_level(monkeypatch)
+    child = chunks["small"][7]
+    assert child.metadata["parent_chunk_level"] == "medium"
+    medium = chunks["medium"][child.metadata["parent_chunk_index"]]
+    want = chunks["large"][medium.metadata["parent_chunk_index"]]
+
+    parent = expand_chunk_to_parent(child, _NoSearch(), "large")
+    assert parent.metadata["chunk_level"] == "large"
+    assert parent.page_content == want.page_content
+
+
+def test_expand_reuses_one_store_connection(monkeypatch, kb):
+    chunks = _store_multi_level(monkeypatch)
+    opened = []
+    real_connect = pcs.sqlite3.connect
+
+    def counting_connect(*a, **k):
+        opened.append(a)
+        return real_connect(*a, **k)
+
+    monkeypatch.setattr(pcs.sqlite3, "connect", counting_connect)
+    scored = [(c, 1.0) for c in chunks["small"][:6]]
+    expanded = expand_retrieved_chunks(scored, _NoSearch(), "parent", "large")
+    assert all(d.metadata["chunk_level"] == "large" for d, _ in expanded)
+    assert len(opened) == 1
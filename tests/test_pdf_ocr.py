@@ -0,0 +1,165 @@
+"""扫描版 PDF 分页 OCR 引擎：按页序产出、在途页数有界、云端回退限并发（线程模式 + mock，不渲染真实 PDF）。"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+
+import pytest
+
+import utils.document_parsers as dp
+import utils.pdf_ocr as po
+
+
+class _Img:
+    mode = "L"
+    size = (1, 1)
+
+    def __init__(self, page_no: int):
+        self.page_no = page_no
+
+    def tobytes(self):
+        return b"pixels%d" % self.page_no
+
+    def save(self, buf, format="PNG"):
+        buf.write(b"page%d" % self.page_no)
+
+
+class _Tracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.live = 0
+        self.max_live = 0
+
+    def enter(self):
+        with self.lock:
+            self.live += 1
+            self.max_live = max(self.max_live, self.live)
+
+    def exit(self):
+        with self.lock:
+            self.live -= 1
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    import utils.ocr_cache as oc
+
+    monkeypatch.setattr(oc, "get_kb_dir", lambda: str(tmp_path))
+    monkeypatch.setenv("RAG_OCR_PROCESSES", "0")
+    monkeypatch.setenv("RAG_OCR_CLOUD_CONCURRENCY", "2")
+    monkeypatch.setattr(po.os, "cpu_count", lambda: 3)
+    rendered = _Tracker()
+    cloud = _Tracker()
+    rendered.tesseract_calls = cloud.calls = 0
+    cfg = {"mode": "fallback", "conf_threshold": 60, "model": "m", "api_key": "k", "base_url": "u"}
+    monkeypatch.setattr(dp, "_ocr_cloud_cfg", lambda: cfg)
+
+    def render(path, page_no, dpi):
+        rendered.enter()
+        time.sleep(random.random() * 0.005)
+        return _Img(page_no)
+
+    def tesseract(img):
+        rendered.tesseract_calls += 1
+        time.sleep(random.random() * 0.005)
+        rendered.exit()
+        if img.page_no % 5 == 0:
+            raise RuntimeError("未找到 Tesseract OCR")
+        # 偶数页置信度低 → 云端回退
+        return "本地识别第%d页内容文本" % img.page_no, 30.0 if img.page_no % 2 == 0 else 95.0
+
+    class _Cloud:
+        def extract_text(self, image_bytes, mime="image/png"):
+            cloud.enter()
+            cloud.calls += 1
+            try:
+                time.sleep(random.random() * 0.01)
+                if image_bytes == b"page10":
+                    raise RuntimeError("api down")
+                return "云端" + image_bytes.decode()
+            finally:
+                cloud.exit()
+
+    monkeypatch.setattr(po, "_render_page", render)
+    monkeypatch.setattr(dp, "_tesseract_text_and_conf", tesseract)
+    monkeypatch.setattr(dp, "_build_cloud_ocr", lambda c: _Cloud())
+    return rendered, cloud
+
+
+def test_pages_in_order_with_bounded_in_flight_and_capped_cloud(engine):
+    rendered, cloud = engine
+    pages = list(po.iter_pdf_ocr_pages("scan.pdf", 40))
+    assert [p.page for p in pages] == list(range(1, 41))
+    by_no = {p.page: p for p in pages}
+    assert by_no[1].engine == "tesseract" and by_no[1].text == "本地识别第1页内容文本"
+    assert by_no[2].engine == "cloud" and by_no[2].text == "云端page2"
+    # 本地失败由云端接管；本地与云端都失败 → 该页失败，不影响其他页
+    assert by_no[5].engine == "cloud"
+    assert by_no[10].engine == "failed" and "Tesseract" in by_no[10].error
+    assert all(p.render_ms >= 0 and p.tesseract_ms >= 0 for p in pages)
+    assert by_no[2].cloud_ms > 0
+    # 3 个本地工作线程 → 同时持有页图像的不超过 3；云端并发不超过上限 2
+    assert rendered.max_live <= 3
+    assert cloud.max_live <= 2
+
+
+def test_early_close_stops_submitting(engine):
+    rendered, _cloud = engine
+    it = po.iter_pdf_ocr_pages("scan.pdf", 1000)
+    first = [next(it) for _ in range(3)]
+    it.close()
+    assert [p.page for p in first] == [1, 2, 3]
+
+
+def test_parse_pdf_scanned_uses_page_engine(monkeypatch, engine):
+    from langchain_core.documents import Document
+
+    class _Loader:
+        def __init__(self, path):
+            pass
+
+        def load(self):
+            return [Document(page_content="", metadata={}) for _ in range(4)]
+
+    import langchain_community.document_loaders as loaders
+
+    monkeypatch.setattr(loaders, "PyPDFLoader", _Loader)
+    docs = dp.parse_pdf("scan.pdf", "扫描件.pdf")
+    assert len(docs) == 1
+    text = docs[0].page_content
+    assert text.index("第1页") < text.index("第2页") < text.index("第4页")
+    assert "云端page2" in text
+
+
+def test_second_pass_served_from_ocr_cache(engine, tmp_path):
+    rendered, cloud = engine
+    cache = str(tmp_path / "ocr_cache.sqlite3")
+    first = list(po.iter_pdf_ocr_pages("scan.pdf", 12, cache_path=cache))
+    tess_calls, cloud_calls = rendered.tesseract_calls, cloud.calls
+    assert tess_calls == 12 and cloud_calls > 0 and not any(p.cached for p in first)
+
+    second = list(po.iter_pdf_ocr_pages("scan.pdf", 12, cache_path=cache))
+    assert [(p.page, p.text, p.engine) for p in second] == [(p.page, p.text, p.engine) for p in first]
+    # 第 10 页本地、云端都失败，未写缓存，会重新识别；其余页全部命中
+    assert [p.page for p in second if not p.cached] == [10]
+    assert rendered.tesseract_calls == tess_calls + 1
+    assert cloud.calls == cloud_calls + 1
+
+
+def _ocr_plan_in_worker():
+    return po._get_ocr_pool(8) is None, po._thread_worker_count(8)
+
+
+def test_parse_pool_worker_uses_shared_thread_budget():
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # 解析进程池的工作进程（非 daemon）不再派生 OCR 进程池，8 路并行由 4 个解析进程均分
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=po.share_ocr_workers,
+        initargs=(4,),
+    ) as pool:
+        assert pool.submit(_ocr_plan_in_worker).result(timeout=60) == (True, 2)
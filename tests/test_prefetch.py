@@ -0,0 +1,108 @@
+"""登录预取：后台载入后首问命中缓存、按用户去重、已热跳过、排队中/执行中取消、与并发请求合并为一次载入。"""
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+import config
+import services.vector_store as vector_store
+import utils.web_system_settings as wss
+from utils.path_context import reset_kb_context, set_user_kb_context
+from web_app.backend import prefetch, vdb_cache
+
+
+class _Loader:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def __call__(self, read_only=False):
+        self.calls += 1
+        self.started.set()
+        assert self.gate.wait(5)
+        return object(), object()
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    loader = _Loader()
+    monkeypatch.setattr(config, "WEB_USERS_ROOT", str(tmp_path))
+    monkeypatch.setattr(vector_store, "load_embeddings_and_vector_db", loader)
+    monkeypatch.setattr(wss, "get_rag_defaults_dict", lambda: {"default_search_mode": "vector"})
+    monkeypatch.setenv("RAG_PREFETCH_WORKERS", "1")
+    vdb_cache.clear_all_cache()
+    monkeypatch.setattr(prefetch, "_stats", prefetch._Stats())
+    prefetch.start_prefetcher()
+    yield loader
+    loader.gate.set()
+    prefetch.stop_prefetcher()
+    vdb_cache.clear_all_cache()
+
+
+def _wait_idle() -> None:
+    for t in list(prefetch._tasks.values()):
+        t.future.result(timeout=5)
+
+
+def _get(uid: int):
+    t_kb, t_api = set_user_kb_context(uid)
+    try:
+        return vdb_cache.get_cached_vdb_pair(uid)
+    finally:
+        reset_kb_context(t_kb, t_api)
+
+
+def test_not_started_is_noop():
+    assert prefetch._pool is None
+    assert prefetch.schedule_prefetch(1, "login") is False
+
+
+def test_prefetch_warms_cache_and_dedups(env):
+    env.gate.clear()
+    assert prefetch.schedule_prefetch(7, "login") is True
+    assert prefetch.schedule_prefetch(7, "resume") is False  # 执行中：去重
+    env.gate.set()
+    _wait_idle()
+    assert env.calls == 1
+    assert prefetch.schedule_prefetch(7, "resume") is False  # 已热：跳过
+    _get(7)
+    assert env.calls == 1 and vdb_cache.cache_stats()["vdb_cache_hits"] == 1
+    st = prefetch.prefetch_stats()
+    assert (st["prefetch_completed"], st["prefetch_deduped"], st["prefetch_skipped_warm"]) == (1, 1, 1)
+
+
+def test_cancel_queued_and_running(env):
+    env.gate.clear()
+    assert prefetch.schedule_prefetch(1, "login")
+    assert env.started.wait(5)
+    assert prefetch.schedule_prefetch(2, "login")  # 单 worker：排队中
+    assert prefetch.cancel_prefetch(2) is True
+    assert prefetch.cancel_prefetch(1) is True  # 执行中：载入完成后不再进入后续阶段
+    env.gate.set()
+    prefetch.stop_prefetcher()
+    assert env.calls == 1
+    st = prefetch.prefetch_stats()
+    assert st["prefetch_cancelled"] == 2 and st["prefetch_completed"] == 0
+
+
+def test_request_during_prefetch_waits_instead_of_reloading(env):
+    env.gate.clear()
+    assert prefetch.schedule_prefetch(3, "login")
+    assert env.started.wait(5)
+    got = []
+    t = threading.Thread(target=lambda: got.append(_get(3)))
+    t.start()
+    # 等请求线程也记为未命中（正排队等载入锁）后再放行
+    for _ in range(500):
+        if vdb_cache.cache_stats()["vdb_cache_misses"] == 2:
+            break
+        time.sleep(0.01)
+    env.gate.set()
+    t.join(5)
+    _wait_idle()
+    assert env.calls == 1 and got
+    assert vdb_cache.cache_stats()["vdb_cache_coalesced"] == 1
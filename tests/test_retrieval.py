@@ -20,9 +20,12 @@ def _make_doc(text, source="a.txt", score=0.8):
 
 
 class TestMergeDocKey:
-    def test_key_contains_source(self):
-        doc = _make_doc("hello", source="a.txt")
-        assert "a.txt" in _merge_doc_key(doc)
+    def test_key_differs_by_source(self):
+        assert _merge_doc_key(_make_doc("hello", source="a.txt")) != _merge_doc_key(_make_doc("hello", source="b.txt"))
+
+    def test_key_prefers_ingest_chunk_uid(self):
+        doc = _FakeDoc("hello", {"source_file": "a.txt", "chunk_uid": 42})
+        assert _merge_doc_key(doc) == 42
 
     def test_key_deterministic(self):
         doc = _make_doc("hello", source="a.txt")
@@ -36,7 +39,7 @@ class TestMergeDocKey:
     def test_handles_missing_metadata(self):
         doc = _FakeDoc("x", None)
         key = _merge_doc_key(doc)
-        assert isinstance(key, str)
+        assert isinstance(key, int) and 0 <= key < 2**63
 
 
 class TestFinalizeRetrieval:
@@ -40,6 +40,35 @@ class TestRRFFusion:
         out = hs.rrf_fusion([(d, 0.42)], [])
         assert 0.0 <= out[0][1] <= 1.0
 
+    def test_matches_per_item_reference(self):
+        # 与逐条按 dict 累加的原实现一致（含同分先后、重复出现、仅单路命中）
+        import random
+
+        from utils.chunk_ids import chunk_uid
+
+        rnd = random.Random(7)
+        pool = [_doc(f"第{i}段", f"{i % 3}.txt") for i in range(30)]
+        for _ in range(20):
+            vec = [(rnd.choice(pool), rnd.random()) for _ in range(rnd.randint(0, 25))]
+            bm = [(rnd.choice(pool), rnd.random()) for _ in range(rnd.randint(0, 25))]
+            acc, ev = {}, {}
+            for lst in (vec, bm):
+                for rank, (d, sc) in enumerate(lst, 1):
+                    key = chunk_uid(d)
+                    acc.setdefault(key, [d, 0.0])[1] += 1.0 / (60 + rank)
+            for side, lst in enumerate((vec, bm)):
+                for d, sc in lst:
+                    e = ev.setdefault(chunk_uid(d), [0.0, 0.0])
+                    e[side] = max(e[side], sc)
+            want = [(d, max(ev[chunk_uid(d)])) for d, _r in sorted(acc.values(), key=lambda x: x[1], reverse=True)]
+            assert hs.rrf_fusion(vec, bm) == want
+
+    def test_ingest_uid_wins_over_content(self):
+        # 入库写入的 chunk_uid 优先：即便正文被改写（如扩展、截断），仍与原块融合
+        a = _doc("原文", "a.txt", chunk_uid=5)
+        b = _doc("原文（已截断）", "a.txt", chunk_uid=5)
+        assert len(hs.rrf_fusion([(a, 0.6)], [(b, 0.9)])) == 1
+
 
 # ------------------- H2：向量地板双信号判定 -------------------
 
@@ -239,3 +268,24 @@ class TestBM25CoverageGate:
 
     def test_empty_query_tokens_returns_empty(self):
         assert hs._bm25_coverage_gate([], [(_doc("x", "a"), 1.0)]) == []
+
+    def test_postings_gate_matches_text_gate(self):
+        texts = ["图书逾期费每册每天一角", "读者证挂失补办流程说明", "提示词工程中信息的组织方式", "借阅证办理需携带身份证"]
+        docs = [_doc(t, "lib.txt") for t in texts]
+        bm25 = hs.BM25Okapi([hs.tokenize_chinese(t) for t in texts])
+        for q in ("图书逾期多少钱", "潜水证怎么考", "黑洞的信息悖论", "借阅证怎么办理", "身份证"):
+            raw = hs.bm25_search(q, bm25, docs, top_k=4)
+            toks = hs.tokenize_chinese(q)
+            postings = hs._result_postings(bm25, docs, raw)
+            assert postings is not None
+            assert hs._bm25_coverage_gate(toks, raw, postings=postings) == hs._bm25_coverage_gate(toks, raw)
+
+    def test_bm25_top_k_matches_full_sort(self):
+        texts = [f"借阅规则第{i % 7}条 逾期 {'图书' * (i % 3)}" for i in range(50)]
+        docs = [_doc(t) for t in texts]
+        bm25 = hs.BM25Okapi([hs.tokenize_chinese(t) for t in texts])
+        scores = bm25.get_scores(hs.tokenize_chinese("图书逾期"))
+        want = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)[:10]
+        assert [(d, round(s, 9)) for d, s in hs.bm25_search("图书逾期", bm25, docs, top_k=10)] == [
+            (d, round(float(s), 9)) for d, s in want
+        ]
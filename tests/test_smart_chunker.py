@@ -0,0 +1,97 @@
+"""多层级分块：父子块关联（区间扫描）与逐对比较结果一致。"""
+from __future__ import annotations
+
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+from utils.smart_chunker import SmartChunker, _link_children_to_parents
+
+
+def _naive(children: List[Document], parents: List[Document]) -> List[int]:
+    out = []
+    for c in children:
+        cs, ce = c.metadata.get("chunk_start"), c.metadata.get("chunk_end")
+        best, best_c = 0, 0
+        if cs is not None and ce is not None:
+            for j, p in enumerate(parents):
+                ps, pe = p.metadata.get("chunk_start"), p.metadata.get("chunk_end")
+                if ps is not None and pe is not None and ps <= cs and ce <= pe:
+                    v = (ce - cs) / max(1, pe - ps)
+                    if v > best_c:
+                        best_c, best = v, j
+        if best_c == 0:
+            best_o = 0
+            for j, p in enumerate(parents):
+                if c.page_content[:50] in p.page_content:
+                    o = len(set(c.page_content) & set(p.page_content))
+                    if o > best_o:
+                        best_o, best = o, j
+        out.append(best)
+    return out
+
+
+def _span_doc(text: str, start: Optional[int], end: Optional[int]) -> Document:
+    return Document(page_content=text, metadata={"chunk_start": start, "chunk_end": end})
+
+
+def test_sweep_matches_naive_on_real_chunks():
+    para = "第{}节：城市图书馆提供借阅、续借与预约服务。读者凭证件办理，逾期需按日缴纳费用。"
+    text = "\n\n".join(para.format(i) * 6 for i in range(80))
+    # 重复段落：内容回退时多个父块正文相同
+    text += "\n\n" + "\n\n".join([para.format(0) * 6] * 5)
+    chunks = SmartChunker().create_multi_level_chunks(text, "lib.txt")
+    for child_level, parent_level in (("small", "medium"), ("medium", "large")):
+        children, parents = chunks[child_level], chunks[parent_level]
+        got = _link_children_to_parents(children, parents, text)
+        assert got == _naive(children, parents)
+        assert got == [c.metadata["parent_chunk_index"] for c in children]
+        assert all(
+            c.metadata["parent_chunk_id"] == parents[j].metadata["chunk_id"] for c, j in zip(children, got)
+        )
+
+
+def test_containment_prefers_tightest_parent_and_falls_back_to_content():
+    text = "甲乙丙丁戊己庚辛壬癸" * 10
+    parents = [
+        _span_doc(text[0:60], 0, 60),
+        _span_doc(text[10:40], 10, 40),
+        _span_doc(text[10:40], 10, 40),
+        _span_doc("无位置的父块" + text[50:70], None, None),
+    ]
+    children = [
+        _span_doc(text[12:30], 12, 30),  # 取最短的包含父块，同分取下标小者
+        _span_doc(text[50:70], 50, 70),  # 跨越所有父区间 → 内容匹配
+        _span_doc("完全不相关", None, None),  # 都不满足 → 0
+        _span_doc(text[5:5], 5, 5),  # 空区间 → 内容回退
+    ]
+    got = _link_children_to_parents(children, parents, text)
+    assert got == _naive(children, parents)
+    assert got[:3] == [1, 0, 0]
+
+
+def test_single_pass_chunks_have_exact_offsets_and_respect_sizes():
+    para = "读者凭证件办理借阅。逾期需按日缴纳费用！续借可在线办理；预约到馆后保留三天？"
+    text = "\n\n".join(f"## 第{i}节\n" + para * (i % 4 + 1) for i in range(60))
+    text += "\n\n" + "超长无标点句子" * 120  # 超过最小块长，需二次切开
+    configs = {
+        "small": {"chunk_size": 120, "chunk_overlap": 30},
+        "medium": {"chunk_size": 400, "chunk_overlap": 60},
+        "large": {"chunk_size": 1000, "chunk_overlap": 100},
+    }
+    chunks = SmartChunker(level_configs=configs).create_multi_level_chunks(text, "rules.txt")
+    for level, cfg in configs.items():
+        docs = chunks[level]
+        assert docs
+        prev_end = 0
+        for d in docs:
+            s, e = d.metadata["chunk_start"], d.metadata["chunk_end"]
+            assert d.page_content == text[s:e] and d.page_content.strip() == d.page_content
+            assert e - s <= cfg["chunk_size"]
+            # 相邻块无空洞（重叠或仅隔空白）
+            assert not text[prev_end:s].strip()
+            prev_end = max(prev_end, e)
+        assert prev_end == len(text.rstrip())
+    # 块尾落在句读或段落处（超长无标点句除外）
+    ends = [d.page_content[-1] for d in chunks["small"] if "超长无标点" not in d.page_content]
+    assert all(ch in "。！；？" or ch.isdigit() or ch == "节" for ch in ends)
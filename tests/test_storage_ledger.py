@@ -0,0 +1,118 @@
+"""存储台账：增量记账与整目录测量一致、删目录/删用户后归零、批量读取。"""
+from __future__ import annotations
+
+import os
+import shutil
+
+import pytest
+
+import web_app.backend.stats_helpers as sh
+import web_app.backend.storage_ledger as sl
+
+
+@pytest.fixture
+def users(monkeypatch, tmp_path):
+    root = tmp_path / "users"
+    monkeypatch.setattr(sl, "WEB_USERS_ROOT", str(root))
+    monkeypatch.setattr(sh, "WEB_USERS_ROOT", str(root))
+    monkeypatch.setenv("RAG_STORAGE_LEDGER_DB", str(tmp_path / "ledger.sqlite3"))
+    return root
+
+
+def _write(path, n: int) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * n)
+    return str(path)
+
+
+def _walk_total(root) -> int:
+    return sum(os.path.getsize(os.path.join(r, f)) for r, _d, fs in os.walk(root) for f in fs)
+
+
+def test_incremental_notes_match_full_walk(users):
+    kb = users / "7" / "knowledge_db"
+    _write(kb / "faiss_index" / "index.faiss", 1000)
+    _write(kb / "documents_metadata.json", 50)
+    _write(users / "7" / "web_ui_state" / "chats.json", 30)
+    assert sl.user_storage_bytes(7) == 1080
+    assert sl.user_faiss_bytes(7) == 1000
+
+    # 上传暂存 -> 入库完成（暂存删除、原文副本与 sidecar 写入、索引增长）
+    staging = _write(kb / "upload_staging" / "job_a.txt", 400)
+    sl.note_storage_changed(7, staging)
+    assert sl.user_storage_bytes(7) == 1480
+    os.unlink(staging)
+    _write(kb / "original_files" / "a.txt", 400)
+    _write(kb / "faiss_index" / "index.pkl", 300)
+    _write(kb / "parent_chunks.sqlite3", 20)
+    from utils.text_sidecar import sidecar_paths
+
+    for p in sidecar_paths("a.txt", str(kb)):
+        _write(p, 10)
+    sl.note_document_storage_changed(7, "a.txt", staging)
+    assert sl.user_storage_bytes(7) == _walk_total(users / "7") == 1000 + 300 + 50 + 20 + 30 + 400 + 20
+    assert sl.user_faiss_bytes(7) == 1300
+
+    # 删除文档
+    os.unlink(kb / "original_files" / "a.txt")
+    for p in sidecar_paths("a.txt", str(kb)):
+        os.unlink(p)
+    sl.note_document_storage_changed(7, "a.txt")
+    assert sl.user_storage_bytes(7) == _walk_total(users / "7")
+
+    # 整个目录被删（重置索引）
+    shutil.rmtree(kb / "faiss_index")
+    sl.note_storage_changed(7, str(kb / "faiss_index"))
+    assert sl.user_faiss_bytes(7) == 0
+    assert sl.user_storage_bytes(7) == _walk_total(users / "7") == 100
+
+
+def test_unhooked_writes_fixed_by_reconcile_and_bulk_read(users):
+    _write(users / "1" / "knowledge_db" / "faiss_index" / "index.faiss", 10)
+    _write(users / "2" / "knowledge_db" / "documents_metadata.json", 5)
+    assert sl.storage_totals([1, 2, 3]) == {1: (10, 10), 2: (5, 0), 3: (0, 0)}
+    _write(users / "1" / "web_ui_state" / "x.json", 7)  # 未挂钩的写入
+    assert sl.user_storage_bytes(1) == 10
+    assert sl.reconcile_all_users() == 3
+    assert sl.user_storage_bytes(1) == 17
+    shutil.rmtree(users / "1")
+    sl.reconcile_user_storage(1)
+    assert sl.storage_totals([1])[1] == (0, 0)
+
+
+def test_full_reconcile_claimed_once_per_interval(users):
+    assert sl._reconciler.claim(600) is True
+    assert sl._reconciler.claim(600) is False
+
+
+def test_reconcile_thread_survives_failed_cycle(monkeypatch):
+    import threading
+
+    from web_app.backend.periodic_reconcile import PeriodicReconciler
+
+    calls = []
+    done = threading.Event()
+
+    def reconcile():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("账号库不可用")
+        done.set()
+        return 0
+
+    r = PeriodicReconciler(
+        name="test-reconcile",
+        connect=sl._connect,
+        meta_table="ledger_meta",
+        interval_sec=lambda: 0.01,
+        reconcile=reconcile,
+        log_prefix="[Test] ",
+    )
+    monkeypatch.setattr(r, "claim", lambda interval: True)
+    r.start()
+    try:
+        assert done.wait(5.0)
+    finally:
+        r.stop()
+    assert len(calls) >= 2
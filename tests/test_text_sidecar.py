@@ -0,0 +1,99 @@
+"""纯文本 sidecar：入库写入（含块区间）、流式写入、查看内容优先读取与旧文档补写。"""
+from __future__ import annotations
+
+from typing import List
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import utils.document_preview as dpv
+import utils.text_sidecar as ts
+from utils.path_context import kb_dir_context
+from utils.smart_chunker import SmartChunker
+
+
+class _HashEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float((hash(text) >> s) & 0xFF) for s in range(0, 32, 8)]
+
+
+@pytest.fixture
+def kb(tmp_path):
+    with kb_dir_context(str(tmp_path)):
+        yield tmp_path
+
+
+def test_ingest_sidecar_roundtrip_with_chunk_spans(kb):
+    text = "\n\n".join(f"第{i}条：借阅期限为三十天，可续借一次。逾期每日收取滞纳金。" * 3 for i in range(40))
+    chunks = [c for docs in SmartChunker().create_multi_level_chunks(text, "rules.txt").values() for c in docs]
+    assert ts.write_sidecar("rules.txt", text, chunks)
+    assert ts.read_sidecar_text("rules.txt") == text
+    header = ts.read_sidecar_header("rules.txt")
+    assert header["origin"] == "ingest" and header["chars"] == len(text)
+    assert header["chunks"] and all(text[s:e] for _lv, _i, s, e in header["chunks"])
+    medium = {c.metadata["chunk_index"]: c.page_content for c in chunks if c.metadata["chunk_level"] == "medium"}
+    for lv, i, s, e in header["chunks"]:
+        if lv == "medium":
+            assert text[s:e] == medium[i]
+    # 同名覆盖、删除
+    assert ts.write_sidecar("rules.txt", "新版本")
+    assert ts.read_sidecar_text("rules.txt") == "新版本"
+    ts.delete_sidecar("rules.txt")
+    assert ts.read_sidecar_text("rules.txt") is None
+
+
+def test_streaming_ingest_writes_sidecar(kb):
+    from utils import ingest_streaming as ins
+
+    segments = ["  " + "段落内容，用于流式入库测试。" * 400 + "\n", "第二段：" + "补充说明文字。" * 300]
+    vdb = FAISS.from_documents([Document(page_content="占位", metadata={"source_file": "system"})], _HashEmbeddings())
+    n = ins.run_streaming_ingest(iter(segments), "big.txt", "txt", vdb, 300_000, None)
+    assert n > 0
+    text = ts.read_sidecar_text("big.txt")
+    assert text == "\n\n".join(s.strip() for s in segments)
+    spans = ts.read_sidecar_header("big.txt")["chunks"]
+    assert len(spans) == n
+    stored = {
+        d.metadata["chunk_index"]: d.page_content
+        for d in (vdb.docstore.search(i) for i in vdb.index_to_docstore_id.values())
+        if d.metadata.get("source_file") == "big.txt"
+    }
+    assert all(text[s:e] == stored[i] for _lv, i, s, e in spans)
+
+
+def test_streaming_ingest_failure_leaves_old_sidecar(kb):
+    from utils import ingest_streaming as ins
+
+    ts.write_sidecar("big.txt", "旧版本正文")
+
+    def broken():
+        yield "第一段正文。" * 100
+        raise RuntimeError("解析中断")
+
+    vdb = FAISS.from_documents([Document(page_content="占位", metadata={"source_file": "system"})], _HashEmbeddings())
+    with pytest.raises(RuntimeError):
+        ins.run_streaming_ingest(broken(), "big.txt", "txt", vdb, 300_000, None)
+    assert ts.read_sidecar_text("big.txt") == "旧版本正文"
+    assert not [p for p in (kb / ts.SIDECAR_SUBDIR).iterdir() if p.name.endswith(".tmp")]
+
+
+def test_preview_reads_sidecar_and_backfills_legacy(kb, monkeypatch):
+    orig_dir = kb / dpv.ORIGINAL_FILES_SUBDIR
+    orig_dir.mkdir()
+    (orig_dir / "old.txt").write_text("  旧文档正文：没有 sidecar。\n", encoding="utf-8")
+    calls = []
+    real = dpv._parse_original_full_text
+    monkeypatch.setattr(dpv, "_parse_original_full_text", lambda p: calls.append(p) or real(p))
+
+    first = dpv.get_document_full_view_payload("old.txt", None)
+    assert first["source"] == "original_file" and first["text"] == "旧文档正文：没有 sidecar。"
+    second = dpv.get_document_full_view_payload("old.txt", None, max_chars=5)
+    assert second["text"] == "旧文档正文" and second["truncated"] is True
+    assert len(calls) == 1
+    assert ts.read_sidecar_header("old.txt")["origin"] == "original_file"
+    assert dpv.get_plain_text_for_kb_substring_search("old.txt", None) == "旧文档正文：没有 sidecar。"
@@ -0,0 +1,110 @@
+"""vdb_cache：按字节预算准入、GDSF 淘汰（载入代价 / 字节数 / 命中次数）、BM25 计入条目并随淘汰释放、命中率统计。"""
+from __future__ import annotations
+
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+import services.vector_store as vector_store
+import utils.hybrid_search as hs
+from utils.path_context import get_kb_dir, kb_dir_context
+from web_app.backend import vdb_cache
+
+_MB = 1 << 20
+
+
+class _FakeVdb:
+    def __init__(self, heap: int, mapped: int = 0) -> None:
+        self._fp = {"heap": heap, "mapped": mapped}
+
+    def memory_footprint(self):
+        return self._fp
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    """uid → (私有堆字节, 映射字节, 载入耗时秒)；假载入按当前知识库目录名取规格。"""
+    spec = {}
+
+    def fake_load(read_only=False):
+        assert read_only
+        heap, mapped, delay = spec[int(get_kb_dir().rsplit("/", 1)[-1])]
+        if delay:
+            time.sleep(delay)
+        return _FakeVdb(heap, mapped), object()
+
+    def get(uid: int):
+        with kb_dir_context(str(tmp_path / str(uid))):
+            return vdb_cache.get_cached_vdb_pair(uid)
+
+    monkeypatch.setattr(vector_store, "load_embeddings_and_vector_db", fake_load)
+    monkeypatch.setenv("RAG_VDB_CACHE_MAX_BYTES", str(1000 * _MB))
+    monkeypatch.delenv("RAG_VDB_CACHE_MAX_USERS", raising=False)
+    vdb_cache.clear_all_cache()
+    yield spec, get, tmp_path
+    vdb_cache.clear_all_cache()
+
+
+def test_budget_and_single_oversized_entry(users):
+    spec, get, _ = users
+    spec.update({1: (300 * _MB, 0, 0), 2: (100 * _MB, 200 * _MB, 0), 3: (500 * _MB, 0, 0), 4: (2 << 30, 0, 0)})
+    for uid in (1, 2, 3):
+        get(uid)
+    st = vdb_cache.cache_stats()
+    assert st["vdb_cache_heap_bytes"] + st["vdb_cache_mapped_bytes"] <= 1000 * _MB
+    assert 3 in vdb_cache._cache and st["vdb_cache_evictions"] == 1
+    # 单条超预算：仍留下它本身，其余让位
+    get(4)
+    assert list(vdb_cache._cache) == [4]
+
+
+def test_gdsf_keeps_small_expensive_entry_over_large_cheap_one(users):
+    spec, get, _ = users
+    spec.update({1: (100 * _MB, 0, 0.05), 2: (600 * _MB, 0, 0), 3: (400 * _MB, 0, 0)})
+    get(1)
+    get(2)
+    get(3)
+    # LRU 会淘汰最久未用的 1；GDSF 按代价/字节淘汰又大又便宜的 2
+    assert sorted(vdb_cache._cache) == [1, 3]
+
+
+def test_gdsf_prefers_frequently_hit_entries(users):
+    spec, get, _ = users
+    spec.update({1: (400 * _MB, 0, 0), 2: (400 * _MB, 0, 0), 3: (400 * _MB, 0, 0)})
+    get(1)
+    get(2)
+    for _ in range(5):
+        get(1)
+    get(2)  # 2 最近用过，但命中次数少
+    get(3)
+    assert sorted(vdb_cache._cache) == [1, 3]
+    st = vdb_cache.cache_stats()
+    assert st["vdb_cache_hits"] == 6 and st["vdb_cache_misses"] == 3
+    assert st["vdb_cache_hit_ratio"] == round(6 / 9, 4)
+
+
+def test_bm25_bytes_counted_and_released(users):
+    spec, get, tmp_path = users
+    spec.update({1: (100 * _MB, 0, 0), 2: (950 * _MB, 0, 0)})
+    get(1)
+    kb1 = str(tmp_path / "1")
+    with kb_dir_context(kb1):
+        docs = [Document(page_content=f"借阅 规则 第{i}条", metadata={"source_file": "a.txt"}) for i in range(20)]
+        hs.save_bm25_index(hs.build_bm25_index(docs), docs)
+        bm25, _docs = hs.load_bm25_index()
+        assert hs.load_bm25_index()[0] is bm25  # 进程内缓存：文件未变不再反序列化
+    assert vdb_cache.cache_stats()["vdb_cache_bm25_bytes"] == hs.bm25_cached_bytes(kb1) > 0
+    get(2)
+    assert list(vdb_cache._cache) == [2]
+    assert hs.bm25_cached_bytes(kb1) == 0
+
+
+def test_load_slots_do_not_accumulate(users):
+    spec, get, _ = users
+    for uid in range(1, 21):
+        spec[uid] = (100 * _MB, 0, 0)
+        get(uid)
+    get(20)
+    # 载入结束即释放该用户的载入锁，不随曾访问过的用户数增长
+    assert vdb_cache._load_slots == {}
@@ -0,0 +1,135 @@
+"""会话同步到 MySQL：按摘要跳过未变化会话、消息只写变化尾部（以 sqlite 模拟连接）。"""
+from __future__ import annotations
+
+import json
+import sqlite3
+from typing import Any, List
+
+import pytest
+
+import utils.web_ui_state_mysql as wsm
+
+
+class _SqliteConn:
+    """与 AuthConn 相同的 execute / executemany / fetch 接口，记录写语句便于断言。"""
+
+    def __init__(self) -> None:
+        self._db = sqlite3.connect(":memory:")
+        self._db.row_factory = lambda cur, row: {c[0]: row[i] for i, c in enumerate(cur.description)}
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(
+            """
+            CREATE TABLE chat_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, title TEXT, mode TEXT,
+                client_conv_key TEXT, session_payload TEXT, sync_hash TEXT, created_at TEXT, updated_at TEXT
+            );
+            CREATE TABLE chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER REFERENCES chat_sessions(id) ON DELETE CASCADE,
+                role TEXT, content TEXT, prompt_tokens INTEGER, completion_tokens INTEGER,
+                sort_order INTEGER, meta_json TEXT, msg_hash TEXT, created_at TEXT
+            );
+            CREATE TABLE chat_message_evidence (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER REFERENCES chat_messages(id) ON DELETE CASCADE,
+                sort_order INTEGER, evidence_json TEXT, created_at TEXT
+            );
+            """
+        )
+        self._cur: Any = None
+        self.writes: List[str] = []
+
+    def _log(self, sql: str) -> None:
+        head = sql.strip().split()[0].upper()
+        if head in ("INSERT", "UPDATE", "DELETE"):
+            self.writes.append(" ".join(sql.split()[:3]))
+
+    def execute(self, sql, params=()):
+        self._log(sql)
+        self._cur = self._db.execute(sql, params or ())
+        return self
+
+    def executemany(self, sql, seq):
+        self._log(sql)
+        self._cur = self._db.executemany(sql, seq)
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    @property
+    def lastrowid(self) -> int:
+        return int(self._cur.lastrowid or 0)
+
+    def rows(self, sql: str):
+        return self._db.execute(sql).fetchall()
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(wsm, "_set_pref", lambda *a, **k: None)
+    return _SqliteConn()
+
+
+def _store(convs) -> str:
+    return json.dumps(
+        {"version": 2, "currentId": next(iter(convs)), "order": list(convs), "conversations": convs},
+        ensure_ascii=False,
+    )
+
+
+def _conv(n: int, title: str = "会话") -> dict:
+    msgs = []
+    for i in range(n):
+        m = {"role": "user" if i % 2 == 0 else "assistant", "content": f"消息{i}"}
+        if i % 2:
+            m["sources"] = [{"file": "a.txt", "content": f"证据{i}"}]
+        msgs.append(m)
+    return {"title": title, "updatedAt": 1_700_000_000_000, "messages": msgs}
+
+
+def test_unchanged_sessions_are_skipped(conn):
+    store = _store({"c1": _conv(4), "c2": _conv(2)})
+    wsm._sync_conversation_json_conn(conn, 1, "rag", store)
+    assert len(conn.rows("SELECT id FROM chat_messages")) == 6
+    assert len(conn.rows("SELECT id FROM chat_message_evidence")) == 3
+
+    conn.writes.clear()
+    wsm._sync_conversation_json_conn(conn, 1, "rag", store)
+    # 仅剩清理已删除会话的那条 DELETE
+    assert conn.writes == ["DELETE FROM chat_sessions"]
+
+
+def test_appended_messages_insert_only_the_tail(conn):
+    c1 = _conv(4)
+    wsm._sync_conversation_json_conn(conn, 1, "rag", _store({"c1": c1, "c2": _conv(2)}))
+    before = {r["id"] for r in conn.rows("SELECT id FROM chat_messages")}
+
+    c1 = _conv(6)
+    conn.writes.clear()
+    wsm._sync_conversation_json_conn(conn, 1, "rag", _store({"c1": c1, "c2": _conv(2)}))
+    assert "DELETE FROM chat_messages" not in conn.writes
+    after = conn.rows("SELECT id, content, sort_order FROM chat_messages ORDER BY id")
+    assert before <= {r["id"] for r in after}
+    c1_rows = [r for r in after if r["id"] not in before]
+    assert [(r["content"], r["sort_order"]) for r in c1_rows] == [("消息4", 4), ("消息5", 5)]
+    ev = conn.rows(
+        "SELECT e.evidence_json FROM chat_message_evidence e JOIN chat_messages m ON m.id = e.message_id "
+        "WHERE m.content = '消息5'"
+    )
+    assert json.loads(ev[0]["evidence_json"])["content"] == "证据5"
+
+
+def test_edited_message_rewrites_from_first_difference(conn):
+    c1 = _conv(4)
+    wsm._sync_conversation_json_conn(conn, 1, "rag", _store({"c1": c1}))
+    c1["messages"][2]["content"] = "改过的消息2"
+    c1["messages"].pop()
+    wsm._sync_conversation_json_conn(conn, 1, "rag", _store({"c1": c1}))
+    got = [r["content"] for r in conn.rows("SELECT content FROM chat_messages ORDER BY sort_order")]
+    assert got == ["消息0", "消息1", "改过的消息2"]
+    # 被删的助手消息其证据随外键级联删除
+    assert len(conn.rows("SELECT id FROM chat_message_evidence")) == 1
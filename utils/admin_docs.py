@@ -50,6 +50,11 @@ def _save_user_meta(user_id: int, meta: Dict[str, Any]) -> None:
     cats = meta.get("categories") or ["默认知识库"]
     with open(p, "w", encoding="utf-8") as f:
         json.dump({"documents": docs, "categories": cats}, f, ensure_ascii=False, indent=2)
+    from web_app.backend.analytics_aggregates import note_user_documents
+    from web_app.backend.storage_ledger import note_storage_changed
+
+    note_storage_changed(user_id, p)
+    note_user_documents(user_id, meta)
 
 
 def _iter_user_ids() -> List[int]:
@@ -31,6 +31,9 @@ def save_api_config(configs: Any) -> None:
     if not isinstance(configs, dict):
         return
     save_system_settings({"llm_api_presets": dict(configs)})
+    from services.llm_factory import invalidate_llm_clients
+
+    invalidate_llm_clients()
 
 
 def _resolve_active_config_name() -> str:
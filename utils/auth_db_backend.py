@@ -57,6 +57,14 @@ class AuthConn:
         self._cur.execute(sql, params)
         return self
 
+    def executemany(self, sql: str, seq_params: List[tuple[Any, ...]]):
+        """批量写入；pymysql 会把 INSERT ... VALUES 改写为单条多行 INSERT。"""
+        sql = self._adapt_mysql(sql)
+        self._cur = self._raw.cursor()
+        if seq_params:
+            self._cur.executemany(sql, seq_params)
+        return self
+
     def fetchone(self) -> Any:
         if self._cur is None:
             return None
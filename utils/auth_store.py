@@ -151,6 +151,9 @@ def create_user(username: str, password: str, *, admin_portal: bool = False) ->
             if not is_integrity_error(e):
                 raise
             raise ValueError("用户名已存在") from e
+    from web_app.backend.analytics_aggregates import note_user_registered
+
+    note_user_registered(uid)
     with get_conn() as conn:
         row = conn.execute(
             "SELECT id, username, nickname, role, avatar, status FROM users WHERE id = ?",
@@ -210,6 +213,9 @@ def create_session(user_id: int) -> tuple[str, datetime]:
             "UPDATE users SET last_login_at = ? WHERE id = ?",
             (now, int(user_id)),
         )
+    from web_app.backend.analytics_aggregates import note_user_login
+
+    note_user_login(int(user_id))
     return token, exp
 
 
@@ -675,6 +681,18 @@ def delete_user_completely(user_id: int) -> None:
     udir = os.path.join(WEB_USERS_ROOT, str(uid))
     if os.path.isdir(udir):
         shutil.rmtree(udir, ignore_errors=True)
+    try:
+        from web_app.backend.storage_ledger import reconcile_user_storage
+
+        reconcile_user_storage(uid)
+    except Exception:
+        pass
+    try:
+        from web_app.backend.analytics_aggregates import forget_user
+
+        forget_user(uid)
+    except Exception:
+        pass
 
 
 def record_login_failure(*, ip: str, username: Optional[str], reason: str) -> None:
@@ -0,0 +1,227 @@
+"""
+BM25 分词缓存（每个知识库一份，bm25_tokens.sqlite3）：BM25 索引失效后重建时，已分过词的分块直接取回 token，
+只对新内容跑 jieba。
+
+键为 (分块正文 sha1, 分词器版本)；同一正文（重传、不同层级重叠的分块）只分词一次，
+分词规则升版（hybrid_search._BM25_TOKENIZER_VERSION）后旧条目自然不再命中。
+入库写 FAISS 后即调用 remember_document_tokens 写入本次分块的 token，随后的后台重建几乎全部命中。
+
+冷启动（缓存缺失较多，如首次升级或分词器升版）时按 ``RAG_BM25_TOKENIZE_PROCESSES``
+（默认 CPU 核数 - 1，最多 4；0 为单线程）开 spawn 进程池并行分词，
+缺失数少于 ``RAG_BM25_TOKENIZE_PARALLEL_MIN``（默认 2000）时不值得起进程，仍在本线程分词。
+进程池只在本次重建内存在，不常驻（每个 worker 都要载入一份 jieba 词典）。
+
+preload_jieba 在服务启动时后台载入 jieba 词典，避免首个查询在请求内承担约 1 秒的初始化。
+环境变量 ``RAG_BM25_TOKEN_CACHE=0`` 关闭缓存。读写缓存失败只记日志，不影响索引构建。
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from utils.env_numbers import env_int
+from utils.path_context import get_kb_dir
+
+logger = logging.getLogger(__name__)
+
+BM25_TOKENS_FILENAME = "bm25_tokens.sqlite3"
+
+# 词与词之间用单元分隔符拼接存储（jieba token 已去除首尾空白，不会含该字符）
+_SEP = "\x1f"
+_QUERY_BATCH = 500
+# 未再出现在知识库中的条目保留一段时间再清理：删除后又重传同一文档仍可命中
+_STALE_SEC = 7 * 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bm25_tokens (
+    content_sha1 TEXT NOT NULL,
+    tokenizer INTEGER NOT NULL,
+    tokens TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (content_sha1, tokenizer)
+) WITHOUT ROWID;
+"""
+
+
+def token_cache_enabled() -> bool:
+    return (os.environ.get("RAG_BM25_TOKEN_CACHE") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _tokenize_processes() -> int:
+    return env_int("RAG_BM25_TOKENIZE_PROCESSES", min(4, max(0, (os.cpu_count() or 1) - 1)), 0, 16)
+
+
+def _tokenizer_version() -> int:
+    from utils.hybrid_search import _BM25_TOKENIZER_VERSION
+
+    return _BM25_TOKENIZER_VERSION
+
+
+def content_key(text: str) -> str:
+    return hashlib.sha1((text or "").encode("utf-8", errors="ignore")).hexdigest()
+
+
+def token_cache_path(kb_dir: Optional[str] = None) -> Optional[str]:
+    if not token_cache_enabled():
+        return None
+    return os.path.join(kb_dir or get_kb_dir(), BM25_TOKENS_FILENAME)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _lookup(conn: sqlite3.Connection, keys: Sequence[str], version: int) -> Dict[str, List[str]]:
+    out: Dict[str, List[str]] = {}
+    for i in range(0, len(keys), _QUERY_BATCH):
+        batch = keys[i : i + _QUERY_BATCH]
+        marks = ",".join("?" * len(batch))
+        for k, toks in conn.execute(
+            f"SELECT content_sha1, tokens FROM bm25_tokens WHERE tokenizer = ? AND content_sha1 IN ({marks})",
+            (version, *batch),
+        ):
+            out[k] = toks.split(_SEP) if toks else []
+    return out
+
+
+def _store(conn: sqlite3.Connection, got: Dict[str, List[str]], version: int) -> None:
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO bm25_tokens VALUES (?, ?, ?, ?)",
+            ((k, version, _SEP.join(toks), now) for k, toks in got.items()),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _prune(conn: sqlite3.Connection, live: Iterable[str], version: int) -> int:
+    """删除旧分词器版本，以及不在当前知识库中且已过保留期的条目。"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS live_keys (k TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("DELETE FROM live_keys")
+    conn.executemany("INSERT OR IGNORE INTO live_keys VALUES (?)", ((k,) for k in live))
+    cur = conn.execute(
+        """
+        DELETE FROM bm25_tokens WHERE tokenizer != ?
+           OR (created_at < ? AND content_sha1 NOT IN (SELECT k FROM live_keys))
+        """,
+        (version, time.time() - _STALE_SEC),
+    )
+    return cur.rowcount
+
+
+def _tokenize_batch(texts: List[str]) -> List[List[str]]:
+    from utils.hybrid_search import tokenize_chinese
+
+    return [tokenize_chinese(t) for t in texts]
+
+
+def _tokenize_misses(texts: List[str]) -> List[List[str]]:
+    n = _tokenize_processes()
+    if n <= 0 or len(texts) < env_int("RAG_BM25_TOKENIZE_PARALLEL_MIN", 2000, 1, 10_000_000):
+        return _tokenize_batch(texts)
+    step = max(200, -(-len(texts) // (n * 4)))
+    batches = [texts[i : i + step] for i in range(0, len(texts), step)]
+    t0 = time.perf_counter()
+    # spawn：调用方多为多线程的 Web 进程，fork 可能继承持有中的锁
+    with ProcessPoolExecutor(
+        max_workers=n, mp_context=multiprocessing.get_context("spawn"), initializer=preload_jieba
+    ) as pool:
+        out = [toks for part in pool.map(_tokenize_batch, batches) for toks in part]
+    logger.info("[BM25] %d 个进程并行分词 %d 个分块，耗时 %.1fs", n, len(texts), time.perf_counter() - t0)
+    return out
+
+
+def tokenize_texts(texts: Sequence[str], *, kb_dir: Optional[str] = None, prune: bool = False) -> List[List[str]]:
+    """按正文哈希查缓存，只对未命中的正文分词并写回；返回与 texts 等长的 token 列表。
+
+    prune=True（整库重建）时顺带清理不再使用的条目。
+    """
+    keys = [content_key(t) for t in texts]
+    version = _tokenizer_version()
+    path = token_cache_path(kb_dir)
+    cached: Dict[str, List[str]] = {}
+    conn: Optional[sqlite3.Connection] = None
+    if path is not None:
+        try:
+            conn = _connect(path)
+            cached = _lookup(conn, list(dict.fromkeys(keys)), version)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("[BM25] 读分词缓存失败 %s: %s", path, e)
+    try:
+        miss_idx: Dict[str, int] = {}
+        for i, k in enumerate(keys):
+            if k not in cached and k not in miss_idx:
+                miss_idx[k] = i
+        if miss_idx:
+            fresh = _tokenize_misses([texts[i] for i in miss_idx.values()])
+            got = dict(zip(miss_idx, fresh))
+            cached.update(got)
+            if conn is not None:
+                try:
+                    _store(conn, got, version)
+                except sqlite3.Error as e:
+                    logger.warning("[BM25] 写分词缓存失败 %s: %s", path, e)
+        if conn is not None and prune:
+            try:
+                _prune(conn, keys, version)
+            except sqlite3.Error as e:
+                logger.warning("[BM25] 清理分词缓存失败 %s: %s", path, e)
+        if keys:
+            logger.info("[BM25] 分词缓存命中 %d / %d", len(keys) - len(miss_idx), len(keys))
+    finally:
+        if conn is not None:
+            conn.close()
+    return [cached[k] for k in keys]
+
+
+def remember_document_tokens(documents: Sequence, kb_dir: Optional[str] = None) -> None:
+    """入库时预先写入本次分块的 token（已缓存的正文跳过），供随后的 BM25 重建直接命中。"""
+    if token_cache_path(kb_dir) is None or not documents:
+        return
+    tokenize_texts([getattr(d, "page_content", None) or "" for d in documents], kb_dir=kb_dir)
+
+
+def clear_token_cache(kb_dir: Optional[str] = None) -> None:
+    path = os.path.join(kb_dir or get_kb_dir(), BM25_TOKENS_FILENAME)
+    for p in (path, path + "-wal", path + "-shm"):
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+
+
+_preload_lock = threading.Lock()
+_preloaded = False
+
+
+def preload_jieba() -> None:
+    """载入 jieba 词典（幂等）；服务启动时在后台线程调用，进程池 worker 作为 initializer 调用。"""
+    global _preloaded
+    with _preload_lock:
+        if _preloaded:
+            return
+        import jieba
+
+        t0 = time.perf_counter()
+        jieba.initialize()
+        _preloaded = True
+    logger.info("[BM25] jieba 词典已预载，耗时 %.2fs", time.perf_counter() - t0)
+
+
+def start_jieba_preload() -> None:
+    threading.Thread(target=preload_jieba, name="jieba-preload", daemon=True).start()
@@ -1,6 +1,9 @@
 """非 Streamlit 入口上传适配：为 ingest_file 提供与 UploadedFile 兼容的接口。"""
 from __future__ import annotations
 
+import os
+from typing import Optional
+
 
 class BytesUploadFile:
     """模拟 Streamlit UploadedFile（name + getbuffer）。"""
@@ -13,3 +16,26 @@ class BytesUploadFile:
 
     def getbuffer(self):
         return memoryview(self._data)
+
+
+class StagedUploadFile:
+    """已落盘的上传（upload_staging 中的文件）：入库直接以 path 解析、以硬链接存档原文，不再整文件读入内存。
+
+    getbuffer() 仅为兼容旧调用方保留（按需读盘）。content_sha256 为上传时流式算得的字节哈希（可空），
+    入库去重直接复用，不再重读文件。
+    """
+
+    __slots__ = ("name", "path", "content_sha256")
+
+    def __init__(self, name: str, path: str, content_sha256: Optional[str] = None):
+        self.name = name
+        self.path = path
+        self.content_sha256 = content_sha256
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def getbuffer(self):
+        with open(self.path, "rb") as f:
+            return memoryview(f.read())
@@ -0,0 +1,39 @@
+"""
+分块稳定整数 id（metadata["chunk_uid"]）：入库时按 (source_file, 分块全文) 计算并写入元数据，
+向量 / BM25 两路结果融合、多子查询合并、父块扩展去重都以它为键，不再每次对正文前 320 字做 MD5。
+
+id 由内容决定而非自增：同一文档重传得到相同 id，BM25 的 pickle 副本与 FAISS docstore 中的对象也一致；
+旧索引中没有该字段的分块在读取时按同一规则现算（chunk_uid），结果与入库时写入的相同。
+取 blake2b 的 63 位，保证可放进 int64 的 NumPy 数组。
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Iterable
+
+CHUNK_UID_KEY = "chunk_uid"
+
+_MASK = (1 << 63) - 1
+
+
+def compute_chunk_uid(source_file: str, text: str) -> int:
+    h = hashlib.blake2b(digest_size=8)
+    h.update((source_file or "").encode("utf-8", errors="ignore"))
+    h.update(b"\x1f")
+    h.update((text or "").encode("utf-8", errors="ignore"))
+    return int.from_bytes(h.digest(), "little") & _MASK
+
+
+def chunk_uid(doc: Any) -> int:
+    """分块的稳定 id：优先取元数据中入库时写入的值，缺失（旧索引）时现算。"""
+    meta = getattr(doc, "metadata", None) or {}
+    uid = meta.get(CHUNK_UID_KEY)
+    if isinstance(uid, int):
+        return uid
+    return compute_chunk_uid(str(meta.get("source_file") or ""), getattr(doc, "page_content", None) or "")
+
+
+def assign_chunk_uids(docs: Iterable[Any]) -> None:
+    """入库前写入 chunk_uid（source_file 须已设置）。"""
+    for d in docs:
+        d.metadata[CHUNK_UID_KEY] = compute_chunk_uid(str(d.metadata.get("source_file") or ""), d.page_content or "")
@@ -41,15 +41,22 @@ def find_sensitive_hits(text: str, words: List[str]) -> List[str]:
     return hits
 
 
-def apply_compliance_after_staged_ingest(user_id: int, file_name: str, raw_bytes: bytes) -> None:
-    s = load_system_settings()
-    words = _parse_word_list(str(s.get("sensitive_words") or ""))
+COMPLIANCE_SAMPLE_BYTES = 120_000
+
+
+def scan_sensitive_sample(raw_head: bytes) -> List[str]:
+    """对上传内容开头样本（至多 COMPLIANCE_SAMPLE_BYTES）做敏感词扫描；未配置词表时返回空列表。"""
+    words = _parse_word_list(str(load_system_settings().get("sensitive_words") or ""))
     if not words:
-        return
-    text = decode_bytes_sample(raw_bytes)
-    hits = find_sensitive_hits(text, words)
+        return []
+    return find_sensitive_hits(decode_bytes_sample(raw_head, COMPLIANCE_SAMPLE_BYTES), words)
+
+
+def apply_compliance_hits(user_id: int, file_name: str, hits: List[str]) -> None:
+    """入库完成后落实扫描结果：打违规标记、按设置自动下线并记审计。"""
     if not hits:
         return
+    s = load_system_settings()
     update_document_metadata(
         file_name,
         compliance_flag="violation",
@@ -67,3 +74,7 @@ def apply_compliance_after_staged_ingest(user_id: int, file_name: str, raw_bytes
         detail=json.dumps({"hits": hits[:12], "auto_soft_deleted": auto}, ensure_ascii=False),
         client_ip=None,
     )
+
+
+def apply_compliance_after_staged_ingest(user_id: int, file_name: str, raw_bytes: bytes) -> None:
+    apply_compliance_hits(user_id, file_name, scan_sensitive_sample(raw_bytes[:COMPLIANCE_SAMPLE_BYTES]))
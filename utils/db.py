@@ -1,17 +1,18 @@
 # utils/db.py
 import logging
 import os
-from langchain_community.vectorstores import FAISS
 
+from utils.faiss_tombstones import TombstoneFAISS, load_faiss_index
 from utils.path_context import get_kb_dir
 
 logger = logging.getLogger(__name__)
 
 
-def get_vector_db(embeddings=None):
+def get_vector_db(embeddings=None, *, read_only=False):
     """
-    返回 FAISS 向量数据库实例。
+    返回 FAISS 向量数据库实例（TombstoneFAISS：已删除文档的块按墓碑日志在检索时过滤）。
     如果已有索引则加载，否则创建一个空的 FAISS 实例（允许首次启动）。
+    read_only=True 供检索缓存：mmap 只读映射载入（见 utils.faiss_mmap），不可再 add/保存新向量。
 
     加载/初始化全程持有写锁：既防止两个线程同时初始化空索引，
     也防止读到另一线程 save_local 写到一半的索引文件。
@@ -29,15 +30,11 @@ def get_vector_db(embeddings=None):
         # 如果已有索引，正常加载
         if os.path.exists(index_file):
             logger.info("[DB] 加载已有 FAISS 索引：%s", index_dir)
-            return FAISS.load_local(
-                folder_path=index_dir,
-                embeddings=embeddings,
-                allow_dangerous_deserialization=True
-            )
+            return load_faiss_index(index_dir, embeddings, read_only=read_only)
 
         # 如果不存在，创建一个空的 FAISS 实例，并自动保存（为后续入库做准备）
         logger.info("[DB] 未找到索引，创建空的 FAISS 向量库：%s", index_dir)
-        empty_db = FAISS.from_texts(
+        empty_db = TombstoneFAISS.from_texts(
             texts=["初始空文档"],  # 必须至少有一个文本，否则 FAISS 会报错
             embedding=embeddings,
             metadatas=[{"source_file": "system", "note": "empty_init"}]
@@ -3,8 +3,9 @@
 文档删除：从 FAISS 中移除指定 source_file 的全部向量块。
 
 旧实现用 similarity_search("", k=30000) + FAISS.from_texts 全量重嵌入，大库会极慢且占满 CPU/内存，
-且 k=30000 会漏删。现优先用 LangChain FAISS.delete（faiss remove_ids），失败时再回退为「仅 reconstruct +
-from_embeddings」，避免调用 embedding API。
+且 k=30000 会漏删。现对 TombstoneFAISS 只追加墓碑日志（utils.faiss_tombstones），检索时过滤，
+死向量占比过高时由后台压缩物理删除；普通 FAISS 实例仍用 FAISS.delete（faiss remove_ids）+ 整库落盘，
+失败时再回退为「仅 reconstruct + from_embeddings」，避免调用 embedding API。
 """
 import logging
 import os
@@ -18,6 +19,7 @@ from langchain_core.documents import Document
 
 from services.vector_store import load_embeddings_only
 from utils.document_preview import ORIGINAL_FILES_SUBDIR
+from utils.faiss_segments import write_base_files
 from utils.logger import log_error, log_file_delete
 from utils.metadata_manager import delete_document_metadata
 from utils.path_context import get_kb_dir
@@ -87,8 +89,8 @@ def _rebuild_drop_file_no_reembed(
         normalize_L2=vector_db._normalize_L2,
         distance_strategy=vector_db.distance_strategy,
     )
-    os.makedirs(index_dir, exist_ok=True)
-    new_db.save_local(index_dir)
+    # 原子替换基段：其他 worker 可能仍只读映射着旧 index.faiss
+    write_base_files(new_db, index_dir)
     return True, deleted_count
 
 
@@ -98,18 +100,29 @@ def delete_document_from_vector_db(file_name: str, vector_db, embeddings=None):
 
     :return: (成功标志, 删除的 chunk 数)
     """
-    if embeddings is None:
-        embeddings = load_embeddings_only()
+    from utils.faiss_tombstones import TombstoneFAISS, maybe_schedule_compaction
+    from utils.faiss_write_lock import faiss_write_lock
 
     index_dir = os.path.join(get_kb_dir(), "faiss_index")
+    if isinstance(vector_db, TombstoneFAISS):
+        ids_to_delete = vector_db.ids_for_source_file(file_name)
+        if not ids_to_delete:
+            return False, 0
+        with faiss_write_lock():
+            deleted_count = vector_db.mark_deleted(ids_to_delete)
+            vector_db.flush_tombstones()
+        maybe_schedule_compaction(get_kb_dir(), vector_db)
+        _delete_document_side_files(file_name, deleted_count)
+        return True, deleted_count
+
+    if embeddings is None:
+        embeddings = load_embeddings_only()
     ids_to_delete = _docstore_ids_for_file(vector_db, file_name)
     deleted_count = len(ids_to_delete)
 
     if deleted_count == 0:
         return False, 0
 
-    from utils.faiss_write_lock import faiss_write_lock
-
     try:
         with faiss_write_lock():
             vector_db.delete(ids_to_delete)
@@ -142,11 +155,31 @@ def delete_document_from_vector_db(file_name: str, vector_db, embeddings=None):
             traceback.print_exc()
             return False, 0
 
+    _delete_document_side_files(file_name, deleted_count)
+    return True, deleted_count
+
+
+def _delete_document_side_files(file_name: str, deleted_count: int) -> None:
+    """向量删除成功后：元数据、父块、sidecar、原文件与删除日志。"""
     try:
         delete_document_metadata(file_name)
     except Exception as e:
         logger.warning("删除元数据失败: %s", e)
 
+    try:
+        from utils.parent_chunk_store import delete_parent_chunks
+
+        delete_parent_chunks(file_name)
+    except Exception as e:
+        logger.warning("删除父文本块失败: %s", e)
+
+    try:
+        from utils.text_sidecar import delete_sidecar
+
+        delete_sidecar(file_name)
+    except OSError as e:
+        logger.warning("删除纯文本 sidecar 失败: %s", e)
+
     try:
         obase = os.path.basename((file_name or "").replace("\\", "/"))
         opath = os.path.join(get_kb_dir(), ORIGINAL_FILES_SUBDIR, obase)
@@ -159,5 +192,3 @@ def delete_document_from_vector_db(file_name: str, vector_db, embeddings=None):
         log_file_delete(file_name=file_name, chunks_deleted=deleted_count)
     except Exception as e:
         logger.warning("记录删除日志失败: %s", e)
-
-    return True, deleted_count
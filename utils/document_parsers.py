@@ -17,7 +17,7 @@ import logging
 import os
 import subprocess
 import time
-from typing import Callable, Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 from langchain_core.documents import Document
 
@@ -128,7 +128,53 @@ def _tesseract_text_and_conf(img) -> Tuple[str, float]:
     return text, avg_conf
 
 
-def _ocr_image(img) -> Tuple[str, str]:
+def _ocr_needs_cloud(cfg: Dict, tess_text: str, tess_conf: float, tess_err) -> bool:
+    """本页是否需要调用云端：always 总是；fallback 在本地失败、置信度低于阈值或文本过短时。"""
+    if cfg["mode"] == "always":
+        return True
+    return cfg["mode"] == "fallback" and (
+        tess_err is not None
+        or tess_conf < cfg["conf_threshold"]
+        or len(tess_text.strip()) < 10
+    )
+
+
+def _resolve_ocr_result(
+    cfg: Dict,
+    tess_text: str,
+    tess_conf: float,
+    tess_err,
+    cloud_text: Callable[[], str],
+) -> Tuple[str, str]:
+    """按两层 OCR 策略合并本地结果与云端调用（cloud_text 仅在需要时调用）。"""
+    mode = cfg["mode"]
+
+    if mode == "always":
+        try:
+            got = cloud_text()
+            if got.strip():
+                return got, "cloud"
+        except Exception as e:  # noqa: BLE001
+            logger.warning("[OCR] 云端识别失败，回退本地: %s", e)
+        if tess_err is not None:
+            raise tess_err
+        return tess_text, "tesseract"
+
+    if _ocr_needs_cloud(cfg, tess_text, tess_conf, tess_err):
+        try:
+            got = cloud_text()
+            if got.strip():
+                logger.info("[OCR] 本地置信度 %.0f 低于阈值 %d，该页已用云端识别", tess_conf, cfg["conf_threshold"])
+                return got, "cloud"
+        except Exception as e:  # noqa: BLE001
+            logger.warning("[OCR] 云端回退失败，保留本地结果: %s", e)
+
+    if tess_err is not None:
+        raise tess_err
+    return tess_text, "tesseract"
+
+
+def _ocr_image(img, cache_path: Optional[str] = None, dpi: int = 0) -> Tuple[str, str]:
     """对单页/单图执行两层 OCR，返回 (文本, 引擎标记 "tesseract"|"cloud")。
 
     - mode=off：仅本地；
@@ -136,9 +182,17 @@ def _ocr_image(img) -> Tuple[str, str]:
       的典型表现）时该页升级走云端，云端失败保留本地结果；
     - mode=always：云端优先（限免期可用），失败回退本地。
     本地与云端全不可用时抛出原始错误（如「未找到 Tesseract」）。
+    传入 cache_path（见 utils/ocr_cache）时先按图像摘要查缓存，识别结果写回缓存。
     """
     cfg = _ocr_cloud_cfg()
-    mode = cfg["mode"]
+    digest = ""
+    if cache_path:
+        from utils.ocr_cache import image_digest, lookup_ocr
+
+        digest = image_digest(img)
+        hit = lookup_ocr(cache_path, digest, dpi, cfg)
+        if hit is not None:
+            return hit[0], hit[1]
 
     tess_text, tess_conf, tess_err = "", 0.0, None
     try:
@@ -152,35 +206,12 @@ def _ocr_image(img) -> Tuple[str, str]:
             img.save(buf, format="PNG")
             return client.extract_text(buf.getvalue())
 
-    if mode == "always":
-        try:
-            got = cloud_text()
-            if got.strip():
-                return got, "cloud"
-        except Exception as e:  # noqa: BLE001
-            logger.warning("[OCR] 云端识别失败，回退本地: %s", e)
-        if tess_err is not None:
-            raise tess_err
-        return tess_text, "tesseract"
+    text, engine = _resolve_ocr_result(cfg, tess_text, tess_conf, tess_err, cloud_text)
+    if digest:
+        from utils.ocr_cache import store_ocr
 
-    if mode == "fallback":
-        low_quality = (
-            tess_err is not None
-            or tess_conf < cfg["conf_threshold"]
-            or len(tess_text.strip()) < 10
-        )
-        if low_quality:
-            try:
-                got = cloud_text()
-                if got.strip():
-                    logger.info("[OCR] 本地置信度 %.0f 低于阈值 %d，该页已用云端识别", tess_conf, cfg["conf_threshold"])
-                    return got, "cloud"
-            except Exception as e:  # noqa: BLE001
-                logger.warning("[OCR] 云端回退失败，保留本地结果: %s", e)
-
-    if tess_err is not None:
-        raise tess_err
-    return tess_text, "tesseract"
+        store_ocr(cache_path, digest, dpi, cfg, text, engine, tess_conf)
+    return text, engine
 
 
 def detect_text_file_encoding(path: str, sample_size: int = 262144) -> str:
@@ -238,23 +269,18 @@ def parse_pdf(temp_path: str, original_name: str) -> List[Document]:
             out.append(d)
         return out
 
-    # 无文本层：渲染成图片做两层 OCR（本地 Tesseract → 云端）
-    from pdf2image import convert_from_path
+    # 无文本层：逐页渲染做两层 OCR（本地 Tesseract 并行 → 云端限并发回退），不一次性载入全书图像
+    from utils.ocr_cache import ocr_cache_path
+    from utils.pdf_ocr import iter_pdf_ocr_pages, log_ocr_summary
 
     logger.info("[Parser] PDF 无文本层，走 OCR：%s", original_name)
-    images = convert_from_path(temp_path, fmt="png", dpi=300)
-    ocr_parts: List[str] = []
-    cloud_pages = 0
-    for i, img in enumerate(images):
-        try:
-            text, engine = _ocr_image(img)
-            cloud_pages += engine == "cloud"
-            ocr_parts.append(f"第{i + 1}页：\n{text}")
-        except Exception as e:  # noqa: BLE001 — 单页失败不应毁掉整篇
-            logger.warning("第%d页OCR失败: %s", i + 1, e)
-            ocr_parts.append(f"第{i + 1}页：OCR识别失败")
-    if cloud_pages:
-        logger.info("[Parser] PDF OCR 完成：%d 页中 %d 页由云端识别", len(images), cloud_pages)
+    t0 = time.perf_counter()
+    pages = list(iter_pdf_ocr_pages(temp_path, len(docs), dpi=300, cache_path=ocr_cache_path()))
+    log_ocr_summary(original_name, pages, time.perf_counter() - t0)
+    ocr_parts = [
+        f"第{p.page}页：\n{p.text}" if p.engine != "failed" else f"第{p.page}页：OCR识别失败"
+        for p in pages
+    ]
     text = "\n\n".join(ocr_parts).strip()
     if not text:
         raise ValueError("PDF 未提取到文本（OCR 也未识别出内容）")
@@ -265,8 +291,10 @@ def parse_image(temp_path: str, original_name: str, file_type: str = "jpg") -> L
     """图片 OCR：截图 / 扫描件直接入库（jpg / jpeg / png），同样走两层 OCR。"""
     from PIL import Image
 
+    from utils.ocr_cache import ocr_cache_path
+
     with Image.open(temp_path) as img:
-        text, _engine = _ocr_image(img)
+        text, _engine = _ocr_image(img, cache_path=ocr_cache_path())
     text = (text or "").strip()
     if not text:
         raise ValueError("图片中未识别到文字（可能是纯图形，或分辨率过低）")
@@ -5,13 +5,16 @@
 import logging
 import os
 import shutil
+import threading
 import unicodedata
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+from utils.fulltext_index import index_document, indexed_documents, iter_candidate_offsets, plan_fulltext_query
 from utils.metadata_manager import get_document_metadata
 from utils.path_context import get_kb_dir
+from utils.text_sidecar import read_sidecar_header, read_sidecar_text, write_sidecar
 
 ORIGINAL_FILES_SUBDIR = "original_files"
 MAX_FULL_VIEW_CHARS = 500_000
@@ -22,8 +25,12 @@ def _original_abs_path(file_name: str) -> str:
     return os.path.join(get_kb_dir(), ORIGINAL_FILES_SUBDIR, base)
 
 
-def persist_original_from_temp(temp_path: str, logical_name: str) -> None:
-    """入库时将临时文件复制为原文存档，供「查看内容」使用。"""
+def persist_original_from_temp(temp_path: str, logical_name: str, *, link: bool = False) -> None:
+    """入库时将临时文件复制为原文存档，供「查看内容」使用。
+
+    link=True（源文件为同一知识库目录下的暂存文件）时优先硬链接：先链到临时名再原子替换，
+    不复制数据；跨文件系统等 os.link 失败时退回复制。
+    """
     if not temp_path or not os.path.isfile(temp_path):
         return
     base = os.path.basename((logical_name or "file").replace("\\", "/"))
@@ -34,6 +41,17 @@ def persist_original_from_temp(temp_path: str, logical_name: str) -> None:
         os.makedirs(dest_dir, exist_ok=True)
         dest = os.path.join(dest_dir, base)
         # 同名校验后覆盖，与元数据「按文件名索引」一致
+        if link:
+            tmp_dest = f"{dest}.{os.getpid()}.{threading.get_ident()}.lnk"
+            try:
+                os.link(temp_path, tmp_dest)
+                os.replace(tmp_dest, dest)
+                return
+            except OSError:
+                try:
+                    os.unlink(tmp_dest)
+                except OSError:
+                    pass
         shutil.copy2(temp_path, dest)
     except OSError as e:
         logger.warning("[Ingest] 保存原文副本失败 %s: %s", logical_name, e)
@@ -74,17 +92,19 @@ def reconstruct_full_text_from_vector_db(file_name: str, vector_db) -> str:
     return "\n\n".join(parts)
 
 
+def _parse_original_full_text(abs_path: str) -> str:
+    from utils.document_parsers import parse_file_to_documents
+
+    docs = parse_file_to_documents(abs_path, os.path.basename(abs_path))
+    return "\n\n".join(d.page_content for d in docs if d.page_content).strip()
+
+
 def extract_plain_text_from_original_path(abs_path: str, *, max_chars: int) -> str:
     """从本地原文文件提取纯文本（知识库查看用，限制最大字符）。
 
     解析统一走 utils/document_parsers，支持的格式与上传一致。
     """
-    from utils.document_parsers import parse_file_to_documents
-
-    docs = parse_file_to_documents(abs_path, os.path.basename(abs_path))
-    text = "\n\n".join(d.page_content for d in docs if d.page_content)
-
-    text = (text or "").strip()
+    text = _parse_original_full_text(abs_path)
     if len(text) > max_chars:
         return text[:max_chars]
     return text
@@ -99,6 +119,7 @@ def get_document_full_view_payload(
     """
     供 API 返回：整篇纯文本视图（非分块列表）。
     source: original_file | reconstructed
+    优先读入库时写的纯文本 sidecar；旧文档无 sidecar 时解析原文（或拼接分块）并补写，下次直接读取。
     """
     orig = _original_abs_path(file_name)
     truncated = False
@@ -106,11 +127,23 @@ def get_document_full_view_payload(
     source = "reconstructed"
     err: Optional[str] = None
 
-    if os.path.isfile(orig):
+    header = read_sidecar_header(file_name)
+    cached = read_sidecar_text(file_name) if header is not None else None
+    if cached is not None and cached.strip():
+        text = cached.strip()
+        source = "reconstructed" if header.get("origin") == "reconstructed" else "original_file"
+        if len(text) > max_chars:
+            text = text[:max_chars]
+            truncated = True
+
+    if not text and os.path.isfile(orig):
         try:
-            text = extract_plain_text_from_original_path(orig, max_chars=max_chars)
+            text = _parse_original_full_text(orig)
             source = "original_file"
-            if len(text) >= max_chars:
+            if text:
+                write_sidecar(file_name, text, origin="original_file")
+            if len(text) > max_chars:
+                text = text[:max_chars]
                 truncated = True
         except Exception as e:
             err = str(e)
@@ -129,6 +162,8 @@ def get_document_full_view_payload(
                 "truncated": False,
                 "error": str(e),
             }
+        if text.strip():
+            write_sidecar(file_name, text, origin="reconstructed")
         if len(text) > max_chars:
             text = text[:max_chars]
             truncated = True
@@ -242,26 +277,92 @@ def substring_hits_with_context(
         if match_s.casefold() != q_cf:
             pos = idx + 1
             continue
-        mb = max(0, idx - context_before)
-        me = min(len(raw), idx + qlen + context_after)
-        before = raw[mb:idx]
-        after = raw[idx + qlen : me]
-        if mb > 0:
-            before = "…" + before
-        if me < len(raw):
-            after = after + "…"
-        out.append(
-            {
-                "global_offset": idx,
-                "before": before,
-                "match": match_s,
-                "after": after,
-            }
-        )
+        out.append(_hit_with_context(raw, idx, qlen, context_before, context_after))
         pos = idx + qlen
     return out
 
 
+def _hit_with_context(raw: str, idx: int, qlen: int, context_before: int, context_after: int) -> Dict[str, Any]:
+    mb = max(0, idx - context_before)
+    me = min(len(raw), idx + qlen + context_after)
+    before = raw[mb:idx]
+    after = raw[idx + qlen : me]
+    if mb > 0:
+        before = "…" + before
+    if me < len(raw):
+        after = after + "…"
+    return {
+        "global_offset": idx,
+        "before": before,
+        "match": raw[idx : idx + qlen],
+        "after": after,
+    }
+
+
+def iter_indexed_substring_hits(
+    file_names: List[str],
+    query: str,
+    vector_db,
+    *,
+    context_before: int = 90,
+    context_after: int = 120,
+    max_per_file: int = 500,
+) -> Optional[Iterator[Tuple[str, Dict[str, Any]]]]:
+    """
+    借助全文位置索引（utils.fulltext_index）做与 substring_hits_with_context 等价的子串检索，
+    按 file_names 顺序逐条产出 (文件名, 命中)；调用方停止迭代即提前结束，只读取有候选位置的文档正文。
+    查询无法走索引时返回 None，由调用方逐篇线性扫描。未建索引的旧文档在首次检索时补建。
+    """
+    anchors = plan_fulltext_query(query)
+    if anchors is None:
+        return None
+    return _iter_indexed_hits(file_names, query, vector_db, anchors, context_before, context_after, max_per_file)
+
+
+def _iter_indexed_hits(
+    file_names: List[str],
+    query: str,
+    vector_db,
+    anchors,
+    context_before: int,
+    context_after: int,
+    max_per_file: int,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    names = list(dict.fromkeys(fn for fn in file_names if fn))
+    ids = indexed_documents(names)
+    missing = [fn for fn in names if fn not in ids]
+    if missing:
+        for fn in missing:
+            # 读取正文时若补写了 sidecar 会顺带建索引；已有 sidecar 的旧文档在此补建
+            try:
+                text = get_plain_text_for_kb_substring_search(fn, vector_db)
+            except Exception as e:
+                logger.warning("[Search] 读取正文失败 %s: %s", fn, e)
+                continue
+            if fn not in indexed_documents([fn]):
+                index_document(fn, text)
+        ids = indexed_documents(names)
+        logger.info("[Search] 全文索引补建 %d 篇", len(missing))
+
+    q = _normalize_search_text((query or "").strip())
+    q_cf = q.casefold()
+    qlen = len(q)
+    for fn, cands in iter_candidate_offsets(anchors, [(fn, ids[fn]) for fn in names if fn in ids]):
+        raw = _normalize_search_text(get_plain_text_for_kb_substring_search(fn, vector_db))
+        n = 0
+        end = 0
+        for idx in cands.tolist():
+            if idx < end:
+                continue
+            if raw[idx : idx + qlen].casefold() != q_cf:
+                continue
+            yield fn, _hit_with_context(raw, idx, qlen, context_before, context_after)
+            end = idx + qlen
+            n += 1
+            if n >= max_per_file:
+                break
+
+
 def snippet_for_substring_match(full_text: str, query: str, *, radius_chars: int = 140) -> str:
     """在正文中查找 query 的首次出现（大小写不敏感），截取前后片段供列表展示。"""
     hits = substring_hits_with_context(
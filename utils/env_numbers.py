@@ -0,0 +1,24 @@
+"""
+数值型环境变量读取：未设置、空串或无法解析时取默认值，否则截断到 [lo, hi]。
+"""
+import os
+
+
+def env_int(name: str, default: int, lo: int, hi: int) -> int:
+    raw = (os.environ.get(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        return max(lo, min(hi, int(raw)))
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float, lo: float, hi: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        return max(lo, min(hi, float(raw)))
+    except ValueError:
+        return default
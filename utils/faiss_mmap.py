@@ -0,0 +1,212 @@
+"""
+只读 mmap 载入 FAISS：基段向量用 faiss.IO_FLAG_MMAP_IFC 直接映射 index.faiss，docstore 换成可 mmap 的列式文件，
+多个 worker 进程共享同一份 page cache，不再各自把整库读进私有堆（index.faiss + pickle 的 InMemoryDocstore）。
+
+基段整库写时（utils.faiss_segments._full）在同目录写 docs-<令牌>.*：
+- .ids.npy：按向量位置排列的 docstore id（定长字节串）；
+- .sid.npy / .spos.npy：按 id 排序的 id 及其位置，id → 位置用二分查找；
+- .off.npy + .data.bin：每个位置的 pickle((page_content, metadata)) 及偏移，search 时按需反序列化；
+- .src.npy + .src.json：每个位置的 source_file 编码与名称表，删除时按文件取块不必反序列化全部文档。
+
+追加段较小，仍读入内存，作为独立的小 IndexFlat（tail）在检索时与基段结果合并。
+映射出来的 faiss 索引不能再 add（faiss 会直接 abort 进程），因此 mmap 载入的对象只读：
+只用于检索缓存；入库、压缩等写路径仍走 load_faiss_index 的常规载入。只读对象仍可打墓碑（不改索引）。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pickle
+import threading
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+DOCS_PREFIX = "docs-"
+_DOCS_SUFFIXES = (".ids.npy", ".sid.npy", ".spos.npy", ".off.npy", ".data.bin", ".src.npy", ".src.json")
+
+
+def mmap_enabled() -> bool:
+    return (os.environ.get("RAG_FAISS_MMAP") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def docs_files(index_dir: str, name: str) -> List[str]:
+    return [os.path.join(index_dir, name + s) for s in _DOCS_SUFFIXES]
+
+
+def write_mmap_docstore(db: Any, index_dir: str, name: str, n: int) -> None:
+    """按位置顺序写出 db 前 n 个位置（即基段）的列式 docstore（调用方持 faiss_write_lock）。"""
+    ids: List[bytes] = []
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    src_codes = np.zeros(n, dtype=np.int32)
+    src_names: Dict[Any, int] = {}
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    paths = docs_files(index_dir, name)
+    data_path = paths[4]
+    with open(data_path + suffix, "wb") as f:
+        for pos in range(n):
+            doc_id = db.index_to_docstore_id[pos]
+            doc = db.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"docstore 缺少位置 {pos} 的文档 {doc_id}")
+            blob = pickle.dumps((doc.page_content, doc.metadata), protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(blob)
+            offsets[pos + 1] = offsets[pos] + len(blob)
+            ids.append(str(doc_id).encode("utf-8"))
+            src = doc.metadata.get("source_file")
+            src_codes[pos] = src_names.setdefault(src, len(src_names))
+        f.flush()
+        os.fsync(f.fileno())
+    width = max((len(x) for x in ids), default=1)
+    id_arr = np.array(ids, dtype=f"S{width}") if ids else np.zeros(0, dtype="S1")
+    order = np.argsort(id_arr, kind="stable").astype(np.int64)
+    arrays = {
+        paths[0]: id_arr,
+        paths[1]: id_arr[order],
+        paths[2]: order,
+        paths[3]: offsets,
+        paths[5]: src_codes,
+    }
+    for p, arr in arrays.items():
+        with open(p + suffix, "wb") as f:
+            np.save(f, arr)
+            f.flush()
+            os.fsync(f.fileno())
+    with open(paths[6] + suffix, "w", encoding="utf-8") as f:
+        json.dump([k for k, _ in sorted(src_names.items(), key=lambda kv: kv[1])], f, ensure_ascii=False)
+    for p in paths:
+        os.replace(p + suffix, p)
+
+
+def remove_unreferenced_docs(index_dir: str, keep: Optional[str]) -> None:
+    keep_files = {os.path.basename(p) for p in docs_files(index_dir, keep)} if keep else set()
+    try:
+        names = os.listdir(index_dir)
+    except OSError:
+        return
+    for fn in names:
+        if fn.startswith(DOCS_PREFIX) and fn not in keep_files and not fn.endswith(".tmp"):
+            try:
+                # 其他进程仍映射着旧文件时 POSIX 下可直接 unlink；Windows 上失败则留待下次
+                os.unlink(os.path.join(index_dir, fn))
+            except OSError:
+                pass
+
+
+class MmapDocstore(InMemoryDocstore):
+    """只读列式 docstore：基段部分 mmap，追加段部分为内存 dict。"""
+
+    def __init__(self, index_dir: str, name: str, tail: Optional[Dict[str, Document]] = None) -> None:
+        super().__init__(dict(tail or {}))
+        paths = docs_files(index_dir, name)
+        self.ids = np.load(paths[0], mmap_mode="r")
+        self._sorted_ids = np.load(paths[1], mmap_mode="r")
+        self._sorted_pos = np.load(paths[2], mmap_mode="r")
+        self._offsets = np.load(paths[3], mmap_mode="r")
+        self._data = np.memmap(paths[4], dtype=np.uint8, mode="r") if self._offsets[-1] else np.zeros(0, np.uint8)
+        self.src_codes = np.load(paths[5], mmap_mode="r")
+        with open(paths[6], "r", encoding="utf-8") as f:
+            self.src_names: List[Any] = json.load(f)
+        self.mapped_bytes = sum(os.path.getsize(p) for p in paths)
+
+    def base_position(self, doc_id: str) -> Optional[int]:
+        key = str(doc_id).encode("utf-8")
+        if len(key) > self._sorted_ids.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(self._sorted_ids, key))
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == key:
+            return int(self._sorted_pos[i])
+        return None
+
+    def base_document(self, pos: int) -> Document:
+        a, b = int(self._offsets[pos]), int(self._offsets[pos + 1])
+        content, metadata = pickle.loads(self._data[a:b].tobytes())
+        return Document(id=self.ids[pos].decode("utf-8"), page_content=content, metadata=metadata)
+
+    def search(self, search: str) -> Union[str, Document]:
+        doc = self._dict.get(search)
+        if doc is not None:
+            return doc
+        pos = self.base_position(search)
+        if pos is None:
+            return f"ID {search} not found."
+        return self.base_document(pos)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise RuntimeError("mmap 只读 docstore 不可写入")
+
+    def delete(self, ids: List) -> None:
+        raise RuntimeError("mmap 只读 docstore 不可写入")
+
+
+class PositionIds(Mapping):
+    """位置 → docstore id 的只读映射：基段取自 mmap 数组，追加段为列表。"""
+
+    def __init__(self, base_ids: Any, tail_ids: List[str]) -> None:
+        self._base = base_ids
+        self._tail = tail_ids
+        self._n = len(base_ids)
+
+    def __getitem__(self, pos: Any) -> str:
+        pos = int(pos)
+        if 0 <= pos < self._n:
+            return self._base[pos].decode("utf-8")
+        j = pos - self._n
+        if 0 <= j < len(self._tail):
+            return self._tail[j]
+        raise KeyError(pos)
+
+    def __len__(self) -> int:
+        return self._n + len(self._tail)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self)))
+
+
+def load_mmap_faiss(index_dir: str, embeddings: Any) -> Optional[Any]:
+    """按 manifest 只读映射载入；manifest/列式 docstore 缺失或与基段不符时返回 None（调用方退回常规载入）。"""
+    import faiss
+
+    from utils.faiss_segments import _base_fingerprint, read_manifest, read_segment
+    from utils.faiss_tombstones import TombstoneFAISS
+
+    m = read_manifest(index_dir)
+    if m is None or not m.get("docs") or m.get("base_fp") != _base_fingerprint(index_dir):
+        return None
+    if not all(os.path.isfile(p) for p in docs_files(index_dir, m["docs"])):
+        return None
+    try:
+        base = faiss.read_index(os.path.join(index_dir, "index.faiss"), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        logger.warning("[Mmap] 映射 index.faiss 失败，退回常规载入：%s", e)
+        return None
+    if not isinstance(base, faiss.IndexFlat) or int(base.ntotal) != int(m["base_ntotal"]):
+        return None
+
+    tail_docs: Dict[str, Document] = {}
+    tail_ids: List[str] = []
+    tail_index = None
+    for seg in m.get("segments") or []:
+        got = read_segment(index_dir, seg, base.d)
+        if got is None:
+            return None
+        vecs, rows = got
+        if tail_index is None:
+            tail_index = faiss.IndexFlat(base.d, base.metric_type)
+        if int(base.ntotal) + int(tail_index.ntotal) != int(seg["start"]):
+            return None
+        tail_index.add(np.ascontiguousarray(vecs, dtype=np.float32))
+        for doc_id, doc in rows:
+            tail_docs[doc_id] = doc
+            tail_ids.append(doc_id)
+
+    docstore = MmapDocstore(index_dir, m["docs"], tail_docs)
+    db = TombstoneFAISS(embeddings, base, docstore, PositionIds(docstore.ids, tail_ids))
+    db.attach_read_only(index_dir, m, tail_index)
+    return db
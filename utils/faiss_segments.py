@@ -0,0 +1,320 @@
+"""
+FAISS 分段持久化：index.faiss / index.pkl 作为不可变的基段，之后的增量写成追加段，manifest 原子替换。
+
+LangChain save_local 每次都整库序列化 index.faiss 并 pickle 全部 docstore，2 GB 的索引为追加 20 个块也要整体重写。
+现在 TombstoneFAISS.save_local 只把上次落盘之后新增的位置写成一段：
+
+- seg-<令牌>-<序号>.npy：新增向量（float32，载入时 mmap 读取后追加进索引）；
+- seg-<令牌>-<序号>.pkl：这些位置的 (docstore id, Document)；
+- manifest.json：基段指纹（大小 + mtime）、令牌、各段 [start, count]，先写段文件再原子替换 manifest。
+
+合并：段数超过 RAG_FAISS_MAX_SEGMENTS 时把全部追加段并成一段（只重写增量）；增量向量数超过基段的
+RAG_FAISS_SEGMENT_MERGE_RATIO 倍、位置发生变化（压缩物理删除）或磁盘上已被别的副本写过时整库重写基段。
+基段指纹对不上（旧代码直接 save_local 覆盖了基段）时忽略 manifest，行为与原先整库覆盖一致。
+整库写基段时另写一份可 mmap 的列式 docstore（docs-<令牌>.*，manifest 的 docs 字段），供只读映射载入，见 utils.faiss_mmap。
+基段文件一律先写临时文件再 os.replace（write_base_files）：其他 worker 映射着的旧 index.faiss 保留原 inode，
+若就地截断重写，它们下次检索触到被截掉的页会收到 SIGBUS 直接退出。
+调用方仍须持 faiss_write_lock，与原 save_local 语义相同。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pickle
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.env_numbers import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+SEGMENT_PREFIX = "seg-"
+
+
+def max_segments() -> int:
+    return env_int("RAG_FAISS_MAX_SEGMENTS", 16, 1, 1000)
+
+
+def segment_merge_ratio() -> float:
+    return env_float("RAG_FAISS_SEGMENT_MERGE_RATIO", 0.5, 0.01, 100.0)
+
+
+def manifest_path(index_dir: str) -> str:
+    return os.path.join(index_dir, MANIFEST_FILENAME)
+
+
+def read_manifest(index_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(manifest_path(index_dir), "r", encoding="utf-8") as f:
+            m = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(m, dict) or m.get("v") != MANIFEST_VERSION:
+        return None
+    return m
+
+
+def _write_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    path = manifest_path(index_dir)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _base_fingerprint(index_dir: str, index_name: str = "index") -> Optional[List[int]]:
+    try:
+        a = os.stat(os.path.join(index_dir, f"{index_name}.faiss"))
+        b = os.stat(os.path.join(index_dir, f"{index_name}.pkl"))
+    except OSError:
+        return None
+    return [a.st_size, a.st_mtime_ns, b.st_size, b.st_mtime_ns]
+
+
+def write_base_files(db: Any, index_dir: str, index_name: str = "index") -> None:
+    """与 FAISS.save_local 写出相同的 <index_name>.faiss / .pkl，但经临时文件 + os.replace 原子替换，不就地覆盖。"""
+    import faiss
+
+    os.makedirs(index_dir, exist_ok=True)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    faiss_path = os.path.join(index_dir, f"{index_name}.faiss")
+    pkl_path = os.path.join(index_dir, f"{index_name}.pkl")
+    try:
+        faiss.write_index(db.index, faiss_path + suffix)
+        with open(faiss_path + suffix, "rb+") as f:
+            os.fsync(f.fileno())
+        with open(pkl_path + suffix, "wb") as f:
+            pickle.dump((db.docstore, db.index_to_docstore_id), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(faiss_path + suffix, faiss_path)
+        os.replace(pkl_path + suffix, pkl_path)
+    finally:
+        for p in (faiss_path + suffix, pkl_path + suffix):
+            if os.path.exists(p):
+                os.unlink(p)
+
+
+def _is_flat(index: Any) -> bool:
+    import faiss
+
+    return isinstance(index, faiss.IndexFlat)
+
+
+def _write_segment(db: Any, index_dir: str, name: str, start: int, end: int) -> None:
+    vecs = db.index.reconstruct_n(start, end - start).astype(np.float32, copy=False)
+    rows = []
+    for pos in range(start, end):
+        doc_id = db.index_to_docstore_id[pos]
+        rows.append((doc_id, db.docstore.search(doc_id)))
+    base = os.path.join(index_dir, name)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(base + ".npy" + suffix, "wb") as f:
+        np.save(f, vecs)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(base + ".pkl" + suffix, "wb") as f:
+        pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(base + ".npy" + suffix, base + ".npy")
+    os.replace(base + ".pkl" + suffix, base + ".pkl")
+
+
+def _remove_unreferenced_segments(index_dir: str, keep: List[str]) -> None:
+    keep_files = {f"{n}{ext}" for n in keep for ext in (".npy", ".pkl")}
+    try:
+        names = os.listdir(index_dir)
+    except OSError:
+        return
+    for fn in names:
+        if fn.startswith(SEGMENT_PREFIX) and fn not in keep_files and not fn.endswith(".tmp"):
+            try:
+                os.unlink(os.path.join(index_dir, fn))
+            except OSError:
+                pass
+
+
+def read_segment(index_dir: str, seg: Dict[str, Any], dim: int) -> Optional[Tuple[Any, List[Tuple[str, Any]]]]:
+    """读取一段的 (向量 mmap, [(docstore id, Document)])；文件缺失或条数/维度不符时返回 None。"""
+    base = os.path.join(index_dir, seg["name"])
+    try:
+        vecs = np.load(base + ".npy", mmap_mode="r")
+        with open(base + ".pkl", "rb") as f:
+            rows = pickle.load(f)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        logger.warning("[Segments] 读取追加段失败 %s: %s，其后的段不再载入", seg.get("name"), e)
+        return None
+    count = int(seg["count"])
+    if len(rows) != count or vecs.shape != (count, dim):
+        logger.warning("[Segments] 追加段 %s 条数或维度与 manifest 不符，其后的段不再载入", seg.get("name"))
+        return None
+    return vecs, rows
+
+
+def apply_segments(db: Any, index_dir: str) -> Optional[Dict[str, Any]]:
+    """把 manifest 中的追加段接到刚载入的基段之后；返回该 manifest（作为后续增量保存的起点）。
+
+    无 manifest、基段指纹不符或段文件异常时返回 None，调用方下次保存退回整库写。
+    """
+    m = read_manifest(index_dir)
+    if m is None:
+        return None
+    if m.get("base_fp") != _base_fingerprint(index_dir):
+        logger.warning("[Segments] 基段已被整库覆盖，忽略旧 manifest：%s", index_dir)
+        return None
+    if int(db.index.ntotal) != int(m.get("base_ntotal", -1)):
+        logger.warning("[Segments] 基段条数与 manifest 不符，忽略追加段：%s", index_dir)
+        return None
+    for seg in m.get("segments") or []:
+        got = read_segment(index_dir, seg, db.index.d)
+        if got is None:
+            return None
+        vecs, rows = got
+        start = int(seg["start"])
+        if int(db.index.ntotal) != start:
+            logger.warning("[Segments] 追加段 %s 与索引位置不连续，其后的段不再载入", seg.get("name"))
+            return None
+        try:
+            db.docstore.add({doc_id: doc for doc_id, doc in rows})
+        except ValueError as e:
+            logger.warning("[Segments] 追加段 %s 的 id 与已有块重复: %s", seg.get("name"), e)
+            return None
+        db.index.add(np.ascontiguousarray(vecs, dtype=np.float32))
+        for i, (doc_id, _doc) in enumerate(rows):
+            db.index_to_docstore_id[start + i] = doc_id
+    return m
+
+
+def save_segmented(
+    db: Any,
+    index_dir: str,
+    state: Optional[Dict[str, Any]],
+    full_save: Callable[[], None],
+) -> Dict[str, Any]:
+    """增量保存；state 为该对象上次载入/保存时的 manifest（None 表示未知，只能整库写）。返回新 manifest。"""
+    ntotal = int(db.index.ntotal)
+    disk = read_manifest(index_dir)
+    can_append = (
+        state is not None
+        and disk is not None
+        and disk.get("token") == state.get("token")
+        and disk.get("ntotal") == state.get("ntotal")
+        and disk.get("base_fp") == _base_fingerprint(index_dir)
+        and ntotal >= int(state["ntotal"])
+        and _is_flat(db.index)
+    )
+    if can_append:
+        base_n = int(state["base_ntotal"])
+        if ntotal == int(state["ntotal"]):
+            return state
+        if ntotal - base_n <= segment_merge_ratio() * max(base_n, 1):
+            # 同一基段之后补写的列式 docstore（ensure_docs）以磁盘为准，不被旧内存状态覆盖掉
+            if disk.get("docs"):
+                state = dict(state, docs=disk["docs"])
+            return _append(db, index_dir, state, ntotal)
+    _full(db, index_dir, full_save, ntotal)
+    return read_manifest(index_dir) or {}
+
+
+def _append(db: Any, index_dir: str, state: Dict[str, Any], ntotal: int) -> Dict[str, Any]:
+    segments = list(state.get("segments") or [])
+    seq = int(state.get("next_seq", 1))
+    name = f"{SEGMENT_PREFIX}{state['token']}-{seq:06d}"
+    if len(segments) + 1 > max_segments():
+        # 追加段过多：把全部增量并成一段，仍不碰基段
+        start = int(state["base_ntotal"])
+        _write_segment(db, index_dir, name, start, ntotal)
+        segments = [{"name": name, "start": start, "count": ntotal - start}]
+    else:
+        start = int(state["ntotal"])
+        _write_segment(db, index_dir, name, start, ntotal)
+        segments.append({"name": name, "start": start, "count": ntotal - start})
+    manifest = dict(state, segments=segments, next_seq=seq + 1, ntotal=ntotal)
+    _write_manifest(index_dir, manifest)
+    _remove_unreferenced_segments(index_dir, [s["name"] for s in segments])
+    return manifest
+
+
+def _full(db: Any, index_dir: str, full_save: Callable[[], None], ntotal: int) -> None:
+    from utils.faiss_mmap import mmap_enabled, remove_unreferenced_docs
+
+    full_save()
+    token = uuid.uuid4().hex[:12]
+    manifest = {
+        "v": MANIFEST_VERSION,
+        "token": token,
+        "base_fp": _base_fingerprint(index_dir),
+        "base_ntotal": ntotal,
+        "ntotal": ntotal,
+        "segments": [],
+        "next_seq": 1,
+    }
+    docs = _write_docs(db, index_dir, token, ntotal) if mmap_enabled() and _is_flat(db.index) else None
+    if docs:
+        manifest["docs"] = docs
+    _write_manifest(index_dir, manifest)
+    _remove_unreferenced_segments(index_dir, [])
+    remove_unreferenced_docs(index_dir, docs)
+
+
+def _write_docs(db: Any, index_dir: str, token: str, n: int) -> Optional[str]:
+    """为基段写可 mmap 的列式 docstore（utils.faiss_mmap）；失败只影响只读映射载入，不影响本次保存。"""
+    from utils.faiss_mmap import DOCS_PREFIX, write_mmap_docstore
+
+    name = f"{DOCS_PREFIX}{token}"
+    try:
+        write_mmap_docstore(db, index_dir, name, n)
+    except (OSError, ValueError, pickle.PicklingError) as e:
+        logger.warning("[Segments] 写列式 docstore 失败，只读映射载入将退回常规载入：%s", e)
+        return None
+    return name
+
+
+def ensure_docs(db: Any, index_dir: str) -> bool:
+    """为已有基段补写列式 docstore（旧目录迁移）；db 须是刚按 manifest 常规载入、尚未改动的对象。
+
+    无 manifest 时只要基段未被改动（磁盘上就是 db 的全部内容）也补写一份新 manifest，不重写基段。
+    """
+    from utils.faiss_mmap import docs_files
+
+    if not _is_flat(db.index):
+        return False
+    fp = _base_fingerprint(index_dir)
+    m = read_manifest(index_dir)
+    if m is not None and m.get("base_fp") == fp:
+        if m.get("docs") and all(os.path.isfile(p) for p in docs_files(index_dir, m["docs"])):
+            return True
+        if db._seg_state is None or db._seg_state.get("token") != m.get("token"):
+            return False
+        token = m["token"]
+        base_n = int(m["base_ntotal"])
+    else:
+        if db._seg_state is not None or fp is None:
+            return False
+        token = uuid.uuid4().hex[:12]
+        base_n = int(db.index.ntotal)
+        m = {
+            "v": MANIFEST_VERSION,
+            "token": token,
+            "base_fp": fp,
+            "base_ntotal": base_n,
+            "ntotal": base_n,
+            "segments": [],
+            "next_seq": 1,
+        }
+    docs = _write_docs(db, index_dir, token, base_n)
+    if not docs:
+        return False
+    m = dict(m, docs=docs)
+    _write_manifest(index_dir, m)
+    db._seg_state = m
+    return True
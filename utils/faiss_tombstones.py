@@ -0,0 +1,556 @@
+"""
+FAISS 软删除（墓碑）与后台压缩。
+
+删除文档不再 remove_ids + 整库 save_local：只把该文件各块的 docstore id 追加到
+faiss_index/tombstones.log（每行一个 id，fsync 后即持久），检索时用 faiss IDSelector
+把这些向量位置排除在外。删除耗时只与该文件块数相关。
+
+- TombstoneFAISS：LangChain FAISS 子类，load_local 时读取墓碑日志；similarity_search* 统一
+  经 similarity_search_with_score_by_vector，排除墓碑位置；mark_deleted 只改内存（待落盘），
+  save_local 写完索引后再追加日志——同名重传「写新块 → 删旧块 → 落盘」中途崩溃时最多新旧并存，不会两头皆空；
+- 墓碑记 docstore id 而非向量位置：压缩或其他写者改变位置后仍然有效，日志中已不存在的 id 直接忽略；
+- 压缩：死向量占比超过 RAG_FAISS_COMPACT_DEAD_RATIO 时由后台线程分批物理删除并重写日志。
+  压缩后日志仍保留本轮删掉的 id 一代：持有旧内存副本的写者（入库线程）随后 save_local 把它们写回时依旧被屏蔽。
+
+落盘格式（基段 + 追加段 + manifest）见 utils.faiss_segments；检索缓存用的只读 mmap 载入见 utils.faiss_mmap。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from utils.env_numbers import env_float, env_int
+from utils.faiss_segments import apply_segments, save_segmented, write_base_files
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONE_FILENAME = "tombstones.log"
+
+
+def compact_dead_ratio() -> float:
+    return env_float("RAG_FAISS_COMPACT_DEAD_RATIO", 0.2, 0.01, 1.0)
+
+
+def compact_min_dead() -> int:
+    return env_int("RAG_FAISS_COMPACT_MIN_DEAD", 64, 1, 10_000_000)
+
+
+def compact_batch_size() -> int:
+    return env_int("RAG_FAISS_COMPACT_BATCH", 50_000, 100, 10_000_000)
+
+
+def tombstone_log_path(index_dir: str) -> str:
+    return os.path.join(index_dir, TOMBSTONE_FILENAME)
+
+
+def _read_log(path: str, offset: int = 0) -> Tuple[List[str], int]:
+    """从 offset 起读取完整行（末尾未写完的半行留给下次），返回 (ids, 新 offset)。"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+    end = data.rfind(b"\n") + 1
+    ids = [x for x in data[:end].decode("utf-8", errors="ignore").split("\n") if x]
+    return ids, offset + end
+
+
+def _append_log(path: str, ids: Iterable[str]) -> None:
+    data = "".join(f"{i}\n" for i in ids).encode("utf-8")
+    if not data:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _rewrite_log(path: str, ids: Iterable[str]) -> None:
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write("".join(f"{i}\n" for i in ids).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _doc_bytes(doc: Any) -> int:
+    # 粗估：str 对象大小 + 每个元数据键值约 100 字节 + Document 与 dict 开销
+    if not isinstance(doc, Document):
+        return 0
+    return sys.getsizeof(doc.page_content) + 100 * len(doc.metadata) + 400
+
+
+class TombstoneFAISS(FAISS):
+    """带墓碑过滤的 FAISS。墓碑集合为 docstore id；检索时换算成位置位图交给 faiss 过滤。"""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._tomb_dir: Optional[str] = None
+        self._tomb_pos: Tuple[int, int] = (0, 0)  # 已读到的日志 (inode, 偏移)
+        self._tomb_lock = threading.Lock()
+        self._dead: Set[str] = set()
+        self._pending: List[str] = []
+        self._pos_by_id: Optional[Dict[str, int]] = None
+        self._ids_by_file: Optional[Dict[Any, List[str]]] = None
+        # (死向量数, 位图, 基段 IDSelector, 追加段 IDSelector)；检索线程只读这一个属性，整体替换保证一致
+        self._tomb_sel: Tuple[int, Any, Any, Any] = (0, None, None, None)
+        # 分段持久化的起点（utils.faiss_segments 的 manifest）；None 时下次保存整库写
+        self._seg_state: Optional[Dict[str, Any]] = None
+        # 只读 mmap 载入（utils.faiss_mmap）：index 为映射的基段，追加段在独立的小索引 _tail_index 中
+        self._read_only = False
+        self._tail_index: Any = None
+        self._tail_pos: Dict[str, int] = {}
+
+    def attach_read_only(self, index_dir: str, manifest: Dict[str, Any], tail_index: Any) -> None:
+        """由 utils.faiss_mmap.load_mmap_faiss 调用：标记只读并接上追加段索引与墓碑日志。"""
+        self._read_only = True
+        self._tail_index = tail_index
+        base_n = int(self.index.ntotal)
+        n = len(self.index_to_docstore_id)
+        self._tail_pos = {self.index_to_docstore_id[p]: p for p in range(base_n, n)}
+        self._seg_state = manifest
+        self._tomb_dir = index_dir
+        self.sync_tombstones()
+
+    @property
+    def read_only(self) -> bool:
+        return self._read_only
+
+    def _check_writable(self) -> None:
+        # 映射的 faiss 索引上 add/remove 会让 faiss 直接 abort 整个进程，必须在进入 faiss 之前拦下
+        if self._read_only:
+            raise RuntimeError("mmap 只读载入的索引不可写入；请用 load_faiss_index 常规载入后再修改")
+
+    def _ntotal(self) -> int:
+        tail = self._tail_index
+        return int(self.index.ntotal) + (int(tail.ntotal) if tail is not None else 0)
+
+    # —— 载入 / 落盘 ——
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings: Any, index_name: str = "index", **kwargs: Any):
+        db = super().load_local(folder_path, embeddings, index_name, **kwargs)
+        if index_name == "index":
+            db._seg_state = apply_segments(db, folder_path)
+        db._tomb_dir = folder_path
+        db.sync_tombstones()
+        return db
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        same_dir = self._tomb_dir is not None and os.path.abspath(folder_path) == os.path.abspath(self._tomb_dir)
+        if self._read_only:
+            # 只读对象没有未落盘的向量，保存回原目录只需写出待落盘墓碑
+            if not same_dir or index_name != "index":
+                self._check_writable()
+            with self._tomb_lock:
+                self._append_pending_locked()
+            return
+        if index_name == "index":
+            os.makedirs(folder_path, exist_ok=True)
+            self._seg_state = save_segmented(
+                self,
+                folder_path,
+                self._seg_state if same_dir else None,
+                lambda: write_base_files(self, folder_path, index_name),
+            )
+        else:
+            write_base_files(self, folder_path, index_name)
+        with self._tomb_lock:
+            if same_dir:
+                self._append_pending_locked()
+                return
+            # 另存到新目录：整份墓碑写过去，之后以新目录为准
+            self._pending = []
+            path = tombstone_log_path(folder_path)
+            _rewrite_log(path, sorted(self._dead))
+            self._tomb_dir = folder_path
+            st = os.stat(path)
+            self._tomb_pos = (st.st_ino, st.st_size)
+
+    def sync_tombstones(self) -> int:
+        """读入其他写者（其他进程/副本）追加的墓碑，返回新增条数。"""
+        if self._tomb_dir is None:
+            return 0
+        with self._tomb_lock:
+            return self._sync_locked()
+
+    def _sync_locked(self) -> int:
+        path = tombstone_log_path(self._tomb_dir)
+        try:
+            st = os.stat(path)
+            ino, size = st.st_ino, st.st_size
+        except FileNotFoundError:
+            ino, size = 0, 0
+        cur_ino, offset = self._tomb_pos
+        if (ino, size) == (cur_ino, offset):
+            return 0
+        if ino != cur_ino or size < offset:
+            # 日志被压缩重写（os.replace 换了文件）：重新读全量
+            offset = 0
+        ids, offset = _read_log(path, offset)
+        self._tomb_pos = (ino, offset)
+        new = [i for i in ids if i not in self._dead]
+        if new:
+            self._dead.update(new)
+            self._rebuild_selector()
+        return len(new)
+
+    def _append_pending_locked(self) -> None:
+        # 先读入别人已追加的部分，再追加自己的，偏移才不会跳过他人的墓碑
+        self._sync_locked()
+        pending, self._pending = self._pending, []
+        path = tombstone_log_path(self._tomb_dir)
+        _append_log(path, pending)
+        if pending:
+            st = os.stat(path)
+            self._tomb_pos = (st.st_ino, st.st_size)
+
+    # —— 标记删除 ——
+
+    def mark_deleted(self, ids: Iterable[str]) -> int:
+        """仅改内存：后续检索立即不可见，save_local 或 flush_tombstones 时落盘。"""
+        with self._tomb_lock:
+            new = [i for i in dict.fromkeys(ids) if i not in self._dead and self._position_of(i) is not None]
+            if not new:
+                return 0
+            self._dead.update(new)
+            self._pending.extend(new)
+            self._rebuild_selector()
+            return len(new)
+
+    def flush_tombstones(self) -> None:
+        """不重写索引，只把待落盘墓碑追加进日志（须在 faiss_write_lock 内调用）。"""
+        if self._tomb_dir is None:
+            raise RuntimeError("索引尚未关联磁盘目录，无法写墓碑日志")
+        with self._tomb_lock:
+            self._append_pending_locked()
+
+    def is_dead(self, doc_id: str) -> bool:
+        return doc_id in self._dead
+
+    def dead_count(self) -> int:
+        return self._tomb_sel[0]
+
+    def dead_ratio(self) -> float:
+        n = self._ntotal()
+        return self._tomb_sel[0] / n if n else 0.0
+
+    def ids_for_source_file(self, file_name: str) -> List[str]:
+        """该文件仍可见的块 id；首次调用建一次文件 → id 映射，之后 O(该文件块数)。"""
+        if self._read_only:
+            return [i for i in self._read_only_ids_for_file(file_name) if i not in self._dead]
+        with self._tomb_lock:
+            if self._ids_by_file is None:
+                by_file: Dict[Any, List[str]] = {}
+                for _pos, doc_id in sorted(self.index_to_docstore_id.items()):
+                    doc = self.docstore.search(doc_id)
+                    if isinstance(doc, Document):
+                        by_file.setdefault(doc.metadata.get("source_file"), []).append(doc_id)
+                self._ids_by_file = by_file
+            return [i for i in self._ids_by_file.get(file_name, ()) if i not in self._dead]
+
+    def _read_only_ids_for_file(self, file_name: str) -> List[str]:
+        # 基段按列式 source_file 编码向量化筛选，不反序列化文档；追加段（内存 dict，按位置顺序）逐条比对
+        ds = self.docstore
+        out: List[str] = []
+        if file_name in ds.src_names:
+            code = ds.src_names.index(file_name)
+            out = [ds.ids[p].decode("utf-8") for p in np.flatnonzero(ds.src_codes == code)]
+        out.extend(i for i, d in ds._dict.items() if d.metadata.get("source_file") == file_name)
+        return out
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """估算驻留字节：heap 为进程私有堆，mapped 为 mmap 映射（多个 worker 共享同一份 page cache）。"""
+        vec = 4 * int(self.index.d)
+        docs = self.docstore._dict.values()
+        heap = sum(_doc_bytes(d) for d in docs) + 96 * len(self._dead)
+        if self._read_only:
+            tail = self._tail_index
+            heap += (int(tail.ntotal) if tail is not None else 0) * vec
+            mapped = int(self.index.ntotal) * vec + int(self.docstore.mapped_bytes)
+            return {"heap": heap, "mapped": mapped}
+        heap += int(self.index.ntotal) * vec + 120 * len(self.index_to_docstore_id)
+        return {"heap": heap, "mapped": 0}
+
+    # —— 维护内部映射 ——
+
+    def _position_of(self, doc_id: str) -> Optional[int]:
+        if self._read_only:
+            pos = self._tail_pos.get(doc_id)
+            return pos if pos is not None else self.docstore.base_position(doc_id)
+        return self._positions().get(doc_id)
+
+    def _positions(self) -> Dict[str, int]:
+        if self._pos_by_id is None:
+            self._pos_by_id = {doc_id: int(pos) for pos, doc_id in self.index_to_docstore_id.items()}
+        return self._pos_by_id
+
+    def _rebuild_selector(self) -> None:
+        import faiss
+
+        dead_pos = [p for p in map(self._position_of, self._dead) if p is not None]
+        if not dead_pos:
+            self._tomb_sel = (0, None, None, None)
+            return
+        mask = np.zeros(self._ntotal(), dtype=bool)
+        mask[np.asarray(dead_pos, dtype=np.int64)] = True
+        keep: List[Any] = []
+
+        def selector(part: np.ndarray) -> Any:
+            if not part.any():
+                return None
+            bitmap = np.packbits(part, bitorder="little")
+            inner = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+            # 位图与内层 selector 须随外层一同存活（faiss 只持有裸指针）
+            keep.append((bitmap, inner))
+            return faiss.IDSelectorNot(inner)
+
+        if self._tail_index is None:
+            sel, tail_sel = selector(mask), None
+        else:
+            base_n = int(self.index.ntotal)
+            sel, tail_sel = selector(mask[:base_n]), selector(mask[base_n:])
+        self._tomb_sel = (len(dead_pos), keep, sel, tail_sel)
+
+    def _invalidate_maps(self) -> None:
+        with self._tomb_lock:
+            self._pos_by_id = None
+            self._ids_by_file = None
+
+    def add_texts(self, *args: Any, **kwargs: Any) -> List[str]:
+        self._check_writable()
+        ids = super().add_texts(*args, **kwargs)
+        # 新向量追加在末尾，位图之外的位置默认可见，选择器无需重建
+        self._invalidate_maps()
+        return ids
+
+    def add_embeddings(self, *args: Any, **kwargs: Any) -> List[str]:
+        self._check_writable()
+        ids = super().add_embeddings(*args, **kwargs)
+        self._invalidate_maps()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """物理删除（压缩用）。删除后位置整体前移，墓碑位图按 id 重新换算。"""
+        self._check_writable()
+        out = super().delete(ids, **kwargs)
+        self._seg_state = None
+        with self._tomb_lock:
+            self._pos_by_id = None
+            self._ids_by_file = None
+            self._rebuild_selector()
+        return out
+
+    # —— 检索 ——
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Any] = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        if not self._tomb_sel[0] and self._tail_index is None:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter, fetch_k, **kwargs)
+        import faiss
+
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        n = k if filter is None else fetch_k
+        scores, indices = self._search_live(vector, n)
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+        docs: List[Tuple[Document, float]] = []
+        for j, i in enumerate(indices):
+            if i == -1:
+                continue
+            _id = self.index_to_docstore_id[i]
+            if _id in self._dead:
+                continue
+            doc = self.docstore.search(_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {_id}, got {doc}")
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, scores[j]))
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            higher_better = self.distance_strategy in (
+                DistanceStrategy.MAX_INNER_PRODUCT,
+                DistanceStrategy.JACCARD,
+            )
+            docs = [
+                (d, s) for d, s in docs if (s >= score_threshold if higher_better else s <= score_threshold)
+            ]
+        return docs[:k]
+
+    def _search_live(self, vector: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """基段（及只读载入时的追加段）各取 n 个未墓碑的近邻，按距离合并；返回一维 (scores, 位置)。"""
+        import faiss
+
+        n_dead, _keep, sel, tail_sel = self._tomb_sel
+        try:
+            params = faiss.SearchParameters(sel=sel) if sel is not None else None
+            scores, indices = self.index.search(vector, n, params=params)
+        except RuntimeError:
+            # 不支持 IDSelector 的索引类型：多取死向量数量后再过滤
+            scores, indices = self.index.search(vector, min(int(self.index.ntotal), n + n_dead))
+        tail = self._tail_index
+        if tail is None:
+            return scores[0], indices[0]
+        params = faiss.SearchParameters(sel=tail_sel) if tail_sel is not None else None
+        t_scores, t_indices = tail.search(vector, n, params=params)
+        t_pos = np.where(t_indices[0] >= 0, t_indices[0] + int(self.index.ntotal), -1)
+        all_scores = np.concatenate([scores[0], t_scores[0]])
+        all_pos = np.concatenate([indices[0], t_pos])
+        found = all_pos >= 0
+        all_scores, all_pos = all_scores[found], all_pos[found]
+        key = -all_scores if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else all_scores
+        order = np.argsort(key, kind="stable")[:n]
+        return all_scores[order], all_pos[order]
+
+
+def load_faiss_index(index_dir: str, embeddings: Any, *, read_only: bool = False) -> TombstoneFAISS:
+    """按墓碑日志载入索引（调用方负责持 faiss_write_lock，避免读到写了一半的文件）。
+
+    read_only=True（检索缓存）时优先 mmap 只读映射（RAG_FAISS_MMAP=0 关闭），多进程共享 page cache；
+    旧目录尚无列式 docstore 时先常规载入、补写一次后再映射，映射失败则返回常规载入的对象。
+    """
+    from utils.faiss_mmap import load_mmap_faiss, mmap_enabled
+    from utils.faiss_segments import ensure_docs
+
+    if read_only and mmap_enabled():
+        db = load_mmap_faiss(index_dir, embeddings)
+        if db is not None:
+            return db
+    db = TombstoneFAISS.load_local(
+        folder_path=index_dir,
+        embeddings=embeddings,
+        allow_dangerous_deserialization=True,
+    )
+    if read_only and mmap_enabled() and ensure_docs(db, index_dir):
+        logger.info("[Mmap] 已为 %s 补写列式 docstore，改为只读映射载入", index_dir)
+        return load_mmap_faiss(index_dir, embeddings) or db
+    return db
+
+
+# —— 压缩 ——
+
+
+def needs_compaction(vector_db: Any) -> bool:
+    dead = getattr(vector_db, "dead_count", lambda: 0)()
+    return dead >= compact_min_dead() and vector_db.dead_ratio() >= compact_dead_ratio()
+
+
+class _NoEmbeddings(Embeddings):
+    """压缩只搬运已有向量，不需要（也不应加载）嵌入模型。"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise RuntimeError("压缩过程不应调用嵌入模型")
+
+    def embed_query(self, text: str) -> List[float]:
+        raise RuntimeError("压缩过程不应调用嵌入模型")
+
+
+def compact_faiss_index(kb_dir: str, embeddings: Any = None) -> int:
+    """分批物理删除墓碑向量并重写日志，返回删除条数。每批独立持锁、落盘，缩短入库/删除的等待。"""
+    from utils.faiss_write_lock import faiss_write_lock
+
+    index_dir = os.path.join(kb_dir, "faiss_index")
+    if embeddings is None:
+        embeddings = _NoEmbeddings()
+    removed = 0
+    batch = compact_batch_size()
+    while True:
+        with faiss_write_lock(kb_dir):
+            if not os.path.isfile(os.path.join(index_dir, "index.faiss")):
+                return removed
+            db = load_faiss_index(index_dir, embeddings)
+            logged, _ = _read_log(tombstone_log_path(index_dir))
+            present = set(db.index_to_docstore_id.values())
+            dead = [i for i in dict.fromkeys(logged) if i in present]
+            if not dead:
+                return removed
+            chunk = dead[:batch]
+            db.delete(chunk)
+            db.save_local(index_dir)
+            # 保留本轮仍在索引中的墓碑 + 本批刚删掉的 id（防旧副本写回）；更早删掉的 id 丢弃
+            _rewrite_log(tombstone_log_path(index_dir), dead)
+            removed += len(chunk)
+            logger.info(
+                "[Tombstone] 压缩 %s：本批 %d 条，剩余墓碑 %d，索引 %d 条",
+                kb_dir,
+                len(chunk),
+                len(dead) - len(chunk),
+                db.index.ntotal,
+            )
+            if len(dead) <= batch:
+                return removed
+
+
+_compact_queue: "queue.Queue[Optional[str]]" = queue.Queue()
+_compact_pending: Set[str] = set()
+_compact_pending_lock = threading.Lock()
+_compactor: Optional[threading.Thread] = None
+
+
+def schedule_compaction(kb_dir: str) -> bool:
+    """排队压缩该知识库；后台线程未启动（如 Streamlit）或已在队列中时返回 False。"""
+    if _compactor is None or not _compactor.is_alive():
+        return False
+    key = os.path.abspath(kb_dir)
+    with _compact_pending_lock:
+        if key in _compact_pending:
+            return False
+        _compact_pending.add(key)
+    _compact_queue.put(key)
+    return True
+
+
+def maybe_schedule_compaction(kb_dir: str, vector_db: Any) -> bool:
+    if not needs_compaction(vector_db):
+        return False
+    return schedule_compaction(kb_dir)
+
+
+def _compact_loop() -> None:
+    while True:
+        kb_dir = _compact_queue.get()
+        if kb_dir is None:
+            return
+        with _compact_pending_lock:
+            _compact_pending.discard(kb_dir)
+        try:
+            compact_faiss_index(kb_dir)
+        except Exception as e:  # noqa: BLE001 — 压缩失败不影响检索，墓碑仍生效
+            logger.warning("[Tombstone] 压缩失败 %s: %s", kb_dir, e)
+
+
+def start_compactor() -> None:
+    global _compactor
+    if _compactor is not None and _compactor.is_alive():
+        return
+    _compactor = threading.Thread(target=_compact_loop, name="faiss-compactor", daemon=True)
+    _compactor.start()
+
+
+def stop_compactor() -> None:
+    global _compactor
+    t = _compactor
+    _compactor = None
+    if t is not None:
+        _compact_queue.put(None)
+        t.join(timeout=5.0)
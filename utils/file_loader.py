@@ -1,17 +1,95 @@
 # utils/file_loader.py
 import logging
+import multiprocessing
 import os
 import tempfile
+import threading
+import time
 import traceback
+from concurrent.futures import ProcessPoolExecutor
+from utils.bm25_tokens import remember_document_tokens
+from utils.chunk_ids import assign_chunk_uids
 from utils.document_parsers import parse_file_to_documents
-from utils.path_context import get_kb_dir
+from utils.path_context import get_kb_dir, kb_dir_context
 from utils.document_preview import persist_original_from_temp
-from utils.metadata_manager import MAX_FILE_SIZE_BYTES, add_document_metadata, update_chunks_count
+from utils.ingest_dedup import ChunkVectorReuse, file_sha256, find_identical_document
+from utils.parent_chunk_store import replace_parent_chunks, split_chunks_for_embedding
+from utils.text_sidecar import write_sidecar
+from utils.metadata_manager import (
+    MAX_FILE_SIZE_BYTES,
+    add_document_metadata,
+    get_document_metadata,
+    update_chunks_count,
+)
 from utils.logger import log_file_upload, log_error
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["ingest_file", "MAX_FILE_SIZE_BYTES"]
+__all__ = ["ingest_file", "MAX_FILE_SIZE_BYTES", "shutdown_parse_pool"]
+
+# 解析进程池：PDF/Office 解析与 OCR 后处理为 CPU 密集，多入库线程并发时受 GIL 限制；
+# RAG_INGEST_PARSE_PROCESSES>0 时整文件解析改在子进程执行（spawn，避免多线程进程 fork）。
+_parse_pool: "ProcessPoolExecutor | None" = None
+_parse_pool_lock = threading.Lock()
+
+
+def _parse_process_count() -> int:
+    try:
+        return max(0, min(int(os.environ.get("RAG_INGEST_PARSE_PROCESSES", "0")), 16))
+    except ValueError:
+        return 0
+
+
+def _get_parse_pool() -> "ProcessPoolExecutor | None":
+    global _parse_pool
+    n = _parse_process_count()
+    if n <= 0:
+        return None
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            from utils.pdf_ocr import share_ocr_workers
+
+            # 工作进程内 OCR 只用线程，并按 n 均分，避免 n 个解析进程各开满核 Tesseract
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=n,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=share_ocr_workers,
+                initargs=(n,),
+            )
+        return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_in_kb_dir(kb_dir: str, temp_path: str, original_name: str):
+    # 子进程没有父进程的请求上下文：恢复知识库目录，OCR 缓存等才会落到正确的用户目录
+    with kb_dir_context(kb_dir):
+        return parse_file_to_documents(temp_path, original_name)
+
+
+def _parse_documents(temp_path: str, original_name: str):
+    pool = _get_parse_pool()
+    if pool is None:
+        return parse_file_to_documents(temp_path, original_name)
+    return pool.submit(_parse_in_kb_dir, get_kb_dir(), temp_path, original_name).result()
+
+
+def _record_stage(stage_timings, name: str, t0: float) -> None:
+    if stage_timings is not None:
+        stage_timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+def _upload_size(uploaded_file) -> int:
+    staged = getattr(uploaded_file, "path", None)
+    if staged:
+        return os.path.getsize(staged)
+    return len(uploaded_file.getbuffer())
 
 
 def _finalize_ingest_metadata(
@@ -20,16 +98,21 @@ def _finalize_ingest_metadata(
     category: str,
     description: str,
     chunks_count: int,
+    content_sha256: str = "",
+    parent_chunks=(),
 ) -> None:
     if chunks_count <= 0:
         return
-    file_size = len(uploaded_file.getbuffer())
+    # 同名重传：旧版本遗留的父文本块一并替换（流式路径无父文本块，即清空）
+    replace_parent_chunks(uploaded_file.name, parent_chunks)
+    file_size = _upload_size(uploaded_file)
     add_document_metadata(
         file_name=uploaded_file.name,
         file_size=file_size,
         file_type=file_ext.lstrip("."),
         category=category,
         description=description,
+        content_sha256=content_sha256 or None,
     )
     update_chunks_count(uploaded_file.name, chunks_count)
     try:
@@ -43,32 +126,71 @@ def _finalize_ingest_metadata(
         logger.warning("记录上传日志失败: %s", e)
 
 
-def ingest_file(uploaded_file, vector_db, category: str = "默认知识库", description: str = ""):
+def ingest_file(
+    uploaded_file,
+    vector_db,
+    category: str = "默认知识库",
+    description: str = "",
+    stage_timings=None,
+    dedup_stats=None,
+    abort_check=None,
+):
     """
     处理上传的文件并入库。
     大文件走流式：分段读入、单层 medium 切分、分批写入向量库，降低内存峰值。
+    stage_timings 为 dict 时写入各阶段耗时（毫秒）：parse / chunk / embed_write，流式路径为 stream。
+    uploaded_file 带 path 属性（已落盘的暂存文件，见 StagedUploadFile）时直接就地解析、
+    原文存档走硬链接，不再经内存与临时文件复制；该文件由调用方负责删除。
+    同一知识库已有同内容文档时跳过入库（返回已有块数，异名副本返回 0）；
+    块级复用已有向量、同名重传替换旧块，详见 utils.ingest_dedup。dedup_stats 为 dict 时写入去重统计。
+    abort_check 为可调用对象时，每次写入向量库前调用，抛异常即中止（入库队列的租约已被回收时）。
     """
     from utils import ingest_streaming as ins
 
     temp_path = None
+    owns_temp = False
     try:
-        file_size = len(uploaded_file.getbuffer())
+        file_size = _upload_size(uploaded_file)
         if file_size > MAX_FILE_SIZE_BYTES:
             raise ValueError(
                 f"文件大小 {file_size / (1024*1024):.2f}MB 超过限制 {MAX_FILE_SIZE_BYTES / (1024*1024)}MB"
             )
 
         file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext, mode="wb") as tmp:
-            tmp.write(uploaded_file.getbuffer())
-            temp_path = tmp.name
+        staged_path = getattr(uploaded_file, "path", None)
+        if staged_path:
+            temp_path = staged_path
+        else:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext, mode="wb") as tmp:
+                tmp.write(uploaded_file.getbuffer())
+                temp_path = tmp.name
+            owns_temp = True
+
+        cat = category.strip() or "默认知识库"
+        desc = description or ""
+        content_sha = getattr(uploaded_file, "content_sha256", None) or file_sha256(temp_path)
+        dup = find_identical_document(content_sha, cat)
+        if dup is not None:
+            same_name = dup == uploaded_file.name
+            existing = int((get_document_metadata(dup) or {}).get("chunks_count") or 0)
+            if dedup_stats is not None:
+                dedup_stats.update(
+                    {
+                        "file": "identical" if same_name else "duplicate_of_other",
+                        "duplicate_of": dup,
+                        "chunks_embedded": 0,
+                        "chunks_reused": 0,
+                        "chunks_replaced": 0,
+                    }
+                )
+            logger.info("[Ingest] 内容与已有文档 %s 相同，跳过入库：%s", dup, uploaded_file.name)
+            return existing if same_name else 0
 
-        persist_original_from_temp(temp_path, uploaded_file.name)
+        persist_original_from_temp(temp_path, uploaded_file.name, link=bool(staged_path))
 
         on_disk = os.path.getsize(temp_path)
         use_stream = ins.should_use_streaming_ingest(on_disk)
-        cat = category.strip() or "默认知识库"
-        desc = description or ""
+        t_stage = time.perf_counter()
 
         # ---------- 流式入库（大文件）----------
         if use_stream and file_ext in (".txt", ".md"):
@@ -84,9 +206,12 @@ def ingest_file(uploaded_file, vector_db, category: str = "默认知识库", des
                 vector_db,
                 on_disk,
                 summary,
+                dedup_stats=dedup_stats,
+                abort_check=abort_check,
             )
+            _record_stage(stage_timings, "stream", t_stage)
             logger.info("[Ingest/stream] txt/md 入库 %d 块，文件：%s", n, uploaded_file.name)
-            _finalize_ingest_metadata(uploaded_file, file_ext, cat, desc, n)
+            _finalize_ingest_metadata(uploaded_file, file_ext, cat, desc, n, content_sha)
             return n
 
         if use_stream and file_ext == ".pdf":
@@ -100,6 +225,8 @@ def ingest_file(uploaded_file, vector_db, category: str = "默认知识库", des
                     vector_db,
                     on_disk,
                     summary,
+                    dedup_stats=dedup_stats,
+                    abort_check=abort_check,
                 )
             else:
                 n = ins.run_streaming_ingest(
@@ -109,9 +236,12 @@ def ingest_file(uploaded_file, vector_db, category: str = "默认知识库", des
                     vector_db,
                     on_disk,
                     None,
+                    dedup_stats=dedup_stats,
+                    abort_check=abort_check,
                 )
+            _record_stage(stage_timings, "stream", t_stage)
             logger.info("[Ingest/stream] PDF 入库 %d 块，文件：%s", n, uploaded_file.name)
-            _finalize_ingest_metadata(uploaded_file, file_ext, cat, desc, n)
+            _finalize_ingest_metadata(uploaded_file, file_ext, cat, desc, n, content_sha)
             return n
 
         if use_stream and file_ext == ".docx":
@@ -124,13 +254,18 @@ def ingest_file(uploaded_file, vector_db, category: str = "默认知识库", des
                 vector_db,
                 on_disk,
                 summary,
+                dedup_stats=dedup_stats,
+                abort_check=abort_check,
             )
+            _record_stage(stage_timings, "stream", t_stage)
             logger.info("[Ingest/stream] DOCX 入库 %d 块，文件：%s", n, uploaded_file.name)
-            _finalize_ingest_metadata(uploaded_file, file_ext, cat, desc, n)
+            _finalize_ingest_metadata(uploaded_file, file_ext, cat, desc, n, content_sha)
             return n
 
         # ---------- 原有路径（较小文件）：全文进内存 + 多层级 smart chunk ----------
-        docs = parse_file_to_documents(temp_path, uploaded_file.name)
+        docs = _parse_documents(temp_path, uploaded_file.name)
+        _record_stage(stage_timings, "parse", t_stage)
+        t_stage = time.perf_counter()
 
         from utils.smart_chunker import smart_chunk_document
 
@@ -152,27 +287,52 @@ def ingest_file(uploaded_file, vector_db, category: str = "默认知识库", des
         )
 
         logger.info("[SmartChunker] 分块统计: %s", chunk_stats)
+        _record_stage(stage_timings, "chunk", t_stage)
+        t_stage = time.perf_counter()
 
         for chunk in chunks:
             if "source_file" not in chunk.metadata:
                 chunk.metadata["source_file"] = uploaded_file.name
             if "file_type" not in chunk.metadata:
                 chunk.metadata["file_type"] = file_ext.lstrip(".")
+        # 稳定整数 id：检索融合 / 合并去重的键（父文本库层级一并写入，扩展出的父块同样可去重）
+        assign_chunk_uids(chunks)
 
-        if chunks:
+        # embed-once：仅 RAG_EMBED_LEVELS 中的层级嵌入写入 FAISS，其余层级只存父文本库
+        to_embed, text_only = split_chunks_for_embedding(chunks)
+        if to_embed:
             index_dir = os.path.join(get_kb_dir(), "faiss_index")
             os.makedirs(index_dir, exist_ok=True)
             bs = ins.EMBED_ADD_BATCH_SIZE
             from utils.faiss_write_lock import faiss_write_lock
 
             with faiss_write_lock():
-                for i in range(0, len(chunks), bs):
-                    vector_db.add_documents(chunks[i : i + bs])
+                if abort_check is not None:
+                    abort_check()
+                reuse = ChunkVectorReuse(vector_db, uploaded_file.name)
+                for i in range(0, len(to_embed), bs):
+                    reuse.add_documents(to_embed[i : i + bs])
+                replaced = reuse.drop_replaced()
                 vector_db.save_local(index_dir)
-            logger.info("成功入库 %d 个文本块，文件：%s", len(chunks), uploaded_file.name)
-            _finalize_ingest_metadata(uploaded_file, file_ext, cat, desc, len(chunks))
+            if dedup_stats is not None:
+                dedup_stats.update(reuse.stats(replaced))
+            _record_stage(stage_timings, "embed_write", t_stage)
+            logger.info(
+                "成功入库 %d 个文本块（嵌入 %d，仅存父文本 %d），文件：%s",
+                len(chunks),
+                len(to_embed),
+                len(text_only),
+                uploaded_file.name,
+            )
+            # 整篇纯文本 sidecar：查看内容 / 全文检索直接读取，不再重新解析原文
+            write_sidecar(uploaded_file.name, full_text, chunks)
+            # BM25 分词缓存：随后的索引重建只需取回本次分块的 token
+            remember_document_tokens(to_embed)
+            _finalize_ingest_metadata(
+                uploaded_file, file_ext, cat, desc, len(chunks), content_sha, text_only
+            )
 
-        return len(chunks)
+        return len(chunks) if to_embed else 0
 
     except Exception as e:
         error_msg = f"文件处理失败 {uploaded_file.name}: {str(e)}"
@@ -181,7 +341,7 @@ def ingest_file(uploaded_file, vector_db, category: str = "默认知识库", des
         raise
 
     finally:
-        if temp_path and os.path.exists(temp_path):
+        if owns_temp and temp_path and os.path.exists(temp_path):
             try:
                 os.unlink(temp_path)
             except Exception as e:
@@ -0,0 +1,425 @@
+"""
+全文子串检索的位置倒排索引（每个知识库一份，fulltext_index.sqlite3）。
+
+正文先做 NFC 与逐字 casefold（只折叠一对一的字符，保证下标与原文对齐），再按字符类别切成连续串：
+- 中日韩文字串：每个位置取 2 元组（串尾取单字）；
+- 其它字母数字串（英文词、数字等）：每个位置取词内 3 元组（词尾取 2/1 字），
+  查询截断单词（如 "ytho" 命中 "python"）时仍是精确的词项查找，不必扫词表。
+每个词项记录它在文中的全部起点（差分 + zlib 压缩）。查询按同样规则取若干锚点词项，
+按出现次数从少到多逐个求位置交集得到候选起点，最终由调用方在原文上逐一核对子串，结果与线性扫描一致。
+
+索引由 utils.text_sidecar 在写入/删除 sidecar 时同步维护（入库、同名重传、删除、清空），
+旧文档首次检索时由 document_preview 补建。查询中含一对多折叠字符（如 ß）或没有可索引文字（纯标点）时
+plan_fulltext_query 返回 None，调用方退回线性扫描。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.path_context import get_kb_dir
+
+logger = logging.getLogger(__name__)
+
+FULLTEXT_INDEX_FILENAME = "fulltext_index.sqlite3"
+
+# 写入端累计这么多个位置后落一批 postings，控制超大文档入库时的内存
+_FLUSH_POSITIONS = 1_000_000
+# 单次查询最多用几个锚点求交集（其余由原文核对兜底）
+_MAX_ANCHORS = 4
+_SQL_IN_CHUNK = 500
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_RUN_RE = re.compile(rf"(?P<cjk>[{_CJK}]+)|(?P<word>[^\W_{_CJK}]+)")
+_GRAM = {"cjk": 2, "word": 3}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ft_docs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_name TEXT NOT NULL,
+    ready INTEGER NOT NULL DEFAULT 0,
+    chars INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ft_docs_name ON ft_docs (file_name, ready);
+CREATE TABLE IF NOT EXISTS ft_terms (
+    term_id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS ft_postings (
+    term_id INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    block INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    positions BLOB NOT NULL,
+    PRIMARY KEY (term_id, doc_id, block)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_ft_postings_doc ON ft_postings (doc_id);
+"""
+
+
+def fulltext_index_path(kb_dir: Optional[str] = None) -> str:
+    return os.path.join(kb_dir or get_kb_dir(), FULLTEXT_INDEX_FILENAME)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def fold_text(s: str) -> str:
+    """逐字 casefold；折叠成多个字符的（ß→ss 等）保持原样，下标与输入一一对应。"""
+    f = s.casefold()
+    if len(f) == len(s):
+        return f
+    return "".join(c.casefold() if len(c.casefold()) == 1 else c for c in s)
+
+
+def _runs(cp: np.ndarray) -> np.ndarray:
+    """与 _RUN_RE.finditer 等价的连续串切分（向量化）：返回 [[start, end, n], ...]。"""
+    if not len(cp):
+        return np.empty((0, 3), dtype=np.int64)
+    uniq, inv = np.unique(cp, return_inverse=True)
+    kinds = np.array([_char_gram(c) for c in uniq.tolist()], dtype=np.int64)
+    n = kinds[inv]
+    change = np.flatnonzero(np.diff(n, prepend=0, append=0))
+    starts, ends = change[:-1], change[1:]
+    keep = n[starts] > 0
+    return np.stack([starts[keep], ends[keep], n[starts[keep]]], axis=1)
+
+
+def _char_gram(c: int) -> int:
+    m = _RUN_RE.fullmatch(chr(c))
+    return _GRAM[m.lastgroup] if m else 0
+
+
+def _decode_gram(code: int) -> str:
+    return "".join(chr(c) for c in (code >> 42, (code >> 21) & 0x1FFFFF, code & 0x1FFFFF) if c)
+
+
+def _encode_positions(pos: np.ndarray) -> bytes:
+    return zlib.compress(np.diff(pos, prepend=0).astype("<u4").tobytes(), 1)
+
+
+def _decode_positions(blob: bytes) -> np.ndarray:
+    return np.cumsum(np.frombuffer(zlib.decompress(blob), dtype="<u4"), dtype=np.int64)
+
+
+def _chunks(seq: Sequence, size: int = _SQL_IN_CHUNK) -> Iterator[Sequence]:
+    for i in range(0, len(seq), size):
+        yield seq[i : i + size]
+
+
+def _term_ids(conn: sqlite3.Connection, terms: List[str]) -> Dict[str, int]:
+    conn.executemany("INSERT OR IGNORE INTO ft_terms (term) VALUES (?)", ((t,) for t in terms))
+    out: Dict[str, int] = {}
+    for part in _chunks(terms):
+        q = f"SELECT term, term_id FROM ft_terms WHERE term IN ({','.join('?' * len(part))})"
+        out.update(conn.execute(q, list(part)).fetchall())
+    return out
+
+
+def _delete_docs(conn: sqlite3.Connection, doc_ids: Iterable[int]) -> None:
+    for did in doc_ids:
+        conn.execute("DELETE FROM ft_postings WHERE doc_id = ?", (did,))
+        conn.execute("DELETE FROM ft_docs WHERE doc_id = ?", (did,))
+
+
+class FulltextIndexWriter:
+    """逐段建立一篇文档的索引；commit 时原子替换同名旧版本，abort 丢弃已写入的批次。
+
+    分段方式与 SidecarWriter 相同（段间以空行连接），位置对应「查看内容」里去首尾空白、NFC 后的整篇正文。
+    """
+
+    def __init__(self, file_name: str, kb_dir: Optional[str] = None) -> None:
+        self.file_name = file_name
+        self.chars = 0
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._pending_n = 0
+        self._block = 0
+        path = fulltext_index_path(kb_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = _connect(path)
+        cur = self._conn.execute(
+            "INSERT INTO ft_docs (file_name, ready, chars, updated_at) VALUES (?, 0, 0, ?)",
+            (file_name, time.time()),
+        )
+        self.doc_id = int(cur.lastrowid)
+
+    def add(self, text: str) -> None:
+        t = unicodedata.normalize("NFC", text or "")
+        if self.chars:
+            self.chars += 2
+        else:
+            t = t.lstrip()
+        cp = np.frombuffer(fold_text(t).encode("utf-32-le"), dtype="<u4").astype(np.int64)
+        arr = _runs(cp)
+        if len(arr):
+            cp = np.append(cp, [0, 0])
+            # 按位置数切批，单次 add 超长文本时也不会一次生成过大的数组
+            total = np.cumsum(arr[:, 1] - arr[:, 0])
+            cuts = np.searchsorted(total, np.arange(_FLUSH_POSITIONS, int(total[-1]), _FLUSH_POSITIONS))
+            for part in np.split(arr, cuts):
+                if len(part):
+                    self._add_runs(cp, part)
+        self.chars += len(t)
+
+    def _add_runs(self, cp: np.ndarray, runs: np.ndarray) -> None:
+        """runs: [[start, end, n], ...]；逐位置算 n 元组的码点编码（每字 21 位，串尾不足 n 字补 0）。"""
+        lengths = runs[:, 1] - runs[:, 0]
+        firsts = np.cumsum(lengths) - lengths
+        pos = np.repeat(runs[:, 0] - firsts, lengths) + np.arange(int(lengths.sum()))
+        end = np.repeat(runs[:, 1], lengths)
+        n = np.repeat(runs[:, 2], lengths)
+        c1 = np.where(pos + 1 < end, cp[pos + 1], 0)
+        c2 = np.where((n > 2) & (pos + 2 < end), cp[pos + 2], 0)
+        self._pending.append(((cp[pos] << 42) | (c1 << 21) | c2, pos + self.chars))
+        self._pending_n += len(pos)
+        if self._pending_n >= _FLUSH_POSITIONS:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        codes = np.concatenate([c for c, _p in self._pending])
+        positions = np.concatenate([p for _c, p in self._pending])
+        uniq, inv = np.unique(codes, return_inverse=True)
+        # 稳定排序：同一词项内位置保持升序
+        grouped = np.split(positions[np.argsort(inv, kind="stable")], np.cumsum(np.bincount(inv))[:-1])
+        terms = [_decode_gram(c) for c in uniq.tolist()]
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = _term_ids(conn, terms)
+            conn.executemany(
+                "INSERT INTO ft_postings VALUES (?, ?, ?, ?, ?)",
+                (
+                    (ids[g], self.doc_id, self._block, len(pos), _encode_positions(pos))
+                    for g, pos in zip(terms, grouped)
+                ),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._pending = []
+        self._pending_n = 0
+        self._block += 1
+
+    def commit(self) -> None:
+        try:
+            self._flush()
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = [
+                    r[0]
+                    for r in conn.execute(
+                        "SELECT doc_id FROM ft_docs WHERE file_name = ? AND doc_id != ?",
+                        (self.file_name, self.doc_id),
+                    )
+                ]
+                _delete_docs(conn, old)
+                conn.execute(
+                    "UPDATE ft_docs SET ready = 1, chars = ?, updated_at = ? WHERE doc_id = ?",
+                    (self.chars, time.time(), self.doc_id),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            self._conn.close()
+
+    def abort(self) -> None:
+        try:
+            _delete_docs(self._conn, [self.doc_id])
+        except sqlite3.Error as e:
+            logger.debug("[FullText] 丢弃未完成索引失败 %s: %s", self.file_name, e)
+        finally:
+            self._conn.close()
+
+
+def index_document(file_name: str, text: str, kb_dir: Optional[str] = None) -> bool:
+    """整篇（重新）建立索引；失败只记日志并返回 False。"""
+    try:
+        w = FulltextIndexWriter(file_name, kb_dir)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[FullText] 建索引失败 %s: %s", file_name, e)
+        return False
+    try:
+        w.add(text)
+        w.commit()
+        return True
+    except Exception as e:  # noqa: BLE001 — 索引只是加速结构，失败时检索退回补建/线性扫描
+        w.abort()
+        logger.warning("[FullText] 建索引失败 %s: %s", file_name, e)
+        return False
+
+
+def delete_fulltext_document(file_name: str, kb_dir: Optional[str] = None) -> None:
+    path = fulltext_index_path(kb_dir)
+    if not os.path.isfile(path):
+        return
+    try:
+        conn = _connect(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [r[0] for r in conn.execute("SELECT doc_id FROM ft_docs WHERE file_name = ?", (file_name,))]
+            _delete_docs(conn, ids)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("[FullText] 删除索引失败 %s: %s", file_name, e)
+
+
+def clear_fulltext_index(kb_dir: Optional[str] = None) -> None:
+    path = fulltext_index_path(kb_dir)
+    for p in (path, path + "-wal", path + "-shm"):
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+
+
+def indexed_documents(file_names: Iterable[str], kb_dir: Optional[str] = None) -> Dict[str, int]:
+    """已建好索引的文件名 -> doc_id（库不存在或读失败时为空）。"""
+    names = list(dict.fromkeys(file_names))
+    path = fulltext_index_path(kb_dir)
+    if not names or not os.path.isfile(path):
+        return {}
+    out: Dict[str, int] = {}
+    try:
+        conn = _connect(path)
+        try:
+            for part in _chunks(names):
+                q = f"SELECT file_name, doc_id FROM ft_docs WHERE ready = 1 AND file_name IN ({','.join('?' * len(part))})"
+                out.update(conn.execute(q, list(part)).fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("[FullText] 读取索引失败: %s", e)
+        return {}
+    return out
+
+
+@dataclass(frozen=True)
+class _Anchor:
+    term: str
+    offset: int  # 词项在查询中的起点
+    prefix: bool  # True：正文中对应位置的词项以 term 开头（查询在串中途结束）
+
+
+def plan_fulltext_query(query: str) -> Optional[List[_Anchor]]:
+    """把查询拆成锚点词项；无法用索引精确覆盖时返回 None（调用方走线性扫描）。"""
+    q = unicodedata.normalize("NFC", (query or "").strip())
+    if not q or any(len(c.casefold()) != 1 for c in q):
+        return None
+    fq = q.casefold()
+    anchors: List[_Anchor] = []
+    for m in _RUN_RE.finditer(fq):
+        run, s, n = m.group(), m.start(), _GRAM[m.lastgroup]
+        if len(run) >= n:
+            anchors.extend(_Anchor(run[i : i + n], s + i, False) for i in range(len(run) - n + 1))
+        else:
+            # 串比 n 短：查询里其后还有字符时正文同样在此断开，词项就是 run 本身；否则按前缀匹配
+            anchors.append(_Anchor(run, s, m.end() == len(fq)))
+    return anchors or None
+
+
+def _resolve(conn: sqlite3.Connection, a: _Anchor) -> List[int]:
+    if a.prefix:
+        rows = conn.execute(
+            "SELECT term_id FROM ft_terms WHERE term >= ? AND term < ?",
+            (a.term, a.term + "\U0010ffff"),
+        ).fetchall()
+    else:
+        rows = conn.execute("SELECT term_id FROM ft_terms WHERE term = ?", (a.term,)).fetchall()
+    return [r[0] for r in rows]
+
+
+def _postings(
+    conn: sqlite3.Connection, term_ids: List[int], doc_id: Optional[int] = None
+) -> Iterator[Tuple[int, bytes]]:
+    for part in _chunks(term_ids):
+        ph = ",".join("?" * len(part))
+        if doc_id is None:
+            yield from conn.execute(f"SELECT doc_id, positions FROM ft_postings WHERE term_id IN ({ph})", list(part))
+        else:
+            yield from conn.execute(
+                f"SELECT doc_id, positions FROM ft_postings WHERE doc_id = ? AND term_id IN ({ph})",
+                [doc_id, *part],
+            )
+
+
+def _cost(conn: sqlite3.Connection, term_ids: List[int]) -> int:
+    total = 0
+    for part in _chunks(term_ids):
+        ph = ",".join("?" * len(part))
+        total += conn.execute(f"SELECT COALESCE(SUM(n), 0) FROM ft_postings WHERE term_id IN ({ph})", list(part)).fetchone()[0]
+    return int(total)
+
+
+def _union(parts: List[np.ndarray]) -> np.ndarray:
+    if not parts:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(parts)) if len(parts) > 1 else np.unique(parts[0])
+
+
+def iter_candidate_offsets(
+    anchors: List[_Anchor],
+    doc_ids: Sequence[Tuple[str, int]],
+    kb_dir: Optional[str] = None,
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    按 doc_ids 的顺序逐篇产出 (文件名, 候选起点升序数组)；无候选的文档跳过。
+    最稀有的锚点一次取全部文档的 postings，其余锚点按文档惰性求交集，调用方停止迭代即提前结束。
+    """
+    path = fulltext_index_path(kb_dir)
+    if not anchors or not doc_ids or not os.path.isfile(path):
+        return
+    conn = _connect(path)
+    try:
+        resolved: List[Tuple[int, List[int], int]] = []
+        for a in anchors:
+            tids = _resolve(conn, a)
+            if not tids:
+                return
+            resolved.append((_cost(conn, tids), tids, a.offset))
+        resolved.sort(key=lambda r: r[0])
+        resolved = resolved[:_MAX_ANCHORS]
+
+        wanted = {did for _fn, did in doc_ids}
+        _cost0, first_tids, first_off = resolved[0]
+        first: Dict[int, List[np.ndarray]] = {}
+        for did, blob in _postings(conn, first_tids):
+            if did in wanted:
+                first.setdefault(did, []).append(_decode_positions(blob) - first_off)
+
+        for fn, did in doc_ids:
+            parts = first.pop(did, None)
+            if not parts:
+                continue
+            cand = _union(parts)
+            for _c, tids, off in resolved[1:]:
+                other = _union([_decode_positions(b) - off for _d, b in _postings(conn, tids, did)])
+                cand = np.intersect1d(cand, other, assume_unique=True)
+                if cand.size == 0:
+                    break
+            cand = cand[cand >= 0]
+            if cand.size:
+                yield fn, cand
+    finally:
+        conn.close()
@@ -7,14 +7,20 @@
 与 config 的 SIMILARITY_THRESHOLD / ABSOLUTE_MIN_SCORE 同尺度可比；
 RRF 只决定排序，不直接作为分数（RRF 原始量级 ~0.01，与绝对阈值比较无意义）。
 """
-import hashlib
 import logging
 import os
 import pickle
+import sys
+import threading
+import weakref
+from collections import OrderedDict
 from typing import List, Tuple, Dict, Optional
+import numpy as np
 from langchain_core.documents import Document
 from rank_bm25 import BM25Okapi
 import jieba
+from utils.chunk_ids import CHUNK_UID_KEY, chunk_uid, compute_chunk_uid
+from utils.latency_trace import span
 from utils.path_context import get_kb_dir
 
 logger = logging.getLogger(__name__)
@@ -31,6 +37,55 @@ _BM25_SINGLE_CHAR_STOP = set(
 _BM25_MULTI_CHAR_STOP = {"怎么", "如何", "为什么", "什么", "哪些", "哪个"}
 
 
+# 进程内 BM25 缓存：按知识库目录，索引文件 mtime 变化（重建/失效）即重新载入，避免每次混合检索都反序列化 pickle。
+# Web 端由 vdb_cache 把它计入该用户条目的字节预算，条目被淘汰时一并释放（drop_cached_bm25）。
+_BM25_MEM_MAX_ENTRIES = 64
+_bm25_mem_lock = threading.Lock()
+_bm25_mem: "OrderedDict[str, Tuple[Tuple[float, float], BM25Okapi, List[Document], int]]" = OrderedDict()
+# 索引 -> {id(文档): 下标}：由 bm25_search 返回的文档取回其倒排（覆盖率门控），随索引对象回收
+_bm25_positions: "weakref.WeakKeyDictionary[BM25Okapi, Dict[int, int]]" = weakref.WeakKeyDictionary()
+
+
+def _bm25_signature(idx_f: str, docs_f: str) -> Optional[Tuple[float, float]]:
+    try:
+        return os.path.getmtime(idx_f), os.path.getmtime(docs_f)
+    except OSError:
+        return None
+
+
+def _bm25_bytes(bm25_index: BM25Okapi, documents: List[Document]) -> int:
+    """粗估驻留字节：每条 (词, 词频) 倒排约 120 字节 + idf 表 + 文档正文与 Document 开销
+    （含覆盖率门控用的文档下标表，每篇约 100 字节）。"""
+    postings = sum(len(f) for f in getattr(bm25_index, "doc_freqs", ()))
+    idf = len(getattr(bm25_index, "idf", ()))
+    docs = sum(sys.getsizeof(d.page_content) + 100 * len(d.metadata) + 500 for d in documents)
+    return postings * 120 + idf * 150 + docs
+
+
+def _remember_bm25(sig: Optional[Tuple[float, float]], bm25_index: BM25Okapi, documents: List[Document]) -> None:
+    if sig is None:
+        return
+    kb = os.path.abspath(get_kb_dir())
+    nbytes = _bm25_bytes(bm25_index, documents)
+    with _bm25_mem_lock:
+        _bm25_mem[kb] = (sig, bm25_index, documents, nbytes)
+        _bm25_mem.move_to_end(kb)
+        while len(_bm25_mem) > _BM25_MEM_MAX_ENTRIES:
+            _bm25_mem.popitem(last=False)
+
+
+def bm25_cached_bytes(kb_dir: str) -> int:
+    """该知识库在进程内缓存的 BM25 估算字节（未缓存为 0）。"""
+    with _bm25_mem_lock:
+        hit = _bm25_mem.get(os.path.abspath(kb_dir))
+        return hit[3] if hit is not None else 0
+
+
+def drop_cached_bm25(kb_dir: str) -> None:
+    with _bm25_mem_lock:
+        _bm25_mem.pop(os.path.abspath(kb_dir), None)
+
+
 def _bm25_index_file() -> str:
     return os.path.join(get_kb_dir(), f"bm25_index.v{_BM25_TOKENIZER_VERSION}.pkl")
 
@@ -57,6 +112,7 @@ def invalidate_bm25_index() -> None:
     删除已持久化的索引文件（含历史版本），使下次混合检索时自动重建，
     避免「旧索引 + 新文档」导致的一致性偏移问题。
     """
+    drop_cached_bm25(get_kb_dir())
     for p in (_bm25_index_file(), _bm25_docs_file(), *_legacy_bm25_files()):
         try:
             if os.path.isfile(p):
@@ -65,19 +121,6 @@ def invalidate_bm25_index() -> None:
             logger.warning("失效 BM25 索引失败: %s", p)
 
 
-def _fusion_key(doc: Document) -> str:
-    """跨来源稳定标识：source_file + 内容哈希。
-
-    不能用 id(doc)：BM25 文档来自 pickle 反序列化，与向量检索返回的 docstore
-    对象必然不同 id，同块两路永远无法融合。
-    """
-    meta = getattr(doc, "metadata", None) or {}
-    src = str(meta.get("source_file") or "")
-    body = (getattr(doc, "page_content", None) or "")[:320]
-    digest = hashlib.md5(body.encode("utf-8", errors="ignore")).hexdigest()[:16]
-    return f"{src}\x1f{digest}"
-
-
 def tokenize_chinese(text: str) -> List[str]:
     """
     中文分词（用于BM25）。保留单字 CJK token（非虚词），避免单字查询/型号无关键词可用。
@@ -100,20 +143,18 @@ def tokenize_chinese(text: str) -> List[str]:
 
 def build_bm25_index(documents: List[Document]) -> Optional[BM25Okapi]:
     """
-    构建BM25索引
-    :param documents: 文档列表
+    构建BM25索引（分词经 utils.bm25_tokens 按正文哈希缓存，只对新内容跑 jieba）
+    :param documents: 文档列表（当前知识库的全部分块）
     :return: BM25索引对象
     """
     if not documents:
         return None
-    
-    # 提取文档内容并分词
-    tokenized_docs = []
-    for doc in documents:
-        content = doc.page_content if hasattr(doc, 'page_content') else str(doc)
-        tokens = tokenize_chinese(content)
-        tokenized_docs.append(tokens)
-    
+
+    from utils.bm25_tokens import tokenize_texts
+
+    contents = [doc.page_content if hasattr(doc, 'page_content') else str(doc) for doc in documents]
+    tokenized_docs = tokenize_texts(contents, prune=True)
+
     if not tokenized_docs:
         return None
     
@@ -134,6 +175,7 @@ def save_bm25_index(bm25_index: BM25Okapi, documents: List[Document]):
             pickle.dump(bm25_index, f)
         with open(docs_f, "wb") as f:
             pickle.dump(documents, f)
+        _remember_bm25(_bm25_signature(idx_f, docs_f), bm25_index, documents)
         logger.info("[BM25] 索引已保存到: %s", idx_f)
     except Exception as e:
         logger.warning("[BM25] 保存索引失败: %s", e)
@@ -145,11 +187,19 @@ def load_bm25_index() -> Tuple[Optional[BM25Okapi], Optional[List[Document]]]:
     """
     try:
         idx_f, docs_f = _bm25_index_file(), _bm25_docs_file()
-        if os.path.exists(idx_f) and os.path.exists(docs_f):
+        sig = _bm25_signature(idx_f, docs_f)
+        if sig is not None:
+            kb = os.path.abspath(get_kb_dir())
+            with _bm25_mem_lock:
+                hit = _bm25_mem.get(kb)
+                if hit is not None and hit[0] == sig:
+                    _bm25_mem.move_to_end(kb)
+                    return hit[1], hit[2]
             with open(idx_f, "rb") as f:
                 bm25_index = pickle.load(f)
             with open(docs_f, "rb") as f:
                 documents = pickle.load(f)
+            _remember_bm25(sig, bm25_index, documents)
             logger.info("[BM25] 索引已加载: %d 个文档", len(documents))
             return bm25_index, documents
     except Exception as e:
@@ -157,6 +207,25 @@ def load_bm25_index() -> Tuple[Optional[BM25Okapi], Optional[List[Document]]]:
     return None, None
 
 
+def _bm25_top(
+    query_tokens: List[str],
+    bm25_index: BM25Okapi,
+    top_k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """BM25 前 top_k 的 (文档下标, 分数)，按分数降序；argpartition 取前 k，不对全库排序。"""
+    scores = np.asarray(bm25_index.get_scores(query_tokens), dtype=np.float64)
+    n = min(int(top_k), scores.shape[0])
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    if n < scores.shape[0]:
+        part = np.argpartition(-scores, n - 1)[:n]
+    else:
+        part = np.arange(scores.shape[0])
+    # 前 k 内同分按下标升序（与对全库稳定排序的次序相同）
+    pos = part[np.lexsort((part, -scores[part]))]
+    return pos, scores[pos]
+
+
 def bm25_search(
     query: str,
     bm25_index: BM25Okapi,
@@ -178,15 +247,9 @@ def bm25_search(
     query_tokens = tokenize_chinese(query)
     if not query_tokens:
         return []
-    
-    # BM25检索
-    scores = bm25_index.get_scores(query_tokens)
-    
-    # 排序并返回top_k
-    doc_scores = list(zip(documents, scores))
-    doc_scores.sort(key=lambda x: x[1], reverse=True)
-    
-    return doc_scores[:top_k]
+
+    pos, scores = _bm25_top(query_tokens, bm25_index, top_k)
+    return [(documents[i], float(sc)) for i, sc in zip(pos.tolist(), scores.tolist())]
 
 
 def rrf_fusion(
@@ -198,44 +261,65 @@ def rrf_fusion(
     RRF (Reciprocal Rank Fusion) 融合算法
     融合向量检索和BM25检索的结果
 
+    以分块稳定 id（utils.chunk_ids）为键：BM25 文档来自 pickle 反序列化，与向量检索返回的
+    docstore 对象必然不是同一对象，同块两路须按 id 融合。名次、RRF 累加与证据分取最大都在 NumPy 数组上完成。
+
     :param vector_results: 向量检索结果 [(doc, score), ...]
     :param bm25_results: BM25检索结果 [(doc, score), ...]
     :param k: RRF参数，通常为60
     :return: 融合后的结果 [(doc, 证据分), ...]，按 RRF 排序；
              证据分 = max(该文档的向量相似度, BM25 归一分)，与绝对阈值同尺度
     """
-    doc_rrf_scores: Dict[str, Dict] = {}
-    vector_evidence: Dict[str, float] = {}
-    bm25_evidence: Dict[str, float] = {}
-
-    for rank, (doc, score) in enumerate(vector_results, 1):
-        doc_id = _fusion_key(doc)
-        vector_evidence[doc_id] = max(vector_evidence.get(doc_id, 0.0), float(score))
-        if doc_id not in doc_rrf_scores:
-            doc_rrf_scores[doc_id] = {"doc": doc, "rrf_score": 0.0}
-        doc_rrf_scores[doc_id]["rrf_score"] += 1.0 / (k + rank)
-
-    for rank, (doc, score) in enumerate(bm25_results, 1):
-        doc_id = _fusion_key(doc)
-        bm25_evidence[doc_id] = max(bm25_evidence.get(doc_id, 0.0), float(score))
-        if doc_id not in doc_rrf_scores:
-            doc_rrf_scores[doc_id] = {"doc": doc, "rrf_score": 0.0}
-        doc_rrf_scores[doc_id]["rrf_score"] += 1.0 / (k + rank)
-
-    fused_results = sorted(doc_rrf_scores.values(), key=lambda x: x["rrf_score"], reverse=True)
-
-    out: List[Tuple[Document, float]] = []
-    for item in fused_results:
-        doc_id = _fusion_key(item["doc"])
-        evidence = max(vector_evidence.get(doc_id, 0.0), bm25_evidence.get(doc_id, 0.0))
-        out.append((item["doc"], evidence))
-    return out
+    nv = len(vector_results)
+    pairs = list(vector_results) + list(bm25_results)
+    if not pairs:
+        return []
+    uids = np.fromiter((chunk_uid(d) for d, _ in pairs), dtype=np.int64, count=len(pairs))
+    scores = np.fromiter((float(sc) for _, sc in pairs), dtype=np.float64, count=len(pairs))
+    ranks = np.concatenate([np.arange(1, nv + 1), np.arange(1, len(pairs) - nv + 1)]).astype(np.float64)
+
+    uniq, first, inv = np.unique(uids, return_index=True, return_inverse=True)
+    rrf = np.zeros(uniq.shape[0])
+    np.add.at(rrf, inv, 1.0 / (k + ranks))
+    vec_ev = np.zeros(uniq.shape[0])
+    bm_ev = np.zeros(uniq.shape[0])
+    np.maximum.at(vec_ev, inv[:nv], scores[:nv])
+    np.maximum.at(bm_ev, inv[nv:], scores[nv:])
+    evidence = np.maximum(vec_ev, bm_ev)
+
+    # RRF 降序，同分按首次出现先后（与逐条累加再稳定排序一致）；文档取首次出现的对象
+    order = np.lexsort((first, -rrf))
+    return [(pairs[first[j]][0], float(evidence[j])) for j in order.tolist()]
+
+
+def _result_postings(
+    bm25_index: BM25Okapi,
+    documents: List[Document],
+    results: List[Tuple[Document, float]],
+) -> Optional[List[Dict[str, int]]]:
+    """bm25_search 结果各文档在索引中的倒排（doc_freqs 项）；索引与文档列表对不上时返回 None。"""
+    freqs = getattr(bm25_index, "doc_freqs", None)
+    if freqs is None or len(freqs) != len(documents):
+        return None
+    try:
+        with _bm25_mem_lock:
+            pos = _bm25_positions.get(bm25_index)
+            if pos is None:
+                pos = {id(d): i for i, d in enumerate(documents)}
+                _bm25_positions[bm25_index] = pos
+    except TypeError:
+        return None
+    try:
+        return [freqs[pos[id(d)]] for d, _ in results]
+    except KeyError:
+        return None
 
 
 def _bm25_coverage_gate(
     query_toks: List[str],
     bm25_results: List[Tuple[Document, float]],
     min_coverage: float = 0.5,
+    postings: Optional[List[Dict[str, int]]] = None,
 ) -> List[Tuple[Document, float]]:
     """BM25 命中的查询词覆盖率门控。
 
@@ -244,25 +328,43 @@ def _bm25_coverage_gate(
     经归一化后 evidence=1.0 直接穿透负样本防线。
     规则：文档须覆盖查询分词的至少 min_coverage 比例，且命中词中至少一个为多字词
     （排除单字巧合，如「潜水证」的「证」撞上「借阅证」）。
+
+    postings 为与 bm25_results 对齐的各文档倒排（BM25Okapi.doc_freqs 的对应项）：
+    查询词本身是文档 token 即判命中（查字典），只有倒排查不到的词才回退到正文子串判断；
+    文档 token 都是正文片段，因此结果与逐条扫描正文完全一致。
     """
     if not bm25_results:
         return []
     if not query_toks:
         return []
-    out: List[Tuple[Document, float]] = []
-    for doc, score in bm25_results:
-        # 子串匹配而非 token 相等：分词边界不一致（查询「逾期」vs 文档 token「逾期费」）
-        # 会让真实命中漏检，用原文包含判断对此鲁棒
+    n_toks = len(query_toks)
+    rows: List[List[bool]] = []
+    for i, (doc, _score) in enumerate(bm25_results):
+        terms = postings[i] if postings is not None else {}
         text = doc.page_content or ""
-        matched = [t for t in query_toks if t in text]
-        if not matched:
-            continue
-        if len(matched) / len(query_toks) < min_coverage:
-            continue
-        if not any(len(t) >= 2 for t in matched):
-            continue
-        out.append((doc, score))
-    return out
+        # 子串匹配而非 token 相等：分词边界不一致（查询「逾期」vs 文档 token「逾期费」，
+        # 或查询词跨越文档的两个 token）会让真实命中漏检，倒排查不到时用原文包含判断
+        rows.append([t in terms or t in text for t in query_toks])
+    hit = np.array(rows, dtype=bool).reshape(len(rows), n_toks)
+    multi = np.fromiter((len(t) >= 2 for t in query_toks), dtype=bool, count=n_toks)
+    keep = (hit.sum(axis=1) / n_toks >= min_coverage) & hit[:, multi].any(axis=1)
+    return [bm25_results[i] for i in np.flatnonzero(keep).tolist()]
+
+
+def vector_search_with_score(vector_db, query: str, k: int) -> List[Tuple[Document, float]]:
+    """
+    向量检索，返回 (doc, L2 距离)。LangChain FAISS（含 TombstoneFAISS）时拆成查询向量化与 FAISS 搜索两步，
+    与 similarity_search_with_score 内部步骤相同，只为分别计时；其它实现（测试替身等）整体计入 faiss_search。
+    """
+    from langchain_community.vectorstores import FAISS
+
+    if isinstance(vector_db, FAISS):
+        with span("embed"):
+            embedding = vector_db._embed_query(query)
+        with span("faiss_search"):
+            return vector_db.similarity_search_with_score_by_vector(embedding, k=k)
+    with span("faiss_search"):
+        return vector_db.similarity_search_with_score(query, k=k)
 
 
 def hybrid_search(
@@ -292,7 +394,7 @@ def hybrid_search(
 
     # 1. 向量检索
     try:
-        vector_results = vector_db.similarity_search_with_score(query, k=top_k * 2)
+        vector_results = vector_search_with_score(vector_db, query, top_k * 2)
         # 转换L2距离为相似度
         vector_results = [
             (doc, 1 / (1 + score)) for doc, score in vector_results
@@ -306,9 +408,14 @@ def hybrid_search(
     bm25_max_raw = 0.0
     if bm25_index and bm25_docs:
         try:
-            raw_results = bm25_search(query, bm25_index, bm25_docs, top_k=top_k * 2)
-            # 词覆盖率门控：剔除仅靠个别公共词的弱命中（负样本误召回主因）
-            bm25_results = _bm25_coverage_gate(tokenize_chinese(query), raw_results)
+            with span("bm25_score"):
+                raw_results = bm25_search(query, bm25_index, bm25_docs, top_k=top_k * 2)
+                # 词覆盖率门控：剔除仅靠个别公共词的弱命中（负样本误召回主因）；命中判断查倒排
+                bm25_results = _bm25_coverage_gate(
+                    tokenize_chinese(query),
+                    raw_results,
+                    postings=_result_postings(bm25_index, bm25_docs, raw_results),
+                )
             if bm25_results:
                 bm25_max_raw = max(score for _, score in bm25_results)
                 # 归一化BM25分数到0-1范围（作为证据分；排序由 RRF 决定）
@@ -338,24 +445,25 @@ def hybrid_search(
                 "[Hybrid] 向量相似度过低（<%.2f），但 BM25 有命中，继续融合", ABSOLUTE_MIN_SCORE
             )
 
-    # 4. 分数归一化（按知识库分组归一化，解决分数膨胀问题）
-    if selected_kb == "全部知识库" and (vector_results or bm25_results):
-        from utils.score_normalization import normalize_hybrid_search_scores
-        try:
-            vector_results, bm25_results = normalize_hybrid_search_scores(
-                vector_results, bm25_results, selected_kb
-            )
-        except Exception as e:
-            logger.warning("[Hybrid] 分数归一化失败: %s，使用原始分数", e)
-
-    # 5. RRF融合（排序）+ 证据分（0-1，与阈值同尺度）
-    if vector_results and bm25_results:
-        fused_results = rrf_fusion(vector_results, bm25_results, k=60)
-        results = fused_results[:top_k]
-    elif vector_results:
-        results = vector_results[:top_k]
-    elif bm25_results:
-        results = bm25_results[:top_k]
+    with span("fusion"):
+        # 4. 分数归一化（按知识库分组归一化，解决分数膨胀问题）
+        if selected_kb == "全部知识库" and (vector_results or bm25_results):
+            from utils.score_normalization import normalize_hybrid_search_scores
+            try:
+                vector_results, bm25_results = normalize_hybrid_search_scores(
+                    vector_results, bm25_results, selected_kb
+                )
+            except Exception as e:
+                logger.warning("[Hybrid] 分数归一化失败: %s，使用原始分数", e)
+
+        # 5. RRF融合（排序）+ 证据分（0-1，与阈值同尺度）
+        if vector_results and bm25_results:
+            fused_results = rrf_fusion(vector_results, bm25_results, k=60)
+            results = fused_results[:top_k]
+        elif vector_results:
+            results = vector_results[:top_k]
+        elif bm25_results:
+            results = bm25_results[:top_k]
 
     return results
 
@@ -378,6 +486,18 @@ def rebuild_bm25_index(vector_db) -> Tuple[Optional[BM25Okapi], Optional[List[Do
         if not valid_docs:
             logger.warning("[BM25] 没有有效文档，无法构建索引")
             return None, None
+        # 旧索引的分块没有 chunk_uid：在 BM25 副本上补写，融合时不必逐条现算
+        valid_docs = [
+            doc if CHUNK_UID_KEY in doc.metadata else doc.model_copy(
+                update={
+                    "metadata": {
+                        **doc.metadata,
+                        CHUNK_UID_KEY: compute_chunk_uid(str(doc.metadata.get("source_file") or ""), doc.page_content),
+                    }
+                }
+            )
+            for doc in valid_docs
+        ]
         
         logger.info("[BM25] 开始构建索引，文档数: %d", len(valid_docs))
         bm25_index = build_bm25_index(valid_docs)
@@ -10,6 +10,7 @@
 """
 import logging
 import re
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
 from langchain_core.prompts import ChatPromptTemplate
 
@@ -31,98 +32,104 @@ QUERY_TYPES = {
 }
 
 
-def classify_query_type_rule_based(query: str) -> str:
-    """
-    基于规则的查询类型识别（快速、容错性好）
-    """
-    query = query.strip()
-    query_lower = query.lower()
-    
-    # 口语化表达映射（口语词 -> 正式表达列表）
-    oral_mapping = {
-        "咋": ["如何", "怎么", "怎样"],
-        "啥": ["什么", "什么是"],
-        "咋样": ["怎么样"],
-        "咋办": ["怎么办"],
-        "咋弄": ["怎么弄"],
-        "咋做": ["怎么做"]
-    }
-    
-    # 替换口语化表达（使用第一个正式表达）
-    for oral, formal_list in oral_mapping.items():
-        if oral in query:
-            query = query.replace(oral, formal_list[0])  # 使用第一个正式表达
-    
+# 口语化表达映射（口语词 -> 正式表达，按顺序替换）
+_ORAL_MAPPING = (
+    ("咋", "如何"),
+    ("啥", "什么"),
+    ("咋样", "怎么样"),
+    ("咋办", "怎么办"),
+    ("咋弄", "怎么弄"),
+    ("咋做", "怎么做"),
+)
+
+# 查询类型信号（按优先级从高到低；同一类型内任一模式命中即为该类型）
+_TYPE_PATTERNS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
     # 1. 总结类（优先级最高，避免被其他规则误判）
-    summary_patterns = [
+    ("summary", (
         r"总结|概括|概述|简介|介绍|主题|主旨|中心思想",
         r"讲了什么|说了什么|写了什么|描述了什么",
         r"主要内容|核心内容|大意|要点|要义",
         r"全文|全书|整体|整篇|通篇",
         r"有哪些.*章|有几.*章|章节.*有哪些",
-        r"文档.*内容|资料.*内容"
-    ]
-    for pattern in summary_patterns:
-        if re.search(pattern, query):
-            return "summary"
-    
+        r"文档.*内容|资料.*内容",
+    )),
     # 2. 比较类
-    comparison_patterns = [
+    ("comparison", (
         r"区别|差异|不同|对比|比较|关系|联系",
-        r"哪个.*更好|哪个.*更|.*和.*的区别|.*与.*的区别",
-        r"相比|相较|对比.*和"
-    ]
-    for pattern in comparison_patterns:
-        if re.search(pattern, query):
-            return "comparison"
-    
+        r"哪个.*更好|哪个.*更|和.*的区别|与.*的区别",
+        r"相比|相较|对比.*和",
+    )),
     # 3. 条件类
-    conditional_patterns = [
+    ("conditional", (
         r"满足.*条件|符合.*要求|达到.*标准",
         r"哪些.*满足|哪些.*符合|哪些.*达到",
         r"如果.*那么|假如.*则|当.*时",
-        r"条件.*是|要求.*是|标准.*是"
-    ]
-    for pattern in conditional_patterns:
-        if re.search(pattern, query):
-            return "conditional"
-    
+        r"条件.*是|要求.*是|标准.*是",
+    )),
     # 4. 推理类
-    reasoning_patterns = [
+    ("reasoning", (
         r"为什么|原因|原理|机制|道理|依据",
         r"如何.*判断|怎么.*判断|怎样.*判断",
         r"推导|推理|推断|推测",
-        r"因为.*所以|由于.*因此"
-    ]
-    for pattern in reasoning_patterns:
-        if re.search(pattern, query):
-            return "reasoning"
-    
+        r"因为.*所以|由于.*因此",
+    )),
     # 5. 概念类
-    concept_patterns = [
+    ("concept", (
         r"什么是|是什么|定义|概念|含义|意思",
         r"如何|怎么|怎样|方法|步骤|流程|过程",
         r"特点|特征|特性|性格|品质|品格",
-        r"作用|功能|意义|价值|影响"
-    ]
-    for pattern in concept_patterns:
-        if re.search(pattern, query):
-            return "concept"
-    
+        r"作用|功能|意义|价值|影响",
+    )),
     # 6. 精确类（最后匹配，作为兜底）
-    precise_patterns = [
+    ("precise", (
         r"谁是|是谁|叫什么|名字",
         r"哪里|在哪|何处|地点|位置",
         r"什么时候|何时|时间|日期",
         r"多少|几个|几次|数量|数字",
         r"^.{0,10}的.{0,10}[是叫有在]",  # X的Y是什么
-    ]
-    for pattern in precise_patterns:
-        if re.search(pattern, query):
-            return "precise"
-    
+    )),
+)
+
+_TYPE_ORDER = tuple(name for name, _ in _TYPE_PATTERNS)
+_TYPE_RANK = {name: i for i, name in enumerate(_TYPE_ORDER)}
+
+# 全部类型信号合成一个正则：外层是零宽前瞻，finditer 逐位置尝试一次，
+# 同一位置按优先级取第一个命中的类型（命名组），各位置中优先级最高者即结果，
+# 与逐条 re.search 的结果一致（前瞻不消耗字符，命中区间重叠也不会漏判）。
+_TYPE_SIGNAL_RE = re.compile(
+    "(?=" + "|".join(f"(?P<{name}>{'|'.join(pats)})" for name, pats in _TYPE_PATTERNS) + ")"
+)
+
+# 混合分类判断「多类型关键词」时的计数（与原先四次 re.findall 之和相同：各组关键词互不重叠）
+_TYPE_KEYWORD_RE = re.compile(r"总结|概括|概述|区别|对比|比较|什么是|如何|为什么|满足|条件|如果")
+
+
+def _normalize_oral(query: str) -> str:
+    for oral, formal in _ORAL_MAPPING:
+        if oral in query:
+            query = query.replace(oral, formal)
+    return query
+
+
+@lru_cache(maxsize=4096)
+def _rule_based_type(query: str) -> str:
+    best = len(_TYPE_ORDER)
+    for m in _TYPE_SIGNAL_RE.finditer(_normalize_oral(query)):
+        rank = _TYPE_RANK[m.lastgroup]
+        if rank < best:
+            best = rank
+            if rank == 0:
+                break
     # 默认：概念类（平衡精确度和上下文）
-    return "concept"
+    return _TYPE_ORDER[best] if best < len(_TYPE_ORDER) else "concept"
+
+
+def classify_query_type_rule_based(query: str) -> str:
+    """
+    基于规则的查询类型识别（快速、容错性好）。
+    全部类型信号由一个预编译正则单遍取得，结果按查询文本缓存。
+    """
+    return _rule_based_type(query.strip())
 
 
 def classify_query_type_llm(query: str, chat_history: List = None) -> Tuple[str, float]:
@@ -175,12 +182,7 @@ def classify_query_type_hybrid(
     needs_llm = False
     if use_llm:
         # 如果查询包含多个类型关键词，使用LLM
-        type_keywords_count = sum([
-            len(re.findall(r"总结|概括|概述", query)),
-            len(re.findall(r"区别|对比|比较", query)),
-            len(re.findall(r"什么是|如何|为什么", query)),
-            len(re.findall(r"满足|条件|如果", query))
-        ])
+        type_keywords_count = len(_TYPE_KEYWORD_RE.findall(query))
         if type_keywords_count >= 2:
             needs_llm = True
     
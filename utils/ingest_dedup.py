@@ -0,0 +1,192 @@
+"""
+入库去重（按内容寻址）：
+
+- 文件级：文件字节 sha256 记入文档元数据 content_sha256；同一知识库（category）内已有未删除的同内容文档时跳过入库，
+  传入其它知识库照常入库（块级复用向量；同名文件即移入新知识库）；
+- 块级：块正文哈希（metadata.content_hash）→ 已有向量位置。新块正文与库中任一块相同时，
+  直接 reconstruct 复用其向量（add_embeddings），只对变化的块调用 embedding；
+- 同名重传（新版本）：新块写入后删除（墓碑）该文件的旧块，避免新旧版本向量并存挤占 top-k。
+
+哈希 → 位置映射按索引目录缓存在进程内（最近 _HASH_INDEX_MAX 个目录）：入库每次都新载入一份私有索引，
+但同一目录的向量位置只会在末尾追加，缓存对象只需补扫上次之后新增的位置，不必每次遍历整个 docstore。
+物理删除（压缩、重建）会让位置前移：以「上次扫描到的最后位置上的 docstore id 不变」校验，不符即整表重建。
+
+ChunkVectorReuse 须在 faiss_write_lock 内构造与使用：向量位置在持锁期间才稳定。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+from utils.metadata_manager import load_metadata
+
+_HASH_READ_CHUNK = 1024 * 1024
+_HASH_INDEX_MAX = 8
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(_HASH_READ_CHUNK)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+def chunk_content_hash(text: str) -> str:
+    return hashlib.sha1((text or "").encode("utf-8", errors="ignore")).hexdigest()
+
+
+def find_identical_document(content_sha256: str, category: str) -> Optional[str]:
+    """知识库 category 中内容相同且未删除的文档名；无则 None。"""
+    if not content_sha256:
+        return None
+    for name, meta in (load_metadata().get("documents") or {}).items():
+        if not isinstance(meta, dict) or meta.get("is_deleted"):
+            continue
+        if (meta.get("category") or "默认知识库") != category:
+            continue
+        if meta.get("content_sha256") == content_sha256:
+            return name
+    return None
+
+
+class _HashIndex:
+    """块正文哈希 → 向量位置、source_file → docstore id；只扫描上次之后新增的位置。"""
+
+    def __init__(self) -> None:
+        self.scanned = 0
+        self.last_id: Optional[str] = None
+        self.pos_by_hash: Dict[str, int] = {}
+        self.ids_by_file: Dict[str, List[str]] = {}
+
+    def matches(self, vector_db: Any) -> bool:
+        ids = vector_db.index_to_docstore_id
+        if len(ids) < self.scanned:
+            return False
+        return self.scanned == 0 or ids.get(self.scanned - 1) == self.last_id
+
+    def sync(self, vector_db: Any) -> None:
+        ids = vector_db.index_to_docstore_id
+        n = len(ids)
+        for pos in range(self.scanned, n):
+            doc_id = ids[pos]
+            doc = vector_db.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                continue
+            sf = doc.metadata.get("source_file")
+            if sf in ("system", None):
+                continue
+            self.ids_by_file.setdefault(sf, []).append(doc_id)
+            # 已墓碑的块同样可作向量来源：同一正文的向量相同
+            h = doc.metadata.get("content_hash") or chunk_content_hash(doc.page_content)
+            self.pos_by_hash.setdefault(h, pos)
+        if n > self.scanned:
+            self.scanned = n
+            self.last_id = ids[n - 1]
+
+
+_hash_index_lock = threading.Lock()
+_hash_indexes: "OrderedDict[str, _HashIndex]" = OrderedDict()
+
+
+def _hash_index_for(vector_db: Any) -> _HashIndex:
+    """按索引目录（TombstoneFAISS 载入时记下）取缓存的映射并补扫新位置；无目录的普通 FAISS 每次现建。"""
+    index_dir = getattr(vector_db, "_tomb_dir", None)
+    if not index_dir:
+        idx = _HashIndex()
+        idx.sync(vector_db)
+        return idx
+    key = os.path.abspath(index_dir)
+    with _hash_index_lock:
+        idx = _hash_indexes.get(key)
+        if idx is None or not idx.matches(vector_db):
+            idx = _HashIndex()
+            _hash_indexes[key] = idx
+        _hash_indexes.move_to_end(key)
+        while len(_hash_indexes) > _HASH_INDEX_MAX:
+            _hash_indexes.popitem(last=False)
+    idx.sync(vector_db)
+    return idx
+
+
+class ChunkVectorReuse:
+    """一次入库内的向量复用器：替代 vector_db.add_documents，并统计复用 / 新嵌入条数。"""
+
+    def __init__(self, vector_db: Any, source_file: str) -> None:
+        self.vector_db = vector_db
+        self.source_file = source_file
+        self.embedded = 0
+        self.reused = 0
+        self.last_replaced = 0
+        self._index = _hash_index_for(vector_db)
+        is_dead = getattr(vector_db, "is_dead", None)
+        self.replaced_ids: List[str] = [
+            i for i in self._index.ids_by_file.get(source_file, ()) if is_dead is None or not is_dead(i)
+        ]
+
+    def _reconstruct(self, h: str) -> Optional[List[float]]:
+        pos = self._index.pos_by_hash.get(h)
+        if pos is None:
+            return None
+        try:
+            return self.vector_db.index.reconstruct(pos).astype("float32").tolist()
+        except Exception:  # noqa: BLE001 — 不支持 reconstruct 的索引类型：退回重新嵌入
+            return None
+
+    def add_documents(self, docs: List[Document]) -> None:
+        fresh: List[Document] = []
+        reuse_pairs: List[tuple] = []
+        reuse_metas: List[dict] = []
+        for d in docs:
+            h = chunk_content_hash(d.page_content)
+            d.metadata["content_hash"] = h
+            vec = self._reconstruct(h)
+            if vec is None:
+                fresh.append(d)
+            else:
+                reuse_pairs.append((d.page_content, vec))
+                reuse_metas.append(d.metadata)
+        if fresh:
+            self.vector_db.add_documents(fresh)
+            self.embedded += len(fresh)
+        if reuse_pairs:
+            self.vector_db.add_embeddings(text_embeddings=reuse_pairs, metadatas=reuse_metas)
+            self.reused += len(reuse_pairs)
+        # 补扫本批新位置：同一文件内后续批次出现相同正文时也可复用，缓存随之与索引保持一致
+        self._index.sync(self.vector_db)
+
+    def drop_replaced(self) -> int:
+        """删除同名文件旧版本的块（仅在本次确有新块写入时调用）。
+
+        TombstoneFAISS 只打墓碑，随调用方紧接着的 save_local 落盘；普通 FAISS 物理删除。
+        """
+        if not self.replaced_ids:
+            return 0
+        mark_deleted = getattr(self.vector_db, "mark_deleted", None)
+        if mark_deleted is not None:
+            mark_deleted(self.replaced_ids)
+            from utils.faiss_tombstones import maybe_schedule_compaction
+            from utils.path_context import get_kb_dir
+
+            # 压缩线程需等调用方 save_local 释放写锁后才会执行
+            maybe_schedule_compaction(get_kb_dir(), self.vector_db)
+        else:
+            self.vector_db.delete(self.replaced_ids)
+        self.last_replaced = len(self.replaced_ids)
+        self.replaced_ids = []
+        return self.last_replaced
+
+    def stats(self, replaced: int) -> Dict[str, int]:
+        return {
+            "chunks_embedded": self.embedded,
+            "chunks_reused": self.reused,
+            "chunks_replaced": replaced,
+        }
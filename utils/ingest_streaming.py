@@ -3,18 +3,26 @@
 """
 from __future__ import annotations
 
+import dataclasses
 import gc
+import logging
 import os
-from typing import Generator, Iterable, List, Optional, Tuple
+import time
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
 
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from utils.bm25_tokens import remember_document_tokens
+from utils.chunk_ids import assign_chunk_uids
 from utils.document_parsers import detect_text_file_encoding  # noqa: F401 — 兼容旧引用 ins.detect_text_file_encoding
 from utils.path_context import get_kb_dir
 from utils.smart_chunker import CHINESE_SEPARATORS, SmartChunker
+from utils.text_sidecar import SidecarWriter
 from utils.web_system_settings import get_merged_chunk_levels
 
+logger = logging.getLogger(__name__)
+
 # 超过此字节数走流式路径（约 9～10 万汉字 UTF-8 量级，可按机器内存再调）
 STREAMING_MIN_BYTES = 280_000
 # 每段目标字符数（单段内做 Recursive 切分，避免整书进 smart_chunk 多层级）
@@ -253,24 +261,22 @@ def read_docx_sample(path: str, max_chars: int = 16000) -> str:
 
 
 def iter_segments_pdf_ocr(path: str, dpi: int = 200) -> Generator[str, None, None]:
-    """扫描版 PDF：按页渲染两层 OCR（本地 → 云端回退），按字数合并为段，避免一次性载入全书图像。"""
-    from pdf2image import convert_from_path
-
-    from utils.document_parsers import _ocr_image
+    """扫描版 PDF：分页 OCR 引擎按页序产出（本地并行、云端限并发回退），按字数合并为段，避免一次性载入全书图像。"""
+    from utils.ocr_cache import ocr_cache_path
+    from utils.pdf_ocr import iter_pdf_ocr_pages, log_ocr_summary
 
     n = pdf_page_count(path)
     if n <= 0:
         return
     buf: List[str] = []
     size = 0
-    for i in range(n):
-        imgs = convert_from_path(path, first_page=i + 1, last_page=i + 1, dpi=dpi, fmt="png")
-        try:
-            img = imgs[0]
-            page_text, _engine = _ocr_image(img)
-        finally:
-            del imgs
-        block = "第%d页：\n%s" % (i + 1, page_text)
+    pages = []
+    t0 = time.perf_counter()
+    for page in iter_pdf_ocr_pages(path, n, dpi=dpi, cache_path=ocr_cache_path()):
+        if page.engine == "failed":
+            raise RuntimeError("第%d页OCR失败: %s" % (page.page, page.error))
+        pages.append(dataclasses.replace(page, text=""))  # 只留耗时用于汇总
+        block = "第%d页：\n%s" % (page.page, page.text)
         buf.append(block)
         size += len(block)
         if size >= SEGMENT_CHAR_TARGET:
@@ -279,6 +285,20 @@ def iter_segments_pdf_ocr(path: str, dpi: int = 200) -> Generator[str, None, Non
             size = 0
     if buf:
         yield "\n\n".join(buf)
+    log_ocr_summary(os.path.basename(path), pages, time.perf_counter() - t0)
+
+
+def _sidecar_append_segment(sidecar: SidecarWriter, segment: str, chunks: List[Document]) -> None:
+    """段正文写入 sidecar，并按段内位置记下各块区间（与 split_segment_medium 一样先去首尾空白）。"""
+    text = segment.strip()
+    base = sidecar.append(text)
+    cursor = 0
+    for ch in chunks:
+        pos = text.find(ch.page_content, cursor)
+        if pos < 0:
+            continue
+        sidecar.add_chunk("medium", ch.metadata["chunk_index"], base + pos, base + pos + len(ch.page_content))
+        cursor = pos + 1
 
 
 def run_streaming_ingest(
@@ -288,20 +308,50 @@ def run_streaming_ingest(
     vector_db,
     file_size_bytes: int,
     summary_doc: Optional[Document],
+    dedup_stats: Optional[Dict[str, Any]] = None,
+    write_sidecar: bool = True,
+    abort_check: Optional[Callable[[], None]] = None,
 ) -> int:
     """
     消费文本段迭代器：切 medium chunk、分批 add_documents、周期性 save_local。
     返回写入的 chunk 条数（含可选 1 条 summary）。
+    write_sidecar 时各段正文同时写入纯文本 sidecar（见 utils.text_sidecar），入库成功才替换旧文件。
 
     全程持有 FAISS 写锁：大文件入库可达数分钟，期间同目录的删除/重置/另一入库
     必须等待，否则周期性 save_local 会互相覆盖索引。
+    写入经 ChunkVectorReuse：相同正文复用已有向量，同名旧版本的块在最后一并删除。
+    abort_check 在每批写入与每次 save_local 前调用，抛异常即中止（不再写盘）。
     """
     from utils.faiss_write_lock import faiss_write_lock
+    from utils.ingest_dedup import ChunkVectorReuse
 
-    with faiss_write_lock():
-        return _run_streaming_ingest_unlocked(
-            segment_iter, source_file, file_type, vector_db, file_size_bytes, summary_doc
-        )
+    sidecar = None
+    if write_sidecar:
+        try:
+            sidecar = SidecarWriter(source_file)
+        except OSError as e:
+            logger.warning("[Sidecar] 创建失败 %s: %s", source_file, e)
+
+    committed = False
+    try:
+        with faiss_write_lock():
+            reuse = ChunkVectorReuse(vector_db, source_file)
+            n = _run_streaming_ingest_unlocked(
+                segment_iter, source_file, file_type, vector_db, file_size_bytes, summary_doc, reuse, sidecar,
+                abort_check,
+            )
+            if dedup_stats is not None:
+                dedup_stats.update(reuse.stats(reuse.last_replaced))
+        if sidecar is not None and n > 0:
+            try:
+                sidecar.commit()
+                committed = True
+            except OSError as e:
+                logger.warning("[Sidecar] 写入失败 %s: %s", source_file, e)
+        return n
+    finally:
+        if sidecar is not None and not committed:
+            sidecar.abort()
 
 
 def _run_streaming_ingest_unlocked(
@@ -311,6 +361,9 @@ def _run_streaming_ingest_unlocked(
     vector_db,
     file_size_bytes: int,
     summary_doc: Optional[Document],
+    reuse: Any = None,
+    sidecar: Optional[SidecarWriter] = None,
+    abort_check: Optional[Callable[[], None]] = None,
 ) -> int:
     index_dir = os.path.join(get_kb_dir(), "faiss_index")
     os.makedirs(index_dir, exist_ok=True)
@@ -327,10 +380,19 @@ def _run_streaming_ingest_unlocked(
         nonlocal total, flushes_since_save
         if not docs:
             return
-        vector_db.add_documents(docs)
+        if abort_check is not None:
+            abort_check()
+        assign_chunk_uids(docs)
+        if reuse is not None:
+            reuse.add_documents(docs)
+        else:
+            vector_db.add_documents(docs)
+        remember_document_tokens(docs)
         total += len(docs)
         flushes_since_save += 1
         if flushes_since_save >= STREAM_SAVE_EVERY_FLUSHES:
+            if abort_check is not None:
+                abort_check()
             vector_db.save_local(index_dir)
             flushes_since_save = 0
         gc.collect()
@@ -343,6 +405,8 @@ def _run_streaming_ingest_unlocked(
             segment, source_file, file_type, seg_i, chunk_i, doc_length_factor
         )
         seg_i += 1
+        if sidecar is not None and chunks:
+            _sidecar_append_segment(sidecar, segment, chunks)
         for ch in chunks:
             pending.append(ch)
             if len(pending) >= EMBED_ADD_BATCH_SIZE:
@@ -353,6 +417,10 @@ def _run_streaming_ingest_unlocked(
     if pending:
         flush_batch(pending)
 
+    if abort_check is not None:
+        abort_check()
+    if reuse is not None and total > 0:
+        reuse.drop_replaced()
     vector_db.save_local(index_dir)
     return total
 
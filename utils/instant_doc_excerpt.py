@@ -1,9 +1,19 @@
-"""即时文档问答：轻量摘录检索（字符匹配打分），与向量库 RAG 完全独立。"""
+"""即时文档问答：轻量摘录检索（字符匹配打分），与向量库 RAG 完全独立。
+
+同一文档多轮提问时可先 ``build_instant_doc_index`` 预切块并建立字 n-gram 倒排（BM25 打分），
+之后每轮只按查询键查倒排，不再对全文重复切块与 ``str.count``。
+"""
 from __future__ import annotations
 
 import hashlib
+import math
 import re
-from typing import List, Tuple
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# BM25 参数：块长较均匀（约 720 字），b 取略低于常用的 0.75
+_BM25_K1 = 1.2
+_BM25_B = 0.6
 
 
 def _chunk_text(text: str, target: int = 720, stride: int = 360) -> List[str]:
@@ -63,27 +73,85 @@ def score_chunk(chunk: str, keys: List[str]) -> int:
     return score
 
 
+def _key_weight(key: str) -> int:
+    return 3 if len(key) >= 2 else 1
+
+
+class InstantDocIndex:
+    """
+    即时文档的预计算摘录索引：切块结果、块在原文中的位置，以及 1/2-gram → [(块序号, 词频)] 倒排。
+    查询键与 ``_query_keys`` 一致（2-gram 权重 3、单字权重 1），按 BM25 累加。
+    """
+
+    __slots__ = ("text", "chunks", "positions", "_postings", "_chunk_lens", "_avg_len")
+
+    def __init__(self, text: str) -> None:
+        self.text = (text or "").strip()
+        self.chunks: List[str] = _chunk_text(self.text) if self.text else []
+        self.positions: List[int] = [
+            self.text.find(ch) if ch in self.text else 10**9 for ch in self.chunks
+        ]
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for i, ch in enumerate(self.chunks):
+            grams = Counter(ch[j : j + 2] for j in range(len(ch) - 1))
+            grams.update(c for c in ch if c.strip())
+            for g, tf in grams.items():
+                postings.setdefault(g, []).append((i, tf))
+        self._postings = postings
+        self._chunk_lens = [len(ch) for ch in self.chunks]
+        self._avg_len = (sum(self._chunk_lens) / len(self.chunks)) if self.chunks else 1.0
+
+    def score_chunks(self, keys: List[str]) -> Dict[int, float]:
+        """返回 {块序号: 分数}，未命中任何键的块不出现。"""
+        n = len(self.chunks)
+        if not n or not keys:
+            return {}
+        scores: Dict[int, float] = {}
+        for key, qtf in Counter(keys).items():
+            plist = self._postings.get(key)
+            if not plist:
+                continue
+            idf = math.log(1.0 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            w = _key_weight(key) * qtf * idf
+            for i, tf in plist:
+                norm = _BM25_K1 * (1.0 - _BM25_B + _BM25_B * self._chunk_lens[i] / self._avg_len)
+                scores[i] = scores.get(i, 0.0) + w * tf * (_BM25_K1 + 1.0) / (tf + norm)
+        return scores
+
+
+def build_instant_doc_index(document_text: str) -> InstantDocIndex:
+    return InstantDocIndex(document_text)
+
+
 def select_excerpts(
     document_text: str,
     query: str,
     max_chars: int = 16_000,
     max_chunks: int = 14,
+    index: Optional[InstantDocIndex] = None,
 ) -> Tuple[str, List[str]]:
     """
     从全文选出与 query 最相关的若干片段拼接，控制总长度。
     若全文不超过 max_chars，直接返回全文与单块列表。
+    传入 index（同一文档预建）时走倒排 BM25 打分，否则按原字符计数打分。
     """
-    doc = document_text.strip()
+    doc = index.text if index is not None else document_text.strip()
     if not doc:
         return "", []
     if len(doc) <= max_chars:
         return doc, [doc]
 
     keys = _query_keys(query)
-    chunks = _chunk_text(doc)
-    scored: List[Tuple[int, int, str]] = []
-    for i, ch in enumerate(chunks):
-        scored.append((score_chunk(ch, keys), i, ch))
+    scored: List[Tuple[float, int, str]] = []
+    if index is not None:
+        chunks = index.chunks
+        hit = index.score_chunks(keys)
+        for i, ch in enumerate(chunks):
+            scored.append((hit.get(i, 0.0), i, ch))
+    else:
+        chunks = _chunk_text(doc)
+        for i, ch in enumerate(chunks):
+            scored.append((score_chunk(ch, keys), i, ch))
     scored.sort(key=lambda x: (-x[0], x[1]))
 
     picked: List[str] = []
@@ -110,10 +178,13 @@ def select_excerpts(
         return merged[:max_chars], [merged[:max_chars]]
 
     # 按在原文中出现顺序重排，便于模型阅读
-    merged_parts = sorted(
-        picked,
-        key=lambda t: document_text.find(t) if t in document_text else 10**9,
-    )
+    if index is not None:
+        merged_parts = [index.chunks[i] for i in sorted(used_idx, key=lambda i: index.positions[i])]
+    else:
+        merged_parts = sorted(
+            picked,
+            key=lambda t: document_text.find(t) if t in document_text else 10**9,
+        )
     out = "\n\n---\n\n".join(merged_parts)
     if len(out) > max_chars:
         out = out[:max_chars]
@@ -125,17 +196,18 @@ def select_excerpts_multi(
     queries: List[str],
     max_chars: int = 16_000,
     max_chunks_per_query: int = 8,
+    index: Optional[InstantDocIndex] = None,
 ) -> Tuple[str, List[str]]:
     """
     多子问分别选摘录，按内容去重后合并，控制总长。
     与 RAG 多子查询思路一致，避免一句多问时只命中第一个意图。
     """
-    doc = document_text.strip()
+    doc = index.text if index is not None else document_text.strip()
     qs = [q.strip() for q in queries if q.strip()][:5]
     if not doc:
         return "", []
     if len(qs) <= 1:
-        return select_excerpts(doc, qs[0] if qs else "", max_chars=max_chars)
+        return select_excerpts(doc, qs[0] if qs else "", max_chars=max_chars, index=index)
 
     per = max(2200, min(max_chars // len(qs) + 400, max_chars))
     seen_hash: set[str] = set()
@@ -146,6 +218,7 @@ def select_excerpts_multi(
             q,
             max_chars=min(per, max_chars),
             max_chunks=max_chunks_per_query,
+            index=index,
         )
         for p in parts:
             h = hashlib.md5(p.encode("utf-8", errors="ignore")).hexdigest()[:20]
@@ -0,0 +1,161 @@
+"""即时文档：服务端解析结果缓存（按内容哈希 + TTL），供 /api/chat/instant 以 doc_id 引用。
+
+背景：此前前端把最多 10 万字符的 document_text 随每轮对话回传，后端每轮再对全文切块打分。
+现解析后按正文 sha256 登记在进程内（按用户隔离），并预建摘录倒排索引；前端只需回传 doc_id。
+同一文件重复上传时按原始字节哈希直接命中，不再重复解析。
+
+条目过期（默认 1 小时无访问）或进程重启后 doc_id 失效，调用方应回退为携带 document_text 重新登记。
+环境变量：``RAG_INSTANT_DOC_TTL_SEC``、``RAG_INSTANT_DOC_CACHE_MAX``（全进程条目上限，LRU 淘汰）。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from utils.instant_doc_excerpt import InstantDocIndex, build_instant_doc_index
+
+
+def _ttl_sec() -> float:
+    try:
+        return max(60.0, float(os.environ.get("RAG_INSTANT_DOC_TTL_SEC", "3600")))
+    except ValueError:
+        return 3600.0
+
+
+def _max_entries() -> int:
+    try:
+        return max(4, int(os.environ.get("RAG_INSTANT_DOC_CACHE_MAX", "64")))
+    except ValueError:
+        return 64
+
+
+@dataclass
+class InstantDocEntry:
+    doc_id: str
+    user_id: int
+    file_name: str
+    text: str
+    index: InstantDocIndex
+    upload_sha256: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+
+
+_lock = threading.Lock()
+# (user_id, doc_id) → 条目；按最近访问排序，末尾最新
+_entries: "OrderedDict[Tuple[int, str], InstantDocEntry]" = OrderedDict()
+# (user_id, 原始上传字节 sha256) → doc_id
+_upload_alias: Dict[Tuple[int, str], str] = {}
+
+
+def instant_doc_id(text: str) -> str:
+    """正文内容哈希（前 32 位十六进制），同一正文恒得同一 doc_id。"""
+    return hashlib.sha256((text or "").strip().encode("utf-8", errors="ignore")).hexdigest()[:32]
+
+
+def upload_sha256(data: bytes) -> str:
+    return hashlib.sha256(data or b"").hexdigest()
+
+
+def _drop_locked(key: Tuple[int, str]) -> None:
+    ent = _entries.pop(key, None)
+    if ent is not None and ent.upload_sha256:
+        alias = (ent.user_id, ent.upload_sha256)
+        if _upload_alias.get(alias) == ent.doc_id:
+            _upload_alias.pop(alias, None)
+
+
+def _prune_locked(now: float) -> None:
+    ttl = _ttl_sec()
+    for key in [k for k, e in _entries.items() if now - e.last_access > ttl]:
+        _drop_locked(key)
+    cap = _max_entries()
+    while len(_entries) > cap:
+        _drop_locked(next(iter(_entries)))
+
+
+def put_instant_doc(
+    user_id: int,
+    text: str,
+    file_name: str,
+    *,
+    raw_sha256: Optional[str] = None,
+) -> InstantDocEntry:
+    """登记解析后的正文并预建摘录索引；同一用户同一正文重复登记时复用已有条目。"""
+    body = (text or "").strip()
+    doc_id = instant_doc_id(body)
+    key = (int(user_id), doc_id)
+    now = time.time()
+    with _lock:
+        ent = _entries.get(key)
+        if ent is not None:
+            ent.last_access = now
+            if file_name:
+                ent.file_name = file_name
+            _entries.move_to_end(key)
+            if raw_sha256:
+                ent.upload_sha256 = raw_sha256
+                _upload_alias[(key[0], raw_sha256)] = doc_id
+            return ent
+    # 建索引在锁外，避免大文档阻塞其他用户
+    idx = build_instant_doc_index(body)
+    ent = InstantDocEntry(
+        doc_id=doc_id,
+        user_id=key[0],
+        file_name=file_name,
+        text=body,
+        index=idx,
+        upload_sha256=raw_sha256,
+        created_at=now,
+        last_access=now,
+    )
+    with _lock:
+        _entries[key] = ent
+        _entries.move_to_end(key)
+        if raw_sha256:
+            _upload_alias[(key[0], raw_sha256)] = doc_id
+        _prune_locked(now)
+    return ent
+
+
+def get_instant_doc(user_id: int, doc_id: str) -> Optional[InstantDocEntry]:
+    """按 doc_id 取条目（滑动续期）；不存在或已过期返回 None。"""
+    did = (doc_id or "").strip().lower()
+    if not did:
+        return None
+    key = (int(user_id), did)
+    now = time.time()
+    with _lock:
+        ent = _entries.get(key)
+        if ent is None:
+            return None
+        if now - ent.last_access > _ttl_sec():
+            _drop_locked(key)
+            return None
+        ent.last_access = now
+        _entries.move_to_end(key)
+        return ent
+
+
+def get_instant_doc_by_upload(user_id: int, raw_sha256: str) -> Optional[InstantDocEntry]:
+    """同一用户重复上传同一文件（字节哈希一致）时直接复用已解析结果。"""
+    with _lock:
+        doc_id = _upload_alias.get((int(user_id), raw_sha256))
+    if not doc_id:
+        return None
+    return get_instant_doc(user_id, doc_id)
+
+
+def instant_doc_store_stats() -> Dict[str, Any]:
+    with _lock:
+        _prune_locked(time.time())
+        return {
+            "instant_doc_entries": len(_entries),
+            "instant_doc_chars": sum(len(e.text) for e in _entries.values()),
+            "instant_doc_cap": _max_entries(),
+        }
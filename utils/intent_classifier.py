@@ -11,6 +11,7 @@
 勿将二者合并或混用职责，以免路由与检索参数纠缠。
 """
 import re
+from functools import lru_cache
 from typing import Tuple, Optional
 
 
@@ -56,63 +57,73 @@ QUESTION_PATTERNS = [
 ]
 
 
-def classify_intent_lightweight(query: str) -> Optional[str]:
-    """
-    企业级策略：默认RAG，识别少数明确闲聊和系统问题
-    :param query: 用户查询
-    :return: "CHAT" 或 None（默认走RAG）
-    """
+# 极简问候语（单独出现，长度<=5）
+_SIMPLE_GREETINGS = frozenset(["你好", "hi", "hello", "嗨", "谢谢", "再见", "拜拜", "bye"])
+
+# 感谢、再见（单独出现，长度<=10）
+_POLITE_WORDS = frozenset(["谢谢你", "谢了", "多谢", "感谢", "再见了", "拜拜了"])
+
+# 关于系统本身的问题（不要检索文档），这些问题应该直接用LLM回答，而不是浪费资源检索文档
+_SYSTEM_QUESTIONS = (
+    # 身份相关
+    "你是谁", "你是什么", "你叫什么", "你的名字", "你叫啥", "你是哪个",
+    "介绍一下你", "介绍下你", "介绍自己", "自我介绍",
+
+    # 功能相关
+    "你能做什么", "你能干什么", "你会什么", "你有什么功能", "你可以做什么",
+    "你能帮我什么", "你能帮我做什么", "你有哪些功能", "功能有哪些",
+)
+
+# 使用相关的短语不能单独作为 CHAT 判据：
+# 「灭火器怎么使用」「怎么使用灭火器」是知识库问题，会被"怎么使用"子串误伤成闲聊（不检索）。
+# 只有同时出现系统指代词（你/系统/助手/平台/知识库…）才认为在问本系统的用法。
+_USAGE_PHRASES = ("怎么使用", "如何使用", "怎么用", "使用方法", "使用说明",
+                  "怎么问", "如何提问", "怎么提问")
+_SYSTEM_REFS = ("你", "系统", "助手", "平台", "知识库")
+
+# 三类子串合成一个正则，零宽前瞻逐位置匹配一次，得到命中的信号集合（命名组）。
+# 同一位置按 system → usage → ref 取第一个命中：被遮住的只可能是 usage/ref，而此时已有 system 命中，判定不变。
+_SIGNAL_RE = re.compile(
+    "(?=(?P<system>{})|(?P<usage>{})|(?P<ref>{}))".format(
+        *("|".join(map(re.escape, words)) for words in (_SYSTEM_QUESTIONS, _USAGE_PHRASES, _SYSTEM_REFS))
+    )
+)
+
+
+@lru_cache(maxsize=4096)
+def _lightweight_intent(query: str) -> Optional[str]:
     query_lower = query.lower().strip()
     query_zh = query.strip()
-    
+
     # 【优先识别】：避免浪费检索资源的问题
-    
-    # 1. 极简问候语（单独出现，长度<=5）
-    if len(query_zh) <= 5:
-        simple_greetings = ["你好", "hi", "hello", "嗨", "谢谢", "再见", "拜拜", "bye"]
-        for greeting in simple_greetings:
-            if query_lower == greeting or query_zh == greeting:
-                return "CHAT"
-    
-    # 2. 感谢、再见（单独出现）
-    if len(query_zh) <= 10:
-        polite_words = ["谢谢你", "谢了", "多谢", "感谢", "再见了", "拜拜了"]
-        for word in polite_words:
-            if query_zh == word or query_lower == word:
-                return "CHAT"
-    
-    # 3. 【关键新增】：关于系统本身的问题（不要检索文档）
-    # 这些问题应该直接用LLM回答，而不是浪费资源检索文档
-    system_questions = [
-        # 身份相关
-        "你是谁", "你是什么", "你叫什么", "你的名字", "你叫啥", "你是哪个",
-        "介绍一下你", "介绍下你", "介绍自己", "自我介绍",
-
-        # 功能相关
-        "你能做什么", "你能干什么", "你会什么", "你有什么功能", "你可以做什么",
-        "你能帮我什么", "你能帮我做什么", "你有哪些功能", "功能有哪些",
-    ]
-
-    # 使用相关的短语不能单独作为 CHAT 判据：
-    # 「灭火器怎么使用」「怎么使用灭火器」是知识库问题，会被"怎么使用"子串误伤成闲聊（不检索）。
-    # 只有同时出现系统指代词（你/系统/助手/平台/知识库…）才认为在问本系统的用法。
-    usage_phrases = ["怎么使用", "如何使用", "怎么用", "使用方法", "使用说明",
-                     "怎么问", "如何提问", "怎么提问"]
-    system_refs = ["你", "系统", "助手", "平台", "知识库"]
-
-    # 检查是否是系统问题（短问题，长度<30）
+    if len(query_zh) <= 5 and (query_lower in _SIMPLE_GREETINGS or query_zh in _SIMPLE_GREETINGS):
+        return "CHAT"
+    if len(query_zh) <= 10 and (query_lower in _POLITE_WORDS or query_zh in _POLITE_WORDS):
+        return "CHAT"
+
+    # 系统问题（短问题，长度<30）
     if len(query_zh) < 30:
-        for sq in system_questions:
-            if sq in query_zh:
-                return "CHAT"
-        for up in usage_phrases:
-            if up in query_zh and any(r in query_zh for r in system_refs):
+        signals = set()
+        for m in _SIGNAL_RE.finditer(query_zh):
+            if m.lastgroup == "system":
                 return "CHAT"
-    
+            signals.add(m.lastgroup)
+        if "usage" in signals and "ref" in signals:
+            return "CHAT"
+
     # 其他所有情况：默认走RAG流程
     return None  # 返回None，默认走RAG
 
 
+def classify_intent_lightweight(query: str) -> Optional[str]:
+    """
+    企业级策略：默认RAG，识别少数明确闲聊和系统问题（单遍预编译匹配，结果按查询文本缓存）
+    :param query: 用户查询
+    :return: "CHAT" 或 None（默认走RAG）
+    """
+    return _lightweight_intent(query)
+
+
 def classify_intent_with_llm(query: str, chat_history: list, llm_chain) -> Tuple[str, str]:
     """
     使用LLM判断意图（当轻量级方法无法确定时）
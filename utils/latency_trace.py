@@ -0,0 +1,148 @@
+"""
+对话轮次分阶段计时：一轮对话开一个 LatencyTrace，各阶段用 span(名称) 包起来累计毫秒数，
+结束时 finish() 把本轮各阶段耗时写入进程内的滑动样本，供管理端查看 p50 / p95 / p99。
+
+检索在 asyncio.to_thread 的工作线程里执行，深层函数（hybrid_search、父块扩展等）不便逐层传参，
+因此由 LatencyTrace.activate() 把本轮计时挂到 ContextVar 上，模块级 span() 记到当前计时；
+没有激活的计时（Streamlit 页面、评测脚本）时 span() 什么也不做。
+同一阶段在一轮内多次出现（多子问分别召回）时耗时累加。
+
+阶段名：
+  intent（意图分类）、rephrase（指代改写）、decompose（子问拆分）、query_classify（查询类型与检索参数）、
+  embed（查询向量化）、faiss_search（FAISS 搜索；非 LangChain FAISS 时含向量化）、
+  bm25_load（BM25 索引加载/重建）、bm25_score（BM25 打分与覆盖率门控）、fusion（归一化与 RRF 融合）、
+  kb_filter（知识库过滤）、rerank（重排序）、parent_expand（父块扩展与上下文拼装）、
+  retrieval（检索总耗时）、web_search（联网检索）、
+  ttft（自本轮开始至首个回答片段）、generate（大模型流式生成总耗时）、total（本轮总耗时）。
+
+样本按阶段保留最近 ``RAG_LATENCY_SAMPLES`` 个（默认 2048），只在本进程内，多 worker 部署时各自统计。
+"""
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+_current: ContextVar[Optional["LatencyTrace"]] = ContextVar("latency_trace", default=None)
+
+_lock = threading.Lock()
+_samples: Dict[str, Deque[float]] = {}
+_counts: Dict[str, int] = {}
+_since = time.time()
+
+
+def _max_samples() -> int:
+    raw = (os.environ.get("RAG_LATENCY_SAMPLES") or "").strip()
+    if not raw:
+        return 2048
+    try:
+        return max(16, min(100_000, int(raw)))
+    except ValueError:
+        return 2048
+
+
+class LatencyTrace:
+    """一轮对话的阶段耗时（毫秒，按阶段累加）。"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, ms: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def mark(self, stage: str) -> None:
+        """记录自本轮开始到此刻的耗时（如 ttft）；只记第一次。"""
+        with self._lock:
+            self.stages.setdefault(stage, (time.perf_counter() - self.started) * 1000.0)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - t0) * 1000.0)
+
+    @contextmanager
+    def activate(self) -> Iterator["LatencyTrace"]:
+        """在当前（同步）上下文中把本计时设为模块级 span() 的记录目标。"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {k: round(v, 1) for k, v in self.stages.items()}
+
+    def finish(self) -> Dict[str, float]:
+        """写入 total 并把本轮各阶段计入滑动样本；返回供 meta 事件使用的 stage_ms。"""
+        with self._lock:
+            self.stages["total"] = (time.perf_counter() - self.started) * 1000.0
+        out = self.as_dict()
+        record_stage_samples(out)
+        return out
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """计入当前激活的 LatencyTrace；未激活时直接执行。"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
+
+
+def record_stage_samples(stage_ms: Dict[str, float]) -> None:
+    cap = _max_samples()
+    with _lock:
+        for stage, ms in stage_ms.items():
+            buf = _samples.get(stage)
+            if buf is None or buf.maxlen != cap:
+                buf = deque(buf or (), maxlen=cap)
+                _samples[stage] = buf
+            buf.append(float(ms))
+            _counts[stage] = _counts.get(stage, 0) + 1
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    # 最近秩法：与样本中的某个实际值对应
+    idx = max(0, min(len(sorted_vals) - 1, math.ceil(q * len(sorted_vals)) - 1))
+    return sorted_vals[idx]
+
+
+def stage_latency_stats() -> Dict[str, Any]:
+    """各阶段最近样本的 p50 / p95 / p99 / 最大值（毫秒）与累计次数。"""
+    with _lock:
+        snap = {k: sorted(v) for k, v in _samples.items() if v}
+        counts = dict(_counts)
+    stages: Dict[str, Dict[str, Any]] = {}
+    for stage, vals in sorted(snap.items()):
+        stages[stage] = {
+            "count": counts.get(stage, len(vals)),
+            "samples": len(vals),
+            "p50_ms": round(_percentile(vals, 0.50), 1),
+            "p95_ms": round(_percentile(vals, 0.95), 1),
+            "p99_ms": round(_percentile(vals, 0.99), 1),
+            "max_ms": round(vals[-1], 1),
+        }
+    return {"since": _since, "window": _max_samples(), "stages": stages}
+
+
+def reset_stage_latency_stats() -> None:
+    global _since
+    with _lock:
+        _samples.clear()
+        _counts.clear()
+        _since = time.time()
@@ -57,11 +57,18 @@ def save_metadata(metadata: Dict):
     os.makedirs(kb, exist_ok=True)
     with open(_metadata_file(), "w", encoding="utf-8") as f:
         json.dump(metadata, f, ensure_ascii=False, indent=2)
+    uid = get_current_web_user_id()
+    if uid is not None:
+        # 管理端概览读物化汇总：随保存重算该用户一行，不再在请求内扫描全部元数据
+        from web_app.backend.analytics_aggregates import note_user_documents
+
+        note_user_documents(uid, metadata)
 
 
 def add_document_metadata(file_name: str, file_size: int, file_type: str, 
-                         category: str = "默认知识库", description: str = ""):
-    """添加文档元数据"""
+                         category: str = "默认知识库", description: str = "",
+                         content_sha256: Optional[str] = None):
+    """添加文档元数据（content_sha256 为原文件字节哈希，供入库去重）"""
     metadata = load_metadata()
     if "documents" not in metadata:
         metadata["documents"] = {}
@@ -77,6 +84,8 @@ def add_document_metadata(file_name: str, file_size: int, file_type: str,
         "update_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "chunks_count": 0
     }
+    if content_sha256:
+        metadata["documents"][file_name]["content_sha256"] = content_sha256
     
     # 确保分类存在
     if "categories" not in metadata:
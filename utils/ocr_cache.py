@@ -0,0 +1,133 @@
+"""
+OCR 结果缓存（每个知识库一份，ocr_cache.sqlite3）：同一扫描件重传、「查看内容」、全文子串检索
+反复解析时，按渲染后页图像的内容摘要直接取回文本，不再跑 Tesseract，也不重复调用付费的云端 OCR。
+
+键为 (页图像 sha256, dpi, OCR 模式, 云端模型)；值为文本、引擎（tesseract|cloud）与本地平均置信度。
+命中时按当前配置复核：fallback/always 下缓存的是本地结果、而现在应走云端（阈值调高、
+当时云端失败等）则视为未命中，重新识别。
+
+环境变量 ``RAG_OCR_CACHE=0`` 关闭缓存。写缓存失败只记日志，不影响识别结果。
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+from utils.path_context import get_kb_dir
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_FILENAME = "ocr_cache.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    image_sha256 TEXT NOT NULL,
+    dpi INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (image_sha256, dpi, mode, model)
+);
+"""
+
+
+def ocr_cache_enabled() -> bool:
+    return (os.environ.get("RAG_OCR_CACHE") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def ocr_cache_path(kb_dir: Optional[str] = None) -> Optional[str]:
+    """当前知识库的缓存库路径；缓存关闭时返回 None（调用方据此跳过）。"""
+    if not ocr_cache_enabled():
+        return None
+    return os.path.join(kb_dir or get_kb_dir(), OCR_CACHE_FILENAME)
+
+
+def image_digest(img) -> str:
+    """页图像内容摘要：模式、尺寸与像素字节（与 PNG 编码参数无关）。"""
+    h = hashlib.sha256()
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode("ascii"))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def _model_key(cfg: Dict) -> str:
+    # 仅本地模式与云端模型无关，避免切换模型后本地结果失效
+    return "" if cfg["mode"] == "off" else str(cfg.get("model") or "")
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def lookup_ocr(path: Optional[str], digest: str, dpi: int, cfg: Dict) -> Optional[Tuple[str, str, float]]:
+    """命中返回 (文本, 引擎, 置信度)；未命中、缓存关闭或按当前配置需要重新识别时返回 None。"""
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        conn = _connect(path)
+        try:
+            row = conn.execute(
+                """
+                SELECT text, engine, confidence FROM ocr_cache
+                WHERE image_sha256 = ? AND dpi = ? AND mode = ? AND model = ?
+                """,
+                (digest, int(dpi), cfg["mode"], _model_key(cfg)),
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.debug("[OCR] 读缓存失败 %s: %s", path, e)
+        return None
+    if row is None:
+        return None
+    text, engine, conf = row[0], row[1], float(row[2])
+    if engine == "tesseract":
+        from utils.document_parsers import _ocr_needs_cloud
+
+        if _ocr_needs_cloud(cfg, text, conf, None):
+            return None
+    return text, engine, conf
+
+
+def store_ocr(
+    path: Optional[str],
+    digest: str,
+    dpi: int,
+    cfg: Dict,
+    text: str,
+    engine: str,
+    confidence: float,
+) -> None:
+    if not path or engine not in ("tesseract", "cloud"):
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = _connect(path)
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, int(dpi), cfg["mode"], _model_key(cfg), text, engine, float(confidence), time.time()),
+            )
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[OCR] 写缓存失败 %s: %s", path, e)
+
+
+def clear_ocr_cache(kb_dir: Optional[str] = None) -> None:
+    path = os.path.join(kb_dir or get_kb_dir(), OCR_CACHE_FILENAME)
+    for p in (path, path + "-wal", path + "-shm"):
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,220 @@
+"""
+层级块父文本库（embed-once 入库模式）：只对“检索层级”做 embedding 写入 FAISS，
+其余层级（默认不启用；如 RAG_EMBED_LEVELS=small,summary 时的 medium/large）仅以正文 + 元数据
+存入知识库目录下的 SQLite（parent_chunks.sqlite3），由 parent_document_retrieval 按 parent_chunk_id 取回。
+
+环境变量 ``RAG_EMBED_LEVELS``：逗号分隔的需嵌入层级，默认 small,medium,large,summary（全部嵌入，与旧行为一致）。
+至少保留一个 small/medium/large 层级，配置非法时回退默认。
+
+实验性：非默认取值对召回的影响尚未评测（评测方法见 scripts/build_eval_kb_20260815.py 的 --embed-levels
+与 scripts/eval_retrieval.py），生产环境保持默认；启用时每个进程记一次警告日志。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from utils.path_context import get_kb_dir
+
+logger = logging.getLogger(__name__)
+
+PARENT_STORE_FILENAME = "parent_chunks.sqlite3"
+ALL_CHUNK_LEVELS = ("small", "medium", "large", "summary")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parent_chunks (
+    source_file TEXT NOT NULL,
+    chunk_level TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata_json TEXT NOT NULL,
+    PRIMARY KEY (source_file, chunk_level, chunk_index)
+);
+CREATE INDEX IF NOT EXISTS idx_parent_chunks_id ON parent_chunks (source_file, chunk_id);
+"""
+
+_experimental_warned = False
+
+
+def embed_levels() -> Tuple[str, ...]:
+    global _experimental_warned
+    raw = (os.environ.get("RAG_EMBED_LEVELS") or "").strip()
+    if not raw:
+        return ALL_CHUNK_LEVELS
+    picked = tuple(x for x in (p.strip().lower() for p in raw.split(",")) if x in ALL_CHUNK_LEVELS)
+    if not any(lv in picked for lv in ("small", "medium", "large")):
+        return ALL_CHUNK_LEVELS
+    if set(picked) != set(ALL_CHUNK_LEVELS) and not _experimental_warned:
+        _experimental_warned = True
+        logger.warning("RAG_EMBED_LEVELS=%s 为实验性配置（召回影响未经评测），仅嵌入 %s", raw, ",".join(picked))
+    return picked
+
+
+def split_chunks_for_embedding(chunks: List[Document]) -> Tuple[List[Document], List[Document]]:
+    """按 RAG_EMBED_LEVELS 拆成 (需嵌入写入 FAISS 的块, 仅存父文本库的块)。"""
+    levels = set(embed_levels())
+    to_embed: List[Document] = []
+    text_only: List[Document] = []
+    for c in chunks:
+        if c.metadata.get("chunk_level", "medium") in levels:
+            to_embed.append(c)
+        else:
+            text_only.append(c)
+    return to_embed, text_only
+
+
+def parent_store_path(kb_dir: Optional[str] = None) -> str:
+    return os.path.join(kb_dir or get_kb_dir(), PARENT_STORE_FILENAME)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _to_document(content: str, metadata_json: str) -> Document:
+    try:
+        meta = json.loads(metadata_json or "{}")
+    except (TypeError, ValueError):
+        meta = {}
+    meta["from_parent_store"] = True
+    return Document(page_content=content, metadata=meta)
+
+
+def replace_parent_chunks(source_file: str, chunks: Iterable[Document], kb_dir: Optional[str] = None) -> int:
+    """整体替换某文件的父文本块（同名重传时旧版本一并清除），返回写入条数。"""
+    rows = [
+        (
+            source_file,
+            str(c.metadata.get("chunk_level", "")),
+            int(c.metadata.get("chunk_index", i)),
+            str(c.metadata.get("chunk_id", "")),
+            c.page_content,
+            json.dumps(c.metadata, ensure_ascii=False, default=str),
+        )
+        for i, c in enumerate(chunks)
+    ]
+    path = parent_store_path(kb_dir)
+    if not rows and not os.path.isfile(path):
+        return 0
+    conn = _connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM parent_chunks WHERE source_file = ?", (source_file,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO parent_chunks VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def delete_parent_chunks(source_file: str, kb_dir: Optional[str] = None) -> int:
+    path = parent_store_path(kb_dir)
+    if not os.path.isfile(path):
+        return 0
+    conn = _connect(path)
+    try:
+        return conn.execute("DELETE FROM parent_chunks WHERE source_file = ?", (source_file,)).rowcount
+    finally:
+        conn.close()
+
+
+def clear_parent_store(kb_dir: Optional[str] = None) -> None:
+    path = parent_store_path(kb_dir)
+    for p in (path, path + "-wal", path + "-shm"):
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+
+
+class ParentChunkReader:
+    """
+    父文本库只读连接，供一次检索内的多次取父块复用（避免每次查找都新建连接、执行建表脚本）。
+    首次查询时才打开；库文件不存在时所有查询返回 None。可作上下文管理器使用。
+    """
+
+    def __init__(self, kb_dir: Optional[str] = None) -> None:
+        self.path = parent_store_path(kb_dir)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._opened = False
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self._opened:
+            self._opened = True
+            # 库文件只由 _connect 创建，存在即已建表；WAL 模式持久记录在库文件中
+            if os.path.isfile(self.path):
+                self._conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+        return self._conn
+
+    def get(
+        self,
+        source_file: str,
+        chunk_level: str,
+        chunk_index: Optional[int] = None,
+        chunk_id: Optional[str] = None,
+    ) -> Optional[Document]:
+        """按 (source_file, 层级, chunk_index) 取父块并校验 chunk_id；无下标时按 chunk_id 取。未命中返回 None。"""
+        if not source_file:
+            return None
+        conn = self._connection()
+        if conn is None:
+            return None
+        row = None
+        if chunk_index is not None:
+            row = conn.execute(
+                """
+                SELECT chunk_id, content, metadata_json FROM parent_chunks
+                WHERE source_file = ? AND chunk_level = ? AND chunk_index = ?
+                """,
+                (source_file, chunk_level, int(chunk_index)),
+            ).fetchone()
+            if row is not None and chunk_id and row[0] != chunk_id:
+                row = None
+        if row is None and chunk_id:
+            row = conn.execute(
+                """
+                SELECT chunk_id, content, metadata_json FROM parent_chunks
+                WHERE source_file = ? AND chunk_id = ? AND chunk_level = ?
+                ORDER BY chunk_index LIMIT 1
+                """,
+                (source_file, chunk_id, chunk_level),
+            ).fetchone()
+        return _to_document(row[1], row[2]) if row else None
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "ParentChunkReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def get_parent_chunk(
+    source_file: str,
+    chunk_level: str,
+    chunk_index: Optional[int] = None,
+    chunk_id: Optional[str] = None,
+    kb_dir: Optional[str] = None,
+) -> Optional[Document]:
+    """单次取父块（见 ParentChunkReader.get）；同一次检索内多次查找请复用 ParentChunkReader。"""
+    with ParentChunkReader(kb_dir) as reader:
+        return reader.get(source_file, chunk_level, chunk_index, chunk_id)
@@ -2,18 +2,44 @@
 """
 Parent-Document Retrieval（检索与读取分离）
 解决颗粒度悖论：检索时用精确的小chunk，读取时扩展为完整的上下文
+
+父块按 parent_chunk_id 优先从父文本库（utils.parent_chunk_store，embed-once 模式下未嵌入的层级）取回，
+跨级扩展（small → large）沿 small → medium → large 的父链逐级查找；未命中再回退为向量检索查找。
+一次 expand_retrieved_chunks 调用内复用同一个父文本库连接。
 """
 import logging
 from typing import List, Tuple, Optional
 from langchain_core.documents import Document
 
+from utils.parent_chunk_store import ParentChunkReader
+
 logger = logging.getLogger(__name__)
 
+_LEVEL_HIERARCHY = {"small": 0, "medium": 1, "large": 2, "summary": 3}
+
+
+def _parent_from_store(chunk: Document, source_file: str, expand_to_level: str, reader) -> Optional[Document]:
+    """沿 parent_chunk_level/parent_chunk_id 父链逐级向上取，直到目标层级；中途缺失返回 None。"""
+    target = _LEVEL_HIERARCHY.get(expand_to_level, 1)
+    meta = chunk.metadata
+    current = _LEVEL_HIERARCHY.get(meta.get("chunk_level", "medium"), 1)
+    while True:
+        parent_level = meta.get("parent_chunk_level")
+        rank = _LEVEL_HIERARCHY.get(parent_level, -1)
+        # 父链层级必须严格上升且不越过目标层级
+        if rank <= current or rank > target:
+            return None
+        parent = reader.get(source_file, parent_level, meta.get("parent_chunk_index"), meta.get("parent_chunk_id"))
+        if parent is None or rank == target:
+            return parent
+        meta, current = parent.metadata, rank
+
 
 def expand_chunk_to_parent(
     chunk: Document,
     vector_db,
-    expand_to_level: str = "medium"
+    expand_to_level: str = "medium",
+    parent_store=None,
 ) -> Optional[Document]:
     """
     将检索到的小chunk扩展为其父级chunk
@@ -21,6 +47,7 @@ def expand_chunk_to_parent(
     :param chunk: 检索到的chunk（通常是small）
     :param vector_db: 向量数据库
     :param expand_to_level: 扩展到的层级（medium 或 large）
+    :param parent_store: 复用的 ParentChunkReader；为 None 时本次调用内自行打开并关闭
     :return: 父级chunk，如果找不到则返回None
     """
     source_file = chunk.metadata.get("source_file")
@@ -30,10 +57,23 @@ def expand_chunk_to_parent(
         return None
     
     # 如果已经是目标层级或更高层级，不需要扩展
-    level_hierarchy = {"small": 0, "medium": 1, "large": 2, "summary": 3}
-    if level_hierarchy.get(chunk_level, 1) >= level_hierarchy.get(expand_to_level, 1):
+    if _LEVEL_HIERARCHY.get(chunk_level, 1) >= _LEVEL_HIERARCHY.get(expand_to_level, 1):
         return None
     
+    if chunk.metadata.get("parent_chunk_level"):
+        reader = parent_store
+        try:
+            if reader is None:
+                reader = ParentChunkReader()
+            parent = _parent_from_store(chunk, source_file, expand_to_level, reader)
+            if parent is not None:
+                return parent
+        except Exception as e:  # noqa: BLE001 — 父文本库不可用时回退向量查找
+            logger.warning("[ParentDoc] 父文本库读取失败: %s", e)
+        finally:
+            if parent_store is None and reader is not None:
+                reader.close()
+    
     try:
         # 从向量数据库中查找同一文件的父级chunk
         # 使用chunk的部分内容作为查询
@@ -135,7 +175,8 @@ def expand_retrieved_chunks(
     retrieved_chunks: List[Tuple[Document, float]],
     vector_db,
     expansion_strategy: str = "parent",
-    expand_to_level: str = "medium"
+    expand_to_level: str = "medium",
+    parent_store=None,
 ) -> List[Tuple[Document, float]]:
     """
     扩展检索到的chunks，解决颗粒度悖论
@@ -148,11 +189,18 @@ def expand_retrieved_chunks(
         - "both": 先尝试父级，失败则使用相邻
         - "none": 不扩展
     :param expand_to_level: 扩展到哪个层级（仅用于parent策略）
+    :param parent_store: 复用的 ParentChunkReader；为 None 时本次调用内打开一个并在结束时关闭
     :return: 扩展后的chunks [(doc, score), ...]
     """
     if expansion_strategy == "none":
         return retrieved_chunks
     
+    if parent_store is None:
+        with ParentChunkReader() as reader:
+            return expand_retrieved_chunks(
+                retrieved_chunks, vector_db, expansion_strategy, expand_to_level, parent_store=reader
+            )
+    
     expanded_results = []
     
     for chunk, score in retrieved_chunks:
@@ -161,7 +209,7 @@ def expand_retrieved_chunks(
         # 决定扩展策略
         if expansion_strategy == "parent" or expansion_strategy == "both":
             # 尝试扩展到父级
-            parent_chunk = expand_chunk_to_parent(chunk, vector_db, expand_to_level)
+            parent_chunk = expand_chunk_to_parent(chunk, vector_db, expand_to_level, parent_store=parent_store)
             if parent_chunk:
                 # 使用父级chunk，保持原始分数
                 expanded_results.append((parent_chunk, score))
@@ -5,8 +5,9 @@
 from __future__ import annotations
 
 import os
+from contextlib import contextmanager
 from contextvars import ContextVar, Token
-from typing import Optional
+from typing import Iterator, Optional
 
 _kb_dir_var: ContextVar[Optional[str]] = ContextVar("kb_dir", default=None)
 _use_web_server_api_config: ContextVar[bool] = ContextVar("use_web_server_api_config", default=False)
@@ -43,6 +44,16 @@ def set_user_kb_context(user_id: int) -> tuple[Token, Token]:
     return t_kb, t_api
 
 
+@contextmanager
+def kb_dir_context(kb_dir: str) -> Iterator[None]:
+    """在给定知识库目录下执行（如解析子进程内恢复父进程的知识库上下文）。"""
+    t_kb = _kb_dir_var.set(kb_dir)
+    try:
+        yield
+    finally:
+        _kb_dir_var.reset(t_kb)
+
+
 def reset_kb_context(t_kb: Token, t_api: Token) -> None:
     _kb_dir_var.reset(t_kb)
     _use_web_server_api_config.reset(t_api)
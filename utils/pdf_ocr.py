@@ -0,0 +1,313 @@
+"""
+扫描版 PDF 分页 OCR 引擎：逐页延迟渲染，本地 Tesseract 并行，云端回退限并发，按页序产出。
+
+- 渲染 + Tesseract 在进程池中执行（``RAG_OCR_PROCESSES``，默认 CPU 核数，上限 16；
+  设为 0 时改用进程内线程，Tesseract/pdftoppm 本身是外部进程，线程也能并行）。
+  当前进程本身是子进程（如 ``RAG_INGEST_PARSE_PROCESSES`` 的解析工作进程）时不再派生 OCR 进程池，
+  只用线程，且线程数按解析进程数均分（见 share_ocr_workers），整机 Tesseract 并行度不随解析进程数翻倍。
+  页图像只存在于工作进程内，主进程只拿回文本；需要走云端的页才回传 PNG 字节。
+- 云端回退（DeepSeek-OCR 等）在线程池中并发，上限 ``RAG_OCR_CLOUD_CONCURRENCY``（默认 4）。
+- 同时在途的页数不超过 2 × 工作数，内存与页数无关；结果按页序产出，每页带渲染/本地/云端耗时。
+- 传入 cache_path 时按渲染后页图像摘要查 OCR 缓存（utils/ocr_cache），命中页不跑 Tesseract 与云端。
+"""
+from __future__ import annotations
+
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set
+
+from utils import document_parsers as dp
+from utils.ocr_cache import image_digest, lookup_ocr, store_ocr
+
+logger = logging.getLogger(__name__)
+
+_ocr_pool: "ProcessPoolExecutor | None" = None
+_ocr_pool_size = 0
+_ocr_pool_lock = threading.Lock()
+# 与本进程并列做 OCR 的进程数（解析进程池的工作进程由父进程经 share_ocr_workers 设置）
+_sibling_processes = 1
+
+
+def _ocr_process_count() -> int:
+    default = os.cpu_count() or 1
+    try:
+        n = int(os.environ.get("RAG_OCR_PROCESSES", str(default)))
+    except ValueError:
+        n = default
+    return max(0, min(n, 16))
+
+
+def share_ocr_workers(processes: int) -> None:
+    """解析进程池工作进程的初始化函数：本机 OCR 并行度由 processes 个工作进程均分。"""
+    global _sibling_processes
+    _sibling_processes = max(1, int(processes))
+
+
+def _thread_worker_count(n: int) -> int:
+    """不用进程池时的本地 OCR 线程数：RAG_OCR_PROCESSES（为 0 时取 CPU 核数）按并列进程数均分。"""
+    return max(1, (n or (os.cpu_count() or 1)) // _sibling_processes)
+
+
+def _cloud_concurrency() -> int:
+    try:
+        return max(1, min(int(os.environ.get("RAG_OCR_CLOUD_CONCURRENCY", "4")), 16))
+    except ValueError:
+        return 4
+
+
+@dataclass
+class OcrPage:
+    page: int  # 从 1 开始
+    text: str = ""
+    engine: str = "failed"  # tesseract | cloud | failed
+    error: str = ""
+    render_ms: float = 0.0
+    tesseract_ms: float = 0.0
+    cloud_ms: float = 0.0
+    cached: bool = False
+
+    @property
+    def total_ms(self) -> float:
+        return self.render_ms + self.tesseract_ms + self.cloud_ms
+
+
+def _render_page(path: str, page_no: int, dpi: int):
+    from pdf2image import convert_from_path
+
+    imgs = convert_from_path(path, first_page=page_no, last_page=page_no, dpi=dpi, fmt="png")
+    if not imgs:
+        raise ValueError("第%d页渲染失败" % page_no)
+    return imgs[0]
+
+
+def _ocr_page_local(path: str, page_no: int, dpi: int, cfg: Dict, cache_path: Optional[str] = None) -> Dict:
+    """渲染单页并跑本地 Tesseract（工作进程/线程内执行）。缓存命中时直接返回；需要云端时附带 PNG 字节。"""
+    raw: Dict = {"page": page_no, "rendered": False, "text": "", "conf": 0.0, "error": "", "image": None,
+                 "dpi": dpi, "render_ms": 0.0, "tesseract_ms": 0.0, "digest": "", "cached_engine": ""}
+    t0 = time.perf_counter()
+    try:
+        img = _render_page(path, page_no, dpi)
+    except Exception as e:  # noqa: BLE001 — 渲染失败记为该页失败
+        raw["error"] = str(e)
+        raw["render_ms"] = (time.perf_counter() - t0) * 1000
+        return raw
+    t1 = time.perf_counter()
+    raw["rendered"] = True
+    raw["render_ms"] = (t1 - t0) * 1000
+    if cache_path:
+        raw["digest"] = image_digest(img)
+        hit = lookup_ocr(cache_path, raw["digest"], dpi, cfg)
+        if hit is not None:
+            raw["text"], raw["cached_engine"], raw["conf"] = hit
+            return raw
+        t1 = time.perf_counter()
+    tess_err = None
+    try:
+        raw["text"], raw["conf"] = dp._tesseract_text_and_conf(img)
+    except Exception as e:  # noqa: BLE001 — 本地失败时仍可能走云端
+        tess_err = e
+        raw["error"] = str(e)
+    raw["tesseract_ms"] = (time.perf_counter() - t1) * 1000
+    if dp._ocr_needs_cloud(cfg, raw["text"], raw["conf"], tess_err):
+        with io.BytesIO() as buf:
+            img.save(buf, format="PNG")
+            raw["image"] = buf.getvalue()
+    return raw
+
+
+def _finish_page(raw: Dict, cfg: Dict, cache_path: Optional[str] = None) -> OcrPage:
+    """合并本地结果与云端回退（云端线程池内执行），得到最终页结果并写回缓存。"""
+    page = OcrPage(page=raw["page"], render_ms=raw["render_ms"], tesseract_ms=raw["tesseract_ms"])
+    if not raw["rendered"]:
+        page.error = raw["error"]
+        return page
+    if raw["cached_engine"]:
+        page.text, page.engine, page.cached = raw["text"], raw["cached_engine"], True
+        return page
+    tess_err = RuntimeError(raw["error"]) if raw["error"] else None
+    image = raw["image"]
+
+    def cloud_text() -> str:
+        t0 = time.perf_counter()
+        try:
+            return dp._build_cloud_ocr(cfg).extract_text(image)
+        finally:
+            page.cloud_ms = (time.perf_counter() - t0) * 1000
+
+    try:
+        page.text, page.engine = dp._resolve_ocr_result(cfg, raw["text"], raw["conf"], tess_err, cloud_text)
+    except Exception as e:  # noqa: BLE001 — 单页失败不应毁掉整篇
+        page.error = str(e)
+        return page
+    if raw["digest"]:
+        store_ocr(cache_path, raw["digest"], raw["dpi"], cfg, page.text, page.engine, raw["conf"])
+    return page
+
+
+def _get_ocr_pool(n: int) -> "ProcessPoolExecutor | None":
+    global _ocr_pool, _ocr_pool_size
+    # ProcessPoolExecutor 的工作进程并非 daemon，须按是否有父进程判断
+    if n <= 0 or multiprocessing.parent_process() is not None:
+        return None
+    with _ocr_pool_lock:
+        if _ocr_pool is None or _ocr_pool_size != n:
+            if _ocr_pool is not None:
+                _ocr_pool.shutdown(wait=False)
+            try:
+                _ocr_pool = ProcessPoolExecutor(max_workers=n, mp_context=multiprocessing.get_context("spawn"))
+                _ocr_pool_size = n
+            except Exception as e:  # noqa: BLE001 — 无法建进程池时退回线程
+                logger.warning("[OCR] 进程池创建失败，改用线程: %s", e)
+                _ocr_pool, _ocr_pool_size = None, 0
+        return _ocr_pool
+
+
+def _drop_ocr_pool(broken: ProcessPoolExecutor) -> None:
+    global _ocr_pool, _ocr_pool_size
+    with _ocr_pool_lock:
+        if _ocr_pool is broken:
+            _ocr_pool, _ocr_pool_size = None, 0
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_ocr_pool() -> None:
+    global _ocr_pool, _ocr_pool_size
+    with _ocr_pool_lock:
+        pool, _ocr_pool, _ocr_pool_size = _ocr_pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_pdf_ocr_pages(
+    path: str,
+    page_count: int,
+    dpi: int = 300,
+    cache_path: Optional[str] = None,
+) -> Iterator[OcrPage]:
+    """按页序产出 OCR 结果；单页失败以 engine="failed" 产出，不中断整篇。"""
+    if page_count <= 0:
+        return
+    cfg = dp._ocr_cloud_cfg()
+    # 工作进程只需判定是否走云端与缓存键，不下发 api_key 等
+    local_cfg = {"mode": cfg["mode"], "conf_threshold": cfg["conf_threshold"], "model": cfg["model"]}
+    workers = _ocr_process_count()
+    pool = _get_ocr_pool(workers)
+    if pool is None:
+        workers = _thread_worker_count(workers)
+    own_threads: List[ThreadPoolExecutor] = []
+    local = [pool]  # 当前本地执行器；进程池损坏时换成进程内线程池
+    local_lock = threading.Lock()
+
+    def fall_back_to_threads(failed) -> "ThreadPoolExecutor | ProcessPoolExecutor":
+        with local_lock:
+            if local[0] is failed:
+                if failed is not None:
+                    logger.warning("[OCR] 进程池不可用，本篇剩余页改用线程")
+                    _drop_ocr_pool(failed)
+                own_threads.append(ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-local"))
+                local[0] = own_threads[-1]
+            return local[0]
+
+    if pool is None:
+        fall_back_to_threads(None)
+    cloud_pool = ThreadPoolExecutor(max_workers=_cloud_concurrency(), thread_name_prefix="ocr-cloud")
+    window = max(2, 2 * workers)
+    pending: Dict[int, Future] = {}
+    in_flight: Set[Future] = set()  # 仅保留未完成的本地任务，便于关闭时取消（已完成的不再持有页数据）
+
+    def submit(page_no: int) -> None:
+        done: Future = Future()
+
+        def settle(f: Future) -> None:
+            if f.cancelled():
+                return
+            err = f.exception()
+            done.set_result(f.result() if err is None else OcrPage(page=page_no, error=str(err)))
+
+        def run_local() -> None:
+            ex = local[0]
+            try:
+                fut = ex.submit(_ocr_page_local, path, page_no, dpi, local_cfg, cache_path)
+            except BrokenProcessPool:
+                ex = fall_back_to_threads(ex)
+                fut = ex.submit(_ocr_page_local, path, page_no, dpi, local_cfg, cache_path)
+            in_flight.add(fut)
+            fut.add_done_callback(lambda f: on_local(f, ex))
+
+        def on_local(f: Future, ex) -> None:
+            in_flight.discard(f)
+            if f.cancelled():
+                return
+            if isinstance(f.exception(), BrokenProcessPool):
+                # 工作进程异常退出：该页改在线程中重跑
+                fall_back_to_threads(ex)
+                try:
+                    run_local()
+                except RuntimeError as e:  # 迭代已结束、线程池已关闭
+                    done.set_result(OcrPage(page=page_no, error=str(e)))
+                return
+            if f.exception() is not None:
+                settle(f)
+                return
+            raw = f.result()
+            if raw["image"] is None:
+                done.set_result(_finish_page(raw, cfg, cache_path))
+                return
+            try:
+                cloud_pool.submit(_finish_page, raw, cfg, cache_path).add_done_callback(settle)
+            except RuntimeError as e:  # 迭代已结束、云端线程池已关闭
+                done.set_result(OcrPage(page=page_no, error=str(e)))
+
+        pending[page_no] = done
+        run_local()
+
+    next_page = 1
+    try:
+        for want in range(1, page_count + 1):
+            while next_page <= page_count and next_page < want + window:
+                submit(next_page)
+                next_page += 1
+            page = pending.pop(want).result()
+            if page.engine == "failed":
+                logger.warning("第%d页OCR失败: %s", page.page, page.error)
+            logger.debug(
+                "[OCR] 第%d页 %s：渲染 %.0fms，本地 %.0fms，云端 %.0fms",
+                page.page, page.engine, page.render_ms, page.tesseract_ms, page.cloud_ms,
+            )
+            yield page
+    finally:
+        for f in list(in_flight):
+            f.cancel()
+        cloud_pool.shutdown(wait=False, cancel_futures=True)
+        for t in own_threads:
+            t.shutdown(wait=False, cancel_futures=True)
+
+
+def log_ocr_summary(original_name: str, pages: List[OcrPage], wall_s: float) -> None:
+    """汇总每页耗时：总墙钟、逐页累计、最慢页与云端页数。"""
+    if not pages:
+        return
+    slowest = max(pages, key=lambda p: p.total_ms)
+    logger.info(
+        "[Parser] PDF OCR 完成：%s 共 %d 页，缓存命中 %d 页，云端 %d 页，失败 %d 页；墙钟 %.1fs，逐页累计 %.1fs"
+        "（渲染 %.1fs / 本地 %.1fs / 云端 %.1fs），最慢第%d页 %.0fms",
+        original_name,
+        len(pages),
+        sum(p.cached for p in pages),
+        sum(p.engine == "cloud" for p in pages),
+        sum(p.engine == "failed" for p in pages),
+        wall_s,
+        sum(p.total_ms for p in pages) / 1000,
+        sum(p.render_ms for p in pages) / 1000,
+        sum(p.tesseract_ms for p in pages) / 1000,
+        sum(p.cloud_ms for p in pages) / 1000,
+        slowest.page,
+        slowest.total_ms,
+    )
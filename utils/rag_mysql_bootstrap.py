@@ -18,7 +18,9 @@ def _dict_seeds() -> List[Tuple[str, str, str, str]]:
         ("user_preferences", "pref_value", "偏好值", "JSON 字符串"),
         ("chat_sessions", "mode", "会话模式", "rag / instant / chat"),
         ("chat_sessions", "client_conv_key", "客户端会话键", "对齐前端 localStorage"),
+        ("chat_sessions", "sync_hash", "同步摘要", "会话标题/正文/消息摘要，未变化时跳过写库"),
         ("chat_messages", "meta_json", "消息元数据", "引用、耗时等 JSON"),
+        ("chat_messages", "msg_hash", "消息摘要", "增量同步比对用"),
         ("ai_model_presets", "preset_name", "预设名", "用户多模型配置名称"),
         ("ai_model_presets", "api_key_stored", "密钥存储", "敏感字段，生产建议加密"),
         ("llm_call_logs", "call_type", "调用类型", "qa、rephrase、ingest 等"),
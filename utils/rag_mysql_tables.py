@@ -46,6 +46,7 @@ RAG_MYSQL_DDL: List[str] = [
         mode VARCHAR(32) NOT NULL DEFAULT 'rag' COMMENT 'rag|instant|chat',
         client_conv_key VARCHAR(128) NULL COMMENT '前端 localStorage 会话 id 等',
         session_payload MEDIUMTEXT NULL COMMENT '即时档 instantDoc 等 JSON',
+        sync_hash CHAR(40) NULL COMMENT '上次同步的会话摘要，未变化的会话跳过',
         created_at VARCHAR(40) NOT NULL,
         updated_at VARCHAR(40) NOT NULL,
         KEY idx_chat_sess_user_mode_key (user_id, mode, client_conv_key),
@@ -63,6 +64,7 @@ RAG_MYSQL_DDL: List[str] = [
         completion_tokens INT NULL,
         sort_order INT NOT NULL DEFAULT 0,
         meta_json VARCHAR(4000) NULL COMMENT '引用、耗时等 JSON',
+        msg_hash CHAR(40) NULL COMMENT '消息内容摘要，增量同步按公共前缀保留',
         created_at VARCHAR(40) NOT NULL,
         KEY idx_chat_msg_sess (session_id, sort_order),
         CONSTRAINT fk_chat_msg_session FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE
@@ -258,6 +260,8 @@ RAG_MYSQL_DDL: List[str] = [
 # 已存在旧表时补列（与 auth_db_backend.mysql_upgrade_schema 合并执行）
 RAG_MYSQL_COLUMN_UPGRADES: List[tuple[str, str, str]] = [
     ("chat_sessions", "session_payload", "MEDIUMTEXT NULL"),
+    ("chat_sessions", "sync_hash", "CHAR(40) NULL"),
+    ("chat_messages", "msg_hash", "CHAR(40) NULL"),
     ("prompt_templates", "is_active", "TINYINT(1) NOT NULL DEFAULT 1"),
     ("prompt_templates", "updated_by_username", "VARCHAR(64) NULL"),
     ("faiss_index_registry", "last_rebuilt_at", "VARCHAR(40) NULL"),
@@ -4,11 +4,11 @@
 解决固定chunk对抽象/概念/总结类问题失效的问题
 """
 import re
+import bisect
 import hashlib
 import logging
 from typing import List, Dict, Tuple, Optional
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 logger = logging.getLogger(__name__)
 
@@ -58,14 +58,6 @@ class SmartChunker:
 
     def __init__(self, level_configs: Optional[Dict[str, Dict]] = None):
         self._level_configs = level_configs if level_configs is not None else CHUNK_CONFIGS
-        self.splitters = {}
-        for level, config in self._level_configs.items():
-            self.splitters[level] = RecursiveCharacterTextSplitter(
-                chunk_size=config["chunk_size"],
-                chunk_overlap=config["chunk_overlap"],
-                separators=CHINESE_SEPARATORS,
-                length_function=len
-            )
     
     def create_multi_level_chunks(
         self, 
@@ -74,16 +66,19 @@ class SmartChunker:
         file_type: str = "txt"
     ) -> Dict[str, List[Document]]:
         """
-        创建多层级分块（改进版：支持边界修复和文档类型识别）
+        创建多层级分块（单遍切分：全文只切一次句/段区间，各层级按区间贪心打包）
         :param text: 原始文本
         :param source_file: 源文件名
         :param file_type: 文件类型
         :return: {"small": [...], "medium": [...], "large": [...], "summary": [...]}
+
+        各块 chunk_start / chunk_end 为原文精确偏移，page_content == text[chunk_start:chunk_end]；
+        块边界落在句末或段落处，不再逐块在原文中查找位置、回溯修复边界。
         """
         result = {}
         
         # 【优化1】：检测文档类型
-        from utils.improved_chunker import detect_document_type, is_sentence_complete, fix_chunk_boundary
+        from utils.improved_chunker import detect_document_type, is_sentence_complete
         doc_type = detect_document_type(text, file_type)
         
         # 【优化2】：根据文档类型调整配置
@@ -99,70 +94,38 @@ class SmartChunker:
                 adjusted_config["chunk_size"] = int(config["chunk_size"] * 1.2)
             adjusted_configs[level] = adjusted_config
         
-        # 基础文档
-        base_doc = Document(
-            page_content=text,
-            metadata={"source_file": source_file, "file_type": file_type, "doc_type": doc_type}
-        )
+        # 1. 全文切一次句/段区间（超长句按最小层级块长再切），各层级共用
+        min_size = min((max(1, c["chunk_size"]) for c in adjusted_configs.values()), default=1)
+        spans, para_starts = _segment_text_spans(text, min_size)
         
-        # 1. 创建各层级chunk
-        for level, splitter in self.splitters.items():
-            # 如果配置被调整，创建新的splitter
-            if level in adjusted_configs:
-                config = adjusted_configs[level]
-                splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=config["chunk_size"],
-                    chunk_overlap=config["chunk_overlap"],
-                    separators=CHINESE_SEPARATORS,
-                    length_function=len
-                )
-            
-            chunks = splitter.split_documents([base_doc])
-            
-            # 【优化3】：修复chunk边界，确保句子完整
-            improved_chunks = []
-            current_pos = 0
-            
-            for i, chunk in enumerate(chunks):
-                chunk_text = chunk.page_content
-                
-                # 查找chunk在原文中的位置
-                chunk_start = text.find(chunk_text[:50], current_pos)
-                if chunk_start == -1:
-                    chunk_start = current_pos
-                
-                # 修复边界
-                fixed_text = fix_chunk_boundary(chunk_text, text, chunk_start)
-                
-                # 更新chunk内容
-                chunk.page_content = fixed_text
-                
-                # 添加层级和位置信息
-                chunk_id = self._generate_chunk_id(fixed_text)
-                chunk.metadata.update({
-                    "chunk_level": level,
-                    "chunk_index": i,
-                    "chunk_id": chunk_id,
-                    "total_chunks": len(chunks),
-                    "source_file": source_file,
-                    "file_type": file_type,
-                    "doc_type": doc_type,
-                    "chunk_start": chunk_start,
-                    "chunk_end": chunk_start + len(fixed_text),
-                    "is_sentence_complete": is_sentence_complete(fixed_text)
-                })
-                
-                improved_chunks.append(chunk)
-                current_pos = chunk_start + len(fixed_text)
-            
-            result[level] = improved_chunks
+        for level, config in adjusted_configs.items():
+            bounds = _pack_spans(spans, para_starts, config["chunk_size"], config["chunk_overlap"])
+            chunks = []
+            for i, (chunk_start, chunk_end) in enumerate(bounds):
+                chunk_text = text[chunk_start:chunk_end]
+                chunks.append(Document(
+                    page_content=chunk_text,
+                    metadata={
+                        "source_file": source_file,
+                        "file_type": file_type,
+                        "doc_type": doc_type,
+                        "chunk_level": level,
+                        "chunk_index": i,
+                        "chunk_id": self._generate_chunk_id(chunk_text),
+                        "total_chunks": len(bounds),
+                        "chunk_start": chunk_start,
+                        "chunk_end": chunk_end,
+                        "is_sentence_complete": is_sentence_complete(chunk_text),
+                    },
+                ))
+            result[level] = chunks
         
         # 2. 创建文档摘要（用于总结类问题）
         summary_chunk = self._create_summary_chunk(text, source_file, file_type)
         result["summary"] = [summary_chunk] if summary_chunk else []
         
         # 3. 建立父子关系
-        self._build_parent_child_relations(result)
+        self._build_parent_child_relations(result, text)
         
         return result
     
@@ -364,78 +327,234 @@ class SmartChunker:
         sorted_words = sorted(word_count.items(), key=lambda x: x[1], reverse=True)
         return [word for word, count in sorted_words[:30] if count >= 3]
     
-    def _build_parent_child_relations(self, chunks_dict: Dict[str, List[Document]]):
+    def _build_parent_child_relations(
+        self,
+        chunks_dict: Dict[str, List[Document]],
+        text: Optional[str] = None,
+    ):
         """
-        建立父子关系：小chunk指向中chunk，中chunk指向大chunk（改进版：使用位置信息和chunk_id映射）
+        建立父子关系：小chunk指向中chunk，中chunk指向大chunk（按 chunk_start/chunk_end 区间扫描）
+
+        规则：优先选完整包含子区间、占比最大（即最短）的父块；无包含父块时回退到内容匹配
+        （子块前 50 字出现在父块中，按字符集合重叠最大）；都不满足取第 0 个父块。同分取下标最小者。
+        父子按起点排序后一次扫描，活跃父块只保留与当前位置重叠的少数几个；传入原文 text 时，
+        内容匹配只检查前缀出现位置附近的父块，不再与全部父块逐一比对。
         """
         levels = ["small", "medium", "large"]
-        
-        # 【优化4】：建立chunk_id映射表，快速查找
-        chunk_id_maps = {}
-        for level in levels:
-            if level in chunks_dict:
-                chunk_id_maps[level] = {
-                    chunk.metadata.get("chunk_id"): (i, chunk)
-                    for i, chunk in enumerate(chunks_dict[level])
-                }
-        
+
         for i, level in enumerate(levels[:-1]):
             parent_level = levels[i + 1]
-            
+
             if level not in chunks_dict or parent_level not in chunks_dict:
                 continue
-            
+
             child_chunks = chunks_dict[level]
             parent_chunks = chunks_dict[parent_level]
-            
+
             if not parent_chunks:
                 continue
-            
-            # 使用位置信息建立父子关系（更准确）
-            for child in child_chunks:
-                child_start = child.metadata.get("chunk_start")
-                child_end = child.metadata.get("chunk_end")
-                child_id = child.metadata.get("chunk_id")
-                
-                best_parent_idx = 0
-                best_containment = 0
-                
-                if child_start is not None and child_end is not None:
-                    # 方法1：使用位置信息（最准确）
-                    for j, parent in enumerate(parent_chunks):
-                        parent_start = parent.metadata.get("chunk_start")
-                        parent_end = parent.metadata.get("chunk_end")
-                        
-                        if parent_start is not None and parent_end is not None:
-                            # 检查子chunk是否在父chunk范围内
-                            if parent_start <= child_start and child_end <= parent_end:
-                                containment = (child_end - child_start) / max(1, parent_end - parent_start)
-                                if containment > best_containment:
-                                    best_containment = containment
-                                    best_parent_idx = j
-                
-                if best_containment == 0:
-                    # 方法2：回退到内容匹配
-                    child_start_text = child.page_content[:50]
-                    best_overlap = 0
-                    
-                    for j, parent in enumerate(parent_chunks):
-                        if child_start_text in parent.page_content:
-                            overlap = len(set(child.page_content) & set(parent.page_content))
-                            if overlap > best_overlap:
-                                best_overlap = overlap
-                                best_parent_idx = j
-                
+
+            best = _link_children_to_parents(child_chunks, parent_chunks, text)
+            for child, best_parent_idx in zip(child_chunks, best):
                 # 记录父chunk信息
                 child.metadata["parent_chunk_index"] = best_parent_idx
                 child.metadata["parent_chunk_level"] = parent_level
-                
+
                 # 记录父chunk的chunk_id（用于快速查找）
-                if best_parent_idx < len(parent_chunks):
-                    parent_chunk = parent_chunks[best_parent_idx]
-                    parent_chunk_id = parent_chunk.metadata.get("chunk_id")
-                    if parent_chunk_id:
-                        child.metadata["parent_chunk_id"] = parent_chunk_id
+                parent_chunk_id = parent_chunks[best_parent_idx].metadata.get("chunk_id")
+                if parent_chunk_id:
+                    child.metadata["parent_chunk_id"] = parent_chunk_id
+
+
+# 句级区间：以非空白开头，止于句读（含后随引号/括号）或行尾（不含行尾空白）
+_SENTENCE_RE = re.compile(r"[^\s](?:[^\n。！？；!?]*[^\s。！？；!?])?(?:[。！？；!?]+[”’」』）)\"']*)?")
+# 超长句内的次级切点，按优先级：英文句末 > 逗号/顿号/冒号 > 空白
+_LONG_SPAN_BREAKS = ((". ", "? ", "! "), ("，", ",", "、", "：", ":"), (" ", "\t"))
+
+
+def _split_long_span(text: str, s: int, e: int, max_span: int, out: List[Tuple[int, int]]) -> None:
+    """把超过 max_span 的句子在窗口后半段的次级切点处切开（找不到则硬切），区间去首尾空白。"""
+    while e - s > max_span:
+        lo, hi = s + max_span // 2, s + max_span
+        cut = -1
+        for group in _LONG_SPAN_BREAKS:
+            for sep in group:
+                k = text.rfind(sep, lo, hi)
+                if k != -1 and k + len(sep.rstrip()) > cut:
+                    cut = k + len(sep.rstrip())
+            if cut != -1:
+                break
+        if cut <= s:
+            cut = hi
+        end = cut
+        while end > s and text[end - 1].isspace():
+            end -= 1
+        if end > s:
+            out.append((s, end))
+        s = cut
+        while s < e and text[s].isspace():
+            s += 1
+    if e > s:
+        out.append((s, e))
+
+
+def _segment_text_spans(text: str, max_span: int) -> Tuple[List[Tuple[int, int]], List[bool]]:
+    """
+    全文切成句级区间（原文精确偏移，不含首尾空白），返回 (spans, para_starts)。
+    para_starts[i] 表示第 i 个区间前有空行（段落起点）；长于 max_span 的句子再按次级切点切开。
+    """
+    spans: List[Tuple[int, int]] = []
+    para_starts: List[bool] = []
+    max_span = max(1, max_span)
+    prev_end = 0
+    for m in _SENTENCE_RE.finditer(text):
+        s, e = m.span()
+        para = not spans or text.count("\n", prev_end, s) >= 2
+        if e - s <= max_span:
+            spans.append((s, e))
+            para_starts.append(para)
+        else:
+            n0 = len(spans)
+            _split_long_span(text, s, e, max_span, spans)
+            para_starts.extend([para] + [False] * (len(spans) - n0 - 1))
+        prev_end = e
+    return spans, para_starts
+
+
+def _pack_spans(
+    spans: List[Tuple[int, int]],
+    para_starts: List[bool],
+    chunk_size: int,
+    chunk_overlap: int,
+) -> List[Tuple[int, int]]:
+    """
+    按句级区间贪心打包成块（块长按原文偏移计，含区间之间的空白）。
+    块装不下下一句时收尾；若块后半段内有段落起点，优先在段落处断开。
+    下一块从末尾不超过 chunk_overlap 字的若干句开始，保证重叠且必有前进。
+    """
+    out: List[Tuple[int, int]] = []
+    n = len(spans)
+    if n == 0:
+        return out
+    chunk_size = max(1, chunk_size)
+    half = chunk_size // 2
+    i = 0
+    while i < n:
+        start = spans[i][0]
+        k = i
+        while k + 1 < n and spans[k + 1][1] - start <= chunk_size:
+            k += 1
+        if k + 1 < n:
+            for p in range(k, i, -1):
+                if spans[p][0] - start < half:
+                    break
+                if para_starts[p]:
+                    k = p - 1
+                    break
+        out.append((start, spans[k][1]))
+        if k + 1 >= n:
+            break
+        m = k + 1
+        while m - 1 > i and spans[k][1] - spans[m - 1][0] <= chunk_overlap and not para_starts[m]:
+            m -= 1
+        i = m
+    return out
+
+
+def _chunk_span(doc: Document) -> Optional[Tuple[int, int]]:
+    s, e = doc.metadata.get("chunk_start"), doc.metadata.get("chunk_end")
+    if s is None or e is None:
+        return None
+    return int(s), int(e)
+
+
+def _link_children_to_parents(
+    child_chunks: List[Document],
+    parent_chunks: List[Document],
+    text: Optional[str] = None,
+) -> List[int]:
+    """为每个子块选父块下标（规则见 SmartChunker._build_parent_child_relations）。"""
+    n_parent = len(parent_chunks)
+    p_spans = [_chunk_span(p) for p in parent_chunks]
+    p_order = sorted((sp[0], j) for j, sp in enumerate(p_spans) if sp is not None)
+    result = [0] * len(child_chunks)
+    unresolved: List[int] = []
+
+    # 1) 区间扫描：子块按起点排序，父块起点 ≤ 子块起点时入活跃集，终点已在当前起点之前的移出
+    c_order = []
+    for ci, child in enumerate(child_chunks):
+        sp = _chunk_span(child)
+        if sp is None or sp[1] <= sp[0]:
+            unresolved.append(ci)
+        else:
+            c_order.append((sp[0], ci, sp[1]))
+    c_order.sort()
+    active: List[int] = []
+    k = 0
+    for cs, ci, ce in c_order:
+        while k < len(p_order) and p_order[k][0] <= cs:
+            active.append(p_order[k][1])
+            k += 1
+        active = [j for j in active if p_spans[j][1] >= cs]
+        best_j, best_containment = 0, 0.0
+        for j in sorted(active):
+            ps, pe = p_spans[j]
+            if ce <= pe:
+                containment = (ce - cs) / max(1, pe - ps)
+                if containment > best_containment:
+                    best_containment, best_j = containment, j
+        if best_containment == 0:
+            unresolved.append(ci)
+        else:
+            result[ci] = best_j
+
+    if not unresolved:
+        return result
+
+    # 2) 内容匹配回退：父块正文即原文切片时，前缀出现位置落在其区间内才可能命中
+    exact = [False] * n_parent
+    if text is not None:
+        for j, sp in enumerate(p_spans):
+            if sp is not None and text[sp[0] : sp[1]] == parent_chunks[j].page_content:
+                exact[j] = True
+    loose = [j for j in range(n_parent) if not exact[j]]
+    exact_order = [(p_spans[j][0], j) for j in range(n_parent) if exact[j]]
+    exact_order.sort()
+    exact_starts = [s for s, _ in exact_order]
+    max_len = max((p_spans[j][1] - p_spans[j][0] for j in range(n_parent) if exact[j]), default=0)
+    # 正文相同的父块得分相同、同分取下标最小者，只需比较每组正文的首个父块（重复段落/页眉常见）
+    first_by_text: Dict[str, int] = {}
+    canonical = [first_by_text.setdefault(p.page_content, j) for j, p in enumerate(parent_chunks)]
+    parent_sets: Dict[int, set] = {}
+
+    for ci in unresolved:
+        child_text = child_chunks[ci].page_content
+        prefix = child_text[:50]
+        if text is None or not prefix:
+            candidates = range(n_parent)
+        else:
+            cand = {canonical[j] for j in loose}
+            pos = text.find(prefix)
+            while pos != -1:
+                lo = bisect.bisect_left(exact_starts, pos + len(prefix) - max_len)
+                hi = bisect.bisect_right(exact_starts, pos)
+                for _, j in exact_order[lo:hi]:
+                    if p_spans[j][1] >= pos + len(prefix):
+                        cand.add(canonical[j])
+                pos = text.find(prefix, pos + 1)
+            candidates = sorted(cand)
+        child_set = set(child_text)
+        best_j, best_overlap = 0, 0
+        for j in candidates:
+            parent_text = parent_chunks[j].page_content
+            if prefix in parent_text:
+                if j not in parent_sets:
+                    parent_sets[j] = set(parent_text)
+                overlap = len(child_set & parent_sets[j])
+                if overlap > best_overlap:
+                    best_overlap, best_j = overlap, j
+        result[ci] = best_j
+    return result
 
 
 # ==================== 查询类型识别 ====================
@@ -0,0 +1,215 @@
+"""
+文档纯文本旁路文件（sidecar）：入库时把分块所用的整篇纯文本压缩落盘，供「查看内容」与全文子串检索直接读取，
+不再每次重新解析原文（PDF/Office/OCR）或从向量库拼接。
+
+位置：知识库目录下 text_sidecars/<sha1(文件名)>.txt.gz（正文，gzip）+ 同名 .json（头信息）。
+头信息含 file_name、chars、origin（ingest | original_file | reconstructed）与 chunks：
+每块 [chunk_level, chunk_index, start, end]，为该块在正文中的字符区间。
+
+- 常规入库：正文即分块用的 full_text，偏移与块元数据 chunk_start/chunk_end 一致；
+- 流式入库：正文为各段去首尾空白后以空行连接，块区间按段内位置换算；
+- 旧文档（无 sidecar）：首次查看/检索时由 document_preview 解析原文或拼接分块后补写，不带块区间。
+同名重传覆盖、删除文档时一并删除。读写失败只记日志，调用方退回原有解析路径。
+写入/删除时同步维护全文子串检索的位置索引（utils.fulltext_index）。
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from utils.fulltext_index import FulltextIndexWriter, clear_fulltext_index, delete_fulltext_document
+from utils.path_context import get_kb_dir
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SUBDIR = "text_sidecars"
+SIDECAR_VERSION = 1
+_COMPRESS_LEVEL = 6
+
+
+def _sidecar_dir(kb_dir: Optional[str] = None) -> str:
+    return os.path.join(kb_dir or get_kb_dir(), SIDECAR_SUBDIR)
+
+
+def _sidecar_base(file_name: str, kb_dir: Optional[str] = None) -> str:
+    key = hashlib.sha1((file_name or "").encode("utf-8")).hexdigest()
+    return os.path.join(_sidecar_dir(kb_dir), key)
+
+
+def _tmp_suffix() -> str:
+    return f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _chunk_spans(chunks: Iterable[Any]) -> List[List[Any]]:
+    out: List[List[Any]] = []
+    for c in chunks:
+        md = getattr(c, "metadata", None) or {}
+        s, e = md.get("chunk_start"), md.get("chunk_end")
+        if s is None or e is None:
+            continue
+        out.append([str(md.get("chunk_level", "")), int(md.get("chunk_index", 0)), int(s), int(e)])
+    return out
+
+
+def _write_header(base: str, header: Dict[str, Any]) -> None:
+    tmp = base + ".json" + _tmp_suffix()
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(header, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, base + ".json")
+
+
+class SidecarWriter:
+    """流式写 sidecar：逐段 append，最后 commit 原子替换；失败或无内容时 abort。"""
+
+    def __init__(self, file_name: str, kb_dir: Optional[str] = None, origin: str = "ingest") -> None:
+        self.file_name = file_name
+        self.origin = origin
+        self.chars = 0
+        self.chunks: List[List[Any]] = []
+        self._base = _sidecar_base(file_name, kb_dir)
+        os.makedirs(os.path.dirname(self._base), exist_ok=True)
+        self._tmp = self._base + ".txt.gz" + _tmp_suffix()
+        self._f = gzip.open(self._tmp, "wt", encoding="utf-8", compresslevel=_COMPRESS_LEVEL, newline="")
+        self._kb_dir = kb_dir
+        self._index: Optional[FulltextIndexWriter] = None
+        try:
+            self._index = FulltextIndexWriter(file_name, kb_dir)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("[Sidecar] 全文索引不可用 %s: %s", file_name, e)
+
+    def append(self, text: str) -> int:
+        """追加一段正文（与前文以空行分隔），返回该段在整篇中的起始偏移。"""
+        if self.chars:
+            self._f.write("\n\n")
+            self.chars += 2
+        start = self.chars
+        self._f.write(text)
+        self.chars += len(text)
+        if self._index is not None:
+            try:
+                self._index.add(text)
+            except Exception as e:  # noqa: BLE001 — 索引失败不影响 sidecar，检索时再补建
+                logger.warning("[Sidecar] 全文索引写入失败 %s: %s", self.file_name, e)
+                self._index.abort()
+                self._index = None
+        return start
+
+    def add_chunk(self, level: str, index: int, start: int, end: int) -> None:
+        self.chunks.append([level, int(index), int(start), int(end)])
+
+    def commit(self) -> None:
+        self._f.close()
+        os.replace(self._tmp, self._base + ".txt.gz")
+        _write_header(
+            self._base,
+            {
+                "v": SIDECAR_VERSION,
+                "file_name": self.file_name,
+                "chars": self.chars,
+                "origin": self.origin,
+                "chunks": self.chunks,
+            },
+        )
+        if self._index is None:
+            # 旧版本的索引已与新正文不符，删掉后由检索时补建
+            delete_fulltext_document(self.file_name, self._kb_dir)
+            return
+        try:
+            self._index.commit()
+        except Exception as e:  # noqa: BLE001
+            logger.warning("[Sidecar] 全文索引提交失败 %s: %s", self.file_name, e)
+            delete_fulltext_document(self.file_name, self._kb_dir)
+        finally:
+            self._index = None
+
+    def abort(self) -> None:
+        if self._index is not None:
+            self._index.abort()
+            self._index = None
+        try:
+            self._f.close()
+        finally:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
+
+
+def write_sidecar(
+    file_name: str,
+    text: str,
+    chunks: Iterable[Any] = (),
+    *,
+    origin: str = "ingest",
+    kb_dir: Optional[str] = None,
+) -> bool:
+    """整篇写入 sidecar（块区间取自 chunk_start/chunk_end）。失败返回 False，不抛异常。"""
+    try:
+        w = SidecarWriter(file_name, kb_dir=kb_dir, origin=origin)
+    except OSError as e:
+        logger.warning("[Sidecar] 创建失败 %s: %s", file_name, e)
+        return False
+    try:
+        w.append(text or "")
+        w.chunks = _chunk_spans(chunks)
+        w.commit()
+        return True
+    except Exception as e:  # noqa: BLE001 — sidecar 只是加速缓存，写失败不影响入库
+        w.abort()
+        logger.warning("[Sidecar] 写入失败 %s: %s", file_name, e)
+        return False
+
+
+def read_sidecar_header(file_name: str, kb_dir: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    base = _sidecar_base(file_name, kb_dir)
+    if not os.path.isfile(base + ".txt.gz"):
+        return None
+    try:
+        with open(base + ".json", "r", encoding="utf-8") as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if header.get("v") != SIDECAR_VERSION or header.get("file_name") != file_name:
+        return None
+    return header
+
+
+def read_sidecar_text(file_name: str, kb_dir: Optional[str] = None) -> Optional[str]:
+    """读取整篇正文；不存在、版本不符或损坏时返回 None。"""
+    header = read_sidecar_header(file_name, kb_dir)
+    if header is None:
+        return None
+    try:
+        with gzip.open(_sidecar_base(file_name, kb_dir) + ".txt.gz", "rt", encoding="utf-8", newline="") as f:
+            return f.read()
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        logger.warning("[Sidecar] 读取失败，将重新生成 %s: %s", file_name, e)
+        return None
+
+
+def sidecar_paths(file_name: str, kb_dir: Optional[str] = None) -> List[str]:
+    """该文档 sidecar 的正文与头信息文件路径（存储记账用）。"""
+    base = _sidecar_base(file_name, kb_dir)
+    return [base + ".txt.gz", base + ".json"]
+
+
+def delete_sidecar(file_name: str, kb_dir: Optional[str] = None) -> None:
+    delete_fulltext_document(file_name, kb_dir)
+    base = _sidecar_base(file_name, kb_dir)
+    for p in (base + ".txt.gz", base + ".json"):
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+
+
+def clear_sidecars(kb_dir: Optional[str] = None) -> None:
+    clear_fulltext_index(kb_dir)
+    shutil.rmtree(_sidecar_dir(kb_dir), ignore_errors=True)
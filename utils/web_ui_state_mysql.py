@@ -1,10 +1,11 @@
 """登录用户 Web 端状态与 MySQL 同步：会话→chat_sessions/chat_messages，偏好→user_preferences。"""
 from __future__ import annotations
 
+import hashlib
 import json
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from config import WEB_USERS_ROOT
 from utils.auth_db_backend import get_conn
@@ -91,8 +92,113 @@ def mysql_has_any_web_state(user_id: int) -> bool:
     return False
 
 
+def _message_row(m: Dict[str, Any]) -> Optional[Tuple[str, str, Optional[int], Optional[int], Optional[str], List[str], str]]:
+    """前端消息 → (role, content, prompt_tokens, completion_tokens, meta_json, 证据 JSON 列表, msg_hash)。"""
+    if not isinstance(m, dict):
+        return None
+    role = str(m.get("role") or "")[:16]
+    content = str(m.get("content") or "")
+    meta_obj = {}
+    for k in ("meta", "timing", "latencyMs"):
+        if k in m:
+            meta_obj[k] = m.get(k)
+    meta_json: Optional[str] = None
+    if meta_obj:
+        try:
+            meta_json = json.dumps(meta_obj, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            meta_json = None
+    pt = m.get("prompt_tokens")
+    ct = m.get("completion_tokens")
+    pti = int(pt) if pt is not None and str(pt).strip() != "" else None
+    cti = int(ct) if ct is not None and str(ct).strip() != "" else None
+    evidence: List[str] = []
+    srcs = m.get("sources")
+    if role == "assistant" and isinstance(srcs, list):
+        for sv in srcs:
+            if not isinstance(sv, dict):
+                continue
+            try:
+                ej = json.dumps(sv, ensure_ascii=False, default=str)
+            except (TypeError, ValueError):
+                continue
+            evidence.append(ej[:16_000_000])
+    h = hashlib.sha1()
+    for part in (role, content, str(pti), str(cti), meta_json or "", *evidence):
+        h.update(part.encode("utf-8", errors="ignore"))
+        h.update(b"\x00")
+    return role, content, pti, cti, meta_json, evidence, h.hexdigest()
+
+
+def _session_hash(title: str, updated_at: str, payload_sql: Optional[str], msg_hashes: List[str]) -> str:
+    h = hashlib.sha1()
+    for part in (title, updated_at, payload_sql or ""):
+        h.update(part.encode("utf-8", errors="ignore"))
+        h.update(b"\x00")
+    h.update("".join(msg_hashes).encode("ascii"))
+    return h.hexdigest()
+
+
+def _sync_session_messages(conn: Any, sid: int, rows: List[Tuple[Any, ...]]) -> None:
+    """按 msg_hash 保留库中与新列表相同的最长前缀，只删改其后的消息；新增部分批量插入。"""
+    existing = conn.execute(
+        "SELECT id, sort_order, msg_hash FROM chat_messages WHERE session_id = ? ORDER BY sort_order ASC, id ASC",
+        (sid,),
+    ).fetchall()
+    keep = 0
+    for i, er in enumerate(existing or []):
+        ed = _row_dict(er)
+        if i >= len(rows) or int(ed.get("sort_order") or 0) != i or ed.get("msg_hash") != rows[i][6]:
+            break
+        keep += 1
+    if len(existing or []) > keep:
+        # 证据行随外键级联删除
+        conn.execute("DELETE FROM chat_messages WHERE session_id = ? AND sort_order >= ?", (sid, keep))
+    tail = rows[keep:]
+    if not tail:
+        return
+    now = _iso_now()
+    conn.executemany(
+        """
+        INSERT INTO chat_messages (
+            session_id, role, content, prompt_tokens, completion_tokens,
+            sort_order, meta_json, msg_hash, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [(sid, r[0], r[1], r[2], r[3], keep + j, r[4], r[6], now) for j, r in enumerate(tail)],
+    )
+    if not any(r[5] for r in tail):
+        return
+    # 多行 INSERT 的自增 id 不保证连续，回查 sort_order → id
+    id_rows = conn.execute(
+        "SELECT id, sort_order FROM chat_messages WHERE session_id = ? AND sort_order >= ?",
+        (sid, keep),
+    ).fetchall()
+    id_by_order = {int(_row_dict(r)["sort_order"]): int(_row_dict(r)["id"]) for r in id_rows or []}
+    ev_params: List[Tuple[Any, ...]] = []
+    for j, r in enumerate(tail):
+        mid = id_by_order.get(keep + j)
+        if not mid:
+            continue
+        for si, ej in enumerate(r[5]):
+            ev_params.append((mid, si, ej, now))
+    if ev_params:
+        conn.executemany(
+            """
+            INSERT INTO chat_message_evidence (
+                message_id, sort_order, evidence_json, created_at
+            ) VALUES (?, ?, ?, ?)
+            """,
+            ev_params,
+        )
+
+
 def _sync_conversation_json_conn(conn: Any, user_id: int, mode: str, raw: Optional[str]) -> None:
-    """在已有连接/事务内写入会话与消息。"""
+    """在已有连接/事务内写入会话与消息（增量）。
+
+    每个会话按标题、更新时间、附带文档与各消息摘要算 sync_hash，与库中一致则整段跳过；
+    有变化时消息只重写与库中不同的尾部（追加新消息即只插入新行），写入走 executemany 批量。
+    """
     if not raw or not str(raw).strip():
         return
     try:
@@ -123,6 +229,17 @@ def _sync_conversation_json_conn(conn: Any, user_id: int, mode: str, raw: Option
             (int(user_id), mode),
         )
 
+    known: Dict[str, Dict[str, Any]] = {}
+    for r in conn.execute(
+        """
+        SELECT id, client_conv_key, sync_hash FROM chat_sessions
+        WHERE user_id = ? AND mode = ? AND client_conv_key IS NOT NULL
+        """,
+        (int(user_id), mode),
+    ).fetchall() or []:
+        d = _row_dict(r)
+        known.setdefault(str(d.get("client_conv_key")), d)
+
     for cid in order:
         conv = conversations.get(cid)
         if not isinstance(conv, dict):
@@ -139,96 +256,39 @@ def _sync_conversation_json_conn(conn: Any, user_id: int, mode: str, raw: Option
             except (TypeError, ValueError):
                 payload_sql = None
 
-        row = conn.execute(
-            """
-            SELECT id FROM chat_sessions
-            WHERE user_id = ? AND mode = ? AND client_conv_key = ? LIMIT 1
-            """,
-            (int(user_id), mode, ck),
-        ).fetchone()
-        d0 = _row_dict(row)
+        msgs = conv.get("messages") or []
+        if not isinstance(msgs, list):
+            msgs = []
+        rows = [r for r in (_message_row(m) for m in msgs) if r is not None]
+        digest = _session_hash(title, updated_at, payload_sql, [r[6] for r in rows])
+
+        d0 = known.get(ck) or {}
         if d0.get("id") is not None:
+            if d0.get("sync_hash") == digest:
+                continue
             sid = int(d0["id"])
             conn.execute(
                 """
                 UPDATE chat_sessions
-                SET title = ?, updated_at = ?, session_payload = ?
+                SET title = ?, updated_at = ?, session_payload = ?, sync_hash = ?
                 WHERE id = ?
                 """,
-                (title, updated_at, payload_sql, sid),
+                (title, updated_at, payload_sql, digest, sid),
             )
         else:
             created = _iso_now()
             conn.execute(
                 """
                 INSERT INTO chat_sessions (
-                    user_id, title, mode, client_conv_key, session_payload, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    user_id, title, mode, client_conv_key, session_payload, sync_hash, created_at, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (int(user_id), title, mode, ck, payload_sql, created, updated_at),
+                (int(user_id), title, mode, ck, payload_sql, digest, created, updated_at),
             )
             sid = int(conn.lastrowid)
+            known[ck] = {"id": sid, "sync_hash": digest}
 
-        conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (sid,))
-        msgs = conv.get("messages") or []
-        if not isinstance(msgs, list):
-            msgs = []
-        for i, m in enumerate(msgs):
-            if not isinstance(m, dict):
-                continue
-            role = str(m.get("role") or "")[:16]
-            content = str(m.get("content") or "")
-            meta_obj = {}
-            for k in ("meta", "timing", "latencyMs"):
-                if k in m:
-                    meta_obj[k] = m.get(k)
-            meta_json: Optional[str] = None
-            if meta_obj:
-                try:
-                    meta_json = json.dumps(meta_obj, ensure_ascii=False, default=str)
-                except (TypeError, ValueError):
-                    meta_json = None
-            pt = m.get("prompt_tokens")
-            ct = m.get("completion_tokens")
-            pti = int(pt) if pt is not None and str(pt).strip() != "" else None
-            cti = int(ct) if ct is not None and str(ct).strip() != "" else None
-            conn.execute(
-                """
-                INSERT INTO chat_messages (
-                    session_id, role, content, prompt_tokens, completion_tokens,
-                    sort_order, meta_json, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (sid, role, content, pti, cti, i, meta_json, _iso_now()),
-            )
-            mid = int(conn.lastrowid)
-            srcs = m.get("sources")
-            if (
-                mid > 0
-                and role == "assistant"
-                and isinstance(srcs, list)
-                and srcs
-            ):
-                for si, sv in enumerate(srcs):
-                    if not isinstance(sv, dict):
-                        continue
-                    try:
-                        ej = json.dumps(sv, ensure_ascii=False, default=str)
-                    except (TypeError, ValueError):
-                        continue
-                    if len(ej) > 16_000_000:
-                        ej = ej[:16_000_000]
-                    try:
-                        conn.execute(
-                            """
-                            INSERT INTO chat_message_evidence (
-                                message_id, sort_order, evidence_json, created_at
-                            ) VALUES (?, ?, ?, ?)
-                            """,
-                            (mid, si, ej, _iso_now()),
-                        )
-                    except Exception:
-                        break
+        _sync_session_messages(conn, sid, rows)
 
     layout = {"version": version, "currentId": current_id, "order": order}
     pref_key = _PREF_LAYOUT_RAG if mode == "rag" else _PREF_LAYOUT_INSTANT
@@ -10,9 +10,11 @@ from langchain_community.vectorstores import FAISS
 from config import WEB_USERS_ROOT
 from utils.embedding import get_embeddings
 from utils.metadata_manager import load_metadata, save_metadata
+from utils.parent_chunk_store import clear_parent_store
 from utils.path_context import get_kb_dir, reset_kb_context, set_user_kb_context
 
-from .stats_helpers import faiss_index_size_bytes, user_kb_doc_stats
+from .stats_helpers import user_kb_doc_stats
+from .storage_ledger import note_storage_changed, storage_totals
 
 
 def _kb_dir_for_user(user_id: int) -> str:
@@ -21,6 +23,7 @@ def _kb_dir_for_user(user_id: int) -> str:
 
 def admin_vector_summary_users(user_ids: List[int]) -> List[Dict[str, Any]]:
     out: List[Dict[str, Any]] = []
+    storage = storage_totals(user_ids)
     for uid in user_ids:
         kb = _kb_dir_for_user(uid)
         bm25 = os.path.isfile(os.path.join(kb, "bm25_index.pkl"))
@@ -28,7 +31,7 @@ def admin_vector_summary_users(user_ids: List[int]) -> List[Dict[str, Any]]:
         out.append(
             {
                 "user_id": int(uid),
-                "faiss_bytes": faiss_index_size_bytes(uid),
+                "faiss_bytes": storage[int(uid)][1],
                 "bm25_index_exists": bm25,
                 "doc_count": int(st["doc_count"]),
                 "total_chunks": int(st["total_chunks"]),
@@ -58,6 +61,8 @@ def admin_reset_user_faiss(user_id: int) -> Dict[str, Any]:
                 shutil.rmtree(index_dir)
             os.makedirs(index_dir, exist_ok=True)
             empty_db.save_local(index_dir)
+            clear_parent_store(kb)
+        note_storage_changed(user_id, index_dir, kb)
         meta = load_metadata()
         docs = meta.get("documents") or {}
         if isinstance(docs, dict):
@@ -83,6 +88,7 @@ def admin_delete_user_bm25(user_id: int) -> Dict[str, Any]:
                     removed += 1
                 except OSError:
                     pass
+        note_storage_changed(user_id, kb)
         return {"ok": True, "user_id": int(user_id), "files_removed": removed}
     finally:
         reset_kb_context(t_kb, t_api)
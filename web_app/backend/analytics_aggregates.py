@@ -0,0 +1,324 @@
+"""
+管理端全站统计的物化汇总：概览接口直接读 SQLite 中维护好的按用户 / 按天汇总，不再每次解析全部用户的元数据。
+
+两张表：
+- user_aggregates：每用户一行（是否注册、最近登录时间、知识库数、文档数、分块数、文档体积）；
+- upload_days：(user_id, 上传日) -> 未删除文档数，按日期建索引，上传趋势为一次 GROUP BY。
+
+写入方在事件发生时更新涉及的单个用户：
+- 元数据保存（入库、删除、改分类等，metadata_manager.save_metadata / admin_docs._save_user_meta）
+  用手头的元数据字典重算该用户一行及其上传日；
+- 注册 / 登录 / 删除账号（auth_store）更新注册标记与最近登录时间，删除时移除该用户的记录。
+
+未挂钩的改动（手工改文件、旧版本写入等）由后台线程按 ``RAG_ANALYTICS_RECONCILE_SEC``（默认 3600 秒，
+0 关闭）全量校正；多个 worker 进程通过汇总库中的时间戳抢占，同一周期只有一个进程执行。
+汇总库从未校正过时（首次部署），首个概览请求先同步校正一次。
+
+汇总库默认位于 WEB_SERVER_DIR/analytics_aggregates.sqlite3，可用 ``RAG_ANALYTICS_DB`` 覆盖。
+更新失败只记日志，不影响上传、登录等主流程。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import WEB_SERVER_DIR
+from web_app.backend.periodic_reconcile import PeriodicReconciler
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_CATEGORY = "默认知识库"
+_ALL_CATEGORIES = "全部知识库"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_aggregates (
+    user_id INTEGER PRIMARY KEY,
+    registered INTEGER NOT NULL DEFAULT 0,
+    last_login_at REAL,
+    kb_count INTEGER NOT NULL DEFAULT 1,
+    doc_count INTEGER NOT NULL DEFAULT 0,
+    total_chunks INTEGER NOT NULL DEFAULT 0,
+    total_size_mb REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_user_aggregates_login ON user_aggregates (registered, last_login_at);
+CREATE TABLE IF NOT EXISTS upload_days (
+    user_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    uploads INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_upload_days_day ON upload_days (day, uploads);
+CREATE TABLE IF NOT EXISTS aggregates_meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+def default_aggregates_path() -> str:
+    p = (os.environ.get("RAG_ANALYTICS_DB") or "").strip()
+    return p or os.path.join(WEB_SERVER_DIR, "analytics_aggregates.sqlite3")
+
+
+def _reconcile_interval_sec() -> float:
+    try:
+        v = float(os.environ.get("RAG_ANALYTICS_RECONCILE_SEC", "3600"))
+    except ValueError:
+        v = 3600.0
+    return 0.0 if v <= 0 else max(60.0, v)
+
+
+def _connect() -> sqlite3.Connection:
+    path = default_aggregates_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _upload_day(upload_time: str) -> Optional[str]:
+    s = (upload_time or "").strip()
+    if len(s) >= 10:
+        return s[:10].replace("/", "-")
+    return None
+
+
+def summarize_metadata(meta: Any) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """元数据（documents 为 dict 或 list，或旧版顶层 list）-> (用户汇总, {上传日: 文档数})；已删除文档不计。"""
+    cats: List[Any] = [_DEFAULT_CATEGORY]
+    raw: Any = meta
+    if isinstance(meta, dict):
+        raw = meta.get("documents") or {}
+        cats = list(meta.get("categories") or [_DEFAULT_CATEGORY])
+    docs = raw.values() if isinstance(raw, dict) else raw if isinstance(raw, list) else []
+    doc_count = 0
+    chunks = 0
+    size_mb = 0.0
+    days: Dict[str, int] = defaultdict(int)
+    for d in docs:
+        if not isinstance(d, dict) or d.get("is_deleted"):
+            continue
+        doc_count += 1
+        try:
+            chunks += int(d.get("chunks_count") or 0)
+            size_mb += float(d.get("file_size_mb") or 0)
+        except (TypeError, ValueError):
+            pass
+        day = _upload_day(str(d.get("upload_time") or ""))
+        if day:
+            days[day] += 1
+    summary = {
+        "kb_count": sum(1 for c in cats if c != _ALL_CATEGORIES),
+        "doc_count": doc_count,
+        "total_chunks": chunks,
+        "total_size_mb": round(size_mb, 4),
+    }
+    return summary, dict(days)
+
+
+def _write_documents(conn: sqlite3.Connection, user_id: int, meta: Any) -> None:
+    summary, days = summarize_metadata(meta)
+    conn.execute(
+        """
+        INSERT INTO user_aggregates (user_id, kb_count, doc_count, total_chunks, total_size_mb, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            kb_count = excluded.kb_count, doc_count = excluded.doc_count,
+            total_chunks = excluded.total_chunks, total_size_mb = excluded.total_size_mb,
+            updated_at = excluded.updated_at
+        """,
+        (
+            user_id,
+            summary["kb_count"],
+            summary["doc_count"],
+            summary["total_chunks"],
+            summary["total_size_mb"],
+            time.time(),
+        ),
+    )
+    conn.execute("DELETE FROM upload_days WHERE user_id = ?", (user_id,))
+    conn.executemany(
+        "INSERT INTO upload_days VALUES (?, ?, ?)", ((user_id, day, n) for day, n in days.items())
+    )
+
+
+def _write_account(conn: sqlite3.Connection, user_id: int, last_login_at: Optional[float]) -> None:
+    """标记为已注册；last_login_at 为 None 时保留原值（注册）。"""
+    conn.execute(
+        """
+        INSERT INTO user_aggregates (user_id, registered, last_login_at, updated_at) VALUES (?, 1, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            registered = 1,
+            last_login_at = COALESCE(excluded.last_login_at, user_aggregates.last_login_at),
+            updated_at = excluded.updated_at
+        """,
+        (user_id, last_login_at, time.time()),
+    )
+
+
+def _run(what: str, user_id: int, fn, *args) -> None:
+    try:
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                fn(conn, int(user_id), *args)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[Analytics] %s失败 user=%s: %s", what, user_id, e)
+
+
+def note_user_documents(user_id: int, meta: Any) -> None:
+    """该用户元数据已保存：按保存的内容重算其汇总行与上传日。"""
+    _run("更新文档汇总", user_id, _write_documents, meta)
+
+
+def note_user_registered(user_id: int) -> None:
+    _run("记录注册", user_id, _write_account, None)
+
+
+def note_user_login(user_id: int, at: Optional[float] = None) -> None:
+    _run("记录登录", user_id, _write_account, time.time() if at is None else float(at))
+
+
+def _forget(conn: sqlite3.Connection, user_id: int) -> None:
+    conn.execute("DELETE FROM user_aggregates WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM upload_days WHERE user_id = ?", (user_id,))
+
+
+def forget_user(user_id: int) -> None:
+    """账号与目录已删除：移除该用户的全部汇总。"""
+    _run("移除汇总", user_id, _forget)
+
+
+def _login_ts(value: Any) -> Optional[float]:
+    from utils.admin_analytics import _parse_iso_dt
+
+    dt = _parse_iso_dt(value)
+    return dt.timestamp() if dt is not None else None
+
+
+def reconcile_all_users() -> int:
+    """按用户表与各用户元数据文件全量重建汇总（含删除残留记录），返回校正的用户数。"""
+    from utils.admin_docs import _iter_user_ids, _load_user_meta
+    from utils.auth_store import list_users_admin
+
+    accounts = {int(r["id"]): _login_ts(r.get("last_login_at")) for r in list_users_admin()}
+    ids = set(accounts) | set(_iter_user_ids())
+    n = 0
+    try:
+        conn = _connect()
+        try:
+            stale = {int(r[0]) for r in conn.execute("SELECT user_id FROM user_aggregates")} - ids
+            for uid in stale:
+                conn.execute("BEGIN IMMEDIATE")
+                _forget(conn, uid)
+                conn.execute("COMMIT")
+            for uid in sorted(ids):
+                if _reconciler.stopping():
+                    break
+                meta = _load_user_meta(uid)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    _write_documents(conn, uid, meta)
+                    if uid in accounts:
+                        conn.execute(
+                            "UPDATE user_aggregates SET registered = 1, last_login_at = ? WHERE user_id = ?",
+                            (accounts[uid], uid),
+                        )
+                    else:
+                        conn.execute(
+                            "UPDATE user_aggregates SET registered = 0, last_login_at = NULL WHERE user_id = ?",
+                            (uid,),
+                        )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                n += 1
+            if not _reconciler.stopping():
+                conn.execute(
+                    "INSERT OR REPLACE INTO aggregates_meta VALUES ('reconciled_at', ?)", (time.time(),)
+                )
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[Analytics] 全量校正失败: %s", e)
+    return n
+
+
+def _ensure_reconciled(conn: sqlite3.Connection) -> None:
+    if conn.execute("SELECT 1 FROM aggregates_meta WHERE key = 'reconciled_at'").fetchone() is None:
+        reconcile_all_users()
+
+
+def overview_totals(active_since: float) -> Dict[str, Any]:
+    """汇总一次聚合查询：注册用户数、活跃用户数、知识库数、文档/分块合计（仅注册用户）、有记录的用户 id（供台账批量取存储量）。"""
+    conn = _connect()
+    try:
+        _ensure_reconciled(conn)
+        row = conn.execute(
+            """
+            SELECT
+                COALESCE(SUM(registered), 0),
+                COALESCE(SUM(CASE WHEN registered = 1 AND last_login_at >= ? THEN 1 ELSE 0 END), 0),
+                COALESCE(SUM(kb_count), 0),
+                COALESCE(SUM(CASE WHEN registered = 1 THEN doc_count ELSE 0 END), 0),
+                COALESCE(SUM(CASE WHEN registered = 1 THEN total_chunks ELSE 0 END), 0)
+            FROM user_aggregates
+            """,
+            (float(active_since),),
+        ).fetchone()
+        ids = conn.execute("SELECT user_id, registered FROM user_aggregates").fetchall()
+    finally:
+        conn.close()
+    return {
+        "user_total": int(row[0]),
+        "users_active": int(row[1]),
+        "knowledge_bases_total": int(row[2]),
+        "documents_total": int(row[3]),
+        "chunks_total": int(row[4]),
+        "user_ids": sorted(int(u) for u, _r in ids),
+        "registered_ids": sorted(int(u) for u, r in ids if r),
+    }
+
+
+def uploads_by_day(first_day: str) -> Dict[str, int]:
+    """first_day（含）起各上传日的未删除文档数，走 upload_days 的日期索引。"""
+    conn = _connect()
+    try:
+        _ensure_reconciled(conn)
+        rows = conn.execute(
+            "SELECT day, SUM(uploads) FROM upload_days WHERE day >= ? GROUP BY day", (first_day,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {str(d): int(n) for d, n in rows}
+
+
+_reconciler = PeriodicReconciler(
+    name="analytics-reconcile",
+    connect=_connect,
+    meta_table="aggregates_meta",
+    interval_sec=_reconcile_interval_sec,
+    reconcile=reconcile_all_users,
+    log_prefix="[Analytics] 汇总",
+)
+
+
+def start_reconciler() -> None:
+    _reconciler.start()
+
+
+def stop_reconciler() -> None:
+    _reconciler.stop()
@@ -10,8 +10,10 @@ from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Resp
 from fastapi.staticfiles import StaticFiles
 from config import STREAMLIT_KB_DIR, WEB_SERVER_DIR, WEB_USERS_ROOT
 from utils.auth_store import init_auth_db, prune_expired_sessions
+from utils.bm25_tokens import start_jieba_preload
+from utils.faiss_tombstones import start_compactor, stop_compactor
 
-from . import ingest_queue, vdb_cache
+from . import analytics_aggregates, ingest_queue, prefetch, storage_ledger, vdb_cache
 from .middleware import auth_kb_audit_middleware
 from .routers import admin_routes, auth_routes, public_routes, rag_routes
 
@@ -61,12 +63,22 @@ async def lifespan(app: FastAPI):
         os.makedirs(WEB_USERS_ROOT, exist_ok=True)
         os.makedirs(STREAMLIT_KB_DIR, exist_ok=True)
         ingest_queue.start_worker()
+        storage_ledger.start_reconciler()
+        analytics_aggregates.start_reconciler()
+        start_compactor()
+        prefetch.start_prefetcher()
+        # jieba 词典约 1 秒的首次载入放到后台，不落在首个混合检索请求内
+        start_jieba_preload()
     try:
         yield
     finally:
         _lifespan_refcount -= 1
         if _lifespan_refcount == 0:
             ingest_queue.stop_worker()
+            storage_ledger.stop_reconciler()
+            analytics_aggregates.stop_reconciler()
+            stop_compactor()
+            prefetch.stop_prefetcher()
             vdb_cache.clear_all_cache()
 
 
@@ -0,0 +1,397 @@
+"""
+入库任务持久化：本地 SQLite（WAL）保存任务状态、租约与心跳，进程重启或多 uvicorn worker 共享同一队列。
+
+- 领取（claim）在 ``BEGIN IMMEDIATE`` 事务内完成，多进程并发领取不会拿到同一任务；
+  空闲轮询先做只读探测（has_claimable），有可领取任务时才开写事务；
+- 领取顺序按「最久未被服务的用户优先」，且跳过已有任务在跑的用户（同用户 FAISS 写入串行）；
+- 运行中的任务持有租约（lease_expires_at），工作线程定期心跳续约；租约过期视为执行者已崩溃，
+  由 ``requeue_expired`` 放回队列，超过最大尝试次数则置为 error。
+
+暂存文件位于本机各用户 knowledge_db/upload_staging，故队列库默认放在本机 WEB_SERVER_DIR，
+可用 ``RAG_INGEST_JOB_DB`` 覆盖路径。
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import WEB_SERVER_DIR
+
+_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        job_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        file_name TEXT NOT NULL,
+        category TEXT NOT NULL DEFAULT '',
+        description TEXT NOT NULL DEFAULT '',
+        staging_path TEXT NOT NULL,
+        status TEXT NOT NULL,
+        chunks INTEGER,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        queue_depth_at_enqueue INTEGER NOT NULL DEFAULT 0,
+        stages_json TEXT NOT NULL DEFAULT '{}',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_expires_at REAL,
+        content_sha256 TEXT,
+        size_bytes INTEGER,
+        compliance_hits_json TEXT,
+        dedup_json TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_user_created ON ingest_jobs (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status_created ON ingest_jobs (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_user_started ON ingest_jobs (user_id, started_at)",
+)
+
+
+# 旧库补列（列已存在时 sqlite 报 duplicate column，忽略）
+_ALTER_TRY = (
+    "ALTER TABLE ingest_jobs ADD COLUMN content_sha256 TEXT",
+    "ALTER TABLE ingest_jobs ADD COLUMN size_bytes INTEGER",
+    "ALTER TABLE ingest_jobs ADD COLUMN compliance_hits_json TEXT",
+    "ALTER TABLE ingest_jobs ADD COLUMN dedup_json TEXT",
+)
+
+
+def default_job_db_path() -> str:
+    p = (os.environ.get("RAG_INGEST_JOB_DB") or "").strip()
+    return p or os.path.join(WEB_SERVER_DIR, "ingest_jobs.sqlite3")
+
+
+def _row_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    d = dict(row)
+    try:
+        d["stages"] = json.loads(d.pop("stages_json") or "{}")
+    except (TypeError, ValueError):
+        d["stages"] = {}
+    raw_hits = d.pop("compliance_hits_json", None)
+    try:
+        d["compliance_hits"] = json.loads(raw_hits) if raw_hits is not None else None
+    except (TypeError, ValueError):
+        d["compliance_hits"] = None
+    raw_dedup = d.pop("dedup_json", None)
+    try:
+        d["dedup"] = json.loads(raw_dedup) if raw_dedup else None
+    except (TypeError, ValueError):
+        d["dedup"] = None
+    return d
+
+
+class IngestJobStore:
+    """每线程一个 sqlite3 连接（autocommit），写事务显式 BEGIN IMMEDIATE。"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = self._conn()
+        for sql in _DDL:
+            conn.execute(sql)
+        for sql in _ALTER_TRY:
+            try:
+                conn.execute(sql)
+            except sqlite3.OperationalError:
+                pass
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # ---------- 写入 ----------
+
+    def insert_queued(
+        self,
+        *,
+        job_id: str,
+        user_id: int,
+        file_name: str,
+        category: str,
+        description: str,
+        staging_path: str,
+        created_at: float,
+        content_sha256: Optional[str] = None,
+        size_bytes: Optional[int] = None,
+        compliance_hits: Optional[List[str]] = None,
+    ) -> int:
+        """插入排队任务，返回入队时全局排队深度（不含本任务）。
+
+        compliance_hits 为上传流式扫描的结果；None 表示未扫描（入库时再从暂存文件扫描）。
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            depth = int(
+                conn.execute("SELECT COUNT(*) FROM ingest_jobs WHERE status = 'queued'").fetchone()[0]
+            )
+            conn.execute(
+                """
+                INSERT INTO ingest_jobs (job_id, user_id, file_name, category, description,
+                    staging_path, status, created_at, queue_depth_at_enqueue,
+                    content_sha256, size_bytes, compliance_hits_json)
+                VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)
+                """,
+                (
+                    job_id,
+                    int(user_id),
+                    file_name,
+                    category,
+                    description,
+                    staging_path,
+                    created_at,
+                    depth,
+                    content_sha256,
+                    size_bytes,
+                    None if compliance_hits is None else json.dumps(compliance_hits, ensure_ascii=False),
+                ),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return depth
+
+    def has_claimable(self) -> bool:
+        """只读探测是否有可领取任务（排队中或租约已过期）；空闲轮询先探测，避免反复抢写锁。"""
+        row = self._conn().execute(
+            """
+            SELECT 1 FROM ingest_jobs
+            WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?)
+            LIMIT 1
+            """,
+            (time.time(),),
+        ).fetchone()
+        return row is not None
+
+    def claim_next(
+        self, owner: str, lease_sec: float, max_attempts: int
+    ) -> Tuple[Optional[Dict[str, Any]], List[Tuple[int, str]]]:
+        """领取下一个任务（先回收过期租约），返回 (任务或 None, 超过尝试次数置 error 的 (user_id, 暂存路径))。
+
+        暂存路径由调用方删除，否则要到下次启动恢复才清理，期间仍计入用户存储占用。
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            failed = self._requeue_expired_in_tx(conn, now, max_attempts)
+            row = conn.execute(
+                """
+                SELECT j.job_id FROM ingest_jobs j
+                LEFT JOIN (
+                    SELECT user_id, MAX(started_at) AS last_start FROM ingest_jobs GROUP BY user_id
+                ) u ON u.user_id = j.user_id
+                WHERE j.status = 'queued'
+                  AND j.user_id NOT IN (SELECT user_id FROM ingest_jobs WHERE status = 'running')
+                ORDER BY COALESCE(u.last_start, 0), j.created_at
+                LIMIT 1
+                """
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None, failed
+            conn.execute(
+                """
+                UPDATE ingest_jobs SET status = 'running', started_at = ?, attempts = attempts + 1,
+                    lease_owner = ?, lease_expires_at = ?
+                WHERE job_id = ?
+                """,
+                (now, owner, now + lease_sec, row["job_id"]),
+            )
+            out = conn.execute("SELECT * FROM ingest_jobs WHERE job_id = ?", (row["job_id"],)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return _row_dict(out), failed
+
+    def heartbeat(self, job_id: str, owner: str, lease_sec: float, stages: Dict[str, float]) -> bool:
+        """续约并落盘阶段耗时；租约已不属于 owner 时返回 False。"""
+        cur = self._conn().execute(
+            """
+            UPDATE ingest_jobs SET lease_expires_at = ?, stages_json = ?
+            WHERE job_id = ? AND status = 'running' AND lease_owner = ?
+            """,
+            (time.time() + lease_sec, json.dumps(stages, ensure_ascii=False), job_id, owner),
+        )
+        return cur.rowcount > 0
+
+    def finish(
+        self,
+        job_id: str,
+        owner: str,
+        *,
+        status: str,
+        chunks: Optional[int],
+        error: Optional[str],
+        stages: Dict[str, float],
+        dedup: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """仅租约持有者可写终态；返回 False 表示任务已被回收（勿再清理其暂存文件）。"""
+        cur = self._conn().execute(
+            """
+            UPDATE ingest_jobs SET status = ?, chunks = ?, error = ?, finished_at = ?,
+                stages_json = ?, dedup_json = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE job_id = ? AND status = 'running' AND lease_owner = ?
+            """,
+            (
+                status,
+                chunks,
+                error,
+                time.time(),
+                json.dumps(stages, ensure_ascii=False),
+                json.dumps(dedup, ensure_ascii=False) if dedup else None,
+                job_id,
+                owner,
+            ),
+        )
+        return cur.rowcount > 0
+
+    def mark_error(self, job_id: str, error: str) -> None:
+        self._conn().execute(
+            """
+            UPDATE ingest_jobs SET status = 'error', error = ?, finished_at = ?,
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE job_id = ? AND status IN ('queued', 'running')
+            """,
+            (error, time.time(), job_id),
+        )
+
+    def delete(self, job_id: str) -> None:
+        self._conn().execute("DELETE FROM ingest_jobs WHERE job_id = ?", (job_id,))
+
+    def prune_terminal(self, keep: int) -> None:
+        self._conn().execute(
+            """
+            DELETE FROM ingest_jobs WHERE status IN ('done', 'error') AND job_id NOT IN (
+                SELECT job_id FROM ingest_jobs WHERE status IN ('done', 'error')
+                ORDER BY created_at DESC LIMIT ?
+            )
+            """,
+            (int(keep),),
+        )
+
+    def _requeue_expired_in_tx(
+        self, conn: sqlite3.Connection, now: float, max_attempts: int
+    ) -> List[Tuple[int, str]]:
+        """租约过期的 running 任务：未超次数放回 queued，否则置 error；返回置 error 的 (user_id, 暂存路径)。"""
+        rows = conn.execute(
+            """
+            SELECT job_id, user_id, attempts, staging_path FROM ingest_jobs
+            WHERE status = 'running' AND lease_expires_at IS NOT NULL AND lease_expires_at < ?
+            """,
+            (now,),
+        ).fetchall()
+        failed: List[Tuple[int, str]] = []
+        for r in rows:
+            if int(r["attempts"]) >= max_attempts:
+                conn.execute(
+                    """
+                    UPDATE ingest_jobs SET status = 'error', finished_at = ?, lease_owner = NULL,
+                        lease_expires_at = NULL, error = '入库任务多次中断（进程退出或超时），请重新上传'
+                    WHERE job_id = ?
+                    """,
+                    (now, r["job_id"]),
+                )
+                failed.append((int(r["user_id"]), r["staging_path"]))
+            else:
+                conn.execute(
+                    """
+                    UPDATE ingest_jobs SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL
+                    WHERE job_id = ?
+                    """,
+                    (r["job_id"],),
+                )
+        return failed
+
+    def requeue_expired(self, max_attempts: int, *, now: Optional[float] = None) -> List[Tuple[int, str]]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            failed = self._requeue_expired_in_tx(conn, time.time() if now is None else now, max_attempts)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return failed
+
+    def expire_leases_of(self, owners: List[str]) -> None:
+        """已确认死亡的执行者：租约立即过期，下次领取时回收。"""
+        if not owners:
+            return
+        self._conn().executemany(
+            "UPDATE ingest_jobs SET lease_expires_at = 0 WHERE status = 'running' AND lease_owner = ?",
+            [(o,) for o in owners],
+        )
+
+    # ---------- 读取 ----------
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _row_dict(row)
+
+    def list_for_user(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM ingest_jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (int(user_id), int(limit)),
+        ).fetchall()
+        return [_row_dict(r) for r in rows]
+
+    def list_active(self) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM ingest_jobs WHERE status IN ('queued', 'running')"
+        ).fetchall()
+        return [_row_dict(r) for r in rows]
+
+    def count_active_for_user(self, user_id: int) -> int:
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM ingest_jobs WHERE user_id = ? AND status IN ('queued', 'running')",
+            (int(user_id),),
+        ).fetchone()
+        return int(row[0])
+
+    def queue_position(self, job_id: str, user_id: int, created_at: float) -> Tuple[int, int]:
+        """返回 (该用户队列中的位置，从 1 起, 全局排队深度)。"""
+        conn = self._conn()
+        pos = conn.execute(
+            """
+            SELECT COUNT(*) FROM ingest_jobs
+            WHERE user_id = ? AND status = 'queued' AND (created_at < ? OR (created_at = ? AND job_id <= ?))
+            """,
+            (int(user_id), created_at, created_at, job_id),
+        ).fetchone()[0]
+        depth = conn.execute("SELECT COUNT(*) FROM ingest_jobs WHERE status = 'queued'").fetchone()[0]
+        return int(pos), int(depth)
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._conn().execute(
+            """
+            SELECT status, COUNT(*) AS n, COUNT(DISTINCT user_id) AS u FROM ingest_jobs
+            WHERE status IN ('queued', 'running') GROUP BY status
+            """
+        ).fetchall()
+        by = {r["status"]: (int(r["n"]), int(r["u"])) for r in rows}
+        return {
+            "ingest_queue_depth": by.get("queued", (0, 0))[0],
+            "ingest_users_waiting": by.get("queued", (0, 0))[1],
+            "ingest_users_running": by.get("running", (0, 0))[1],
+        }
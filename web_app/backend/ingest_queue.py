@@ -2,43 +2,84 @@
 异步入库队列：HTTP 仅负责校验与落盘，解析/切分/向量写入在独立线程中执行，
 避免阻塞 asyncio 事件循环导致「一人上传、全站卡住」。
 
-注意：任务状态保存在进程内存；多 worker（uvicorn --workers N）时需改为 Redis 等外部队列。
+调度：``RAG_INGEST_WORKERS`` 个工作线程（默认 2）从持久化任务库按用户公平领取任务
+（最久未被服务的用户优先），同一用户同一时刻最多一个任务在跑——其 FAISS 写入天然串行，
+而一人的大扫描件不再挡住其他用户的小文件。
+解析阶段可另开进程池（见 utils.file_loader 的 ``RAG_INGEST_PARSE_PROCESSES``）。
+
+任务状态持久化在本地 SQLite（见 ingest_job_store）：运行中任务持租约并定期心跳，
+进程崩溃后租约过期自动重新排队；启动时回收本机已退出进程的任务并清理孤儿暂存文件。
+同机多 uvicorn worker 共享同一任务库。
 """
 from __future__ import annotations
 
+import logging
 import os
-import queue
+import socket
 import threading
 import time
+import uuid
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from utils.bytes_upload import BytesUploadFile
+from config import WEB_USERS_ROOT
+from utils.bytes_upload import StagedUploadFile
 from utils.metadata_manager import get_all_documents
 from utils.path_context import get_kb_dir, reset_kb_context, set_user_kb_context
 from utils.web_system_settings import get_max_docs_per_user
 
 from . import vdb_cache
+from .ingest_job_store import IngestJobStore, default_job_db_path
+from .storage_ledger import note_document_storage_changed, note_storage_changed
 
 from services.ingest import ingest_file
-from utils.compliance import apply_compliance_after_staged_ingest
+from utils.compliance import COMPLIANCE_SAMPLE_BYTES, apply_compliance_hits, scan_sensitive_sample
 
-_MAX_JOBS_RETAINED = 400
-_SENTINEL = object()
+logger = logging.getLogger(__name__)
 
-_jobs_lock = threading.Lock()
-_jobs: Dict[str, "IngestJobRecord"] = {}
+_MAX_JOBS_RETAINED = 400
+_MAX_ATTEMPTS = 3
+# 孤儿暂存文件（无对应活动任务）超过该时长才清理，避免误删其他进程刚落盘、尚未入队的文件
+_ORPHAN_STAGING_GRACE_SEC = 600
 
+# 本进程内「已预留名额、尚未写入任务库」的上传数；入库后由任务库 queued/running 计数接管
 _pending_lock = threading.Lock()
 _pending_by_user: Dict[int, int] = {}
 
 _user_ingest_locks: Dict[int, threading.Lock] = {}
 _user_locks_master = threading.Lock()
 
-_task_queue: "queue.Queue[Any]" = queue.Queue()
-_worker_thread: Optional[threading.Thread] = None
+_store: Optional[IngestJobStore] = None
+_store_lock = threading.Lock()
+_wake = threading.Condition()
+_worker_threads: List[threading.Thread] = []
 _shutdown = threading.Event()
 
+# 租约持有者标识：主机 + pid + 随机后缀（pid 复用时仍可区分）
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _ingest_worker_count() -> int:
+    try:
+        return max(1, min(int(os.environ.get("RAG_INGEST_WORKERS", "2")), 16))
+    except ValueError:
+        return 2
+
+
+def _lease_sec() -> float:
+    try:
+        return max(15.0, float(os.environ.get("RAG_INGEST_LEASE_SEC", "120")))
+    except ValueError:
+        return 120.0
+
+
+def _get_store() -> IngestJobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IngestJobStore(default_job_db_path())
+        return _store
+
 
 @dataclass
 class IngestJobRecord:
@@ -51,7 +92,16 @@ class IngestJobRecord:
     chunks: Optional[int] = None
     error: Optional[str] = None
     created_at: float = field(default_factory=lambda: time.time())
+    started_at: Optional[float] = None
     finished_at: Optional[float] = None
+    queue_depth_at_enqueue: int = 0
+    # 各阶段耗时（毫秒）：parse / chunk / embed_write / stream / compliance / cache_refresh
+    stages: Dict[str, float] = field(default_factory=dict)
+    attempts: int = 0
+    content_sha256: Optional[str] = None
+    size_bytes: Optional[int] = None
+    # 去重结果：chunks_embedded / chunks_reused / chunks_replaced，整文件重复时另有 file、duplicate_of
+    dedup: Optional[Dict[str, Any]] = None
 
 
 @dataclass
@@ -62,6 +112,30 @@ class IngestTask:
     category: str
     description: str
     staging_path: str
+    compliance_hits: Optional[List[str]] = None
+    content_sha256: Optional[str] = None
+
+
+def _record_from_row(row: Dict[str, Any]) -> IngestJobRecord:
+    return IngestJobRecord(
+        job_id=row["job_id"],
+        user_id=int(row["user_id"]),
+        file_name=row["file_name"],
+        category=row["category"],
+        description=row["description"],
+        status=row["status"],
+        chunks=row["chunks"],
+        error=row["error"],
+        created_at=float(row["created_at"]),
+        started_at=row["started_at"],
+        finished_at=row["finished_at"],
+        queue_depth_at_enqueue=int(row["queue_depth_at_enqueue"] or 0),
+        stages=row.get("stages") or {},
+        attempts=int(row["attempts"] or 0),
+        content_sha256=row.get("content_sha256"),
+        size_bytes=row.get("size_bytes"),
+        dedup=row.get("dedup"),
+    )
 
 
 def _user_lock(uid: int) -> threading.Lock:
@@ -74,10 +148,11 @@ def _user_lock(uid: int) -> threading.Lock:
 def try_reserve_ingest_slot(user_id: int) -> tuple[bool, str]:
     """在已绑定用户知识库上下文的请求线程中调用。"""
     max_docs = get_max_docs_per_user()
+    active = _get_store().count_active_for_user(user_id)
     with _pending_lock:
         cur = len(get_all_documents())
         pend = _pending_by_user.get(user_id, 0)
-        if cur + pend >= max_docs:
+        if cur + active + pend >= max_docs:
             return False, f"已达到单用户最大文档数限制（{max_docs}）"
         _pending_by_user[user_id] = pend + 1
         return True, ""
@@ -92,17 +167,6 @@ def release_ingest_slot(user_id: int) -> None:
             _pending_by_user[user_id] = v - 1
 
 
-def _prune_jobs_unlocked() -> None:
-    if len(_jobs) <= _MAX_JOBS_RETAINED:
-        return
-    terminal = [(jid, j) for jid, j in _jobs.items() if j.status in ("done", "error")]
-    terminal.sort(key=lambda x: x[1].created_at)
-    for jid, _ in terminal:
-        if len(_jobs) <= _MAX_JOBS_RETAINED:
-            break
-        _jobs.pop(jid, None)
-
-
 def enqueue_staged_file(
     job_id: str,
     user_id: int,
@@ -110,88 +174,126 @@ def enqueue_staged_file(
     category: str,
     description: str,
     staging_path: str,
+    *,
+    content_sha256: Optional[str] = None,
+    size_bytes: Optional[int] = None,
+    compliance_hits: Optional[List[str]] = None,
 ) -> None:
-    rec = IngestJobRecord(
+    """写入任务库（此后名额由 queued/running 计数占用，释放本进程预留）并唤醒工作线程。"""
+    store = _get_store()
+    store.insert_queued(
         job_id=job_id,
         user_id=user_id,
         file_name=file_name,
         category=category,
         description=description,
-        status="queued",
+        staging_path=staging_path,
+        created_at=time.time(),
+        content_sha256=content_sha256,
+        size_bytes=size_bytes,
+        compliance_hits=compliance_hits,
     )
-    with _jobs_lock:
-        _jobs[job_id] = rec
-        _prune_jobs_unlocked()
-    _task_queue.put(
-        IngestTask(
-            job_id=job_id,
-            user_id=user_id,
-            file_name=file_name,
-            category=category,
-            description=description,
-            staging_path=staging_path,
-        )
+    release_ingest_slot(user_id)
+    try:
+        store.prune_terminal(_MAX_JOBS_RETAINED)
+    except Exception as e:  # noqa: BLE001 — 清理历史任务失败不影响本次入队
+        logger.warning("清理历史入库任务失败: %s", e)
+    with _wake:
+        _wake.notify()
+
+
+def _claim_and_sweep() -> Optional[Dict[str, Any]]:
+    """领取一个任务；顺带回收的多次中断任务已置 error，删除其暂存文件（与启动恢复一致）。"""
+    store = _get_store()
+    # 空闲时只做只读探测，不占写锁（多进程多 worker 每 0.5 秒轮询，会与心跳、入队争锁）
+    if not store.has_claimable():
+        return None
+    row, failed = store.claim_next(_OWNER, _lease_sec(), _MAX_ATTEMPTS)
+    _drop_failed_staging(failed)
+    return row
+
+
+def _next_task(timeout: float) -> Optional[IngestTask]:
+    """从任务库领取下一个任务；暂无可领取任务时等待至多 timeout 秒（本进程入队会提前唤醒）。"""
+    row = _claim_and_sweep()
+    if row is None and timeout > 0 and not _shutdown.is_set():
+        with _wake:
+            _wake.wait(timeout)
+        row = _claim_and_sweep()
+    if row is None:
+        return None
+    return IngestTask(
+        job_id=row["job_id"],
+        user_id=int(row["user_id"]),
+        file_name=row["file_name"],
+        category=row["category"],
+        description=row["description"],
+        staging_path=row["staging_path"],
+        compliance_hits=row.get("compliance_hits"),
+        content_sha256=row.get("content_sha256"),
     )
 
 
+def ingest_queue_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = {"ingest_workers": sum(1 for t in _worker_threads if t.is_alive())}
+    out.update(_get_store().stats())
+    return out
+
+
 def forget_job(job_id: str) -> None:
-    with _jobs_lock:
-        _jobs.pop(job_id, None)
+    _get_store().delete(job_id)
 
 
 def get_job_for_user(job_id: str, user_id: int) -> Optional[IngestJobRecord]:
-    with _jobs_lock:
-        rec = _jobs.get(job_id)
-        if rec is None or rec.user_id != user_id:
-            return None
-        return rec
+    row = _get_store().get(job_id)
+    if row is None or int(row["user_id"]) != int(user_id):
+        return None
+    return _record_from_row(row)
 
 
 def list_jobs_for_user(user_id: int, limit: int = 40) -> List[IngestJobRecord]:
-    with _jobs_lock:
-        mine = [j for j in _jobs.values() if j.user_id == user_id]
-    mine.sort(key=lambda x: x.created_at, reverse=True)
-    return mine[:limit]
+    return [_record_from_row(r) for r in _get_store().list_for_user(user_id, limit)]
 
 
 def job_to_dict(rec: IngestJobRecord) -> Dict[str, Any]:
-    return {
+    waited_until = rec.started_at if rec.started_at is not None else time.time()
+    out: Dict[str, Any] = {
         "job_id": rec.job_id,
         "file_name": rec.file_name,
         "status": rec.status,
         "chunks": rec.chunks,
         "error": rec.error,
         "created_at": rec.created_at,
+        "started_at": rec.started_at,
         "finished_at": rec.finished_at,
+        "wait_ms": round(max(0.0, waited_until - rec.created_at) * 1000, 1),
+        "queue_depth_at_enqueue": rec.queue_depth_at_enqueue,
+        "stages": dict(rec.stages),
+        "attempts": rec.attempts,
+        "size_bytes": rec.size_bytes,
+        "dedup": rec.dedup,
     }
-
-
-def _update_job(job_id: str, **kwargs: Any) -> None:
-    with _jobs_lock:
-        rec = _jobs.get(job_id)
-        if rec is None:
-            return
-        for k, v in kwargs.items():
-            setattr(rec, k, v)
+    if rec.status == "queued":
+        pos, depth = _get_store().queue_position(rec.job_id, rec.user_id, rec.created_at)
+        out["queue_position"] = pos
+        out["queue_depth"] = depth
+    return out
 
 
 def _load_vdb_from_disk(kb_dir: str) -> Any:
-    """从磁盘加载最新 FAISS（预热线程用，不复用入库的内存副本）。
+    """从磁盘加载最新 FAISS（预热线程用，不复用入库的内存副本；只读，走 mmap 映射）。
 
     持有 faiss 写锁加载：防止读到另一写者 save_local 到一半的文件。
     """
-    from langchain_community.vectorstores import FAISS
-
     from utils.embedding import get_embeddings
+    from utils.faiss_tombstones import load_faiss_index
     from utils.faiss_write_lock import faiss_write_lock
 
     idx_dir = os.path.join(kb_dir, "faiss_index")
     if not os.path.isfile(os.path.join(idx_dir, "index.faiss")):
         return None
     with faiss_write_lock(kb_dir):
-        return FAISS.load_local(
-            idx_dir, embeddings=get_embeddings(), allow_dangerous_deserialization=True
-        )
+        return load_faiss_index(idx_dir, get_embeddings(), read_only=True)
 
 
 _prewarm_running: set = set()
@@ -209,8 +311,6 @@ def _invalidate_and_prewarm_bm25(user_id: int) -> None:
        若同用户的后续任务在本任务与预热执行之间完成，旧快照会把索引写回旧状态。
     """
     try:
-        import logging
-
         from utils.hybrid_search import invalidate_bm25_index, rebuild_bm25_index
 
         invalidate_bm25_index()
@@ -234,8 +334,9 @@ def _invalidate_and_prewarm_bm25(user_id: int) -> None:
                 if fresh_vdb is None:
                     return
                 rebuild_bm25_index(fresh_vdb)
+                note_storage_changed(user_id, kb_dir)
             except Exception as e:  # noqa: BLE001 — 后台预热失败不应影响主流程
-                logging.getLogger(__name__).warning("BM25 后台预热失败: %s", e)
+                logger.warning("BM25 后台预热失败: %s", e)
             finally:
                 if t_kb is not None:
                     reset_kb_context(t_kb, t_api)
@@ -244,21 +345,67 @@ def _invalidate_and_prewarm_bm25(user_id: int) -> None:
 
         threading.Thread(target=_prewarm, name=f"bm25-prewarm-{user_id}", daemon=True).start()
     except Exception as e:  # noqa: BLE001
-        import logging
+        logger.warning("BM25 失效/预热调度失败: %s", e)
+
+
+def _unlink_quiet(path: str) -> None:
+    try:
+        if path and os.path.isfile(path):
+            os.unlink(path)
+    except OSError:
+        pass
 
-        logging.getLogger(__name__).warning("BM25 失效/预热调度失败: %s", e)
+
+class IngestLeaseLost(RuntimeError):
+    """任务租约已被回收（可能已由其他执行者重新领取），本次执行不得再写入。"""
+
+
+def _drop_failed_staging(failed: List[Tuple[int, str]]) -> None:
+    """多次中断置 error 的任务不会再执行：删除其暂存文件并更新存储台账（不再计入配额）。"""
+    for uid, path in failed:
+        _unlink_quiet(path)
+        note_storage_changed(uid, path)
+
+
+def _heartbeat_loop(
+    job_id: str, stages: Dict[str, float], stop: threading.Event, lease_lost: threading.Event
+) -> None:
+    lease = _lease_sec()
+    while not stop.wait(lease / 3.0):
+        try:
+            if not _get_store().heartbeat(job_id, _OWNER, lease, dict(stages)):
+                logger.warning("入库任务 %s 租约已被回收，中止后续写入", job_id)
+                lease_lost.set()
+                return
+        except Exception as e:  # noqa: BLE001 — 心跳失败仅记录，租约到期前仍可重试
+            logger.warning("入库任务 %s 心跳失败: %s", job_id, e)
 
 
 def _process_one_task(task: IngestTask) -> None:
-    _update_job(task.job_id, status="running")
+    stages: Dict[str, float] = {}
+    hb_stop = threading.Event()
+    lease_lost = threading.Event()
+    threading.Thread(
+        target=_heartbeat_loop,
+        args=(task.job_id, stages, hb_stop, lease_lost),
+        name=f"ingest-heartbeat-{task.job_id[:8]}",
+        daemon=True,
+    ).start()
+
+    def ensure_lease() -> None:
+        # 写 FAISS、登记合规结果、刷新缓存前检查：租约丢失后另一执行者可能已在处理同一任务
+        if lease_lost.is_set():
+            raise IngestLeaseLost("入库任务租约已被回收，已中止写入")
+
+    status, chunks, err = "error", None, None
+    dedup: Dict[str, Any] = {}
     t_kb, t_api = set_user_kb_context(task.user_id)
     try:
         with _user_lock(task.user_id):
             if not os.path.isfile(task.staging_path):
                 raise FileNotFoundError("暂存文件已丢失，请重新上传")
-            with open(task.staging_path, "rb") as f:
-                data = f.read()
-            buf = BytesUploadFile(task.file_name, data)
+            # 暂存文件就地解析，不整文件读入内存
+            buf = StagedUploadFile(task.file_name, task.staging_path, task.content_sha256)
             # 私有 vdb 副本：入库会原地修改内存索引，与缓存对象（检索线程在用）共享会竞态；
             # 嵌入模型可复用（推理线程安全）。写盘由 faiss_write_lock 串行化。
             from utils.db import get_vector_db
@@ -270,61 +417,148 @@ def _process_one_task(task: IngestTask) -> None:
                 vdb,
                 category=task.category.strip() or "默认知识库",
                 description=task.description or "",
+                stage_timings=stages,
+                dedup_stats=dedup,
+                abort_check=ensure_lease,
             )
-            apply_compliance_after_staged_ingest(task.user_id, task.file_name, data)
+            if dedup.get("file") == "duplicate_of_other":
+                # 内容与另一文档相同，未入库：不登记合规结果，也无需刷新缓存
+                status, chunks = "done", 0
+                return
+            ensure_lease()
+            t0 = time.perf_counter()
+            hits = task.compliance_hits
+            if hits is None:
+                # 旧任务（上传时未流式扫描）：从暂存文件开头取样
+                with open(task.staging_path, "rb") as f:
+                    hits = scan_sensitive_sample(f.read(COMPLIANCE_SAMPLE_BYTES))
+            apply_compliance_hits(task.user_id, task.file_name, hits)
+            stages["compliance"] = round((time.perf_counter() - t0) * 1000, 1)
+            ensure_lease()
+            t0 = time.perf_counter()
             vdb_cache.bump_user_cache(task.user_id)
             _invalidate_and_prewarm_bm25(task.user_id)
-        _update_job(
-            task.job_id,
-            status="done",
-            chunks=int(n),
-            finished_at=time.time(),
-            error=None,
-        )
+            stages["cache_refresh"] = round((time.perf_counter() - t0) * 1000, 1)
+        status, chunks = "done", int(n)
     except Exception as e:
-        _update_job(
-            task.job_id,
-            status="error",
-            error=str(e),
-            finished_at=time.time(),
-        )
+        err = str(e)
     finally:
+        hb_stop.set()
         reset_kb_context(t_kb, t_api)
-        try:
-            if os.path.isfile(task.staging_path):
-                os.unlink(task.staging_path)
-        except OSError:
-            pass
-        release_ingest_slot(task.user_id)
+        owned = _get_store().finish(
+            task.job_id, _OWNER, status=status, chunks=chunks, error=err, stages=stages, dedup=dedup
+        )
+        # 租约已被回收时任务可能正由其他执行者处理，不能删其暂存文件
+        if owned:
+            _unlink_quiet(task.staging_path)
+        note_document_storage_changed(task.user_id, task.file_name, task.staging_path)
 
 
 def _worker_loop() -> None:
     while not _shutdown.is_set():
         try:
-            task = _task_queue.get(timeout=0.5)
-        except queue.Empty:
+            task = _next_task(timeout=0.5)
+        except Exception as e:  # noqa: BLE001 — 任务库短暂不可用（锁超时等）时退避重试
+            logger.warning("领取入库任务失败: %s", e)
+            _shutdown.wait(2.0)
+            continue
+        if task is None:
+            continue
+        _process_one_task(task)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _iter_staging_files():
+    if not os.path.isdir(WEB_USERS_ROOT):
+        return
+    for uid in os.listdir(WEB_USERS_ROOT):
+        d = os.path.join(WEB_USERS_ROOT, uid, "knowledge_db", "upload_staging")
+        if not os.path.isdir(d):
+            continue
+        for name in os.listdir(d):
+            yield os.path.join(d, name), name
+
+
+def _recover_on_startup() -> None:
+    """启动恢复：回收本机已退出进程持有的任务、标记暂存文件已丢失的排队任务、清理孤儿暂存文件。"""
+    store = _get_store()
+    host = socket.gethostname()
+    active = store.list_active()
+    dead_owners = set()
+    for row in active:
+        owner = row.get("lease_owner") or ""
+        parts = owner.split(":")
+        if row["status"] != "running" or len(parts) < 3 or parts[0] != host or owner == _OWNER:
+            continue
+        try:
+            pid = int(parts[1])
+        except ValueError:
+            continue
+        # 同 pid 而随机后缀不同：容器重启后 pid 被本进程复用（常见 PID 1），原持有者已退出
+        if pid == os.getpid() or not _pid_alive(pid):
+            dead_owners.add(owner)
+    store.expire_leases_of(sorted(dead_owners))
+    _drop_failed_staging(store.requeue_expired(_MAX_ATTEMPTS))
+
+    referenced = set()
+    for row in store.list_active():
+        if row["status"] == "queued" and not os.path.isfile(row["staging_path"]):
+            store.mark_error(row["job_id"], "暂存文件已丢失，请重新上传")
+            continue
+        referenced.add(os.path.abspath(row["staging_path"]))
+    now = time.time()
+    removed = 0
+    for path, _name in _iter_staging_files():
+        if os.path.abspath(path) in referenced:
             continue
-        if task is _SENTINEL:
-            _task_queue.task_done()
-            break
         try:
-            _process_one_task(task)
-        finally:
-            _task_queue.task_done()
+            if now - os.path.getmtime(path) < _ORPHAN_STAGING_GRACE_SEC:
+                continue
+        except OSError:
+            continue
+        _unlink_quiet(path)
+        removed += 1
+    if dead_owners or removed:
+        logger.info("入库队列启动恢复：回收 %d 个已退出执行者的任务，清理孤儿暂存文件 %d 个", len(dead_owners), removed)
 
 
 def start_worker() -> None:
-    global _worker_thread
-    if _worker_thread is not None and _worker_thread.is_alive():
+    global _worker_threads
+    alive = [t for t in _worker_threads if t.is_alive()]
+    want = _ingest_worker_count()
+    if len(alive) >= want:
         return
     _shutdown.clear()
-    _worker_thread = threading.Thread(target=_worker_loop, name="ingest-worker", daemon=True)
-    _worker_thread.start()
+    if not alive:
+        try:
+            _recover_on_startup()
+        except Exception as e:  # noqa: BLE001 — 恢复失败不阻止服务启动
+            logger.warning("入库队列启动恢复失败: %s", e)
+    for i in range(len(alive), want):
+        t = threading.Thread(target=_worker_loop, name=f"ingest-worker-{i}", daemon=True)
+        t.start()
+        alive.append(t)
+    _worker_threads = alive
 
 
 def stop_worker() -> None:
     _shutdown.set()
-    _task_queue.put(_SENTINEL)
-    t = _worker_thread
-    if t is not None and t.is_alive():
-        t.join(timeout=5.0)
+    with _wake:
+        _wake.notify_all()
+    for t in list(_worker_threads):
+        if t.is_alive():
+            t.join(timeout=5.0)
+    from utils.file_loader import shutdown_parse_pool
+    from utils.pdf_ocr import shutdown_ocr_pool
+
+    shutdown_parse_pool()
+    shutdown_ocr_pool()
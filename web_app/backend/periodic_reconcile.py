@@ -0,0 +1,97 @@
+"""
+物化台账 / 汇总库共用的后台全量校正线程（storage_ledger、analytics_aggregates）。
+
+线程每隔 min(周期, 300 秒) 醒来，在库的 meta 表中抢占 ``full_reconcile_at`` 时间戳：
+距上次全量校正不足一个周期则跳过，否则写入当前时间并执行校正。BEGIN IMMEDIATE 保证
+多个 worker 进程同一周期只有一个抢到。周期 <= 0 时不启动线程。
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicReconciler:
+    """
+    :param name: 线程名
+    :param connect: 打开（并建表）所属 SQLite 库的函数
+    :param meta_table: 库中 (key TEXT PRIMARY KEY, value REAL) 的 meta 表名
+    :param interval_sec: 读取校正周期（秒，<= 0 关闭）的函数，启动时调用
+    :param reconcile: 全量校正函数，返回校正的用户数；应在 stopping() 为真时尽早返回
+    :param log_prefix: 日志前缀，如 "[Storage] 台账"
+    """
+
+    def __init__(
+        self,
+        name: str,
+        connect: Callable[[], sqlite3.Connection],
+        meta_table: str,
+        interval_sec: Callable[[], float],
+        reconcile: Callable[[], int],
+        log_prefix: str,
+    ) -> None:
+        self.name = name
+        self._connect = connect
+        self._meta_table = meta_table
+        self._interval_sec = interval_sec
+        self._reconcile = reconcile
+        self._log_prefix = log_prefix
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+
+    def claim(self, interval: float) -> bool:
+        """抢占本周期的全量校正；已有进程在周期内校正过时返回 False。"""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    f"SELECT value FROM {self._meta_table} WHERE key = 'full_reconcile_at'"
+                ).fetchone()
+                now = time.time()
+                if row is not None and now - float(row[0]) < interval:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute(f"INSERT OR REPLACE INTO {self._meta_table} VALUES ('full_reconcile_at', ?)", (now,))
+                conn.execute("COMMIT")
+                return True
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("%s校正抢占失败: %s", self._log_prefix, e)
+            return False
+
+    def _loop(self, interval: float) -> None:
+        while not self._stop.wait(min(interval, 300.0)):
+            if not self.claim(interval):
+                continue
+            t0 = time.perf_counter()
+            try:
+                n = self._reconcile()
+            except Exception:  # noqa: BLE001 — 单轮失败（如账号库异常）不能让校正线程退出
+                logger.exception("%s全量校正失败", self._log_prefix)
+                continue
+            logger.info("%s全量校正 %d 个用户，耗时 %.1fs", self._log_prefix, n, time.perf_counter() - t0)
+
+    def start(self) -> None:
+        interval = self._interval_sec()
+        if interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        t = self._thread
+        self._thread = None
+        if t is not None:
+            t.join(timeout=5.0)
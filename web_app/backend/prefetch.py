@@ -0,0 +1,189 @@
+"""登录 / 会话恢复 / 上传任务轮询时后台预取用户索引，让首个问答直接命中热缓存。
+
+首问原本要在请求内完成 FAISS 载入、BM25 反序列化（或重建）与重排模型构造，常达数秒。现在这些入口只排队：
+
+- 有界线程池 RAG_PREFETCH_WORKERS（默认 2）执行，排队上限 RAG_PREFETCH_MAX_PENDING（默认 64），满了直接丢弃；
+- 按 user_id 去重：同一用户已在排队/执行时不再提交；vdb_cache 已是最新且 BM25 已在内存时跳过；
+- 分阶段执行（向量库 → BM25 → 重排模型），阶段之间检查取消标记；登出、注销时 cancel_prefetch；
+- BM25：磁盘上已有索引则载入；尚无索引且管理员默认检索模式为 hybrid 时才重建。
+  重排模型（进程级共享）仅在管理员默认开启重排时预取。
+
+Streamlit 与测试未调用 start_prefetcher 时 schedule_prefetch 直接返回 False。RAG_PREFETCH=0 关闭。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from utils.env_numbers import env_int
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch_enabled() -> bool:
+    return (os.environ.get("RAG_PREFETCH") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+@dataclass
+class _Task:
+    user_id: int
+    reason: str
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    future: Optional[Future] = None
+
+
+@dataclass
+class _Stats:
+    scheduled: int = 0
+    deduped: int = 0
+    skipped_warm: int = 0
+    dropped: int = 0
+    cancelled: int = 0
+    completed: int = 0
+    failed: int = 0
+
+
+_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_tasks: Dict[int, _Task] = {}
+_stats = _Stats()
+
+
+def start_prefetcher() -> None:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=env_int("RAG_PREFETCH_WORKERS", 2, 1, 16),
+                thread_name_prefix="rag-prefetch",
+            )
+
+
+def stop_prefetcher() -> None:
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+        for t in _tasks.values():
+            t.cancelled.set()
+        _tasks.clear()
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _bm25_warm(kb_dir: str) -> bool:
+    from utils.hybrid_search import bm25_cached_bytes
+
+    return bm25_cached_bytes(kb_dir) > 0
+
+
+def _bm25_wanted(kb_dir: str) -> bool:
+    from utils.hybrid_search import _bm25_docs_file, _bm25_index_file
+    from utils.path_context import kb_dir_context
+    from utils.web_system_settings import get_rag_defaults_dict
+
+    with kb_dir_context(kb_dir):
+        if os.path.isfile(_bm25_index_file()) and os.path.isfile(_bm25_docs_file()):
+            return True
+    return get_rag_defaults_dict().get("default_search_mode") == "hybrid"
+
+
+def schedule_prefetch(user_id: int, reason: str = "") -> bool:
+    """排队预取该用户的向量库 / BM25 / 重排模型；未排队（关闭、重复、已热、队列满）时返回 False。"""
+    from config import WEB_USERS_ROOT
+
+    from . import vdb_cache
+
+    if not prefetch_enabled():
+        return False
+    uid = int(user_id)
+    kb = os.path.join(WEB_USERS_ROOT, str(uid), "knowledge_db")
+    if _pool is None:
+        return False
+    warm = vdb_cache.is_warm(uid, kb) and (_bm25_warm(kb) or not _bm25_wanted(kb))
+    with _lock:
+        if _pool is None:
+            return False
+        if uid in _tasks:
+            _stats.deduped += 1
+            return False
+        if warm:
+            _stats.skipped_warm += 1
+            return False
+        if len(_tasks) >= env_int("RAG_PREFETCH_MAX_PENDING", 64, 1, 10_000):
+            _stats.dropped += 1
+            return False
+        task = _Task(uid, reason)
+        _tasks[uid] = task
+        _stats.scheduled += 1
+        task.future = _pool.submit(_run, task)
+    return True
+
+
+def cancel_prefetch(user_id: int) -> bool:
+    """取消该用户尚未完成的预取：未开始的直接撤销，执行中的在下一阶段前停下。"""
+    with _lock:
+        task = _tasks.pop(int(user_id), None)
+        if task is None:
+            return False
+        task.cancelled.set()
+        _stats.cancelled += 1
+    if task.future is not None:
+        task.future.cancel()
+    return True
+
+
+def _run(task: _Task) -> None:
+    from utils.path_context import get_kb_dir, reset_kb_context, set_user_kb_context
+
+    from . import vdb_cache
+
+    t_kb, t_api = set_user_kb_context(task.user_id)
+    try:
+        if task.cancelled.is_set():
+            return
+        vdb, _emb = vdb_cache.get_cached_vdb_pair(task.user_id)
+        if task.cancelled.is_set():
+            return
+        if _bm25_wanted(get_kb_dir()):
+            from utils.hybrid_search import load_bm25_index, rebuild_bm25_index
+
+            bm25_index, _docs = load_bm25_index()
+            if bm25_index is None and not task.cancelled.is_set():
+                rebuild_bm25_index(vdb)
+        if task.cancelled.is_set():
+            return
+        from utils.web_system_settings import get_rag_defaults_dict
+
+        if get_rag_defaults_dict().get("default_enable_reranker"):
+            from utils.reranker import get_cached_reranker
+
+            get_cached_reranker()
+        with _lock:
+            _stats.completed += 1
+    except Exception as e:  # noqa: BLE001 — 预取失败不影响请求，首问按原路径载入
+        with _lock:
+            _stats.failed += 1
+        logger.warning("[Prefetch] 用户 %s 预取失败（%s）: %s", task.user_id, task.reason, e)
+    finally:
+        reset_kb_context(t_kb, t_api)
+        with _lock:
+            if _tasks.get(task.user_id) is task:
+                del _tasks[task.user_id]
+
+
+def prefetch_stats() -> Dict[str, int]:
+    with _lock:
+        return {
+            "prefetch_pending": len(_tasks),
+            "prefetch_scheduled": _stats.scheduled,
+            "prefetch_deduped": _stats.deduped,
+            "prefetch_skipped_warm": _stats.skipped_warm,
+            "prefetch_dropped": _stats.dropped,
+            "prefetch_cancelled": _stats.cancelled,
+            "prefetch_completed": _stats.completed,
+            "prefetch_failed": _stats.failed,
+        }
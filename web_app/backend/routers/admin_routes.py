@@ -53,7 +53,11 @@ from utils.web_system_settings import (
 )
 from web_app.backend.request_client import get_client_ip
 from web_app.backend.deps import get_admin_user
+from utils.bm25_tokens import clear_token_cache
+from utils.ocr_cache import clear_ocr_cache
+from utils.parent_chunk_store import clear_parent_store
 from utils.path_context import get_kb_dir
+from utils.text_sidecar import clear_sidecars
 from web_app.backend.schemas import (
     AdminAdvancedSettingsBody,
     AdminDestroyUserBody,
@@ -88,8 +92,9 @@ from web_app.backend.admin_vector_ops import (
     admin_vector_summary_users,
 )
 from utils.admin_analytics import platform_analytics_overview
+from utils.latency_trace import reset_stage_latency_stats, stage_latency_stats
+from web_app.backend.storage_ledger import reconcile_user_storage, storage_totals
 from web_app.backend.stats_helpers import (
-    faiss_index_size_bytes,
     list_registered_user_ids,
     user_kb_doc_stats,
 )
@@ -104,10 +109,11 @@ def admin_users(
     rows = list_users_admin(search=q)
     chat_counts = get_user_chat_counts()
     out: List[Dict[str, Any]] = []
+    storage = storage_totals(int(r["id"]) for r in rows)
     for r in rows:
         uid = int(r["id"])
         st = user_kb_doc_stats(uid)
-        st["vector_index_bytes"] = faiss_index_size_bytes(uid)
+        st["vector_index_bytes"] = storage[uid][1]
         st["chat_count"] = int(chat_counts.get(uid, 0))
         out.append({**dict(r), **st})
     return {"users": out}
@@ -211,18 +217,30 @@ def admin_analytics_overview_api(
     return platform_analytics_overview(trend_days=td, active_days=ad)
 
 
+@router.get("/analytics/retrieval-latency")
+def admin_retrieval_latency_api(_: User = Depends(get_admin_user)) -> Dict[str, Any]:
+    """流式对话各阶段耗时的 p50 / p95 / p99（本 worker 进程内最近样本）。"""
+    return stage_latency_stats()
+
+
+@router.delete("/analytics/retrieval-latency")
+def admin_reset_retrieval_latency_api(_: User = Depends(get_admin_user)) -> Dict[str, Any]:
+    reset_stage_latency_stats()
+    return {"ok": True}
+
+
 @router.get("/stats")
 def admin_stats(_: User = Depends(get_admin_user)) -> Dict[str, Any]:
     rows = list_users_admin()
     total_docs = 0
     total_chunks = 0
-    total_index = 0
+    storage = storage_totals(int(r["id"]) for r in rows)
+    total_index = sum(faiss for _total, faiss in storage.values())
     for r in rows:
         uid = int(r["id"])
         st = user_kb_doc_stats(uid)
         total_docs += int(st["doc_count"])
         total_chunks += int(st["total_chunks"])
-        total_index += faiss_index_size_bytes(uid)
     disk_ids = list_registered_user_ids()
     return {
         "user_count": len(rows),
@@ -785,6 +803,11 @@ def admin_clear_all_knowledge(
         p = os.path.join(kb, name)
         if os.path.isfile(p):
             os.remove(p)
+    clear_parent_store(kb)
+    clear_ocr_cache(kb)
+    clear_token_cache(kb)
+    clear_sidecars(kb)
+    reconcile_user_storage(uid)
     vdb_cache.bump_user_cache(uid)
     return {"ok": True, "scope": "current_user_only"}
 
@@ -21,6 +21,7 @@ from utils.auth_store import (
     verify_password,
 )
 from utils.web_system_settings import get_login_bruteforce_settings
+from web_app.backend.prefetch import cancel_prefetch, schedule_prefetch
 from web_app.backend.request_client import get_client_ip
 from web_app.backend.schemas import DeleteAccountBody, LoginBody, MePatchBody, RegisterBody, WebUiStatePutBody
 from web_app.backend.user_web_state import load_web_ui_state, save_web_ui_state
@@ -151,6 +152,8 @@ def auth_login(body: LoginBody, request: Request):
     )
     user = User(id=uid, username=uname, nickname=nick, role=role, avatar=avatar, status=status)
     token, exp = create_session(user.id)
+    # 后台预取索引 / BM25 / 重排模型，首个问答不再在请求内冷载入
+    schedule_prefetch(user.id, "login")
     return {
         "token": token,
         "expires_at": exp.isoformat(),
@@ -161,6 +164,8 @@ def auth_login(body: LoginBody, request: Request):
 @router.get("/me")
 def auth_me(request: Request):
     u = request.state.user
+    # 前端带已存 token 打开页面时先调 /me：视作会话恢复，同样预取
+    schedule_prefetch(u.id, "resume")
     return _user_public(u)
 
 
@@ -247,6 +252,9 @@ def auth_patch_me(request: Request, body: MePatchBody):
 
 @router.post("/logout")
 def auth_logout(request: Request):
+    u = getattr(request.state, "user", None)
+    if u is not None:
+        cancel_prefetch(u.id)
     auth = request.headers.get("authorization") or ""
     if auth.startswith("Bearer "):
         delete_session(auth[7:].strip())
@@ -272,6 +280,7 @@ def auth_delete_account(request: Request, body: DeleteAccountBody):
         detail=None,
         client_ip=get_client_ip(request),
     )
+    cancel_prefetch(u.id)
     auth = request.headers.get("authorization") or ""
     if auth.startswith("Bearer "):
         delete_session(auth[7:].strip())
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import json
 import os
 import uuid
@@ -13,7 +14,7 @@ from fastapi.routing import APIRouter
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from services.chat_turn import run_chat_turn, run_chat_turn_astream
-from services.llm_factory import build_chat_llm, build_chat_openai_explicit
+from services.llm_factory import build_chat_llm, build_chat_openai_explicit, llm_client_stats
 from services.vector_queries import list_indexed_source_files
 from utils.api_config import (
     get_active_preset_name,
@@ -23,11 +24,13 @@ from utils.api_config import (
 )
 from utils.web_system_settings import get_llm_preset_templates
 from utils.auth_store import User
+from utils.compliance import COMPLIANCE_SAMPLE_BYTES, scan_sensitive_sample
 from utils.document_deleter import delete_document_from_vector_db
 from utils.document_preview import (
     get_document_full_view_payload,
     get_document_structure,
     get_plain_text_for_kb_substring_search,
+    iter_indexed_substring_hits,
     substring_hits_with_context,
 )
 from utils.metadata_manager import (
@@ -53,10 +56,19 @@ from utils.web_system_settings import (
     is_rag_web_search_ui_enabled,
 )
 from web_app.backend.stats_helpers import user_kb_dir_total_bytes
+from web_app.backend.storage_ledger import note_document_storage_changed, note_storage_changed
 from web_app.backend.deps import get_admin_user
+from web_app.backend.prefetch import prefetch_stats, schedule_prefetch
 from web_app.backend.resource_limits import rag_chat_slot
 from services.instant_chat_turn import run_instant_chat_turn, run_instant_chat_turn_astream
 from utils.instant_doc_parse import parse_upload_bytes
+from utils.instant_doc_store import (
+    get_instant_doc,
+    get_instant_doc_by_upload,
+    instant_doc_store_stats,
+    put_instant_doc,
+    upload_sha256,
+)
 from web_app.backend.schemas import (
     CategoryCreateBody,
     ChatRequest,
@@ -89,6 +101,12 @@ def health():
     out = {"ok": True, "deployment": "web_multi_user", "per_user_kb": True}
     try:
         out.update(vdb_cache.cache_stats())
+        out.update(instant_doc_store_stats())
+        out.update(ingest_queue.ingest_queue_stats())
+        out.update(prefetch_stats())
+        stats = llm_client_stats()
+        stats.pop("llm_clients", None)
+        out.update(stats)
     except Exception:
         pass
     return out
@@ -155,11 +173,15 @@ def doc_search(
     q: str = Query(..., min_length=1, max_length=500),
     category: str = Query("全部知识库"),
     max_total: int = Query(800, ge=1, le=3000, description="返回条数上限（每条为一处命中）"),
+    offset: int = Query(0, ge=0, le=100_000, description="跳过前若干处命中（分页）"),
     max_per_file: int = Query(200, ge=1, le=500, description="单篇正文内最多返回几处命中"),
     context_before: int = Query(90, ge=20, le=400),
     context_after: int = Query(120, ge=20, le=500),
 ):
-    """全文子串检索：列出文件名、描述、正文中每一处命中（大小写不敏感），带前后文便于前端高亮。"""
+    """全文子串检索：列出文件名、描述、正文中每一处命中（大小写不敏感），带前后文便于前端高亮。
+
+    正文命中走全文位置索引（只读取有候选位置的文档，凑满一页即停止）；查询无法走索引时逐篇线性扫描。
+    """
     uid = request.state.user.id
     vdb, _ = vdb_cache.get_cached_vdb_pair(uid)
     qn = q.strip()
@@ -171,8 +193,13 @@ def doc_search(
 
     results: List[dict] = []
     truncated = False
+    skipped = 0
 
     def push(hit: dict) -> bool:
+        nonlocal skipped
+        if skipped < offset:
+            skipped += 1
+            return False
         results.append(hit)
         if len(results) >= max_total:
             return True
@@ -210,7 +237,22 @@ def doc_search(
         if truncated:
             break
 
+    indexed = None
     if not truncated:
+        indexed = iter_indexed_substring_hits(
+            [str(d.get("file_name")) for d in scoped if d.get("file_name")],
+            qn,
+            vdb,
+            context_before=context_before,
+            context_after=context_after,
+            max_per_file=max_per_file,
+        )
+    if indexed is not None:
+        for fn_s, h in indexed:
+            if push({**h, "file_name": fn_s, "match_type": "content"}):
+                truncated = True
+                break
+    elif not truncated:
         for d in scoped:
             fn = d.get("file_name")
             if not fn:
@@ -241,6 +283,8 @@ def doc_search(
         "results": results,
         "result_count": len(results),
         "max_total": max_total,
+        "offset": offset,
+        "next_offset": offset + len(results) if truncated else None,
         "truncated": truncated,
     }
 
@@ -262,15 +306,12 @@ def patch_doc_metadata(p: DocMetaPatch):
 @router.delete("/api/documents")
 def delete_document(request: Request, file_name: str = Query(...)):
     uid = request.state.user.id
-    # 私有 vdb 副本：删除会原地修改内存索引，不能与检索线程共享缓存对象
-    from utils.db import get_vector_db
-
-    _vdb, emb = vdb_cache.get_cached_vdb_pair(uid)
-    vdb = get_vector_db(emb)
+    # 删除只给缓存对象打墓碑（整体替换过滤位图，检索线程读到的总是完整快照），无需私有副本与整库重载
+    vdb, emb = vdb_cache.get_cached_vdb_pair(uid)
     ok, deleted_count = delete_document_from_vector_db(file_name, vdb, emb)
     if not ok or deleted_count == 0:
         raise HTTPException(status_code=404, detail="未找到该文档或无可删块")
-    vdb_cache.bump_user_cache(uid)
+    note_document_storage_changed(uid, file_name)
     # 已删文档不能继续留在 BM25 索引里被关键词检索到
     try:
         from web_app.backend.ingest_queue import _invalidate_and_prewarm_bm25
@@ -302,6 +343,44 @@ def remove_category(name: str = Query(...)):
     raise HTTPException(status_code=404, detail="知识库不存在")
 
 
+_UPLOAD_READ_CHUNK = 1024 * 1024
+
+
+def _unlink_quiet(path: str) -> None:
+    try:
+        if os.path.isfile(path):
+            os.unlink(path)
+    except OSError:
+        pass
+
+
+class _UploadTooLarge(Exception):
+    pass
+
+
+async def _stream_upload_to_staging(uf: UploadFile, part_path: str, limit: int) -> tuple[int, str, bytes]:
+    """分块写入暂存文件：边写边算 sha256、边校验大小，并保留开头样本供敏感词扫描。
+
+    返回 (字节数, sha256, 开头样本)；超过 limit 抛 _UploadTooLarge（调用方删除 part 文件）。
+    """
+    h = hashlib.sha256()
+    head = bytearray()
+    size = 0
+    with open(part_path, "wb") as f:
+        while True:
+            chunk = await uf.read(_UPLOAD_READ_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise _UploadTooLarge()
+            h.update(chunk)
+            if len(head) < COMPLIANCE_SAMPLE_BYTES:
+                head += chunk[: COMPLIANCE_SAMPLE_BYTES - len(head)]
+            f.write(chunk)
+    return size, h.hexdigest(), bytes(head)
+
+
 @router.post("/api/upload")
 async def upload_documents(
     request: Request,
@@ -332,38 +411,46 @@ async def upload_documents(
                 }
             )
             continue
-        data = await uf.read()
-        if len(data) > max_bytes:
-            results.append(
-                {
-                    "file_name": raw_name,
-                    "ok": False,
-                    "error": f"超过单文件大小限制 {max_bytes / (1024 * 1024):.1f}MB",
-                }
-            )
+        job_id = str(uuid.uuid4())
+        safe_base = os.path.basename(raw_name.replace("\\", "/"))
+        staging_path = os.path.join(staging_root, f"{job_id}_{safe_base}")
+        part_path = staging_path + ".part"
+        used = user_kb_dir_total_bytes(uid) if storage_cap > 0 else 0
+        limit = max_bytes if storage_cap <= 0 else min(max_bytes, max(0, storage_cap - used))
+        try:
+            size, sha, head = await _stream_upload_to_staging(uf, part_path, limit)
+        except _UploadTooLarge:
+            _unlink_quiet(part_path)
+            if limit >= max_bytes:
+                err = f"超过单文件大小限制 {max_bytes / (1024 * 1024):.1f}MB"
+            else:
+                err = f"超过单用户存储空间上限（约 {storage_cap / (1024 * 1024):.0f}MB，已用约 {used / (1024 * 1024):.1f}MB）"
+            results.append({"file_name": raw_name, "ok": False, "error": err})
+            continue
+        except Exception as e:
+            _unlink_quiet(part_path)
+            results.append({"file_name": raw_name, "ok": False, "error": str(e)})
             continue
-        if storage_cap > 0:
-            used = user_kb_dir_total_bytes(uid)
-            if used + len(data) > storage_cap:
-                results.append(
-                    {
-                        "file_name": raw_name,
-                        "ok": False,
-                        "error": f"超过单用户存储空间上限（约 {storage_cap / (1024 * 1024):.0f}MB，已用约 {used / (1024 * 1024):.1f}MB）",
-                    }
-                )
-                continue
         ok_slot, slot_err = ingest_queue.try_reserve_ingest_slot(uid)
         if not ok_slot:
+            _unlink_quiet(part_path)
             results.append({"file_name": raw_name, "ok": False, "error": slot_err})
             continue
-        job_id = str(uuid.uuid4())
-        safe_base = os.path.basename(raw_name.replace("\\", "/"))
-        staging_path = os.path.join(staging_root, f"{job_id}_{safe_base}")
         try:
-            with open(staging_path, "wb") as f:
-                f.write(data)
-            ingest_queue.enqueue_staged_file(job_id, uid, raw_name, cat, desc, staging_path)
+            os.replace(part_path, staging_path)
+            ingest_queue.enqueue_staged_file(
+                job_id,
+                uid,
+                raw_name,
+                cat,
+                desc,
+                staging_path,
+                content_sha256=sha,
+                size_bytes=size,
+                compliance_hits=scan_sensitive_sample(head),
+            )
+            # 同一批后续文件的配额检查要算上已暂存的这份
+            note_storage_changed(uid, staging_path)
             results.append(
                 {
                     "file_name": raw_name,
@@ -375,11 +462,8 @@ async def upload_documents(
         except Exception as e:
             ingest_queue.release_ingest_slot(uid)
             ingest_queue.forget_job(job_id)
-            try:
-                if os.path.isfile(staging_path):
-                    os.unlink(staging_path)
-            except OSError:
-                pass
+            _unlink_quiet(part_path)
+            _unlink_quiet(staging_path)
             results.append({"file_name": raw_name, "ok": False, "error": str(e)})
     return {"results": results}
 
@@ -397,6 +481,9 @@ def get_upload_job(request: Request, job_id: str):
     rec = ingest_queue.get_job_for_user(job_id, uid)
     if rec is None:
         raise HTTPException(status_code=404, detail="任务不存在")
+    if rec.status == "done":
+        # 入库完成后缓存已失效：趁用户看结果时后台重载，接下来的提问直接命中
+        schedule_prefetch(uid, "upload_done")
     return ingest_queue.job_to_dict(rec)
 
 
@@ -407,6 +494,7 @@ def index_save(request: Request):
     index_dir = os.path.join(get_kb_dir(), "faiss_index")
     os.makedirs(index_dir, exist_ok=True)
     vdb.save_local(index_dir)
+    note_storage_changed(uid, index_dir)
     vdb_cache.bump_user_cache(uid)
     return {"ok": True}
 
@@ -520,17 +608,26 @@ def bm25_status():
 
 @router.post("/api/instant-doc/parse", response_model=InstantDocParseResponse)
 async def instant_doc_parse(request: Request, file: UploadFile = File(...)):
-    """解析即时文档：不入库；限制 5MB、正文 10 万字符。与知识库上传完全独立。"""
-    _ = request.state.user
+    """解析即时文档：不入库；限制 5MB、正文 10 万字符。与知识库上传完全独立。
+
+    解析结果按内容哈希缓存在服务端并返回 doc_id；同一文件重复上传直接命中缓存，不再解析。
+    """
+    uid = request.state.user.id
     raw_name = file.filename or "unnamed"
+    base_name = os.path.basename(raw_name.replace("\\", "/"))
     try:
         data = await file.read()
-        text = parse_upload_bytes(raw_name, data)
+        raw_sha = upload_sha256(data)
+        ent = get_instant_doc_by_upload(uid, raw_sha)
+        if ent is None:
+            text = await asyncio.to_thread(parse_upload_bytes, raw_name, data)
+            ent = await asyncio.to_thread(put_instant_doc, uid, text, base_name, raw_sha256=raw_sha)
         return InstantDocParseResponse(
             ok=True,
-            text=text,
-            file_name=os.path.basename(raw_name.replace("\\", "/")),
-            char_count=len(text),
+            text=ent.text,
+            file_name=base_name,
+            char_count=len(ent.text),
+            doc_id=ent.doc_id,
         )
     except ValueError as e:
         return InstantDocParseResponse(ok=False, file_name=raw_name, error=str(e))
@@ -540,7 +637,7 @@ async def instant_doc_parse(request: Request, file: UploadFile = File(...)):
 
 @router.post("/api/chat/instant")
 async def chat_instant(request: Request, req: InstantChatRequest):
-    """即时文档对话：仅用请求内 document_text + 轻量摘录，不访问向量库。"""
+    """即时文档对话：正文取自服务端缓存（doc_id）或请求内 document_text，不访问向量库。"""
     uid = request.state.user.id
     cfg = get_api_config_for(req.api_config_name)
     if not str(cfg.get("api_key") or "").strip():
@@ -567,6 +664,18 @@ async def chat_instant(request: Request, req: InstantChatRequest):
     doc_text = (req.document_text or "").strip()
     if len(doc_text) > 100_000:
         raise HTTPException(status_code=400, detail="document_text 超过 10 万字符")
+    doc_name = (req.document_file_name or "").strip()
+    doc_index = None
+    doc_ent = get_instant_doc(uid, req.doc_id) if req.doc_id else None
+    if doc_ent is None and doc_text:
+        # 旧前端或缓存过期后带正文重试：重新登记，本轮即可使用预建索引
+        doc_ent = await asyncio.to_thread(put_instant_doc, uid, doc_text, doc_name)
+    elif doc_ent is None and req.doc_id:
+        raise HTTPException(status_code=409, detail="instant_doc_expired")
+    if doc_ent is not None:
+        doc_text = doc_ent.text
+        doc_index = doc_ent.index
+        doc_name = doc_name or doc_ent.file_name
 
     if req.stream:
 
@@ -576,13 +685,15 @@ async def chat_instant(request: Request, req: InstantChatRequest):
                     user_input=req.message.strip(),
                     chat_history_messages=hist,
                     document_text=doc_text,
-                    document_file_name=(req.document_file_name or "").strip(),
+                    document_file_name=doc_name,
                     llm=llm,
                     response_style=(req.response_style or "balanced").strip() or "balanced",
                     persona_prompt=pp,
                     system_prompt_extra=extra_sys or None,
                     user_id=int(uid),
                     enable_web_search=enable_instant_web,
+                    context_mode=req.context_mode,
+                    doc_index=doc_index,
                 ):
                     yield (json.dumps(ev, ensure_ascii=False) + "\n").encode("utf-8")
 
@@ -601,13 +712,15 @@ async def chat_instant(request: Request, req: InstantChatRequest):
             user_input=req.message.strip(),
             chat_history_messages=hist,
             document_text=doc_text,
-            document_file_name=(req.document_file_name or "").strip(),
+            document_file_name=doc_name,
             llm=llm,
             response_style=(req.response_style or "balanced").strip() or "balanced",
             persona_prompt=pp,
             system_prompt_extra=extra_sys or None,
             user_id=int(uid),
             enable_web_search=enable_instant_web,
+            context_mode=req.context_mode,
+            doc_index=doc_index,
         )
     return ChatResponse(answer=answer, mode=mode, retrieval_query=rq, sources=sources, error=err)
 
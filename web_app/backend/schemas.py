@@ -45,16 +45,26 @@ class InstantDocParseResponse(BaseModel):
     text: str = ""
     file_name: str = ""
     char_count: int = 0
+    doc_id: str = Field(default="", description="服务端缓存的正文内容哈希；对话时回传即可不再携带 document_text。")
     error: Optional[str] = None
 
 
 class InstantChatRequest(BaseModel):
-    """即时文档问答：正文由前端保存在当前会话；按全文（超长截断）构造上下文，不走向量库；开启联网时响应可含网页摘要溯源（与知识库问答 sources 结构一致）。"""
+    """即时文档问答：正文由前端保存在当前会话；默认只取与问题相关的摘录构造上下文（短文档仍整篇），不走向量库；开启联网时响应可含网页摘要溯源（与知识库问答 sources 结构一致）。"""
 
     message: str = Field(..., min_length=1)
     history: List[ChatMessage] = Field(default_factory=list)
     document_text: str = Field(default="", max_length=100_000)
     document_file_name: str = Field(default="", max_length=512)
+    doc_id: Optional[str] = Field(
+        default=None,
+        max_length=64,
+        description="解析接口返回的 doc_id；服务端缓存命中时忽略 document_text，过期则返回 409 由前端带正文重试。",
+    )
+    context_mode: Literal["full", "excerpts"] = Field(
+        "excerpts",
+        description="excerpts（默认）：仅发送与问题最相关的若干摘录，全文不超过摘录上限时整篇发送；full：全文（超长截断）进系统提示。",
+    )
     enable_web_search: bool = Field(
         False,
         description="为 True 时在文档上下文后追加网页摘要（无文档且非闲聊时亦可仅依据联网摘要回答）；供应商与密钥同智能问答页。",
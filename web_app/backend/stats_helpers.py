@@ -1,4 +1,4 @@
-"""Web 多用户知识库体量统计（读各用户 documents_metadata.json）。"""
+"""Web 多用户知识库体量统计（读各用户 documents_metadata.json；目录占用读存储台账，见 storage_ledger）。"""
 from __future__ import annotations
 
 import json
@@ -6,6 +6,7 @@ import os
 from typing import Any, Dict, List
 
 from config import WEB_USERS_ROOT
+from web_app.backend.storage_ledger import user_faiss_bytes, user_storage_bytes
 
 
 def _user_kb_dir(user_id: int) -> str:
@@ -53,32 +54,12 @@ def user_kb_doc_stats(user_id: int) -> Dict[str, Any]:
 
 
 def faiss_index_size_bytes(user_id: int) -> int:
-    d = os.path.join(_user_kb_dir(user_id), "faiss_index")
-    if not os.path.isdir(d):
-        return 0
-    n = 0
-    for root, _, files in os.walk(d):
-        for fn in files:
-            try:
-                n += os.path.getsize(os.path.join(root, fn))
-            except OSError:
-                pass
-    return n
+    return user_faiss_bytes(user_id)
 
 
 def user_kb_dir_total_bytes(user_id: int) -> int:
     """用户 Web 数据目录总占用（含 knowledge_db、web_ui_state 等）。"""
-    root = os.path.join(WEB_USERS_ROOT, str(int(user_id)))
-    if not os.path.isdir(root):
-        return 0
-    n = 0
-    for walk_root, _, files in os.walk(root):
-        for fn in files:
-            try:
-                n += os.path.getsize(os.path.join(walk_root, fn))
-            except OSError:
-                pass
-    return n
+    return user_storage_bytes(user_id)
 
 
 def list_registered_user_ids() -> List[int]:
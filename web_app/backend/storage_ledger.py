@@ -0,0 +1,363 @@
+"""
+用户存储占用台账：配额检查与管理端统计直接读 SQLite 中维护好的字节数，不再每次 os.walk 整个用户目录。
+
+台账按「条目」记账（相对用户目录的路径）：
+- 普通目录（knowledge_db、faiss_index、web_ui_state 等）各记一条，值为该目录下直属文件的大小之和；
+- 按文档增长的目录（original_files、text_sidecars、upload_staging）每个文件单独一条，
+  单篇入库/删除只需 stat 涉及的几个文件。
+用户总量单独维护一列，随条目增减同步加减；FAISS 占用即 knowledge_db/faiss_index 条目。
+
+写入方在改动文件后调用 note_storage_changed / note_document_storage_changed，只重新测量涉及的条目；
+清空、重置等批量操作调 reconcile_user_storage 整体重测。后台线程按 ``RAG_STORAGE_RECONCILE_SEC``
+（默认 1800 秒，0 关闭）周期性全量校正漏记的变化（对话记录等未挂钩的写入）；多个 worker 进程通过
+台账库中的时间戳抢占，同一周期只有一个进程执行。
+
+台账库默认位于 WEB_SERVER_DIR/storage_ledger.sqlite3，可用 ``RAG_STORAGE_LEDGER_DB`` 覆盖。
+记账失败只记日志，不影响上传、入库等主流程。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import posixpath
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import WEB_SERVER_DIR, WEB_USERS_ROOT
+from web_app.backend.periodic_reconcile import PeriodicReconciler
+
+logger = logging.getLogger(__name__)
+
+FAISS_ENTRY = "knowledge_db/faiss_index"
+_PER_FILE_DIRS = frozenset(
+    ("knowledge_db/original_files", "knowledge_db/text_sidecars", "knowledge_db/upload_staging")
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS storage_entries (
+    user_id INTEGER NOT NULL,
+    rel_path TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (user_id, rel_path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_storage (
+    user_id INTEGER PRIMARY KEY,
+    total_bytes INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    reconciled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger_meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+def default_ledger_path() -> str:
+    p = (os.environ.get("RAG_STORAGE_LEDGER_DB") or "").strip()
+    return p or os.path.join(WEB_SERVER_DIR, "storage_ledger.sqlite3")
+
+
+def _reconcile_interval_sec() -> float:
+    try:
+        v = float(os.environ.get("RAG_STORAGE_RECONCILE_SEC", "1800"))
+    except ValueError:
+        v = 1800.0
+    return 0.0 if v <= 0 else max(60.0, v)
+
+
+def _connect() -> sqlite3.Connection:
+    path = default_ledger_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _user_root(user_id: int) -> str:
+    return os.path.join(WEB_USERS_ROOT, str(int(user_id)))
+
+
+def _shallow_bytes(d: str) -> int:
+    n = 0
+    try:
+        with os.scandir(d) as it:
+            for e in it:
+                try:
+                    if e.is_file(follow_symlinks=False):
+                        n += e.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        return 0
+    return n
+
+
+def _file_bytes(p: str) -> int:
+    try:
+        return os.path.getsize(p) if os.path.isfile(p) else 0
+    except OSError:
+        return 0
+
+
+def _walk_entries(user_id: int) -> Dict[str, int]:
+    root = _user_root(user_id)
+    out: Dict[str, int] = {}
+    if not os.path.isdir(root):
+        return out
+    for walk_root, _dirs, files in os.walk(root):
+        rel = os.path.relpath(walk_root, root).replace(os.sep, "/")
+        rel = "" if rel == "." else rel
+        if rel in _PER_FILE_DIRS:
+            for fn in files:
+                out[posixpath.join(rel, fn)] = _file_bytes(os.path.join(walk_root, fn))
+        else:
+            n = sum(_file_bytes(os.path.join(walk_root, fn)) for fn in files)
+            if n:
+                out[rel] = n
+    return out
+
+
+def _entries_for(root: str, abs_path: str) -> Tuple[str, ...]:
+    """改动路径 -> 台账条目：目录记自身；按文档增长目录里的文件单独记；其余文件记到所在目录。
+
+    路径已不存在时无从判断原先是文件还是目录（如 rmtree 掉的 faiss_index），两者都重测。
+    """
+    rel = os.path.relpath(os.path.abspath(abs_path), root).replace(os.sep, "/")
+    if rel == ".":
+        return ("",)
+    if rel.startswith("../"):
+        return ()
+    parent = posixpath.dirname(rel)
+    if rel in _PER_FILE_DIRS or parent in _PER_FILE_DIRS:
+        return (rel,)
+    if os.path.isdir(abs_path):
+        return (rel,)
+    if os.path.exists(abs_path):
+        return (parent,)
+    return (rel, parent)
+
+
+def _measure(root: str, entry: str) -> Dict[str, int]:
+    """重新测量一个条目；按文档增长的目录本身则展开为其下全部文件。"""
+    p = os.path.join(root, entry) if entry else root
+    if entry in _PER_FILE_DIRS:
+        if not os.path.isdir(p):
+            return {}
+        return {posixpath.join(entry, fn): _file_bytes(os.path.join(p, fn)) for fn in os.listdir(p)}
+    if posixpath.dirname(entry) in _PER_FILE_DIRS:
+        return {entry: _file_bytes(p)}
+    return {entry: _shallow_bytes(p)} if os.path.isdir(p) else {}
+
+
+def _apply(conn: sqlite3.Connection, user_id: int, replaced: Dict[str, Dict[str, int]], *, full: bool) -> None:
+    """replaced: 条目 -> 该条目重测后的 {条目或其下文件: 字节}；full 时整体替换该用户全部条目。"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT total_bytes FROM user_storage WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None and not full:
+            # 首次记账：先整体测量再回到增量
+            conn.execute("ROLLBACK")
+            reconcile_user_storage(user_id)
+            return
+        if full:
+            conn.execute("DELETE FROM storage_entries WHERE user_id = ?", (user_id,))
+            new = replaced.get("", {})
+            conn.executemany(
+                "INSERT INTO storage_entries VALUES (?, ?, ?)", ((user_id, k, v) for k, v in new.items())
+            )
+            total = sum(new.values())
+            conn.execute(
+                "INSERT OR REPLACE INTO user_storage VALUES (?, ?, ?, ?)", (user_id, total, now, now)
+            )
+        else:
+            delta = 0
+            for entry, new in replaced.items():
+                if entry in _PER_FILE_DIRS:
+                    old_rows = conn.execute(
+                        "SELECT rel_path, bytes FROM storage_entries WHERE user_id = ? AND rel_path >= ? AND rel_path < ?",
+                        (user_id, entry + "/", entry + "0"),
+                    ).fetchall()
+                else:
+                    old_rows = conn.execute(
+                        "SELECT rel_path, bytes FROM storage_entries WHERE user_id = ? AND rel_path = ?",
+                        (user_id, entry),
+                    ).fetchall()
+                delta -= sum(b for _p, b in old_rows)
+                conn.executemany(
+                    "DELETE FROM storage_entries WHERE user_id = ? AND rel_path = ?",
+                    ((user_id, p) for p, _b in old_rows),
+                )
+                conn.executemany(
+                    "INSERT INTO storage_entries VALUES (?, ?, ?)",
+                    ((user_id, k, v) for k, v in new.items() if v),
+                )
+                delta += sum(new.values())
+            conn.execute(
+                "UPDATE user_storage SET total_bytes = MAX(0, total_bytes + ?), updated_at = ? WHERE user_id = ?",
+                (delta, now, user_id),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def note_storage_changed(user_id: int, *paths: str) -> None:
+    """paths 下的文件已新增/修改/删除：只重测这些路径对应的条目。"""
+    root = _user_root(user_id)
+    replaced: Dict[str, Dict[str, int]] = {}
+    for p in paths:
+        if not p:
+            continue
+        for entry in _entries_for(root, p):
+            if entry not in replaced:
+                replaced[entry] = _measure(root, entry)
+    if not replaced:
+        return
+    try:
+        conn = _connect()
+        try:
+            _apply(conn, int(user_id), replaced, full=False)
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[Storage] 记账失败 user=%s: %s", user_id, e)
+
+
+def note_document_storage_changed(user_id: int, file_name: str, *extra_paths: str) -> None:
+    """单篇文档入库/删除后：重测知识库根目录文件、FAISS 目录、该文档的原文副本与 sidecar（及 extra_paths）。"""
+    from utils.document_preview import ORIGINAL_FILES_SUBDIR
+    from utils.text_sidecar import sidecar_paths
+
+    kb = os.path.join(_user_root(user_id), "knowledge_db")
+    base = os.path.basename((file_name or "").replace("\\", "/"))
+    note_storage_changed(
+        user_id,
+        kb,
+        os.path.join(kb, "faiss_index"),
+        os.path.join(kb, ORIGINAL_FILES_SUBDIR, base) if base else "",
+        *sidecar_paths(file_name, kb),
+        *extra_paths,
+    )
+
+
+def reconcile_user_storage(user_id: int) -> int:
+    """整体重测一个用户目录并替换其台账，返回总字节数。"""
+    entries = _walk_entries(int(user_id))
+    try:
+        conn = _connect()
+        try:
+            _apply(conn, int(user_id), {"": entries}, full=True)
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[Storage] 校正台账失败 user=%s: %s", user_id, e)
+    return sum(entries.values())
+
+
+def _read(user_id: int) -> Optional[Tuple[int, int]]:
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                """
+                SELECT s.total_bytes, COALESCE(e.bytes, 0) FROM user_storage s
+                LEFT JOIN storage_entries e ON e.user_id = s.user_id AND e.rel_path = ?
+                WHERE s.user_id = ?
+                """,
+                (FAISS_ENTRY, int(user_id)),
+            ).fetchone()
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[Storage] 读取台账失败 user=%s: %s", user_id, e)
+        return None
+    return (int(row[0]), int(row[1])) if row else None
+
+
+def user_storage_bytes(user_id: int) -> int:
+    """用户目录总占用（台账值；尚未记账的用户当场测量一次）。"""
+    got = _read(user_id)
+    if got is None:
+        reconcile_user_storage(user_id)
+        got = _read(user_id)
+    return got[0] if got else 0
+
+
+def user_faiss_bytes(user_id: int) -> int:
+    got = _read(user_id)
+    if got is None:
+        reconcile_user_storage(user_id)
+        got = _read(user_id)
+    return got[1] if got else 0
+
+
+def storage_totals(user_ids: Iterable[int]) -> Dict[int, Tuple[int, int]]:
+    """批量读取 {user_id: (总字节, FAISS 字节)}，管理端列表一次查询；缺记录的用户当场补测。"""
+    ids = sorted({int(u) for u in user_ids})
+    out: Dict[int, Tuple[int, int]] = {}
+    if not ids:
+        return out
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT s.user_id, s.total_bytes, COALESCE(e.bytes, 0) FROM user_storage s
+                LEFT JOIN storage_entries e ON e.user_id = s.user_id AND e.rel_path = ?
+                """,
+                (FAISS_ENTRY,),
+            ).fetchall()
+        finally:
+            conn.close()
+        have = {int(u): (int(t), int(f)) for u, t, f in rows}
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("[Storage] 读取台账失败: %s", e)
+        have = {}
+    for uid in ids:
+        if uid not in have:
+            reconcile_user_storage(uid)
+            have[uid] = _read(uid) or (0, 0)
+        out[uid] = have[uid]
+    return out
+
+
+def reconcile_all_users() -> int:
+    """全量校正（含已删除用户目录的残留记录），返回校正的用户数。"""
+    from web_app.backend.stats_helpers import list_registered_user_ids
+
+    ids = set(list_registered_user_ids())
+    try:
+        conn = _connect()
+        try:
+            ids |= {int(r[0]) for r in conn.execute("SELECT user_id FROM user_storage")}
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+    for uid in sorted(ids):
+        if _reconciler.stopping():
+            break
+        reconcile_user_storage(uid)
+    return len(ids)
+
+
+_reconciler = PeriodicReconciler(
+    name="storage-reconcile",
+    connect=_connect,
+    meta_table="ledger_meta",
+    interval_sec=_reconcile_interval_sec,
+    reconcile=reconcile_all_users,
+    log_prefix="[Storage] 台账",
+)
+
+
+def start_reconciler() -> None:
+    _reconciler.start()
+
+
+def stop_reconciler() -> None:
+    _reconciler.stop()
@@ -1,20 +1,156 @@
 """Web 多用户：按 user_id 缓存 (vector_db, embeddings)，变更后 bump 失效。
 
-超出容量时按 LRU 淘汰，避免多用户轮流访问时内存无限增长（小内存机器必备）。
+缓存对象为只读 mmap 载入（utils.faiss_mmap）：基段向量与 docstore 映射自磁盘，多个 worker 共享 page cache。
+准入按字节预算 RAG_VDB_CACHE_MAX_BYTES（默认 1 GiB）而非用户数：每条按索引私有堆 + 映射字节
++ 该知识库进程内缓存的 BM25（utils.hybrid_search）计。
+
+淘汰用 GDSF（Greedy-Dual-Size-Frequency）：优先级 H = L + 命中次数 × 载入耗时 / 字节数，超预算时淘汰 H 最小者
+并把 L 抬到该值（老化，久未命中的条目逐渐落后于新条目）。小而常用、重载昂贵的条目留下，大而冷的先走；
+最新载入的一条在本次准入时不淘汰，避免单个大库每次请求都整库重载。
+RAG_VDB_CACHE_MAX_USERS 仅在显式设置时作为附加的条数上限。
+
+同一用户并发未命中（后台预取 web_app.backend.prefetch 与首个请求撞上）只载入一次，后到者等待并复用结果。
 """
 from __future__ import annotations
 
 import os
 import threading
+import time
 from collections import OrderedDict
-from typing import Any, Dict, Tuple
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
 
 _lock = threading.RLock()
-_cache: "OrderedDict[int, Tuple[Any, Any, float]]" = OrderedDict()
 
 
-def _max_cached_users() -> int:
-    return max(1, int(os.environ.get("RAG_VDB_CACHE_MAX_USERS", "12")))
+@dataclass
+class _Entry:
+    vdb: Any
+    emb: Any
+    signature: Tuple[float, float]
+    kb_dir: str
+    heap_bytes: int
+    mapped_bytes: int
+    load_seconds: float
+    hits: int = 1
+    priority: float = 0.0
+
+    def bm25_bytes(self) -> int:
+        from utils.hybrid_search import bm25_cached_bytes
+
+        return bm25_cached_bytes(self.kb_dir)
+
+    def size(self) -> int:
+        return self.heap_bytes + self.mapped_bytes + self.bm25_bytes()
+
+
+@dataclass
+class _Stats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    evicted_bytes: int = 0
+    coalesced: int = 0  # 等到了并发载入结果、未重复载入的未命中
+    inflation: float = 0.0  # GDSF 的 L
+
+
+@dataclass
+class _LoadSlot:
+    """某用户进行中的载入：lock 串行化并发未命中，waiters 为持有/等待该锁的线程数。"""
+
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    waiters: int = 0
+
+
+_cache: "OrderedDict[int, _Entry]" = OrderedDict()
+_stats = _Stats()
+# 只保留有载入在途的用户：最后一个等待者离开即移除，不随曾载入过的用户数增长
+_load_slots: Dict[int, _LoadSlot] = {}
+
+
+def _max_cache_bytes() -> int:
+    raw = (os.environ.get("RAG_VDB_CACHE_MAX_BYTES") or "").strip()
+    default = 1 << 30
+    if not raw:
+        return default
+    try:
+        return max(16 << 20, int(raw))
+    except ValueError:
+        return default
+
+
+def _max_cached_users() -> Optional[int]:
+    raw = (os.environ.get("RAG_VDB_CACHE_MAX_USERS") or "").strip()
+    if not raw:
+        return None
+    try:
+        return max(1, int(raw))
+    except ValueError:
+        return None
+
+
+def _index_signature(index_dir: str) -> Tuple[float, float]:
+    """基段与 manifest 的 mtime：增量保存只追加段、替换 manifest，不改 index.faiss。"""
+    out = []
+    for fn in ("index.faiss", "manifest.json"):
+        p = os.path.join(index_dir, fn)
+        out.append(os.path.getmtime(p) if os.path.isfile(p) else 0.0)
+    return out[0], out[1]
+
+
+def _footprint(vdb: Any, index_dir: str) -> Tuple[int, int]:
+    """(私有堆, 映射) 字节估算；非 TombstoneFAISS 时按索引目录的磁盘大小计入私有堆。"""
+    fp = getattr(vdb, "memory_footprint", None)
+    if fp is not None:
+        try:
+            got = fp()
+            return int(got["heap"]), int(got["mapped"])
+        except Exception:  # noqa: BLE001 — 估算失败按磁盘大小兜底
+            pass
+    total = 0
+    try:
+        for fn in os.listdir(index_dir):
+            p = os.path.join(index_dir, fn)
+            if os.path.isfile(p):
+                total += os.path.getsize(p)
+    except OSError:
+        pass
+    return total, 0
+
+
+def _gdsf_priority(e: _Entry, size: int) -> float:
+    # 载入耗时即未命中的代价；按 MB 计字节，避免优先级量级过小
+    return _stats.inflation + e.hits * max(e.load_seconds, 1e-3) / max(size / (1 << 20), 1e-3)
+
+
+def _evict_locked(keep: int) -> None:
+    from utils.hybrid_search import drop_cached_bm25
+
+    budget = _max_cache_bytes()
+    cap = _max_cached_users()
+    sizes = {uid: e.size() for uid, e in _cache.items()}
+    total = sum(sizes.values())
+    while len(_cache) > 1 and (total > budget or (cap is not None and len(_cache) > cap)):
+        uid = min((u for u in _cache if u != keep), key=lambda u: _cache[u].priority)
+        victim = _cache.pop(uid)
+        _stats.inflation = max(_stats.inflation, victim.priority)
+        _stats.evictions += 1
+        _stats.evicted_bytes += sizes[uid]
+        total -= sizes[uid]
+        drop_cached_bm25(victim.kb_dir)
+
+
+def _hit_locked(uid: int, hit: _Entry) -> Tuple[Any, Any]:
+    _cache.move_to_end(uid)
+    hit.hits += 1
+    hit.priority = _gdsf_priority(hit, hit.size())
+    # BM25 多在条目准入之后才载入：命中时按最新字节数再检查一次预算
+    _evict_locked(uid)
+    # 删除只追加墓碑日志、不动索引文件：增量读入其他写者新增的墓碑即可，无需整库重载
+    sync = getattr(hit.vdb, "sync_tombstones", None)
+    if sync is not None:
+        sync()
+    return hit.vdb, hit.emb
 
 
 def get_cached_vdb_pair(user_id: int) -> Tuple[Any, Any]:
@@ -22,27 +158,56 @@ def get_cached_vdb_pair(user_id: int) -> Tuple[Any, Any]:
     from utils.path_context import get_kb_dir
 
     kb = get_kb_dir()
-    idx = os.path.join(kb, "faiss_index", "index.faiss")
-    mtime = os.path.getmtime(idx) if os.path.isfile(idx) else 0.0
+    index_dir = os.path.join(kb, "faiss_index")
+    mtime = _index_signature(index_dir)
     uid = int(user_id)
 
     with _lock:
         hit = _cache.get(uid)
-        if hit is not None and hit[2] == mtime:
-            _cache.move_to_end(uid)
-            return hit[0], hit[1]
+        if hit is not None and hit.signature == mtime:
+            _stats.hits += 1
+            return _hit_locked(uid, hit)
         if hit is not None:
             del _cache[uid]
+        _stats.misses += 1
+        slot = _load_slots.get(uid)
+        if slot is None:
+            slot = _load_slots[uid] = _LoadSlot()
+        slot.waiters += 1
+
+    try:
+        with slot.lock:
+            with _lock:
+                hit = _cache.get(uid)
+                if hit is not None and hit.signature == mtime:
+                    _stats.coalesced += 1
+                    return _hit_locked(uid, hit)
+
+            t0 = time.perf_counter()
+            vdb, emb = load_embeddings_and_vector_db(read_only=True)
+            load_seconds = time.perf_counter() - t0
+            heap, mapped = _footprint(vdb, index_dir)
+
+            with _lock:
+                e = _Entry(vdb, emb, mtime, kb, heap, mapped, load_seconds)
+                e.priority = _gdsf_priority(e, e.size())
+                _cache[uid] = e
+                _cache.move_to_end(uid)
+                _evict_locked(uid)
+    finally:
+        with _lock:
+            slot.waiters -= 1
+            if slot.waiters == 0 and _load_slots.get(uid) is slot:
+                del _load_slots[uid]
+    return vdb, emb
 
-    vdb, emb = load_embeddings_and_vector_db()
 
+def is_warm(user_id: int, kb_dir: str) -> bool:
+    """该用户的缓存条目与磁盘索引一致（不计入命中统计，供预取判断是否需要载入）。"""
+    mtime = _index_signature(os.path.join(kb_dir, "faiss_index"))
     with _lock:
-        _cache[uid] = (vdb, emb, mtime)
-        _cache.move_to_end(uid)
-        cap = _max_cached_users()
-        while len(_cache) > cap:
-            _cache.popitem(last=False)
-    return vdb, emb
+        hit = _cache.get(int(user_id))
+        return hit is not None and hit.signature == mtime
 
 
 def bump_user_cache(user_id: int) -> None:
@@ -51,11 +216,29 @@ def bump_user_cache(user_id: int) -> None:
 
 
 def clear_all_cache() -> None:
+    global _stats
     with _lock:
         _cache.clear()
+        _stats = _Stats()
 
 
-def cache_stats() -> Dict[str, int]:
-    """运维/健康检查可选：当前缓存条目数与容量。"""
+def cache_stats() -> Dict[str, Any]:
+    """运维/健康检查可选：条目数、命中率、私有堆/映射/BM25 字节与预算、累计淘汰数与字节。"""
     with _lock:
-        return {"vdb_cache_entries": len(_cache), "vdb_cache_cap": _max_cached_users()}
+        cap = _max_cached_users()
+        lookups = _stats.hits + _stats.misses
+        return {
+            "vdb_cache_entries": len(_cache),
+            "vdb_cache_cap": cap if cap is not None else 0,
+            "vdb_cache_hits": _stats.hits,
+            "vdb_cache_misses": _stats.misses,
+            "vdb_cache_coalesced": _stats.coalesced,
+            "vdb_cache_hit_ratio": round(_stats.hits / lookups, 4) if lookups else 0.0,
+            "vdb_cache_heap_bytes": sum(e.heap_bytes for e in _cache.values()),
+            "vdb_cache_mapped_bytes": sum(e.mapped_bytes for e in _cache.values()),
+            "vdb_cache_bm25_bytes": sum(e.bm25_bytes() for e in _cache.values()),
+            "vdb_cache_budget_bytes": _max_cache_bytes(),
+            "vdb_cache_read_only_entries": sum(1 for e in _cache.values() if getattr(e.vdb, "read_only", False)),
+            "vdb_cache_evictions": _stats.evictions,
+            "vdb_cache_evicted_bytes": _stats.evicted_bytes,
+        }
@@ -786,7 +786,13 @@
         }).join("; ") : det || r.statusText;
         throw new Error(typeof msg === "string" ? msg : r.statusText);
       }
-      if (j.status === "done") return j;
+      if (j.status === "done") {
+        const dd = j.dedup || {};
+        if (dd.file === "duplicate_of_other") {
+          showToast((j.file_name || "") + " 与已有文档「" + dd.duplicate_of + "」内容相同，已跳过入库", "info");
+        }
+        return j;
+      }
       if (j.status === "error") throw new Error(j.error || "入库失败");
       await new Promise(function (x) {
         setTimeout(x, 1200);
@@ -1575,12 +1581,20 @@
       ? collectInstantChatBody(userText, true)
       : collectChatBody(userText, true);
     try {
-      const res = await fetch(chatUrl, {
+      let res = await fetch(chatUrl, {
         method: "POST",
         headers: headers,
         body: JSON.stringify(chatBody),
         signal,
       });
+      if (res.status === 409 && IS_INSTANT_PAGE) {
+        res = await fetch(chatUrl, {
+          method: "POST",
+          headers: headers,
+          body: JSON.stringify(collectInstantChatBody(userText, true, true)),
+          signal,
+        });
+      }
       if (res.status === 401) {
         clearAuth();
         const next = encodeURIComponent(location.pathname + location.search);
@@ -2363,17 +2377,23 @@
     return body;
   }
 
-  function collectInstantChatBody(message, stream) {
+  function collectInstantChatBody(message, stream, withDocText) {
     const p = getChatPrefs();
     const rs = (p.response_style && String(p.response_style).trim()) || "balanced";
     const persona = getActivePersonaInstruction();
     const conv = currentConv();
     const idoc = conv && conv.instantDoc;
+    const docId = idoc && idoc.docId ? idoc.docId : "";
+    // 有 doc_id 时正文由服务端缓存提供；缓存过期（409）后再带正文重试
+    const sendText = !docId || !!withDocText;
     const body = {
       message,
       history: historyForApi(message),
-      document_text: idoc && idoc.text ? idoc.text : "",
+      document_text: sendText && idoc && idoc.text ? idoc.text : "",
       document_file_name: idoc && idoc.fileName ? idoc.fileName : "",
+      doc_id: docId || null,
+      // 只发相关摘录（服务端按预建索引选取，短文档仍整篇）
+      context_mode: "excerpts",
       enable_web_search: !!p.enable_web_search && _instantWebSearchUiAllowed,
       temperature: Number(p.temperature_slider ?? 0) / 10,
       api_config_name: (p.preset && String(p.preset).trim()) || null,
@@ -5079,7 +5099,7 @@
           return;
         }
         const conv = currentConv();
-        conv.instantDoc = { text: j.text, fileName: j.file_name || f.name };
+        conv.instantDoc = { text: j.text, fileName: j.file_name || f.name, docId: j.doc_id || "" };
         saveStore();
         syncInstantDocBar();
         showToast("已载入 " + j.char_count + " 字", "ok");